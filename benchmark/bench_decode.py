@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+# Benchmark of the per-cycle decode time of the "struct" and "numpy" decode engines, on synthetic templates of 1k, 10k and 50k tags
+# Usage: $ (python3) path/to/benchmark/bench_decode.py [-n <comma-separated tag counts, default 1000,10000,50000>] [-r <cycles per measure, default 20>]
+
+import os, sys, csv, getopt, random, tempfile, time, io, contextlib
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+
+TEMPLATE_HEADER = ['address','read_type','data_type','tag_name','scaling_coeff','scaling_offset','mqtt_topic','mqtt_payload','mqtt_qos','mqtt_retain','mqtt_publish','mqtt_deadband','mqtt_alarm_low','mqtt_alarm_high','mqtt_ignore_low','mqtt_ignore_high']
+REGISTER_DATA_TYPES = ['uint16','sint16','float32','float64','packedbool','ruint16','rsint16','rfloat32_byte_swap','rfloat32_word_swap','rfloat32_byte_word_swap']
+
+# Method to write a synthetic template of tag_count tags, 80% holding/input registers of every register data_type and 20% coils/discrete inputs, all published with mqtt_payload
+# with publish_rules, the register tags get a random mix of mqtt_publish (rbe or interval), deadband, alarm and ignore limits, otherwise they are all "rbe" without deadband nor limits
+def write_synthetic_template(full_path_to_csv, tag_count, seed=0, mqtt_payload='json', publish_rules=False):
+	rng = random.Random(seed)
+	next_address = {'HR': 0, 'IR': 0, 'coil': 0, 'DI': 0}
+	with open(full_path_to_csv, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(TEMPLATE_HEADER)
+		for i in range(tag_count):
+			read_type = rng.choice(['HR','HR','IR','IR','HR','IR','HR','IR','coil','DI'])
+			if read_type in ['coil','DI']:
+				data_type = 'coil' if read_type == 'coil' else 'di'
+			else:
+				data_type = rng.choice(REGISTER_DATA_TYPES)
+			scaling_coeff, scaling_offset = rng.choice([('',''),('',''),('0.1',''),('2','-10')])
+			if data_type in ['coil','di']:
+				scaling_coeff, scaling_offset = '', ''
+			address = next_address[read_type]
+			next_address[read_type] += modqtt_helper.ModbusHelper.DATA_TYPES_REGISTER_COUNT[data_type]
+			mqtt_rules = ['rbe', '', '', '', '', '']
+			if publish_rules and (data_type not in ['coil','di']):
+				mqtt_rules = [rng.choice(['rbe','rbe','5','60']), rng.choice(['','1','100']), rng.choice(['','','1000']), rng.choice(['','','60000']), rng.choice(['','','0']), rng.choice(['','','65000'])]
+			writer.writerow([address, read_type, data_type, 'tag_'+str(i), scaling_coeff, scaling_offset, 'benchmark', mqtt_payload, '', ''] + mqtt_rules)
+
+# Method to build random responses for every call group of a client, in poll order
+def random_responses(modbus_tcp_client, rng):
+	responses = []
+	for fc in modbus_tcp_client.call_groups:
+		for query in modbus_tcp_client.call_groups[fc]:
+			if fc in ['01', '02']:
+				responses.append((fc, query['start_address'], [rng.randint(0, 1) for i in range(query['register_count'])]))
+			else:
+				responses.append((fc, query['start_address'], [rng.randint(0, 65535) for i in range(query['register_count'])]))
+	return responses
+
+def load_client(full_path_to_csv, decode_engine):
+	with contextlib.redirect_stdout(io.StringIO()):
+		modbus_tcp_client = modqtt_helper.ModbusTCPClient(server_ip='127.0.0.1', decode_engine=decode_engine)
+		modbus_tcp_client.load_template(full_path_to_csv)
+	return modbus_tcp_client
+
+def bench_struct(modbus_tcp_client, responses, cycles):
+	start = time.perf_counter()
+	for cycle in range(cycles):
+		modbus_tcp_client.combine_tag_responses([modbus_tcp_client.interpret_response(response, fc, start_address) for fc, start_address, response in responses])
+	return (time.perf_counter() - start)/cycles
+
+def bench_numpy(modbus_tcp_client, responses, cycles):
+	raw_responses = [response for fc, start_address, response in responses]
+	bulk_decoder = modqtt_helper.NumpyBulkDecoder(modbus_tcp_client.call_group_layouts())
+	start = time.perf_counter()
+	for cycle in range(cycles):
+		modbus_tcp_client.combine_tag_responses([bulk_decoder.decode_cycle(raw_responses)])
+	return (time.perf_counter() - start)/cycles
+
+if __name__ == '__main__':
+	tag_counts = [1000, 10000, 50000]
+	cycles = 20
+	opts, args = getopt.getopt(sys.argv[1:], 'n:r:')
+	for opt, arg in opts:
+		if opt == '-n':
+			tag_counts = [int(n) for n in arg.split(',')]
+		elif opt == '-r':
+			cycles = int(arg)
+
+	print('\t'+'tags'.ljust(10)+'struct (ms/cycle)'.ljust(20)+'numpy (ms/cycle)'.ljust(20)+'speedup')
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for tag_count in tag_counts:
+			full_path_to_csv = os.path.join(tmp_dir, 'synthetic_'+str(tag_count)+'.csv')
+			write_synthetic_template(full_path_to_csv, tag_count)
+			struct_client = load_client(full_path_to_csv, 'struct')
+			responses = random_responses(struct_client, random.Random(tag_count))
+			struct_seconds = bench_struct(struct_client, responses, cycles)
+			numpy_client = load_client(full_path_to_csv, 'numpy')
+			if numpy_client.decode_engine != 'numpy':
+				print('\t'+str(tag_count).ljust(10)+str(round(1000*struct_seconds, 3)).ljust(20)+'n/a (numpy not installed)')
+				continue
+			numpy_seconds = bench_numpy(numpy_client, responses, cycles)
+			print('\t'+str(tag_count).ljust(10)+str(round(1000*struct_seconds, 3)).ljust(20)+str(round(1000*numpy_seconds, 3)).ljust(20)+str(round(struct_seconds/numpy_seconds, 2))+'x')
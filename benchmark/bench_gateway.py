@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+
+# End-to-end benchmark of modqtt-gw: the gateway (modqtt-gw.py) runs in a child process against an in-process Modbus TCP Server simulator and a stub MQTT broker (see simulator_helper.py),
+# on synthetic templates of every supported data_type (see bench_decode.write_synthetic_template), with a configurable server latency, jitter and register churn
+# for each tag count, after a warm-up following the initial publish of all the tags, it measures over the measure window:
+#	cycles/s (Modbus poll cycles completed, counted by the simulator), publishes/s and payload bytes/s (counted by the broker), CPU% and RSS of the gateway process,
+#	and reports the p50/p99 of the poll cycle, rule evaluation and publish latencies from the gateway's own metrics (published under <mqtt_client_id>/_metrics, since the start of the gateway)
+# the results are written as a JSON document, to track regressions between releases
+# Usage: $ (python3) path/to/benchmark/bench_gateway.py [-n <comma-separated tag counts, default 100,1000,10000,50000>] [-i <modbus_poll_interval_seconds, default 0.1>] [-d <measure window in seconds, default 10>] [-w <warm-up in seconds, default 2>]
+#		[-l <Modbus response latency in seconds, default 0>] [-j <Modbus response jitter in seconds, default 0>] [-c <register churn, fraction of the tags changing per poll cycle, default 0.1>]
+#		[-p <mqtt_payload of the tags, default json>] [-k <JSON object of config overrides, ex: '{"mqtt_rule_engine": "numpy"}'>] [-o <path to the JSON results, default bench_gateway.json>]
+
+import os, sys, getopt, json, time, tempfile, subprocess, signal, platform, datetime, io, contextlib
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from scripts import modqtt_helper
+from bench_decode import write_synthetic_template
+from simulator_helper import ModbusServerSimulator, StubMqttBroker, SimulationThread
+
+GATEWAY_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'modqtt-gw.py')
+MQTT_CLIENT_ID = 'benchmark'
+
+def write_config(full_path_to_json, modbus_port, mqtt_port, poll_interval_seconds, config_overrides):
+	config = {
+		'modbus_server_ip': '127.0.0.1',
+		'modbus_server_port': modbus_port,
+		'modbus_server_id': 1,
+		'modbus_server_timeout_seconds': 5.0,
+		'modbus_poll_interval_seconds': poll_interval_seconds,
+		'mqtt_client_id': MQTT_CLIENT_ID,
+		'mqtt_broker_ip_or_url': '127.0.0.1',
+		'mqtt_broker_port': mqtt_port,
+		'mqtt_connection_monitoring': False,
+		'mqtt_broker_tls': False,
+		'mqtt_tls_insecure_set': False,
+		'mqtt_v5': True,
+		'mqtt_v311': False,
+		'mqtt_v31': False,
+		'mqtt_max_inflight_messages_set': 20,
+		'mqtt_metrics': True,
+		'metrics_interval_seconds': 1
+	}
+	config.update(config_overrides)
+	with open(full_path_to_json, 'w') as f:
+		json.dump(config, f, indent=4)
+	return config
+
+# Method to read the CPU time (seconds) and the current and peak RSS (bytes) of a process from /proc, returns None where /proc is not available
+def process_usage(pid):
+	try:
+		with open('/proc/'+str(pid)+'/stat') as f:
+			stat_fields = f.read().rsplit(')', 1)[1].split()
+		with open('/proc/'+str(pid)+'/status') as f:
+			status = dict(line.split(':', 1) for line in f if ':' in line)
+	except OSError:
+		return None
+	return {
+		'cpu_seconds': (int(stat_fields[11]) + int(stat_fields[12]))/os.sysconf('SC_CLK_TCK'),
+		'rss_bytes': 1024*int(status['VmRSS'].split()[0]),
+		'peak_rss_bytes': 1024*int(status['VmHWM'].split()[0])
+	}
+
+def counters(simulation, simulator, broker):
+	return simulation.call(lambda: (simulator.request_count, broker.message_count, broker.payload_bytes))
+
+def metrics_snapshot(simulation, broker):
+	return json.loads(simulation.call(lambda: broker.system_payloads.get(MQTT_CLIENT_ID+'/_metrics', b'{}')))
+
+def histogram_statistics(snapshot, name):
+	statistics = snapshot.get('histograms', {}).get(name, [])
+	if not statistics:
+		return {'p50_seconds': None, 'p99_seconds': None}
+	return {'p50_seconds': max(s['p50_seconds'] for s in statistics), 'p99_seconds': max(s['p99_seconds'] for s in statistics)}
+
+# Method to run the gateway on a synthetic template of tag_count tags, returns the results of the measure window
+def bench_tag_count(tmp_dir, tag_count, options, simulation):
+	full_path_to_csv = os.path.join(tmp_dir, 'synthetic_'+str(tag_count)+'.csv')
+	full_path_to_json = os.path.join(tmp_dir, 'config_'+str(tag_count)+'.json')
+	full_path_to_log = os.path.join(tmp_dir, 'gateway_'+str(tag_count)+'.log')
+	write_synthetic_template(full_path_to_csv, tag_count, mqtt_payload=options['mqtt_payload'])
+
+	simulator = ModbusServerSimulator(options['latency_seconds'], options['jitter_seconds'], options['churn'])
+	broker = StubMqttBroker()
+	config = write_config(full_path_to_json, simulation.start(simulator), simulation.start(broker), options['poll_interval_seconds'], options['config_overrides'])
+	with contextlib.redirect_stdout(io.StringIO()):
+		call_groups, interpreter_helper, mqtt_helper = modqtt_helper.ModbusHelper.parse_template_build_calls(full_path_to_csv, config)
+	requests_per_cycle = sum(len(call_groups[fc]) for fc in call_groups)
+
+	with open(full_path_to_log, 'w') as log:
+		gateway = subprocess.Popen([sys.executable, GATEWAY_SCRIPT, '-c', full_path_to_json, '-t', full_path_to_csv, '-q'], stdout=log, stderr=subprocess.STDOUT)
+	try:
+		# wait for the initial publish of all the tags (i.e. a first publish cycle in the metrics), then for the warm-up
+		deadline = time.monotonic() + options['startup_timeout_seconds']
+		while not any(s['count'] for s in metrics_snapshot(simulation, broker).get('histograms', {}).get('mqtt_publish_seconds', [])):
+			if (gateway.poll() is not None) or (time.monotonic() > deadline):
+				raise RuntimeError('the gateway did not publish all the tags, see its log:\n'+open(full_path_to_log).read()[-2000:])
+			time.sleep(0.1)
+		time.sleep(options['warmup_seconds'])
+
+		start_time = time.monotonic()
+		start_counters = counters(simulation, simulator, broker)
+		start_usage = process_usage(gateway.pid)
+		time.sleep(options['measure_seconds'])
+		end_time = time.monotonic()
+		end_counters = counters(simulation, simulator, broker)
+		end_usage = process_usage(gateway.pid)
+		last_metrics_snapshot = metrics_snapshot(simulation, broker)
+	finally:
+		gateway.send_signal(signal.SIGINT)
+		try:
+			gateway.wait(30)
+		except subprocess.TimeoutExpired:
+			gateway.kill()
+			gateway.wait()
+
+	elapsed_seconds = end_time - start_time
+	results = {
+		'tag_count': tag_count,
+		'requests_per_cycle': requests_per_cycle,
+		'cycles_per_second': (end_counters[0] - start_counters[0])/requests_per_cycle/elapsed_seconds,
+		'publishes_per_second': (end_counters[1] - start_counters[1])/elapsed_seconds,
+		'payload_bytes_per_second': (end_counters[2] - start_counters[2])/elapsed_seconds,
+		'poll_cycle': histogram_statistics(last_metrics_snapshot, 'modbus_poll_seconds'),
+		'rule_evaluation': histogram_statistics(last_metrics_snapshot, 'mqtt_rule_evaluation_seconds'),
+		'publish': histogram_statistics(last_metrics_snapshot, 'mqtt_publish_seconds'),
+		'poll_overruns': sum(value['value'] for value in last_metrics_snapshot.get('values', {}).get('modbus_poll_overruns_total', []))
+	}
+	if (start_usage is not None) and (end_usage is not None):
+		results['cpu_percent'] = 100*(end_usage['cpu_seconds'] - start_usage['cpu_seconds'])/elapsed_seconds
+		results['rss_bytes'] = end_usage['rss_bytes']
+		results['peak_rss_bytes'] = end_usage['peak_rss_bytes']
+	return results
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def milliseconds(seconds):
+	return 'n/a' if seconds is None else str(round(1000*seconds, 2))
+
+if __name__ == '__main__':
+	tag_counts = [100, 1000, 10000, 50000]
+	full_path_to_results = 'bench_gateway.json'
+	options = {
+		'poll_interval_seconds': 0.1,
+		'measure_seconds': 10.0,
+		'warmup_seconds': 2.0,
+		'startup_timeout_seconds': 300.0,
+		'latency_seconds': 0.0,
+		'jitter_seconds': 0.0,
+		'churn': 0.1,
+		'mqtt_payload': 'json',
+		'config_overrides': {}
+	}
+	opts, args = getopt.getopt(sys.argv[1:], 'n:i:d:w:l:j:c:p:k:o:')
+	for opt, arg in opts:
+		if opt == '-n':
+			tag_counts = [int(n) for n in arg.split(',')]
+		elif opt == '-i':
+			options['poll_interval_seconds'] = float(arg)
+		elif opt == '-d':
+			options['measure_seconds'] = float(arg)
+		elif opt == '-w':
+			options['warmup_seconds'] = float(arg)
+		elif opt == '-l':
+			options['latency_seconds'] = float(arg)
+		elif opt == '-j':
+			options['jitter_seconds'] = float(arg)
+		elif opt == '-c':
+			options['churn'] = float(arg)
+		elif opt == '-p':
+			options['mqtt_payload'] = arg
+		elif opt == '-k':
+			options['config_overrides'] = json.loads(arg)
+		elif opt == '-o':
+			full_path_to_results = arg
+
+	document = {
+		'benchmark': 'bench_gateway',
+		'timestamp_utc': datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S%z'),
+		'git_commit': git_commit(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'options': options,
+		'results': []
+	}
+	print('\t'+'tags'.ljust(8)+'cycles/s'.ljust(10)+'publishes/s'.ljust(13)+'poll p50/p99 (ms)'.ljust(20)+'rules p50/p99 (ms)'.ljust(20)+'publish p50/p99 (ms)'.ljust(22)+'overruns'.ljust(10)+'CPU%'.ljust(8)+'RSS (MB)')
+	simulation = SimulationThread()
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for tag_count in tag_counts:
+			results = bench_tag_count(tmp_dir, tag_count, options, simulation)
+			document['results'].append(results)
+			print('\t'+str(tag_count).ljust(8)+str(round(results['cycles_per_second'], 2)).ljust(10)+str(int(results['publishes_per_second'])).ljust(13)
+				+(milliseconds(results['poll_cycle']['p50_seconds'])+'/'+milliseconds(results['poll_cycle']['p99_seconds'])).ljust(20)
+				+(milliseconds(results['rule_evaluation']['p50_seconds'])+'/'+milliseconds(results['rule_evaluation']['p99_seconds'])).ljust(20)
+				+(milliseconds(results['publish']['p50_seconds'])+'/'+milliseconds(results['publish']['p99_seconds'])).ljust(22)
+				+str(results['poll_overruns']).ljust(10)+str(round(results.get('cpu_percent', 0), 1)).ljust(8)+str(round(results.get('rss_bytes', 0)/1e6, 1)))
+	simulation.stop()
+	with open(full_path_to_results, 'w') as f:
+		json.dump(document, f, indent=4)
+	print('\t[INFO] Results written to "'+full_path_to_results+'"')
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+# Benchmark of the "json" mqtt_payload rendering (payloads rendered per second) with each mqtt_json_serializer, against building a dict and calling json.dumps for every message
+# and of the serialization of "batch" mqtt_payload documents (documents per second); the values are a mix of floats, integers and booleans, with a new timestamp on each poll cycle
+# Usage: $ (python3) path/to/benchmark/bench_json.py [-n <values per poll cycle, default 10000>] [-r <cycles per measure, default 20>]
+
+import os, sys, getopt, random, time, json
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+
+def random_values(value_count, rng):
+	return [rng.choice([rng.random()*1000, rng.randint(0, 65535), rng.randint(0, 1) == 1]) for i in range(value_count)]
+
+# Method to measure json.dumps of a new dict per message, in payloads per second
+def bench_dumps(timestamp_formatter, values, cycles):
+	start = time.perf_counter()
+	for cycle in range(cycles):
+		ts_utc, ts_local = timestamp_formatter.format(1672531200000000000 + cycle*1000000000)
+		for value in values:
+			json.dumps({'timestamp_utc': ts_utc, 'timestamp_local': ts_local, 'value': value})
+	return cycles*len(values)/(time.perf_counter() - start)
+
+# Method to measure JsonPayload.render, in payloads per second
+def bench_render(json_payload, values, cycles):
+	start = time.perf_counter()
+	for cycle in range(cycles):
+		timestamp_ns = 1672531200000000000 + cycle*1000000000
+		for value in values:
+			json_payload.render(timestamp_ns, value)
+	return cycles*len(values)/(time.perf_counter() - start)
+
+# Method to measure the serialization of batch documents of 100 values, in documents per second
+def bench_batch(dumps, values, cycles):
+	documents = [{'timestamp_utc': '2023-01-01 00:00:00+0000', 'timestamp_local': '2023-01-01 00:00:00+0000', 'values': dict(('tag_'+str(i + j), values[i + j]) for j in range(100))} for i in range(0, len(values) - 99, 100)]
+	start = time.perf_counter()
+	for cycle in range(cycles):
+		for document in documents:
+			dumps(document)
+	return cycles*len(documents)/(time.perf_counter() - start)
+
+if __name__ == '__main__':
+	value_count = 10000
+	cycles = 20
+	opts, args = getopt.getopt(sys.argv[1:], 'n:r:')
+	for opt, arg in opts:
+		if opt == '-n':
+			value_count = int(arg)
+		elif opt == '-r':
+			cycles = int(arg)
+
+	values = random_values(value_count, random.Random(0))
+	timestamp_formatter = modqtt_helper.TimestampFormatter()
+	print('\t'+'rendering'.ljust(34)+'json (payloads/s)'.ljust(22)+'batch (documents/s)')
+	print('\t'+'json.dumps of a dict per message'.ljust(34)+str(int(bench_dumps(timestamp_formatter, values, cycles))).ljust(22)+str(int(bench_batch(json.dumps, values, cycles))))
+	for serializer in modqtt_helper.JsonPayload.SERIALIZERS:
+		json_payload = modqtt_helper.JsonPayload(timestamp_formatter, serializer)
+		if json_payload.serializer != serializer:
+			print('\t'+('JsonPayload "'+serializer+'"').ljust(34)+'n/a ('+serializer+' not installed)')
+			continue
+		print('\t'+('JsonPayload "'+serializer+'"').ljust(34)+str(int(bench_render(json_payload, values, cycles))).ljust(22)+str(int(bench_batch(json_payload.dumps, values, cycles))))
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+# Benchmark of the MQTT messages and bytes published per poll cycle by each mqtt_payload, on synthetic templates, for the first poll cycle (all tags published) and for poll cycles where a fraction of the tags changed
+# the MQTT client is replaced by a stub counting the messages and bytes, so no MQTT Broker is needed
+# it also measures the encode throughput (tags encoded and handed to the MQTT client per second) and the mean bytes per message of each mqtt_payload
+# Usage: $ (python3) path/to/benchmark/bench_payload.py [-n <comma-separated tag counts, default 1000,3000>] [-p <comma-separated mqtt_payload, default text,json,binary,batch>] [-c <fraction of tags changing per cycle, default 0.1>] [-r <cycles per measure, default 20>]
+
+import os, sys, getopt, random, tempfile, time, io, contextlib
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from scripts import modqtt_helper
+from bench_decode import write_synthetic_template, random_responses, load_client
+
+class CountingMqttClient(object):
+
+	# stand-in for the paho client: counts the messages and payload bytes instead of publishing them
+	def __init__(self):
+		self.message_count = 0
+		self.byte_count = 0
+		self.mid = 0
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		self.message_count += 1
+		self.byte_count += len(topic) + (len(payload) if isinstance(payload, (str, bytes)) else len(str(payload)))
+		self.mid += 1
+		return paho_message_info(self.mid)
+
+def paho_message_info(mid):
+	message_info = modqtt_helper.paho.MQTTMessageInfo(mid)
+	message_info.rc = 0
+	return message_info
+
+# Method to build a gateway publishing the tags of mqtt_helper to a CountingMqttClient, without connecting to any Modbus TCP Server nor MQTT Broker
+def build_gateway(mqtt_helper, rule_engine='python', json_serializer='json'):
+	gateway = modqtt_helper.ModbusTCPMqttDataGateway.__new__(modqtt_helper.ModbusTCPMqttDataGateway)
+	gateway.quiet = True
+	gateway.modqtt_config = {'mqtt_client_id': 'benchmark', 'mqtt_max_inflight_messages_set': 20, 'mqtt_rule_engine': rule_engine}
+	gateway.mqtt_helper = mqtt_helper
+	gateway.compile_publish_rules()
+	gateway.mqqt_last_published_values = {}
+	gateway.mqtt_batches = {}
+	gateway.timestamp_formatter = modqtt_helper.TimestampFormatter()
+	gateway.json_payload = modqtt_helper.JsonPayload(gateway.timestamp_formatter, json_serializer)
+	gateway.mqtt_store = None
+	gateway.shard_publisher = None
+	gateway.mqtt_connected = False
+	gateway.mqtt_force_deadband = False
+	gateway.mqtt_publish_all_on_start = True
+	gateway.mqtt_inflight = modqtt_helper.PublishTracker()
+	gateway.mqtt_publish_ack_timeout_seconds = 10.0
+	gateway.mqtt_client_publish_count = 0
+	gateway.setup_metrics()
+	gateway.mqttc = CountingMqttClient()
+	return gateway
+
+# Method to build cycles poll cycles, one second apart, where change_fraction of the tags change from one cycle to the next
+def build_cycles(first_values, change_fraction, cycles, rng):
+	values = dict(first_values)
+	tag_keys = [tag_key for tag_key in values if not tag_key.startswith('timestamp')]
+	poll_cycles = []
+	for cycle in range(cycles):
+		values = dict(values)
+		values['timestamp_ns'] += 1000000000
+		values['timestamp_monotonic_ns'] += 1000000000
+		for tag_key in rng.sample(tag_keys, int(change_fraction*len(tag_keys))):
+			values[tag_key] = (1 - values[tag_key]) if values[tag_key] in [0, 1] else values[tag_key] + 1
+		poll_cycles.append(values)
+	return poll_cycles
+
+def bench_payload(full_path_to_csv, change_fraction, cycles):
+	modbus_tcp_client = load_client(full_path_to_csv, 'struct')
+	rng = random.Random(0)
+	first_values = modbus_tcp_client.combine_tag_responses([{'timestamp_ns': 1672531200000000000, 'timestamp_monotonic_ns': 0}] + [modbus_tcp_client.interpret_response(response, fc, start_address) for fc, start_address, response in random_responses(modbus_tcp_client, rng)])
+	gateway = build_gateway(modbus_tcp_client.mqtt_helper)
+	gateway.mqtt_publish_data(None, first_values)
+	first_cycle = (gateway.mqttc.message_count, gateway.mqttc.byte_count)
+	poll_cycles = build_cycles(first_values, change_fraction, cycles, rng)
+	gateway.mqttc = CountingMqttClient()
+	start = time.perf_counter()
+	previous_values = first_values
+	for values in poll_cycles:
+		gateway.mqtt_publish_data(previous_values, values)
+		previous_values = values
+	seconds_per_cycle = (time.perf_counter() - start)/cycles
+	return first_cycle, (gateway.mqttc.message_count/cycles, gateway.mqttc.byte_count/cycles), seconds_per_cycle
+
+# Method to measure the encode throughput of the tags of a template, i.e. mqtt_parse_publish_tag (payload encoding and hand over to the MQTT client) without the publish rules
+def bench_encode(full_path_to_csv, cycles):
+	modbus_tcp_client = load_client(full_path_to_csv, 'struct')
+	values = modbus_tcp_client.combine_tag_responses([modbus_tcp_client.interpret_response(response, fc, start_address) for fc, start_address, response in random_responses(modbus_tcp_client, random.Random(0))])
+	gateway = build_gateway(modbus_tcp_client.mqtt_helper)
+	start = time.perf_counter()
+	for cycle in range(cycles):
+		for tag_key in values:
+			gateway.mqtt_parse_publish_tag(gateway.tag_rules[tag_key], values[tag_key], 1672531200000000000, 0)
+		gateway.mqtt_publish_batches(1672531200000000000)
+	tags_per_second = cycles*len(values)/(time.perf_counter() - start)
+	return tags_per_second, gateway.mqttc.byte_count/gateway.mqttc.message_count if gateway.mqttc.message_count else 0
+
+if __name__ == '__main__':
+	tag_counts = [1000, 3000]
+	mqtt_payloads = ['text', 'json', 'binary', 'batch']
+	change_fraction = 0.1
+	cycles = 20
+	opts, args = getopt.getopt(sys.argv[1:], 'n:p:c:r:')
+	for opt, arg in opts:
+		if opt == '-n':
+			tag_counts = [int(n) for n in arg.split(',')]
+		elif opt == '-p':
+			mqtt_payloads = arg.split(',')
+		elif opt == '-c':
+			change_fraction = float(arg)
+		elif opt == '-r':
+			cycles = int(arg)
+
+	print('\t'+'tags'.ljust(8)+'mqtt_payload'.ljust(14)+'first cycle (msg, bytes)'.ljust(28)+('per cycle, '+str(int(100*change_fraction))+'% changed (msg, bytes)').ljust(38)+'publish (ms/cycle)'.ljust(20)+'encode (tags/s)'.ljust(18)+'bytes/message')
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for tag_count in tag_counts:
+			for mqtt_payload in mqtt_payloads:
+				full_path_to_csv = os.path.join(tmp_dir, 'synthetic_'+str(tag_count)+'_'+mqtt_payload+'.csv')
+				write_synthetic_template(full_path_to_csv, tag_count, mqtt_payload=mqtt_payload)
+				with contextlib.redirect_stdout(io.StringIO()):
+					first_cycle, per_cycle, seconds_per_cycle = bench_payload(full_path_to_csv, change_fraction, cycles)
+					tags_per_second, bytes_per_message = bench_encode(full_path_to_csv, cycles)
+				print('\t'+str(tag_count).ljust(8)+mqtt_payload.ljust(14)+(str(first_cycle[0])+', '+str(first_cycle[1])).ljust(28)+(str(round(per_cycle[0], 1))+', '+str(round(per_cycle[1], 1))).ljust(38)+str(round(1000*seconds_per_cycle, 3)).ljust(20)+str(int(tags_per_second)).ljust(18)+str(round(bytes_per_message, 1)))
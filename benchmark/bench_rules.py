@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# Microbenchmark of the publish rules (report by exception, interval, deadband, alarm and ignore limits) evaluated for every tag on every poll cycle, on synthetic templates of 10k tags by default
+# it measures the evaluation of the compiled tag rules alone, and the whole publish cycle (rules, "text" payload encoding and hand over to a stub MQTT client), with the "python" and "numpy" mqtt_rule_engine
+# both rule engines must publish exactly the same messages, this is checked on every run
+# Usage: $ (python3) path/to/benchmark/bench_rules.py [-n <comma-separated tag counts, default 10000>] [-c <fraction of tags changing per cycle, default 0.1>] [-r <cycles per measure, default 20>]
+
+import os, sys, getopt, random, tempfile, time, io, contextlib
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from scripts import modqtt_helper
+from bench_decode import write_synthetic_template, random_responses, load_client
+from bench_payload import build_gateway, build_cycles, CountingMqttClient
+
+class RecordingMqttClient(CountingMqttClient):
+
+	# CountingMqttClient also keeping the messages, to compare the rule engines
+	def __init__(self):
+		super().__init__()
+		self.messages = []
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		self.messages.append((topic, payload, qos, retain))
+		return super().publish(topic, payload, qos, retain)
+
+# Method to measure the evaluation of the tag rules alone with the "python" mqtt_rule_engine, in seconds per cycle
+def bench_evaluate_python(gateway, poll_cycles):
+	tag_rules = gateway.tag_rules
+	last_published_values = gateway.mqqt_last_published_values
+	start = time.perf_counter()
+	for values in poll_cycles:
+		monotonic_ns = values['timestamp_monotonic_ns']
+		for tag_key in values:
+			if tag_key in ['timestamp_ns','timestamp_monotonic_ns']:
+				continue
+			tag_rule = tag_rules[tag_key]
+			last_published = last_published_values[tag_key]
+			tag_rule.evaluate(tag_rule, values[tag_key], last_published, (monotonic_ns - last_published['monotonic_ns'])/1e9, False)
+	return (time.perf_counter() - start)/len(poll_cycles)
+
+# Method to measure the evaluation of the tag rules alone with the "numpy" mqtt_rule_engine (including the conversion of the poll cycle to arrays), in seconds per cycle
+def bench_evaluate_numpy(gateway, poll_cycles):
+	start = time.perf_counter()
+	for values in poll_cycles:
+		gateway.rule_evaluator.evaluate_cycle(values, values['timestamp_monotonic_ns'])
+	return (time.perf_counter() - start)/len(poll_cycles)
+
+# Method to measure the whole publish cycle, in seconds per cycle
+def bench_publish(gateway, first_values, poll_cycles):
+	gateway.mqttc = RecordingMqttClient()
+	start = time.perf_counter()
+	previous_values = first_values
+	for values in poll_cycles:
+		gateway.mqtt_publish_data(previous_values, values)
+		previous_values = values
+	return (time.perf_counter() - start)/len(poll_cycles), gateway.mqttc.messages
+
+if __name__ == '__main__':
+	tag_counts = [10000]
+	change_fraction = 0.1
+	cycles = 20
+	opts, args = getopt.getopt(sys.argv[1:], 'n:c:r:')
+	for opt, arg in opts:
+		if opt == '-n':
+			tag_counts = [int(n) for n in arg.split(',')]
+		elif opt == '-c':
+			change_fraction = float(arg)
+		elif opt == '-r':
+			cycles = int(arg)
+
+	print('\t'+'tags'.ljust(10)+'rule engine'.ljust(14)+'rules (ms/cycle)'.ljust(20)+'rules (ns/tag)'.ljust(18)+'publish (ms/cycle)'.ljust(22)+'messages/cycle'.ljust(18)+'same messages')
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for tag_count in tag_counts:
+			full_path_to_csv = os.path.join(tmp_dir, 'synthetic_rules_'+str(tag_count)+'.csv')
+			write_synthetic_template(full_path_to_csv, tag_count, mqtt_payload='text', publish_rules=True)
+			modbus_tcp_client = load_client(full_path_to_csv, 'struct')
+			rng = random.Random(0)
+			first_values = modbus_tcp_client.combine_tag_responses([{'timestamp_ns': 1672531200000000000, 'timestamp_monotonic_ns': 0}] + [modbus_tcp_client.interpret_response(response, fc, start_address) for fc, start_address, response in random_responses(modbus_tcp_client, rng)])
+			poll_cycles = build_cycles(first_values, change_fraction, cycles, rng)
+			reference_messages = None
+			for rule_engine, bench_evaluate in [('python', bench_evaluate_python), ('numpy', bench_evaluate_numpy)]:
+				# the rules are evaluated on a gateway, and the publish cycle measured on another, both starting from the first poll cycle published
+				with contextlib.redirect_stdout(io.StringIO()):
+					gateway = build_gateway(modbus_tcp_client.mqtt_helper, rule_engine)
+					gateway.mqtt_publish_data(None, first_values)
+				evaluate_seconds = bench_evaluate(gateway, poll_cycles)
+				with contextlib.redirect_stdout(io.StringIO()):
+					gateway = build_gateway(modbus_tcp_client.mqtt_helper, rule_engine)
+					gateway.mqtt_publish_data(None, first_values)
+				publish_seconds, messages = bench_publish(gateway, first_values, poll_cycles)
+				if reference_messages is None:
+					reference_messages = messages
+				print('\t'+str(tag_count).ljust(10)+rule_engine.ljust(14)+str(round(1000*evaluate_seconds, 3)).ljust(20)+str(int(1e9*evaluate_seconds/(len(first_values) - 2))).ljust(18)+str(round(1000*publish_seconds, 3)).ljust(22)+str(round(len(messages)/cycles, 1)).ljust(18)+('yes' if messages == reference_messages else 'NO'))
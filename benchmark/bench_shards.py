@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+# Scaling benchmark of the sharded gateway (see modbus_shard_processes): for each number of worker processes, the gateway (modqtt-gw.py) runs in a child process against the in-process Modbus TCP Server simulator and stub MQTT broker of bench_gateway.py,
+# on a synthetic template large enough (and a poll interval short enough) for a single gateway process to be CPU-bound, and it measures over the measure window:
+#	cycles/s (complete Modbus poll cycles, i.e. all the call groups of the template, counted by the simulator), publishes/s (counted by the broker), CPU% of the gateway and its worker processes, and the speedup over 1 process
+# 1 process runs the gateway without worker processes; the simulator and the broker share the benchmark process, so the speedup flattens once they saturate their own core
+# the results are written as a JSON document, to track regressions between releases
+# Usage: $ (python3) path/to/benchmark/bench_shards.py [-s <comma-separated numbers of processes, default 1 up to the number of CPU cores>] [-n <tag count, default 50000>] [-i <modbus_poll_interval_seconds, default 0.1>]
+#		[-d <measure window in seconds, default 10>] [-w <warm-up in seconds, default 2>] [-l <Modbus response latency in seconds, default 0>] [-c <register churn, default 0.1>]
+#		[-k <JSON object of config overrides, ex: '{"mqtt_rule_engine": "numpy"}'>] [-o <path to the JSON results, default bench_shards.json>]
+
+import os, sys, getopt, json, time, tempfile, subprocess, signal, platform, datetime, io, contextlib
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from scripts import modqtt_helper
+from bench_decode import write_synthetic_template
+from bench_gateway import write_config, process_usage, counters, git_commit, GATEWAY_SCRIPT, MQTT_CLIENT_ID
+from simulator_helper import ModbusServerSimulator, StubMqttBroker, SimulationThread
+
+# Method to read the CPU time (seconds) and the RSS (bytes) of a process and of its child processes (i.e. the worker processes of a sharded gateway) from /proc, returns None where /proc is not available
+def process_tree_usage(pid):
+	usage = process_usage(pid)
+	if usage is None:
+		return None
+	try:
+		with open('/proc/'+str(pid)+'/task/'+str(pid)+'/children') as f:
+			child_pids = [int(child_pid) for child_pid in f.read().split()]
+	except OSError:
+		child_pids = []
+	for child_pid in child_pids:
+		child_usage = process_usage(child_pid)
+		if child_usage is not None:
+			usage['cpu_seconds'] += child_usage['cpu_seconds']
+			usage['rss_bytes'] += child_usage['rss_bytes']
+	return usage
+
+# Method to check if every process polling the Modbus TCP Server completed a publish cycle, i.e. published all its tags, from the metrics of the gateway (or of each of its worker processes)
+def all_processes_published(simulation, broker, shard_processes):
+	metrics_topics = [MQTT_CLIENT_ID+'/_metrics'] if shard_processes == 1 else [MQTT_CLIENT_ID+'/_metrics/shard'+str(shard_index) for shard_index in range(shard_processes)]
+	system_payloads = simulation.call(lambda: dict(broker.system_payloads))
+	for metrics_topic in metrics_topics:
+		snapshot = json.loads(system_payloads.get(metrics_topic, b'{}'))
+		if not any(s['count'] for s in snapshot.get('histograms', {}).get('mqtt_publish_seconds', [])):
+			return False
+	return True
+
+# Method to run the gateway with shard_processes process(es) on the synthetic template, returns the results of the measure window
+def bench_shard_processes(tmp_dir, full_path_to_csv, requests_per_cycle, shard_processes, options, simulation):
+	full_path_to_json = os.path.join(tmp_dir, 'config_'+str(shard_processes)+'.json')
+	full_path_to_log = os.path.join(tmp_dir, 'gateway_'+str(shard_processes)+'.log')
+	simulator = ModbusServerSimulator(options['latency_seconds'], 0.0, options['churn'])
+	broker = StubMqttBroker()
+	config_overrides = dict(options['config_overrides'])
+	config_overrides['modbus_shard_processes'] = shard_processes
+	write_config(full_path_to_json, simulation.start(simulator), simulation.start(broker), options['poll_interval_seconds'], config_overrides)
+
+	with open(full_path_to_log, 'w') as log:
+		gateway = subprocess.Popen([sys.executable, GATEWAY_SCRIPT, '-c', full_path_to_json, '-t', full_path_to_csv, '-q'], stdout=log, stderr=subprocess.STDOUT)
+	try:
+		deadline = time.monotonic() + options['startup_timeout_seconds']
+		while not all_processes_published(simulation, broker, shard_processes):
+			if (gateway.poll() is not None) or (time.monotonic() > deadline):
+				raise RuntimeError('the gateway did not publish all the tags, see its log:\n'+open(full_path_to_log).read()[-2000:])
+			time.sleep(0.1)
+		time.sleep(options['warmup_seconds'])
+
+		start_time = time.monotonic()
+		start_counters = counters(simulation, simulator, broker)
+		start_usage = process_tree_usage(gateway.pid)
+		time.sleep(options['measure_seconds'])
+		end_time = time.monotonic()
+		end_counters = counters(simulation, simulator, broker)
+		end_usage = process_tree_usage(gateway.pid)
+	finally:
+		gateway.send_signal(signal.SIGINT)
+		try:
+			gateway.wait(60)
+		except subprocess.TimeoutExpired:
+			gateway.kill()
+			gateway.wait()
+
+	elapsed_seconds = end_time - start_time
+	results = {
+		'shard_processes': shard_processes,
+		'cycles_per_second': (end_counters[0] - start_counters[0])/requests_per_cycle/elapsed_seconds,
+		'publishes_per_second': (end_counters[1] - start_counters[1])/elapsed_seconds,
+		'payload_bytes_per_second': (end_counters[2] - start_counters[2])/elapsed_seconds
+	}
+	if (start_usage is not None) and (end_usage is not None):
+		results['cpu_percent'] = 100*(end_usage['cpu_seconds'] - start_usage['cpu_seconds'])/elapsed_seconds
+		results['rss_bytes'] = end_usage['rss_bytes']
+	return results
+
+if __name__ == '__main__':
+	shard_processes_list = list(range(1, (os.cpu_count() or 1) + 1))
+	full_path_to_results = 'bench_shards.json'
+	options = {
+		'tag_count': 50000,
+		'poll_interval_seconds': 0.1,
+		'measure_seconds': 10.0,
+		'warmup_seconds': 2.0,
+		'startup_timeout_seconds': 300.0,
+		'latency_seconds': 0.0,
+		'churn': 0.1,
+		'config_overrides': {}
+	}
+	opts, args = getopt.getopt(sys.argv[1:], 's:n:i:d:w:l:c:k:o:')
+	for opt, arg in opts:
+		if opt == '-s':
+			shard_processes_list = [int(n) for n in arg.split(',')]
+		elif opt == '-n':
+			options['tag_count'] = int(arg)
+		elif opt == '-i':
+			options['poll_interval_seconds'] = float(arg)
+		elif opt == '-d':
+			options['measure_seconds'] = float(arg)
+		elif opt == '-w':
+			options['warmup_seconds'] = float(arg)
+		elif opt == '-l':
+			options['latency_seconds'] = float(arg)
+		elif opt == '-c':
+			options['churn'] = float(arg)
+		elif opt == '-k':
+			options['config_overrides'] = json.loads(arg)
+		elif opt == '-o':
+			full_path_to_results = arg
+
+	document = {
+		'benchmark': 'bench_shards',
+		'timestamp_utc': datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S%z'),
+		'git_commit': git_commit(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'cpu_count': os.cpu_count(),
+		'options': options,
+		'results': []
+	}
+	print('\t'+'processes'.ljust(11)+'cycles/s'.ljust(10)+'speedup'.ljust(9)+'publishes/s'.ljust(13)+'CPU%'.ljust(8)+'RSS (MB)')
+	simulation = SimulationThread()
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		full_path_to_csv = os.path.join(tmp_dir, 'synthetic_'+str(options['tag_count'])+'.csv')
+		write_synthetic_template(full_path_to_csv, options['tag_count'])
+		with contextlib.redirect_stdout(io.StringIO()):
+			call_groups, interpreter_helper, mqtt_helper = modqtt_helper.ModbusHelper.parse_template_build_calls(full_path_to_csv, options['config_overrides'])
+		requests_per_cycle = sum(len(call_groups[fc]) for fc in call_groups)
+		single_process_cycles_per_second = None
+		for shard_processes in shard_processes_list:
+			results = bench_shard_processes(tmp_dir, full_path_to_csv, requests_per_cycle, shard_processes, options, simulation)
+			if shard_processes == 1:
+				single_process_cycles_per_second = results['cycles_per_second']
+			if single_process_cycles_per_second:
+				results['speedup'] = results['cycles_per_second']/single_process_cycles_per_second
+			document['results'].append(results)
+			print('\t'+str(shard_processes).ljust(11)+str(round(results['cycles_per_second'], 2)).ljust(10)+(str(round(results['speedup'], 2)) if 'speedup' in results else 'n/a').ljust(9)
+				+str(int(results['publishes_per_second'])).ljust(13)+str(round(results.get('cpu_percent', 0), 1)).ljust(8)+str(round(results.get('rss_bytes', 0)/1e6, 1)))
+	simulation.stop()
+	with open(full_path_to_results, 'w') as f:
+		json.dump(document, f, indent=4)
+	print('\t[INFO] Results written to "'+full_path_to_results+'"')
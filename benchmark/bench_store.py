@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+# Benchmark of the store-and-forward buffer: append throughput (one message per transaction, as when the MQTT Broker is unreachable, and batched) and drain throughput (replay in batches)
+# Usage: $ (python3) path/to/benchmark/bench_store.py [-n <messages, default 100000>] [-b <replay batch size, default 100>]
+
+import os, sys, getopt, json, tempfile, time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'scripts'))
+from store_helper import StoreAndForwardBuffer
+
+# Method to build message_count messages similar to the ones published by the gateway (json payload)
+def build_messages(message_count):
+	payload = json.dumps({'timestamp_utc': '2023-01-01 00:00:00+0000', 'timestamp_local': '2023-01-01 00:00:00+0000', 'value': 123.456})
+	return [('modqtt-gw/benchmark/tag_'+str(i % 1000), payload, 1, False) for i in range(message_count)]
+
+def bench_append(store, messages):
+	start = time.perf_counter()
+	for topic, payload, qos, retain in messages:
+		store.append(topic, payload, qos, retain)
+	return len(messages)/(time.perf_counter() - start)
+
+def bench_append_many(store, messages, batch_size):
+	start = time.perf_counter()
+	for i in range(0, len(messages), batch_size):
+		store.append_many(messages[i:i+batch_size])
+	return len(messages)/(time.perf_counter() - start)
+
+def bench_drain(store, batch_size):
+	drained = 0
+	start = time.perf_counter()
+	while True:
+		batch = store.peek_batch(batch_size)
+		if not batch:
+			break
+		store.remove([message[0] for message in batch])
+		drained += len(batch)
+	return drained/(time.perf_counter() - start)
+
+if __name__ == '__main__':
+	message_count = 100000
+	batch_size = 100
+	opts, args = getopt.getopt(sys.argv[1:], 'n:b:')
+	for opt, arg in opts:
+		if opt == '-n':
+			message_count = int(arg)
+		elif opt == '-b':
+			batch_size = int(arg)
+
+	messages = build_messages(message_count)
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		store = StoreAndForwardBuffer(os.path.join(tmp_dir, 'bench_append.db'))
+		append_rate = bench_append(store, messages)
+		drain_rate = bench_drain(store, batch_size)
+		store.close()
+		store = StoreAndForwardBuffer(os.path.join(tmp_dir, 'bench_append_many.db'))
+		append_many_rate = bench_append_many(store, messages, batch_size)
+		store.close()
+
+	print('\t'+'messages'.ljust(12)+'append (msg/s)'.ljust(18)+('append batches of '+str(batch_size)+' (msg/s)').ljust(35)+'drain batches of '+str(batch_size)+' (msg/s)')
+	print('\t'+str(message_count).ljust(12)+str(int(append_rate)).ljust(18)+str(int(append_many_rate)).ljust(35)+str(int(drain_rate)))
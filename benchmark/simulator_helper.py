@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+# In-process stand-ins for the two ends of the gateway, used by the end-to-end benchmark (bench_gateway.py):
+#	ModbusServerSimulator: a Modbus TCP Server (fc 01 to 04) with a configurable response latency, jitter and register churn
+#	StubMqttBroker: a minimal MQTT 3.1, 3.1.1 and 5 broker that acknowledges and counts the published messages, without subscribers
+# both run on an asyncio event loop in a background thread (see SimulationThread), and listen on a free local port by default
+
+import asyncio, struct, random, threading
+
+class ModbusServerSimulator(object):
+
+	# latency_seconds: delay of each response, plus a uniform random jitter in [-jitter_seconds, +jitter_seconds] (never negative)
+	# the responses of a connection are sent in the order of the requests, as a real Modbus TCP Server would, even with jitter
+	# churn: fraction of the registers (and bits) of each read that change from one read to the next, i.e. the fraction of tags changing per poll cycle
+	def __init__(self, latency_seconds=0.0, jitter_seconds=0.0, churn=0.1, seed=0):
+		self.latency_seconds = latency_seconds
+		self.jitter_seconds = jitter_seconds
+		self.churn = churn
+		self.rng = random.Random(seed)
+		self.tables = {
+			1: [self.rng.randint(0, 1) for address in range(65536)],		# coils
+			2: [self.rng.randint(0, 1) for address in range(65536)],		# discrete inputs
+			3: [self.rng.randint(0, 65535) for address in range(65536)],	# holding registers
+			4: [self.rng.randint(0, 65535) for address in range(65536)]	# input registers
+		}
+		self.request_count = 0
+		self.server = None
+
+	# Method to change churn*quantity random values of a table in [start_address, start_address + quantity), rounding randomly to keep the expected churn
+	def churn_values(self, table, fc, start_address, quantity):
+		expected_changes = self.churn*quantity
+		change_count = int(expected_changes) + (1 if self.rng.random() < (expected_changes - int(expected_changes)) else 0)
+		for address in self.rng.sample(range(start_address, start_address + quantity), min(change_count, quantity)):
+			table[address] = (1 - table[address]) if fc in [1, 2] else self.rng.randint(0, 65535)
+
+	# Method to build the response PDU of a request PDU, or a Modbus exception (illegal function or illegal data address)
+	def response_pdu(self, request_pdu):
+		fc = request_pdu[0]
+		if fc not in self.tables:
+			return struct.pack('>BB', fc | 0x80, 1)
+		start_address, quantity = struct.unpack('>HH', request_pdu[1:5])
+		if (quantity < 1) or (start_address + quantity > 65536):
+			return struct.pack('>BB', fc | 0x80, 2)
+		table = self.tables[fc]
+		self.churn_values(table, fc, start_address, quantity)
+		if fc in [1, 2]:
+			packed_bits = bytearray((quantity + 7)//8)
+			for bit_index in range(quantity):
+				if table[start_address + bit_index]:
+					packed_bits[bit_index//8] |= 1 << (bit_index % 8)
+			return struct.pack('>BB', fc, len(packed_bits)) + bytes(packed_bits)
+		return struct.pack('>BB', fc, 2*quantity) + struct.pack('>'+str(quantity)+'H', *table[start_address:start_address + quantity])
+
+	def response_delay(self):
+		if (self.latency_seconds <= 0) and (self.jitter_seconds <= 0):
+			return 0.0
+		return max(0.0, self.latency_seconds + self.rng.uniform(-self.jitter_seconds, self.jitter_seconds))
+
+	async def handle_connection(self, reader, writer):
+		loop = asyncio.get_running_loop()
+		last_send_time = 0.0
+		try:
+			while True:
+				mbap_header = await reader.readexactly(7)
+				transaction_id, protocol_id, length, unit_id = struct.unpack('>HHHB', mbap_header)
+				request_pdu = await reader.readexactly(length - 1)
+				self.request_count += 1
+				response_pdu = self.response_pdu(request_pdu)
+				response_adu = struct.pack('>HHHB', transaction_id, protocol_id, len(response_pdu) + 1, unit_id) + response_pdu
+				delay = self.response_delay()
+				if delay == 0.0:
+					writer.write(response_adu)
+					continue
+				# responses are delayed, but never overtake the response of a previous request
+				last_send_time = max(loop.time() + delay, last_send_time)
+				loop.call_at(last_send_time, writer.write, response_adu)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	async def start(self, host='127.0.0.1', port=0):
+		self.server = await asyncio.start_server(self.handle_connection, host, port)
+		return self.server.sockets[0].getsockname()[1]
+
+class StubMqttBroker(object):
+
+	# Accepts any MQTT 3.1, 3.1.1 or 5 client, acknowledges its QoS 1 and 2 publishes and PINGREQs, and counts the messages published
+	# messages are not routed to subscribers; the topics with a level starting with "_" (ex: <mqtt_client_id>/_metrics) are not counted as data, their last payload is kept instead
+	def __init__(self):
+		self.message_count = 0
+		self.payload_bytes = 0
+		self.system_payloads = {}	# topic -> last payload, for the topics with a level starting with "_"
+		self.server = None
+
+	@classmethod
+	async def read_remaining_length(cls, reader):
+		remaining_length = 0
+		for shift in range(0, 28, 7):
+			encoded_byte = (await reader.readexactly(1))[0]
+			remaining_length += (encoded_byte & 0x7f) << shift
+			if not (encoded_byte & 0x80):
+				break
+		return remaining_length
+
+	@classmethod
+	def decode_variable_byte_integer(cls, packet, offset):
+		value = 0
+		for shift in range(0, 28, 7):
+			encoded_byte = packet[offset]
+			offset += 1
+			value += (encoded_byte & 0x7f) << shift
+			if not (encoded_byte & 0x80):
+				break
+		return value, offset
+
+	# Method to count a PUBLISH packet, returns its packet identifier (None for QoS 0) and its QoS
+	def receive_publish(self, first_byte, packet, protocol_level):
+		qos = (first_byte >> 1) & 0x03
+		topic_length = struct.unpack('>H', packet[0:2])[0]
+		topic = packet[2:2 + topic_length].decode('utf-8')
+		offset = 2 + topic_length
+		packet_id = None
+		if qos > 0:
+			packet_id = packet[offset:offset + 2]
+			offset += 2
+		if protocol_level == 5:
+			properties_length, offset = StubMqttBroker.decode_variable_byte_integer(packet, offset)
+			offset += properties_length
+		payload = packet[offset:]
+		if '/_' in topic:
+			self.system_payloads[topic] = payload
+		else:
+			self.message_count += 1
+			self.payload_bytes += len(payload)
+		return packet_id, qos
+
+	async def handle_connection(self, reader, writer):
+		protocol_level = 4
+		try:
+			while True:
+				first_byte = (await reader.readexactly(1))[0]
+				packet = await reader.readexactly(await StubMqttBroker.read_remaining_length(reader))
+				packet_type = first_byte >> 4
+				if packet_type == 1:		# CONNECT -> CONNACK
+					protocol_level = packet[2 + struct.unpack('>H', packet[0:2])[0]]
+					writer.write(b'\x20\x03\x00\x00\x00' if protocol_level == 5 else b'\x20\x02\x00\x00')
+				elif packet_type == 3:		# PUBLISH -> PUBACK (QoS 1) or PUBREC (QoS 2)
+					packet_id, qos = self.receive_publish(first_byte, packet, protocol_level)
+					if qos == 1:
+						writer.write(b'\x40\x02' + packet_id)
+					elif qos == 2:
+						writer.write(b'\x50\x02' + packet_id)
+				elif packet_type == 6:		# PUBREL -> PUBCOMP
+					writer.write(b'\x70\x02' + packet[0:2])
+				elif packet_type == 12:		# PINGREQ -> PINGRESP
+					writer.write(b'\xd0\x00')
+				elif packet_type == 14:		# DISCONNECT
+					break
+				await writer.drain()
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	async def start(self, host='127.0.0.1', port=0):
+		self.server = await asyncio.start_server(self.handle_connection, host, port)
+		return self.server.sockets[0].getsockname()[1]
+
+class SimulationThread(object):
+
+	# Runs an asyncio event loop in a daemon thread, to serve the simulators while the caller (or a child process) runs the gateway
+	def __init__(self):
+		self.loop = asyncio.new_event_loop()
+		self.thread = threading.Thread(target=self.loop.run_forever, name='modqtt-simulation', daemon=True)
+		self.thread.start()
+
+	# Method to start a simulator (ModbusServerSimulator or StubMqttBroker) on the event loop, returns its port
+	def start(self, simulator, host='127.0.0.1', port=0):
+		return asyncio.run_coroutine_threadsafe(simulator.start(host, port), self.loop).result()
+
+	# Method to run a function on the event loop (ex: to read the counters of a simulator consistently), returns its result
+	def call(self, function, *args):
+		async def call_function():
+			return function(*args)
+		return asyncio.run_coroutine_threadsafe(call_function(), self.loop).result()
+
+	def stop(self):
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
@@ -13,6 +13,9 @@ def help_and_exit():
 	print('\t\t'+'-K <string pointing to the PEM encoded client private key file (ex: some/path/client.key)> (--keyfile) [optional]')	
 	print('\t\t'+'-f <to force the deadband logic on MQTT interval uploads, i.e. if set to True, do not report unless changes exceed the deadband, default False> (--force-deadband) [optional]')
 	print('\t\t'+'-q <to be quiet and to not display the interval Modbus reads, default False> (--quiet) [optional]')
+	print('\t\t'+'-r <to publish all the tags on startup, instead of restoring their last published state from mqtt_state_path, default False> (--republish) [optional]')
+	print('\t\t'+'-x <to display the Modbus call plan built from the template and the estimated round trips per poll cycle, then exit> (--explain) [optional]')
+	print('\t\t'+'--shard <shard index>/<shard count> --shard-fd <file descriptor> <to run as a worker process of a sharded gateway, set by the MQTT publisher process (see modbus_shard_processes)> [internal]')
 	print('\t\t'+'-h to show the help message and exit (--help) [optional]')
 	sys.exit()
 
@@ -29,8 +32,8 @@ start_utc = start_local.astimezone(datetime.timezone.utc)
 
 argv = sys.argv[1:]
 
-short_options = 'c:t:e:C:F:K:fqh' 
-long_options =  ['config=','template=','env=','ca-certs=','certfile=','keyfile=','force-deadband','quiet','help']
+short_options = 'c:t:e:C:F:K:fqrxh' 
+long_options =  ['config=','template=','env=','ca-certs=','certfile=','keyfile=','force-deadband','quiet','republish','explain','help','shard=','shard-fd=']
 
 try:
 	opts, args = getopt.getopt(argv,short_options,long_options)
@@ -75,12 +78,16 @@ modqtt_certfile = None
 modqtt_keyfile = None
 be_quiet = False
 force_deadband = False
+republish = False
+explain_only = False
+shard = None
+shard_fd = None
 
 for opt, arg in opts:
 	if opt in ('-h', '--help'):
-		print('Usage: ./modqtt-gw.py [-h] -c CONFIG_FILE -t TEMPLATE_FILE [-e ENV_FILE] [-C CA_CERT] [-F CERT_FILE] [-K KEY_FILE] [-f] [-q]')
+		print('Usage: ./modqtt-gw.py [-h] -c CONFIG_FILE -t TEMPLATE_FILE [-e ENV_FILE] [-C CA_CERT] [-F CERT_FILE] [-K KEY_FILE] [-f] [-q] [-r] [-x]')
 		print('')
-		print('Or: python3 path/to/modqtt-gw.py [-h] -c CONFIG_FILE -t TEMPLATE_FILE [-e ENV_FILE] [-C CA_CERT] [-F CERT_FILE] [-K KEY_FILE] [-f] [-q]')
+		print('Or: python3 path/to/modqtt-gw.py [-h] -c CONFIG_FILE -t TEMPLATE_FILE [-e ENV_FILE] [-C CA_CERT] [-F CERT_FILE] [-K KEY_FILE] [-f] [-q] [-r] [-x]')
 		print('')
 		print('OPTIONS:')
 		print('\t-h, --help\tshow this help message and exit')
@@ -98,6 +105,10 @@ for opt, arg in opts:
 		print('\t\t\tstring pointing to the PEM encoded client private key file (ex: some/path/client.key)')
 		print('\t-f, --force-deadband\tforce the deadband logic on MQTT interval uploads')
 		print('\t-q, --quiet\tmute the display of scanned data to the terminal prompt')
+		print('\t-r, --republish\tpublish all the tags on startup, instead of restoring their last published state from mqtt_state_path')
+		print('\t-x, --explain\tdisplay the Modbus call plan and the estimated round trips per poll cycle, then exit')
+		print('\t--shard SHARD_INDEX/SHARD_COUNT, --shard-fd FD')
+		print('\t\t\trun as the worker process of a shard of a sharded gateway, handing over its messages through the file descriptor FD (internal, set by the MQTT publisher process, see modbus_shard_processes)')
 		sys.exit()
 	elif opt in ('-c', '--config'):
 		modqtt_config_location = str(arg)
@@ -115,17 +126,51 @@ for opt, arg in opts:
 		force_deadband = True
 	elif opt in ('-q','--quiet'):
 		be_quiet = True
+	elif opt in ('-r','--republish'):
+		republish = True
+	elif opt in ('-x','--explain'):
+		explain_only = True
+	elif opt == '--shard':
+		try:
+			shard = tuple(int(value) for value in arg.split('/'))
+		except ValueError:
+			shard = None
+		if (shard is None) or (len(shard) != 2) or not (0 <= shard[0] < shard[1]):
+			print('\tERROR! Invalid --shard "'+str(arg)+'", should be <shard index>/<shard count> with 0 <= shard index < shard count')
+			sys.exit()
+	elif opt == '--shard-fd':
+		shard_fd = int(arg)
 	else:
 		print('')
 		display_error_message()
 		print('')
 		help_and_exit()
 
+if (shard is None) != (shard_fd is None):
+	print('\tERROR! --shard and --shard-fd should be set together')
+	sys.exit()
+
 print('')
 print('\t[INFO] start_local\t=', start_local.strftime(time_format))
 print('\t[INFO] start_utc\t=', start_utc.strftime(time_format))
 print('')
 
+if explain_only:
+	modqtt_config = modqtt_helper.ModbusHelper.parse_json_config(modqtt_config_location)
+	if modqtt_config is None:
+		sys.exit()
+	if 'modbus_servers' in modqtt_config:
+		for modbus_server in modqtt_config['modbus_servers']:
+			server_config = dict(modqtt_config)
+			server_config.update(modbus_server)
+			print('\t[INFO] Modbus TCP Server "'+str(modbus_server['name'])+'":')
+			call_groups, interpreter_helper, mqtt_helper = modqtt_helper.ModbusHelper.parse_template_build_calls(modbus_server.get('modbus_template', modqtt_template_location), server_config, modbus_server['name'])
+			modqtt_helper.ModbusHelper.explain_call_groups(call_groups, server_config)
+		sys.exit()
+	call_groups, interpreter_helper, mqtt_helper = modqtt_helper.ModbusHelper.parse_template_build_calls(modqtt_template_location, modqtt_config)
+	modqtt_helper.ModbusHelper.explain_call_groups(call_groups, modqtt_config)
+	sys.exit()
+
 modbus_mqtt_gateway = modqtt_helper.ModbusTCPMqttDataGateway(
 		full_path_to_modqtt_config_json=modqtt_config_location, 
 		full_path_to_modqtt_template_csv=modqtt_template_location, 
@@ -134,5 +179,8 @@ modbus_mqtt_gateway = modqtt_helper.ModbusTCPMqttDataGateway(
 		full_path_to_modqtt_certfile=modqtt_certfile,
 		full_path_to_modqtt_keyfile=modqtt_keyfile,
 		force_deadband=force_deadband,
-		quiet=be_quiet
+		quiet=be_quiet,
+		republish=republish,
+		shard=shard,
+		shard_fd=shard_fd
 	)		
\ No newline at end of file
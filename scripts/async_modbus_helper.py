@@ -0,0 +1,141 @@
+import asyncio, struct, time
+from umodbus.client import tcp
+from pipeline_helper import ModbusTCPPipeline, PipelineError, parse_response_adu
+from pool_helper import ConnectionHealth, spread_requests
+
+class AsyncModbusTCPConnection(object):
+
+	# Non-blocking Modbus TCP connection for the asyncio event loop, the asyncio counterpart of a socket used with umodbus tcp.send_message
+	# requests are built with the umodbus request functions (ex: tcp.read_holding_registers) and responses are parsed with umodbus as well, except the bits of FC01/FC02 (see pipeline_helper.parse_response_adu)
+	def __init__(self, server_ip, server_port=502, timeout_seconds=5):
+		self.server_ip = server_ip
+		self.server_port = server_port
+		self.timeout_seconds = timeout_seconds
+		self.reader = None
+		self.writer = None
+
+	async def connect(self):
+		self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.server_ip, self.server_port), self.timeout_seconds)
+
+	def close(self):
+		if self.writer is not None:
+			self.writer.close()
+		self.reader = None
+		self.writer = None
+
+	# Method to read one response ADU: the 7 bytes MBAP header, then the rest of the ADU given by the MBAP length field
+	async def read_adu(self):
+		mbap_header = await self.reader.readexactly(7)
+		length = struct.unpack('>H', mbap_header[4:6])[0]
+		return mbap_header + await self.reader.readexactly(length - 1)
+
+	# Method to send a request ADU and return the parsed response data, like umodbus tcp.send_message
+	async def send_message(self, request_adu):
+		self.writer.write(request_adu)
+		await self.writer.drain()
+		response_adu = await asyncio.wait_for(self.read_adu(), self.timeout_seconds)
+		tcp.raise_for_exception_adu(response_adu)
+		return parse_response_adu(response_adu, request_adu)
+
+	# Method to send request ADUs pipelined (see ModbusTCPPipeline) and return their parsed responses, in the order of the requests
+	# each response must arrive within timeout_seconds
+	async def send_messages(self, request_adus, pipeline):
+		requests = pipeline.assign_transaction_ids(request_adus)
+		responses = [None]*len(requests)
+		pipeline.round_trip_seconds = [0.0]*len(requests)
+		outstanding = {}	# transaction ID -> (index of the request, request ADU)
+		errors = []
+		next_request = 0
+		while (next_request < len(requests)) or outstanding:
+			sent_at = time.perf_counter()
+			while (next_request < len(requests)) and (len(outstanding) < pipeline.max_outstanding_requests):
+				transaction_id, request_adu = requests[next_request]
+				outstanding[transaction_id] = (next_request, request_adu)
+				self.writer.write(request_adu)
+				pipeline.round_trip_seconds[next_request] = sent_at
+				next_request += 1
+			await self.writer.drain()
+			response_adu = await asyncio.wait_for(self.read_adu(), self.timeout_seconds)
+			index, request_adu = pipeline.pop_outstanding(outstanding, response_adu)
+			pipeline.round_trip_seconds[index] = time.perf_counter() - pipeline.round_trip_seconds[index]
+			responses[index] = pipeline.parse_response(response_adu, request_adu, errors)
+		pipeline.record_success()
+		if errors:
+			raise errors[0]
+		return responses
+
+class AsyncModbusTCPConnectionPool(object):
+
+	# Pool of size AsyncModbusTCPConnection to the same server, the asyncio counterpart of the ModbusTCPConnectionPool: the requests of a poll cycle are spread over the open connections and sent concurrently,
+	# each connection sending its share pipelined with its own ModbusTCPPipeline; a connection that breaks is reconnected and its share sent again once, a connection that can not be reconnected is retried on the next poll cycle
+	def __init__(self, server_ip, server_port=502, timeout_seconds=5, size=2, max_outstanding_requests=1):
+		self.server_ip = server_ip
+		self.server_port = server_port
+		self.size = max(1, int(size))
+		self.connections = [AsyncModbusTCPConnection(server_ip, server_port, timeout_seconds) for index in range(self.size)]
+		self.pipelines = [ModbusTCPPipeline(max_outstanding_requests) for index in range(self.size)]
+		self.health = [ConnectionHealth(index) for index in range(self.size)]
+		self.round_trip_seconds = []	# round trip time of each request of the last send_messages, in the order of the requests
+
+	def connected(self):
+		return any(connection.writer is not None for connection in self.connections)
+
+	# Method to (re)open the closed connections of the pool concurrently, recording the failures in their health; at least one connection must be open
+	async def connect(self):
+		closed_indexes = [index for index in range(self.size) if self.connections[index].writer is None]
+		results = await asyncio.gather(*[self.connections[index].connect() for index in closed_indexes], return_exceptions=True)
+		for index, result in zip(closed_indexes, results):
+			if isinstance(result, Exception):
+				self.connections[index].close()
+				self.health[index].record_error(result)
+		if not self.connected():
+			raise ConnectionError('unable to open any of the '+str(self.size)+' connections to '+str(self.server_ip)+':'+str(self.server_port)+', last errors: '+str([connection_health.last_error for connection_health in self.health]))
+
+	def close(self):
+		for connection in self.connections:
+			connection.close()
+
+	# Method to send request ADUs over the open connections concurrently and return their parsed responses, in the order of the requests
+	async def send_messages(self, request_adus):
+		await self.connect()
+		shares = spread_requests(len(request_adus), [index for index in range(self.size) if self.connections[index].writer is not None])
+		results = await asyncio.gather(*[self.send_share(index, [request_adus[request_index] for request_index in request_indexes]) for index, request_indexes in shares], return_exceptions=True)
+		responses = [None]*len(request_adus)
+		self.round_trip_seconds = [0.0]*len(request_adus)
+		errors = []
+		for (index, request_indexes), result in zip(shares, results):
+			if isinstance(result, BaseException):
+				errors.append(result)
+				continue
+			share_responses, share_round_trip_seconds = result
+			for request_index, response, round_trip_seconds in zip(request_indexes, share_responses, share_round_trip_seconds):
+				responses[request_index] = response
+				self.round_trip_seconds[request_index] = round_trip_seconds
+		if errors:
+			raise errors[0]
+		return responses
+
+	# Method to send the share of the requests of a connection, reconnecting it and sending the share again once if it breaks; Modbus exceptions are raised as is
+	async def send_share(self, index, request_adus):
+		connection = self.connections[index]
+		pipeline = self.pipelines[index]
+		try:
+			responses = await connection.send_messages(request_adus, pipeline)
+		except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, PipelineError) as error:
+			self.health[index].record_error(error)
+			if (pipeline.max_outstanding_requests > 1) and pipeline.record_failure(error):
+				print('\t[WARNING] Connection '+str(index)+' to Modbus TCP Server '+str(self.server_ip)+':'+str(self.server_port)+' broke with pipelined requests ('+repr(error)+'), falling back to sequential requests on this connection')
+			connection.close()
+			self.health[index].reconnect_count += 1
+			try:
+				await connection.connect()
+				responses = await connection.send_messages(request_adus, pipeline)
+			except (OSError, EOFError, asyncio.TimeoutError, PipelineError) as retry_error:
+				self.health[index].record_error(retry_error)
+				connection.close()
+				raise
+		self.health[index].record_success(len(request_adus))
+		return responses, list(pipeline.round_trip_seconds)
+
+	def statistics(self):
+		return [connection_health.statistics() for connection_health in self.health]
@@ -0,0 +1,112 @@
+import os, sys, gc, hashlib, pickle, copyreg, struct, io
+
+class TemplateCache(object):
+
+	# source files of the gateway whose code builds the cached structures: the gateway version is the hash of their content, so that any change of the code invalidates the cache
+	SOURCE_FILES = ['modqtt_helper.py','data_helper.py','rule_helper.py','payload_helper.py','cache_helper.py']
+	gateway_version = None
+
+	# Disk cache of the structures compiled from a template (call plan, decode plans, publish rules), keyed by the hash of the template content, the gateway version and the settings they depend on
+	# entries are pickled; struct.Struct objects are pickled by their format, and the objects of references (ex: the rule evaluation functions) by their name
+	# the cache directory must only be writable by the gateway, since loading a pickle can run arbitrary code
+	# at most max_entries entries are kept, the least recently used ones are deleted
+	def __init__(self, cache_dir, references=None, max_entries=16):
+		self.cache_dir = cache_dir
+		self.references = dict(references or {})	# name -> object
+		self.reference_names = {id(self.references[name]): name for name in self.references}
+		self.max_entries = max_entries
+		self.hit_count = 0
+		self.miss_count = 0
+
+	@classmethod
+	def version(cls):
+		if TemplateCache.gateway_version is None:
+			version_hash = hashlib.sha256(sys.version.encode('utf-8'))
+			for source_file in TemplateCache.SOURCE_FILES:
+				with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), source_file), 'rb') as f:
+					version_hash.update(f.read())
+			TemplateCache.gateway_version = version_hash.hexdigest()
+		return TemplateCache.gateway_version
+
+	# Method to build the key of a cache entry from the gateway version and its parts (strings, bytes, or any value with a stable repr)
+	def key(self, *parts):
+		key_hash = hashlib.sha256(TemplateCache.version().encode('utf-8'))
+		for part in parts:
+			key_hash.update(b'\x00')
+			key_hash.update(part if isinstance(part, bytes) else repr(part).encode('utf-8'))
+		return key_hash.hexdigest()
+
+	# Method to hash the content of a file, read in chunks
+	@classmethod
+	def file_hash(cls, full_path_to_file):
+		file_hash = hashlib.sha256()
+		with open(full_path_to_file, 'rb') as f:
+			for chunk in iter(lambda: f.read(1048576), b''):
+				file_hash.update(chunk)
+		return file_hash.digest()
+
+	def entry_path(self, key):
+		return os.path.join(self.cache_dir, key+'.pickle')
+
+	# Method to load a cache entry, returns None if there is none (or if it is unreadable)
+	# the garbage collector is paused while unpickling: the many small objects of a compiled template would otherwise trigger many collections for nothing
+	def load(self, key):
+		entry_path = self.entry_path(key)
+		gc_enabled = gc.isenabled()
+		try:
+			with open(entry_path, 'rb') as f:
+				unpickler = pickle.Unpickler(f)
+				unpickler.persistent_load = self.persistent_load
+				gc.disable()
+				value = unpickler.load()
+			os.utime(entry_path)
+		except FileNotFoundError:
+			self.miss_count += 1
+			return None
+		except Exception as error:
+			print('\t[WARNING] Unable to load the template cache entry "'+entry_path+'" ('+repr(error)+'), the template will be parsed')
+			self.miss_count += 1
+			return None
+		finally:
+			if gc_enabled:
+				gc.enable()
+		self.hit_count += 1
+		return value
+
+	# Method to store a cache entry, written atomically; failures only print a warning, the cache is an optimization
+	def store(self, key, value):
+		entry_path = self.entry_path(key)
+		try:
+			os.makedirs(self.cache_dir, exist_ok=True)
+			buffer = io.BytesIO()
+			pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+			pickler.dispatch_table = copyreg.dispatch_table.copy()
+			pickler.dispatch_table[struct.Struct] = TemplateCache.reduce_struct
+			pickler.persistent_id = self.persistent_id
+			pickler.dump(value)
+			temporary_path = entry_path+'.'+str(os.getpid())+'.tmp'
+			with open(temporary_path, 'wb') as f:
+				f.write(buffer.getvalue())
+			os.replace(temporary_path, entry_path)
+			self.prune()
+		except Exception as error:
+			print('\t[WARNING] Unable to store the template cache entry "'+entry_path+'": '+repr(error))
+
+	# Method to delete the least recently used entries beyond max_entries
+	def prune(self):
+		entry_paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.pickle')]
+		entry_paths.sort(key=os.path.getmtime, reverse=True)
+		for entry_path in entry_paths[self.max_entries:]:
+			os.remove(entry_path)
+
+	@classmethod
+	def reduce_struct(cls, packer):
+		return (struct.Struct, (packer.format,))
+
+	def persistent_id(self, obj):
+		return self.reference_names.get(id(obj))
+
+	def persistent_load(self, name):
+		if name not in self.references:
+			raise pickle.UnpicklingError('unknown reference "'+str(name)+'"')
+		return self.references[name]
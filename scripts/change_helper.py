@@ -0,0 +1,119 @@
+class CallGroupChangeDetector(object):
+
+	# Change detection of the call groups of one Modbus TCP client: the raw response of each call group is kept along with its interpreted response, so that a call group whose response is identical to the last one is not decoded again
+	# the call groups of each poll cycle are listed with the tags whose decoded value changed since they were last polled, so that only their publish rules are evaluated (see PublishChangeFilter)
+	def __init__(self):
+		self.last_responses = {}	# call group key -> (raw response, interpreted response) of its last poll
+		self.sequence = 0			# number of the poll cycle, to detect the poll cycles that were not published (ex: dropped by the publish queue)
+		self.call_groups = None		# [(call group key, interpreted response, keys of the tags that changed or None for all of them), ...] of the current poll cycle
+		self.group_count = 0
+		self.unchanged_group_count = 0
+
+	# Method to forget the last responses, ex: when the call plan changes and the same call group may be decoded differently
+	def reset(self):
+		self.last_responses = {}
+
+	def start_cycle(self):
+		self.sequence += 1
+		self.call_groups = []
+
+	# Method to end a poll cycle, returns its changes: {'sequence': poll cycle number, 'call_groups': [(call group key, interpreted response, changed tag keys), ...]}
+	def end_cycle(self):
+		cycle_changes = {'sequence': self.sequence, 'call_groups': self.call_groups}
+		self.call_groups = None
+		return cycle_changes
+
+	# Method to get the interpreted response of a call group if its raw response is identical to the last one, otherwise None (the response must then be decoded and recorded)
+	def unchanged_response(self, group_key, response):
+		self.group_count += 1
+		last_response = self.last_responses.get(group_key)
+		if (last_response is None) or (last_response[0] != response):
+			return None
+		self.unchanged_group_count += 1
+		self.call_groups.append((group_key, last_response[1], ()))
+		return last_response[1]
+
+	# Method to get the (raw response, interpreted response) of the last poll of a call group, None if it was not polled yet
+	def last_response(self, group_key):
+		return self.last_responses.get(group_key)
+
+	# Method to record the decoded response of a call group that changed, listing the tags whose value changed (all of them the first time the call group is polled)
+	# NaN values never compare equal, so they are always listed as changed
+	def record(self, group_key, response, interpreted_response):
+		last_response = self.last_responses.get(group_key)
+		if last_response is None:
+			changed_tag_keys = None
+		else:
+			last_interpreted_response = last_response[1]
+			changed_tag_keys = [tag_key for tag_key in interpreted_response if last_interpreted_response.get(tag_key) != interpreted_response[tag_key]]
+		return self.record_changes(group_key, response, interpreted_response, changed_tag_keys)
+
+	# Method to record the decoded response of a call group that changed, with the tags whose value changed already listed (ex: by ModbusHelper.decode_changed_response)
+	def record_changes(self, group_key, response, interpreted_response, changed_tag_keys):
+		self.last_responses[group_key] = (response, interpreted_response)
+		self.call_groups.append((group_key, interpreted_response, changed_tag_keys))
+		return interpreted_response
+
+	def statistics(self):
+		return {
+			'group_count': self.group_count,
+			'unchanged_group_count': self.unchanged_group_count,
+			'unchanged_group_ratio': (self.unchanged_group_count/self.group_count) if self.group_count else 0.0
+		}
+
+class PublishChangeFilter(object):
+
+	# Selection of the tags whose publish rules are evaluated in the poll cycles of one Modbus TCP client, given the changes detected by its CallGroupChangeDetector
+	# a rule evaluated again on the value of the previous evaluation makes the same decision, unless it depends on the time elapsed or on the limit_flag:
+	# the tags whose value did not change are skipped, except the ones published at an interval or with alarm limits (and with a negative deadband)
+	# a call group is fully evaluated the first time it is seen, and again after a poll cycle was not published or the tag rules changed (reset), so that a value is only skipped if it was evaluated on the previous poll of its call group
+	def __init__(self):
+		self.last_sequence = None
+		self.seen_groups = set()
+		self.always_evaluated = {}		# call group key -> keys of the tags evaluated even when their value did not change, in poll order
+		self.evaluated_count = 0
+		self.skipped_count = 0
+
+	# Method to evaluate all the tags of the next poll cycles, ex: after the tag rules changed (hot reload)
+	def reset(self):
+		self.seen_groups = set()
+		self.always_evaluated = {}
+
+	@classmethod
+	def always_evaluate(cls, tag_rule):
+		return (tag_rule.publish_interval is not None) or (tag_rule.alarm_low is not None) or (tag_rule.alarm_high is not None) or (tag_rule.deadband < 0)
+
+	# Method to select the keys of the tags to evaluate in a poll cycle, in poll order
+	def select(self, cycle_changes, tag_rules):
+		if (self.last_sequence is None) or (cycle_changes['sequence'] != self.last_sequence + 1):
+			self.seen_groups = set()
+		self.last_sequence = cycle_changes['sequence']
+		tag_keys = []
+		skipped_count = 0
+		for group_key, interpreted_response, changed_tag_keys in cycle_changes['call_groups']:
+			if (changed_tag_keys is None) or (group_key not in self.seen_groups):
+				self.seen_groups.add(group_key)
+				tag_keys.extend(interpreted_response)
+				continue
+			always_evaluated = self.always_evaluated.get(group_key)
+			if always_evaluated is None:
+				always_evaluated = tuple(tag_key for tag_key in interpreted_response if (tag_key in tag_rules) and PublishChangeFilter.always_evaluate(tag_rules[tag_key]))
+				self.always_evaluated[group_key] = always_evaluated
+			if changed_tag_keys:
+				evaluated = set(changed_tag_keys).union(always_evaluated)
+				group_tag_keys = [tag_key for tag_key in interpreted_response if tag_key in evaluated]
+			else:
+				group_tag_keys = always_evaluated
+			tag_keys.extend(group_tag_keys)
+			skipped_count += len(interpreted_response) - len(group_tag_keys)
+		self.evaluated_count += len(tag_keys)
+		self.skipped_count += skipped_count
+		return tag_keys
+
+	def statistics(self):
+		tag_count = self.evaluated_count + self.skipped_count
+		return {
+			'evaluated_count': self.evaluated_count,
+			'skipped_count': self.skipped_count,
+			'skipped_ratio': (self.skipped_count/tag_count) if tag_count else 0.0
+		}
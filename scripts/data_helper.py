@@ -157,6 +157,15 @@ class DataHelper(object):
    					lod.append(record)
     	return lod
 
+    # Method to read a .csv file with a header row as a stream of dictionaries, one per row, without loading the whole file in memory
+    @classmethod
+    def csv_to_dicts(cls, full_path_to_csv_file):
+    	if not os.path.isfile(full_path_to_csv_file):
+    		print('\n\t'+'File "'+full_path_to_csv_file+'" not found! Unable to read it!'+'\n')
+    		return
+    	with open(full_path_to_csv_file, "r", newline='') as f:
+    		yield from csv.DictReader(f)
+
     # Method to export an in-memory Python list of dictionaries (lod) to a .csv file on the local file system
     @classmethod
     def lod_to_csv(cls, lod, full_path_to_csv_file):
@@ -0,0 +1,187 @@
+import os, time, bisect, threading, http.server
+
+class LatencyHistogram(object):
+
+	# upper bounds (inclusive) of the buckets in seconds, from 100 µs to 10 s, the last bucket being unbounded (+Inf)
+	BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+	# Low-overhead latency histogram with fixed buckets: observe() is a bisect and a few additions, without lock
+	# each histogram is only observed by one thread (a poll loop or the publisher thread), so an export may at most read a histogram one observation behind
+	__slots__ = ('bucket_counts','sum_seconds','max_seconds')
+
+	def __init__(self):
+		self.bucket_counts = [0]*(len(LatencyHistogram.BUCKETS) + 1)
+		self.sum_seconds = 0.0
+		self.max_seconds = 0.0
+
+	def observe(self, seconds):
+		self.bucket_counts[bisect.bisect_left(LatencyHistogram.BUCKETS, seconds)] += 1
+		self.sum_seconds += seconds
+		if seconds > self.max_seconds:
+			self.max_seconds = seconds
+
+	# Method to estimate a quantile (0 to 1) of the observations counted in bucket_counts, as the upper bound of the bucket it falls in (the max for the last bucket)
+	def quantile(self, q, bucket_counts, count):
+		rank = q*count
+		cumulative_count = 0
+		for bucket_index, bucket_count in enumerate(bucket_counts):
+			cumulative_count += bucket_count
+			if (cumulative_count >= rank) and (cumulative_count > 0):
+				return LatencyHistogram.BUCKETS[bucket_index] if bucket_index < len(LatencyHistogram.BUCKETS) else self.max_seconds
+		return 0.0
+
+	def statistics(self):
+		bucket_counts = list(self.bucket_counts)
+		count = sum(bucket_counts)
+		return {
+			'count': count,
+			'mean_seconds': (self.sum_seconds/count) if count else 0.0,
+			'p50_seconds': self.quantile(0.5, bucket_counts, count),
+			'p99_seconds': self.quantile(0.99, bucket_counts, count),
+			'max_seconds': self.max_seconds
+		}
+
+class ModbusClientMetrics(object):
+
+	# Instrumentation of the poll cycles of one Modbus TCP client: round trip time of each call group, decode time, and whole poll cycle time
+	def __init__(self, metrics, server):
+		self.metrics = metrics
+		self.server = server
+		self.round_trip = {}	# (fc, start_address) -> LatencyHistogram
+		self.decode = metrics.histogram('modbus_decode_seconds', 'Time to decode the Modbus responses of a poll cycle', server=server)
+		self.poll = metrics.histogram('modbus_poll_seconds', 'Time of a Modbus poll cycle, requests and decode', server=server)
+
+	# Method to record a poll cycle, given its queries [(fc, query), ...] and the round trip time of each of their requests
+	def record_poll(self, queries, round_trip_seconds, decode_seconds, poll_seconds):
+		for (fc, query), seconds in zip(queries, round_trip_seconds):
+			histogram = self.round_trip.get((fc, query['start_address']))
+			if histogram is None:
+				histogram = self.metrics.histogram('modbus_round_trip_seconds', 'Round trip time of the Modbus request of a call group', server=self.server, fc=fc, start_address=query['start_address'])
+				self.round_trip[(fc, query['start_address'])] = histogram
+			histogram.observe(seconds)
+		self.decode.observe(decode_seconds)
+		self.poll.observe(poll_seconds)
+
+class GatewayMetrics(object):
+
+	# Registry of the metrics of the gateway: latency histograms observed on the hot path, and counters/gauges read from the other components (callables) when exported
+	# the metrics are exported as a JSON document (snapshot, published under <mqtt_client_id>/_metrics) and in the Prometheus text exposition format (prometheus_text)
+	def __init__(self, namespace='modqtt', clock=time.monotonic):
+		self.namespace = namespace
+		self.clock = clock
+		self.lock = threading.Lock()
+		self.histograms = {}	# (name, labels) -> (help, LatencyHistogram)
+		self.values = {}		# (name, labels) -> (help, type, callable returning the current value)
+		self.rates = {}			# rate name -> counter name, see snapshot
+		self.last_snapshot = (clock(), {})
+
+	@classmethod
+	def labels_key(cls, labels):
+		return tuple(sorted((str(label), str(labels[label])) for label in labels))
+
+	# Method to get (or create) the histogram of a name and labels
+	def histogram(self, name, help_text, **labels):
+		key = (name, GatewayMetrics.labels_key(labels))
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = (help_text, LatencyHistogram())
+			return self.histograms[key][1]
+
+	# Method to register a counter (metric_type "counter") or gauge (metric_type "gauge"), whose value is read from value_function when exported
+	def register(self, name, help_text, metric_type, value_function, **labels):
+		with self.lock:
+			self.values[(name, GatewayMetrics.labels_key(labels))] = (help_text, metric_type, value_function)
+
+	# Method to also export the per-second rate of a counter (summed over its labels) in the snapshot, computed between two snapshots
+	def register_rate(self, rate_name, counter_name):
+		self.rates[rate_name] = counter_name
+
+	def client_metrics(self, server):
+		return ModbusClientMetrics(self, server)
+
+	def read_values(self):
+		with self.lock:
+			values = dict(self.values)
+		return [(name, labels, help_text, metric_type, value_function()) for (name, labels), (help_text, metric_type, value_function) in values.items()]
+
+	# Method to build the JSON document of the metrics: histograms statistics, counters and gauges, and the per-second rates since the previous snapshot
+	def snapshot(self):
+		with self.lock:
+			histograms = dict(self.histograms)
+		document = {'histograms': {}, 'values': {}, 'rates': {}}
+		for (name, labels), (help_text, histogram) in histograms.items():
+			document['histograms'].setdefault(name, []).append(dict(labels, **histogram.statistics()))
+		counter_totals = {}
+		for name, labels, help_text, metric_type, value in self.read_values():
+			document['values'].setdefault(name, []).append(dict(labels, value=value))
+			if metric_type == 'counter':
+				counter_totals[name] = counter_totals.get(name, 0) + value
+		now = self.clock()
+		previous_time, previous_totals = self.last_snapshot
+		for rate_name, counter_name in self.rates.items():
+			if (counter_name in previous_totals) and (now > previous_time):
+				document['rates'][rate_name] = (counter_totals.get(counter_name, 0) - previous_totals[counter_name])/(now - previous_time)
+		self.last_snapshot = (now, counter_totals)
+		return document
+
+	@classmethod
+	def format_labels(cls, labels, extra_labels=()):
+		labels = tuple(labels) + tuple(extra_labels)
+		if not labels:
+			return ''
+		return '{'+','.join(label+'="'+value.replace('\\', '\\\\').replace('"', '\\"')+'"' for label, value in labels)+'}'
+
+	# Method to render the metrics in the Prometheus text exposition format
+	def prometheus_text(self):
+		with self.lock:
+			histograms = dict(self.histograms)
+		lines = []
+		described = set()
+		for (name, labels), (help_text, histogram) in sorted(histograms.items()):
+			metric_name = self.namespace+'_'+name
+			if metric_name not in described:
+				described.add(metric_name)
+				lines.append('# HELP '+metric_name+' '+help_text)
+				lines.append('# TYPE '+metric_name+' histogram')
+			bucket_counts = list(histogram.bucket_counts)
+			cumulative_count = 0
+			for bucket_index, bucket_count in enumerate(bucket_counts):
+				cumulative_count += bucket_count
+				upper_bound = repr(LatencyHistogram.BUCKETS[bucket_index]) if bucket_index < len(LatencyHistogram.BUCKETS) else '+Inf'
+				lines.append(metric_name+'_bucket'+GatewayMetrics.format_labels(labels, [('le', upper_bound)])+' '+str(cumulative_count))
+			lines.append(metric_name+'_sum'+GatewayMetrics.format_labels(labels)+' '+repr(histogram.sum_seconds))
+			lines.append(metric_name+'_count'+GatewayMetrics.format_labels(labels)+' '+str(cumulative_count))
+		for name, labels, help_text, metric_type, value in sorted(self.read_values(), key=lambda item: (item[0], item[1])):
+			metric_name = self.namespace+'_'+name
+			if metric_name not in described:
+				described.add(metric_name)
+				lines.append('# HELP '+metric_name+' '+help_text)
+				lines.append('# TYPE '+metric_name+' '+metric_type)
+			lines.append(metric_name+GatewayMetrics.format_labels(labels)+' '+str(value))
+		return '\n'.join(lines)+'\n'
+
+	# Method to write the Prometheus text exposition to a file (ex: for the node_exporter textfile collector), atomically
+	def write_prometheus_file(self, full_path_to_file):
+		temporary_path = full_path_to_file+'.tmp'
+		with open(temporary_path, 'w') as f:
+			f.write(self.prometheus_text())
+		os.replace(temporary_path, full_path_to_file)
+
+	# Method to serve the Prometheus text exposition over HTTP on a port (any path, ex: http://host:port/metrics), from a daemon thread; returns the server, to be shutdown()
+	def serve_prometheus(self, port, host=''):
+		metrics = self
+		class PrometheusHandler(http.server.BaseHTTPRequestHandler):
+			def do_GET(self):
+				body = metrics.prometheus_text().encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+		server = http.server.ThreadingHTTPServer((host, port), PrometheusHandler)
+		server.daemon_threads = True
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		return server
@@ -1,8 +1,25 @@
-import os, sys, socket, datetime, time, math, csv, json, signal, ssl
+import os, sys, socket, time, math, csv, json, signal, ssl, struct, asyncio, threading
 from unittest.case import DIFF_OMITTED
 from umodbus.client import tcp
+from umodbus.exceptions import ModbusError
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from data_helper import DataHelper
+from numpy_helper import NumpyBulkDecoder, NumpyRuleEvaluator
+from scheduler_helper import PollScheduler
+from publish_helper import PublishTracker
+from async_modbus_helper import AsyncModbusTCPConnection, AsyncModbusTCPConnectionPool
+from pipeline_helper import ModbusTCPPipeline, PipelineError, packed_bits
+from pool_helper import ModbusTCPConnectionPool
+from change_helper import CallGroupChangeDetector, PublishChangeFilter
+from stage_helper import StageLatency, BoundedCycleQueue
+from store_helper import StoreAndForwardBuffer
+from payload_helper import BinaryPayload, TimestampFormatter, JsonPayload
+from metrics_helper import GatewayMetrics
+from rule_helper import compile_tag_rules, recompile_tag_rules, EVALUATION_FUNCTIONS
+from cache_helper import TemplateCache
+from reload_helper import FileWatcher
+from state_helper import PublishedStateSnapshot
+from shard_helper import ShardPublisher, ShardSupervisor, shard_call_groups, shard_path
 
 import paho.mqtt.client as paho
 import paho.mqtt.publish as publish
@@ -42,17 +59,63 @@ class ModbusHelper(object):
 		'coil': 1
 	}
 
+	# maximum quantity of bits/registers per read request, as per the Modbus specification
+	MAX_QUANTITY_PER_CALL = {
+		'01': 2000,
+		'02': 2000,
+		'03': 125,
+		'04': 125
+	}
+
+	# Modbus TCP read request size (MBAP header + function code, starting address and quantity), and read response header size (MBAP header + function code and byte count)
+	REQUEST_BYTES = 12
+	RESPONSE_HEADER_BYTES = 9
+
+	# config keys of the call planner, the compiled call plan depends on them (see plan_call_groups)
+	CALL_PLAN_CONFIG_KEYS = ['modbus_max_gap_registers','modbus_max_gap_bits','modbus_max_registers_per_call','modbus_max_bits_per_call','modbus_round_trip_seconds','modbus_link_bytes_per_second']
+
+	# config keys whose changes are put in place by a hot reload (see ModbusTCPMqttDataGateway.hot_reload), the changes of the other keys require a restart
+	# modbus_template is the template of an entry of modbus_servers
+	RELOADABLE_CONFIG_KEYS = CALL_PLAN_CONFIG_KEYS + ['modbus_template','modbus_template_cache_dir','mqtt_rule_engine','mqtt_batch_max_bytes','metrics_interval_seconds','mqtt_state_checkpoint_seconds']
+
+	# optional config keys that accept a fixed list of string values
+	CONFIG_STRING_CHOICES = {
+		'modbus_decode_engine': ['struct','numpy'],
+		'mqtt_rule_engine': ['python','numpy'],
+		'mqtt_json_serializer': JsonPayload.SERIALIZERS,
+		'modbus_poll_overrun_policy': PollScheduler.OVERRUN_POLICIES,
+		'mqtt_publish_queue_overflow_policy': BoundedCycleQueue.OVERFLOW_POLICIES,
+		'mqtt_timestamp_precision': list(TimestampFormatter.PRECISIONS)
+	}
+
+	# struct format character, whether it is read from the byte-swapped copy of the response, and whether its 2 registers are permuted (word swap), for each register data_type
+	STRUCT_DECODE_FORMATS = {
+		'uint16': ('H', False, False),
+		'sint16': ('h', False, False),
+		'float32': ('f', False, False),
+		'float64': ('d', False, False),
+		'packedbool': ('H', False, False),
+		'ruint16': ('H', True, False),
+		'rsint16': ('h', True, False),
+		'rfloat32_byte_swap': ('f', True, False), # [A B C D] -> [B A] [D C]
+		'rfloat32_word_swap': ('f', False, True), # [A B C D] -> [C D] [A B]
+		'rfloat32_byte_word_swap': ('f', True, True) # [A B C D] -> [D C] [B A]
+	}
+
 	# Method to parse a modqtt template .csv configuration file and build the various Modbus TCP calls the client shall send in an "optimized" way (optimized to reduce/minimize the number of calls)
+	# call_plan_config is an optional dictionary (typically the modqtt config) with the call planner settings, see ModbusHelper.plan_call_groups
+	# tag_namespace is an optional prefix of the tag names and MQTT topics (ex: the server name when polling several Modbus TCP Servers), i.e. "<tag_namespace>/<tag_name>"
+	# previous_interpreter_helper is the optional interpreter_helper of a previous version of the template (ex: on a hot reload), whose decode plans are reused for the call groups reading the same tags
 	# it returns 3 elements: call_groups, interpreter_helper, and mqtt_helper
 	@classmethod
-	def parse_template_build_calls(cls, full_path_to_modbus_template_csv):
+	def parse_template_build_calls(cls, full_path_to_modbus_template_csv, call_plan_config=None, tag_namespace=None, previous_interpreter_helper=None):
 		call_groups = {}
 		interpreter_helper = {}
 		mqtt_helper = {}
-		template_lod = DataHelper.csv_to_lod(full_path_to_modbus_template_csv)
-		
-		# find unique/distinct read_type
-		for read_entry in template_lod:
+		fc_lookup_table = {}	# read_type -> function code (None if the read_type is not supported)
+
+		# the template is read as a stream of rows, never loaded in memory as a whole
+		for read_entry in DataHelper.csv_to_dicts(full_path_to_modbus_template_csv):
 			read_address = read_entry['address']
 
 			# skip entry if there is no address (mandatory field)
@@ -94,6 +157,10 @@ class ModbusHelper(object):
 				print('\tUsing default tag_name of: "'+read_type+'_address_'+str(read_address)+'_data_type_'+read_data_type+'"')
 				read_tag_name = read_type+'_address_'+str(read_address)+'_data_type_'+read_data_type
 
+			unnamespaced_tag_name = read_tag_name
+			if tag_namespace is not None:
+				read_tag_name = str(tag_namespace)+'/'+read_tag_name
+
 			if read_tag_name not in mqtt_helper:
 				mqtt_helper[read_tag_name] = {}			
 
@@ -110,9 +177,11 @@ class ModbusHelper(object):
 
 			# set the MQTT topic, if no topic provided, the tag_name will be used as topic, otherwise the tag_name is appended to the provided topic name
 			if (not mqtt_topic) or (mqtt_topic == '') or (mqtt_topic is None):
-				mqtt_topic = read_tag_name
+				mqtt_topic = unnamespaced_tag_name
 			else:
-				mqtt_topic = mqtt_topic + '/' + read_tag_name
+				mqtt_topic = mqtt_topic + '/' + unnamespaced_tag_name
+			if tag_namespace is not None:
+				mqtt_topic = str(tag_namespace) + '/' + mqtt_topic
 			# special case to handle packedbook data_type, create multiple topics accordingly
 			if read_data_type == 'packedbool':
 				mqtt_helper[read_tag_name+'_uint16_value'] = {
@@ -128,6 +197,10 @@ class ModbusHelper(object):
 				mqtt_payload = 'text'
 			elif mqtt_payload in ['json','Json','JSON']:
 				mqtt_payload = 'json'
+			elif mqtt_payload in ['batch','Batch','BATCH']:
+				mqtt_payload = 'batch'
+			elif mqtt_payload in ['binary','Binary','BINARY']:
+				mqtt_payload = 'binary'
 			else:
 				print('\n\t[WARNING] Unsupported mqtt_payload for item:')
 				print('\t\t',read_entry)
@@ -269,85 +342,408 @@ class ModbusHelper(object):
 				print('\tUsing default mqtt_ignore_high of: None')
 				mqtt_ignore_high = None
 						
-			# lookup the read_type in ModbusHelper.FUNCTIONS_CODES and build the lookup table
-			fc_lookup_table = {}			
-
-			fc_found = False
-			for fc in ModbusHelper.FUNCTION_CODES:
-				if fc_found:
-					break
-				for fc_keyword in ModbusHelper.FUNCTION_CODES[fc]:
-					if fc_keyword in read_type:
-						fc_found = True
-						if read_type not in fc_lookup_table:
-							fc_lookup_table[read_type] = fc
-						if fc not in call_groups:
-							call_groups[fc] = []
-							#interpreter_helper[fc] = {'addresses': [],'address_count_map': {},'address_data_type_map':{},'address_tag_name_map': {}}
-							interpreter_helper[fc] = {'addresses': [],'address_maps': {}}
-
-						interpreter_helper[fc]['address_maps'][int(read_address)] = {}
-						interpreter_helper[fc]['address_maps'][int(read_address)]['count'] = ModbusHelper.DATA_TYPES_REGISTER_COUNT[read_data_type]
-						interpreter_helper[fc]['address_maps'][int(read_address)]['data_type'] = read_data_type
-						interpreter_helper[fc]['address_maps'][int(read_address)]['tag_name'] = read_tag_name
-						interpreter_helper[fc]['address_maps'][int(read_address)]['scaling_coeff'] = read_entry['scaling_coeff']
-						interpreter_helper[fc]['address_maps'][int(read_address)]['scaling_offset'] = read_entry['scaling_offset']
-						
-						mqtt_helper[read_tag_name]['data_type'] = read_data_type
-						mqtt_helper[read_tag_name]['mqtt_topic'] = mqtt_topic
-						mqtt_helper[read_tag_name]['mqtt_payload'] = mqtt_payload
-						mqtt_helper[read_tag_name]['mqtt_qos'] = mqtt_qos
-						mqtt_helper[read_tag_name]['mqtt_retain'] = mqtt_retain
-						mqtt_helper[read_tag_name]['mqtt_publish'] = mqtt_publish
-						mqtt_helper[read_tag_name]['mqtt_deadband'] = mqtt_deadband
-						mqtt_helper[read_tag_name]['mqtt_alarm_low'] = mqtt_alarm_low
-						mqtt_helper[read_tag_name]['mqtt_alarm_high'] = mqtt_alarm_high
-						mqtt_helper[read_tag_name]['mqtt_ignore_low'] = mqtt_ignore_low
-						mqtt_helper[read_tag_name]['mqtt_ignore_high'] = mqtt_ignore_high
-
-						if read_data_type == 'packedbool':
-							packedbool_tag_name = read_tag_name+'_uint16_value'
-							mqtt_helper[packedbool_tag_name]['mqtt_payload'] = mqtt_payload
-							mqtt_helper[packedbool_tag_name]['mqtt_qos'] = mqtt_qos
-							mqtt_helper[packedbool_tag_name]['mqtt_retain'] = mqtt_retain
-							mqtt_helper[packedbool_tag_name]['mqtt_publish'] = mqtt_publish
-							mqtt_helper[packedbool_tag_name]['mqtt_deadband'] = mqtt_deadband
-							mqtt_helper[packedbool_tag_name]['mqtt_alarm_low'] = mqtt_alarm_low
-							mqtt_helper[packedbool_tag_name]['mqtt_alarm_high'] = mqtt_alarm_high
-							mqtt_helper[packedbool_tag_name]['mqtt_ignore_low'] = mqtt_ignore_low
-							mqtt_helper[packedbool_tag_name]['mqtt_ignore_high'] = mqtt_ignore_high
-							
-							for i in range(0,16):
-								packedbool_tag_name = read_tag_name+'_bit'+str(i)
-								mqtt_helper[packedbool_tag_name]['mqtt_payload'] = mqtt_payload
-								mqtt_helper[packedbool_tag_name]['mqtt_qos'] = mqtt_qos
-								mqtt_helper[packedbool_tag_name]['mqtt_retain'] = mqtt_retain
-								mqtt_helper[packedbool_tag_name]['mqtt_publish'] = mqtt_publish
-								mqtt_helper[packedbool_tag_name]['mqtt_deadband'] = mqtt_deadband
-								mqtt_helper[packedbool_tag_name]['mqtt_alarm_low'] = mqtt_alarm_low
-								mqtt_helper[packedbool_tag_name]['mqtt_alarm_high'] = mqtt_alarm_high
-								mqtt_helper[packedbool_tag_name]['mqtt_ignore_low'] = mqtt_ignore_low
-								mqtt_helper[packedbool_tag_name]['mqtt_ignore_high'] = mqtt_ignore_high
-
-						for call_address in range(int(read_address),int(read_address)+ModbusHelper.DATA_TYPES_REGISTER_COUNT[read_data_type]):
-							interpreter_helper[fc]['addresses'].append(call_address)
+			# set the poll interval (scan class) of the item in seconds, or "once" to only read it at startup; default to the modbus_poll_interval_seconds of the config if none specified or unsupported
+			read_poll_interval = read_entry.get('poll_interval')
+			if (not read_poll_interval) or (read_poll_interval == '') or (read_poll_interval is None):
+				read_poll_interval = None
+			elif read_poll_interval in ['once','Once','ONCE','startup','Startup','STARTUP']:
+				read_poll_interval = 'once'
+			else:
+				try:
+					read_poll_interval = float(read_poll_interval)
+				except:
+					read_poll_interval = float(0)
+				if read_poll_interval <= 0:
+					print('\n\t[WARNING] Unsupported poll_interval for item:')
+					print('\t\t',read_entry)
+					print('\tUsing default poll_interval of: modbus_poll_interval_seconds')
+					read_poll_interval = None
+
+			# lookup the read_type in ModbusHelper.FUNCTION_CODES, once per distinct read_type of the template
+			if read_type not in fc_lookup_table:
+				fc_lookup_table[read_type] = None
+				for fc in ModbusHelper.FUNCTION_CODES:
+					if any(fc_keyword in read_type for fc_keyword in ModbusHelper.FUNCTION_CODES[fc]):
+						fc_lookup_table[read_type] = fc
 						break
+			fc = fc_lookup_table[read_type]
+			if fc is None:
+				continue
+			if fc not in call_groups:
+				call_groups[fc] = []
+				interpreter_helper[fc] = {'addresses': [],'address_maps': {}}
+
+			address = int(read_address)
+			register_count = ModbusHelper.DATA_TYPES_REGISTER_COUNT[read_data_type]
+			scaling = ModbusHelper.parse_scaling(read_entry['scaling_coeff'], read_entry['scaling_offset'])
+			interpreter_helper[fc]['address_maps'][address] = {
+				'count': register_count,
+				'data_type': read_data_type,
+				'tag_name': read_tag_name,
+				'scaling_coeff': read_entry['scaling_coeff'],
+				'scaling_offset': read_entry['scaling_offset'],
+				'scaling': scaling,
+				'poll_interval': read_poll_interval
+			}
+			interpreter_helper[fc]['addresses'].extend(range(address, address + register_count))
+
+			mqtt_settings = {
+				'mqtt_payload': mqtt_payload,
+				'mqtt_qos': mqtt_qos,
+				'mqtt_retain': mqtt_retain,
+				'mqtt_publish': mqtt_publish,
+				'mqtt_deadband': mqtt_deadband,
+				'mqtt_alarm_low': mqtt_alarm_low,
+				'mqtt_alarm_high': mqtt_alarm_high,
+				'mqtt_ignore_low': mqtt_ignore_low,
+				'mqtt_ignore_high': mqtt_ignore_high
+			}
+			mqtt_helper[read_tag_name].update(mqtt_settings, data_type=read_data_type, mqtt_topic=mqtt_topic, mqtt_binary_type=BinaryPayload.value_type(read_data_type, scaling is not None))
+			if read_data_type == 'packedbool':
+				mqtt_helper[read_tag_name+'_uint16_value'].update(mqtt_settings, mqtt_binary_type='uint16')
+				for i in range(0,16):
+					mqtt_helper[read_tag_name+'_bit'+str(i)].update(mqtt_settings, mqtt_binary_type='bool')
 		
+		# call groups are planned separately for each poll interval (scan class), None being the default modbus_poll_interval_seconds
 		for fc in interpreter_helper:
-			previous_address = None
-			for address in sorted(interpreter_helper[fc]['addresses']):
-				if previous_address is None:
-					call_groups[fc].append({'start_address': address, 'register_count': 1})
-				else:
-					address_delta = address - previous_address
-					if address_delta == 1:
-						call_groups[fc][-1]['register_count'] += 1						
-					else:
-						call_groups[fc].append({'start_address': address, 'register_count': 1})
-				previous_address = address
+			tag_spans_per_poll_interval = {}
+			for address in interpreter_helper[fc]['address_maps']:
+				address_map = interpreter_helper[fc]['address_maps'][address]
+				tag_spans_per_poll_interval.setdefault(address_map['poll_interval'], []).append((address, address_map['count']))
+			call_groups[fc] = []
+			for poll_interval in tag_spans_per_poll_interval:
+				for query in ModbusHelper.plan_call_groups(fc, tag_spans_per_poll_interval[poll_interval], call_plan_config):
+					query['poll_interval'] = poll_interval
+					call_groups[fc].append(query)
+
+		# compile a decode plan for each call group, so that each response can be decoded with a single struct unpack_from at poll time
+		for fc in call_groups:
+			interpreter_helper[fc]['decode_plans'] = {}
+			previous_fc_helper = (previous_interpreter_helper or {}).get(fc, {'address_maps': {}, 'decode_plans': {}})
+			for query in call_groups[fc]:
+				decode_plan_key = (query['start_address'], query['register_count'])
+				if decode_plan_key in interpreter_helper[fc]['decode_plans']:
+					continue
+				decode_plan = previous_fc_helper['decode_plans'].get(decode_plan_key)
+				if (decode_plan is None) or (ModbusHelper.call_group_tags(fc, interpreter_helper[fc]['address_maps'], query['start_address'], query['register_count']) != ModbusHelper.call_group_tags(fc, previous_fc_helper['address_maps'], query['start_address'], query['register_count'])):
+					decode_plan = ModbusHelper.compile_decode_plan(fc, interpreter_helper[fc]['address_maps'], query['start_address'], query['register_count'])
+				interpreter_helper[fc]['decode_plans'][decode_plan_key] = decode_plan
 
 		return call_groups, interpreter_helper, mqtt_helper
 
+	# Method to get the template cache of a config (modbus_template_cache_dir), None if not set
+	@classmethod
+	def template_cache(cls, config=None):
+		if (config is None) or ('modbus_template_cache_dir' not in config):
+			return None
+		return TemplateCache(config['modbus_template_cache_dir'], references=EVALUATION_FUNCTIONS)
+
+	# Method to get the call plan, decode plans and mqtt_helper of a template (see parse_template_build_calls) from the template cache, or to parse the template and cache them
+	# the cache entry is keyed by the template content, the call planner settings, the tag namespace and the gateway version; returns the 3 elements and the cache key (None without cache)
+	@classmethod
+	def load_template_build_calls(cls, full_path_to_modbus_template_csv, call_plan_config=None, tag_namespace=None, previous_interpreter_helper=None):
+		template_cache = ModbusHelper.template_cache(call_plan_config)
+		if template_cache is None:
+			return ModbusHelper.parse_template_build_calls(full_path_to_modbus_template_csv, call_plan_config, tag_namespace, previous_interpreter_helper) + (None,)
+		cache_key = template_cache.key(
+				'template',
+				TemplateCache.file_hash(full_path_to_modbus_template_csv),
+				ModbusHelper.call_plan_config_values(call_plan_config),
+				tag_namespace
+			)
+		cached_plan = template_cache.load(cache_key)
+		if cached_plan is not None:
+			print('\t[INFO] Loaded the compiled call plan of "'+str(full_path_to_modbus_template_csv)+'" from the template cache')
+			return cached_plan + (cache_key,)
+		compiled_plan = ModbusHelper.parse_template_build_calls(full_path_to_modbus_template_csv, call_plan_config, tag_namespace, previous_interpreter_helper)
+		template_cache.store(cache_key, compiled_plan)
+		return compiled_plan + (cache_key,)
+
+	# Method to list the values of the call planner settings of a config, the compiled call plan depends on them
+	@classmethod
+	def call_plan_config_values(cls, config=None):
+		return [(config or {}).get(config_key) for config_key in ModbusHelper.CALL_PLAN_CONFIG_KEYS]
+
+	# Method to read the call planner settings from call_plan_config (typically the modqtt config), using the defaults for any setting not provided
+	@classmethod
+	def call_plan_settings(cls, fc, call_plan_config=None):
+		if call_plan_config is None:
+			call_plan_config = {}
+		if fc in ['01', '02']:
+			max_gap = call_plan_config.get('modbus_max_gap_bits', 0)
+			max_count = call_plan_config.get('modbus_max_bits_per_call', ModbusHelper.MAX_QUANTITY_PER_CALL[fc])
+		else:
+			max_gap = call_plan_config.get('modbus_max_gap_registers', 0)
+			max_count = call_plan_config.get('modbus_max_registers_per_call', ModbusHelper.MAX_QUANTITY_PER_CALL[fc])
+		if (max_count < 1) or (max_count > ModbusHelper.MAX_QUANTITY_PER_CALL[fc]):
+			print('\t[WARNING] maximum quantity per call of '+str(max_count)+' out of the Modbus specification range [1,'+str(ModbusHelper.MAX_QUANTITY_PER_CALL[fc])+'] for function code '+fc+', using '+str(ModbusHelper.MAX_QUANTITY_PER_CALL[fc]))
+			max_count = ModbusHelper.MAX_QUANTITY_PER_CALL[fc]
+		round_trip_seconds = float(call_plan_config.get('modbus_round_trip_seconds', 0.04))
+		link_bytes_per_second = float(call_plan_config.get('modbus_link_bytes_per_second', 125000))
+		return max(int(max_gap), 0), int(max_count), round_trip_seconds, link_bytes_per_second
+
+	# Method to estimate the number of bytes of a Modbus TCP request and of its response, for a quantity of registers or bits
+	@classmethod
+	def call_bytes(cls, fc, quantity):
+		if fc in ['01', '02']:
+			return ModbusHelper.REQUEST_BYTES, ModbusHelper.RESPONSE_HEADER_BYTES + (quantity + 7)//8
+		return ModbusHelper.REQUEST_BYTES, ModbusHelper.RESPONSE_HEADER_BYTES + 2*quantity
+
+	# Method to coalesce the tag spans [(address, count), ...] of one function code into call groups
+	# adjacent tags are merged into the same call while the call stays within the maximum quantity per call (125 registers or 2000 bits by the Modbus specification)
+	# tags separated by a gap of at most max_gap registers/bits are also merged, reading and then discarding the padding, when reading the padding is cheaper than one extra round trip:
+	#	padding bytes / link_bytes_per_second < round_trip_seconds + (request bytes + response header bytes) / link_bytes_per_second
+	# a tag is never split across two calls
+	@classmethod
+	def plan_call_groups(cls, fc, tag_spans, call_plan_config=None):
+		max_gap, max_count, round_trip_seconds, link_bytes_per_second = ModbusHelper.call_plan_settings(fc, call_plan_config)
+		request_bytes, response_header_bytes = ModbusHelper.call_bytes(fc, 0)
+		extra_call_seconds = round_trip_seconds + (request_bytes + response_header_bytes)/link_bytes_per_second
+		call_groups = []
+		group_end = None
+		for address, count in sorted(tag_spans):
+			if group_end is not None:
+				start_address = call_groups[-1]['start_address']
+				new_end = max(group_end, address + count)
+				gap = address - group_end
+				if gap <= 0:
+					fits = (new_end - start_address) <= max_count
+				else:
+					padding_bytes = ModbusHelper.call_bytes(fc, new_end - start_address)[1] - ModbusHelper.call_bytes(fc, new_end - start_address - gap)[1]
+					fits = (gap <= max_gap) and ((new_end - start_address) <= max_count) and (padding_bytes/link_bytes_per_second < extra_call_seconds)
+				if fits:
+					call_groups[-1]['register_count'] = new_end - start_address
+					call_groups[-1]['padding_count'] += max(gap, 0)
+					group_end = new_end
+					continue
+			call_groups.append({'start_address': address, 'register_count': count, 'padding_count': 0})
+			group_end = address + count
+		return call_groups
+
+	# Method to display the call plan built by parse_template_build_calls, and the estimated number of round trips and network time per poll cycle
+	@classmethod
+	def explain_call_groups(cls, call_groups, call_plan_config=None):
+		total_calls = 0
+		total_bytes = 0
+		total_padding = 0
+		calls_per_second = 0.0
+		round_trip_seconds = None
+		default_poll_interval = (call_plan_config or {}).get('modbus_poll_interval_seconds', 1)
+		print('\t[INFO] Modbus call plan:')
+		print('\t\t'+'FC'.ljust(6)+'start_address'.ljust(16)+'count'.ljust(8)+'padding'.ljust(10)+'request_bytes'.ljust(16)+'response_bytes'.ljust(17)+'poll_interval')
+		for fc in call_groups:
+			max_gap, max_count, round_trip_seconds, link_bytes_per_second = ModbusHelper.call_plan_settings(fc, call_plan_config)
+			for query in call_groups[fc]:
+				request_bytes, response_bytes = ModbusHelper.call_bytes(fc, query['register_count'])
+				padding_count = query.get('padding_count', 0)
+				poll_interval = query.get('poll_interval')
+				if poll_interval is None:
+					poll_interval = default_poll_interval
+				if poll_interval != 'once':
+					calls_per_second += 1/float(poll_interval)
+				print('\t\t'+fc.ljust(6)+str(query['start_address']).ljust(16)+str(query['register_count']).ljust(8)+str(padding_count).ljust(10)+str(request_bytes).ljust(16)+str(response_bytes).ljust(17)+str(poll_interval))
+				total_calls += 1
+				total_bytes += request_bytes + response_bytes
+				total_padding += padding_count
+		if round_trip_seconds is None:
+			round_trip_seconds, link_bytes_per_second = ModbusHelper.call_plan_settings('03', call_plan_config)[2:]
+		# with pipelined requests, up to max_outstanding_requests requests share the same round trip, on each of the modbus_connections_per_server connections
+		max_outstanding_requests = max(1, (call_plan_config or {}).get('modbus_max_outstanding_requests', 1))
+		connections = max(1, (call_plan_config or {}).get('modbus_connections_per_server', 1))
+		estimated_seconds = math.ceil(total_calls/(max_outstanding_requests*connections))*round_trip_seconds + total_bytes/link_bytes_per_second
+		print('\t[INFO] Requests per poll cycle:\t\t'+str(total_calls)+' when all scan classes are due, '+str(round(calls_per_second, 3))+' per second on average, at most '+str(max_outstanding_requests)+' outstanding (pipelined) on each of '+str(connections)+' connection(s)')
+		print('\t[INFO] Bytes exchanged per poll cycle:\t\t'+str(total_bytes)+' (including '+str(total_padding)+' padding registers/bits read and discarded)')
+		print('\t[INFO] Estimated network time per poll cycle:\t'+str(round(estimated_seconds, 3))+' seconds (round trip of '+str(round_trip_seconds)+' seconds, link of '+str(link_bytes_per_second)+' bytes/second)')
+		return {'round_trips': total_calls, 'round_trips_per_second': calls_per_second, 'bytes': total_bytes, 'padding': total_padding, 'estimated_seconds': estimated_seconds}
+
+	# Method to parse the scaling_coeff and scaling_offset strings of a template row once, at template load time
+	# it returns None if no scaling applies, otherwise a (coeff, offset) tuple of floats such that scaled_value = value*coeff + offset
+	@classmethod
+	def parse_scaling(cls, scaling_coeff, scaling_offset):
+		coeff_null = (not scaling_coeff) or math.isnan(float(scaling_coeff))
+		offset_null = (not scaling_offset) or math.isnan(float(scaling_offset))
+		if coeff_null and offset_null:
+			return None
+		coeff = float(1) if coeff_null else float(scaling_coeff)
+		offset = float(0) if offset_null else float(scaling_offset)
+		return (coeff, offset)
+
+	# Method to compile the decode plan of one call group (one Modbus request)
+	# for registers (FC03/FC04), the response is packed once as big-endian bytes, followed (if needed) by its byte-swapped copy, and a single struct.Struct reads every tag of the group:
+	#	- uint16, sint16, float32, float64, packedbool and rfloat32_word_swap are read from the big-endian copy
+	#	- ruint16, rsint16, rfloat32_byte_swap and rfloat32_byte_word_swap are read from the byte-swapped copy
+	#	- rfloat32_word_swap and rfloat32_byte_word_swap have their 2 registers permuted before packing
+	# registers not mapped to any tag are skipped as pad bytes
+	@classmethod
+	def compile_decode_plan(cls, fc, address_maps, start_address, register_count):
+		if fc in ['01', '02']:
+			bit_names = []
+			for i in range(register_count):
+				address_map = address_maps.get(start_address + i)
+				bit_names.append(None if address_map is None else address_map['tag_name'])
+			return {'fc': fc, 'register_count': register_count, 'bit_names': tuple(bit_names)}
+
+		register_order = list(range(register_count))
+		big_endian_format = ''
+		byte_swapped_format = ''
+		big_endian_offset = 0
+		byte_swapped_offset = 0
+		big_endian_fields = []
+		byte_swapped_fields = []
+		fields_in_address_order = []
+		for i, address_map in ModbusHelper.walk_call_group(address_maps, start_address, register_count):
+			struct_format, byte_swapped, word_swapped = ModbusHelper.STRUCT_DECODE_FORMATS[address_map['data_type']]
+			if word_swapped:
+				register_order[i], register_order[i+1] = register_order[i+1], register_order[i]
+			if byte_swapped:
+				byte_swapped_format += ModbusHelper.struct_pad(2*i - byte_swapped_offset) + struct_format
+				byte_swapped_offset = 2*(i + address_map['count'])
+				byte_swapped_fields.append(address_map)
+			else:
+				big_endian_format += ModbusHelper.struct_pad(2*i - big_endian_offset) + struct_format
+				big_endian_offset = 2*(i + address_map['count'])
+				big_endian_fields.append(address_map)
+			fields_in_address_order.append(address_map)
+
+		# the byte-swapped copy follows the big-endian copy in the buffer
+		if byte_swapped_fields:
+			unpack_format = '>' + big_endian_format + ModbusHelper.struct_pad(2*register_count - big_endian_offset) + byte_swapped_format
+		else:
+			unpack_format = '>' + big_endian_format
+		value_index = {id(address_map): index for index, address_map in enumerate(big_endian_fields + byte_swapped_fields)}
+
+		fields = []
+		for address_map in fields_in_address_order:
+			tag_name = address_map['tag_name']
+			if address_map['data_type'] == 'packedbool':
+				bit_names = tuple((tag_name+'_bit'+str(bit), bit) for bit in range(15, -1, -1))
+				fields.append((tag_name+'_uint16_value', value_index[id(address_map)], None, bit_names))
+			else:
+				fields.append((tag_name, value_index[id(address_map)], address_map['scaling'], None))
+
+		register_order = None if register_order == list(range(register_count)) else register_order
+		return {
+			'fc': fc,
+			'register_count': register_count,
+			'register_order': register_order,
+			'pack_big_endian': struct.Struct('>'+str(register_count)+'H'),
+			'pack_byte_swapped': struct.Struct('<'+str(register_count)+'H') if byte_swapped_fields else None,
+			'unpack': struct.Struct(unpack_format),
+			'fields': tuple(fields)
+		}
+
+	# Method to walk the registers of one call group and yield the (register offset within the group, address map) of each tag to decode
+	# registers not mapped to any tag, or overlapped by the previous tag, are skipped
+	@classmethod
+	def walk_call_group(cls, address_maps, start_address, register_count):
+		i = 0
+		while i < register_count:
+			address_map = address_maps.get(start_address + i)
+			if (address_map is None) or (i + address_map['count'] > register_count):
+				i += 1
+				continue
+			if address_map['data_type'] not in ModbusHelper.STRUCT_DECODE_FORMATS:
+				print('\t[ERROR] unsupported data_type of "'+str(address_map['data_type'])+'" on tag_name = "'+str(address_map['tag_name'])+'"')
+				i += 1
+				continue
+			yield i, address_map
+			i += address_map['count']
+
+	# Method to list the (register or bit offset within the group, address map) of the tags read by a call group
+	@classmethod
+	def call_group_tags(cls, fc, address_maps, start_address, register_count):
+		if fc in ['01', '02']:
+			return [(i, address_maps[start_address + i]) for i in range(register_count) if (start_address + i) in address_maps]
+		return list(ModbusHelper.walk_call_group(address_maps, start_address, register_count))
+
+	# Method to build a struct pad of a given number of bytes
+	@classmethod
+	def struct_pad(cls, byte_count):
+		if byte_count <= 0:
+			return ''
+		return str(byte_count)+'x'
+
+	# Method to decode a Modbus response (list of 16-bit registers or bits, as returned by umodbus) using a decode plan built by compile_decode_plan
+	@classmethod
+	def decode_response(cls, decode_plan, response, interpreted_response=None):
+		if interpreted_response is None:
+			interpreted_response = {}
+		if 'bit_names' in decode_plan:
+			for tag_name, bit_value in zip(decode_plan['bit_names'], response):
+				if tag_name is not None:
+					interpreted_response[tag_name] = bit_value
+			return interpreted_response
+
+		if decode_plan['register_order'] is not None:
+			response = [response[i] for i in decode_plan['register_order']]
+		buffer = decode_plan['pack_big_endian'].pack(*response)
+		if decode_plan['pack_byte_swapped'] is not None:
+			buffer += decode_plan['pack_byte_swapped'].pack(*response)
+		values = decode_plan['unpack'].unpack_from(buffer)
+
+		for tag_name, index, scaling, bit_names in decode_plan['fields']:
+			value = values[index]
+			if bit_names is not None:
+				interpreted_response[tag_name] = value
+				for bit_tag_name, bit in bit_names:
+					interpreted_response[bit_tag_name] = (value >> bit) & 1
+			elif scaling is None:
+				interpreted_response[tag_name] = value
+			else:
+				interpreted_response[tag_name] = value*scaling[0] + scaling[1]
+		return interpreted_response
+
+	# Method to decode a Modbus response given the last response of the same call group and its interpreted response (see CallGroupChangeDetector), returns the new interpreted response and the keys of the tags whose value changed
+	# bits are diffed as integers: the last and new bits of a FC01/FC02 response (or the last and new word of a packedbool) are XORed, and only the bits that flipped are updated and listed, instead of every bit
+	@classmethod
+	def decode_changed_response(cls, decode_plan, response, last_response, last_interpreted_response):
+		interpreted_response = dict(last_interpreted_response)
+		changed_tag_keys = []
+		if 'bit_names' in decode_plan:
+			bit_names = decode_plan['bit_names']
+			# XOR of the packed bytes of the responses (see pipeline_helper.PackedBits), bit i of the little-endian integer being bit i of the response
+			flipped = int.from_bytes(packed_bits(response), 'little') ^ int.from_bytes(packed_bits(last_response), 'little')
+			flipped &= (1 << len(bit_names)) - 1
+			while flipped:
+				position = (flipped & -flipped).bit_length() - 1
+				flipped &= flipped - 1
+				tag_name = bit_names[position]
+				if tag_name is not None:
+					interpreted_response[tag_name] = response[position]
+					changed_tag_keys.append(tag_name)
+			return interpreted_response, changed_tag_keys
+
+		if decode_plan['register_order'] is not None:
+			response = [response[i] for i in decode_plan['register_order']]
+		buffer = decode_plan['pack_big_endian'].pack(*response)
+		if decode_plan['pack_byte_swapped'] is not None:
+			buffer += decode_plan['pack_byte_swapped'].pack(*response)
+		values = decode_plan['unpack'].unpack_from(buffer)
+
+		for tag_name, index, scaling, bit_names in decode_plan['fields']:
+			value = values[index]
+			if bit_names is not None:
+				flipped = value ^ interpreted_response[tag_name]
+				if not flipped:
+					continue
+				interpreted_response[tag_name] = value
+				changed_tag_keys.append(tag_name)
+				# bit_names are ordered from bit 15 to bit 0
+				while flipped:
+					bit = flipped.bit_length() - 1
+					flipped ^= 1 << bit
+					bit_tag_name = bit_names[15 - bit][0]
+					interpreted_response[bit_tag_name] = (value >> bit) & 1
+					changed_tag_keys.append(bit_tag_name)
+				continue
+			if scaling is not None:
+				value = value*scaling[0] + scaling[1]
+			# the value is set even if equal, ex: -0.0 and 0.0
+			if value != interpreted_response[tag_name]:
+				changed_tag_keys.append(tag_name)
+			interpreted_response[tag_name] = value
+		return interpreted_response, changed_tag_keys
+
 	@classmethod
 	def parse_json_config(cls, full_path_to_modqtt_config_json):
 		with open(full_path_to_modqtt_config_json) as json_file:
@@ -359,7 +755,7 @@ class ModbusHelper(object):
 			key_value = config[key]
 
 			# for keys/values that should be entered as string
-			if key in ['modbus_server_ip','mqtt_client_id','mqtt_broker_ip_or_url']:
+			if key in ['modbus_server_ip','mqtt_client_id','mqtt_broker_ip_or_url','mqtt_store_path','mqtt_timestamp_format','metrics_prometheus_path','modbus_template_cache_dir','mqtt_state_path']:
 				if not isinstance(key_value,str):
 					print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
 					print('\t[ERROR] value of key "'+str(key)+'" should be of type "string" (str)')
@@ -393,8 +789,16 @@ class ModbusHelper(object):
 									print('\t[ERROR] please provide a valid IPv4 address format A.B.C.D with A, B, C, and D in range [0,255]')
 									return
 
+			# for keys/values that should be entered as one of a list of supported strings
+			elif key in ModbusHelper.CONFIG_STRING_CHOICES:
+				if key_value not in ModbusHelper.CONFIG_STRING_CHOICES[key]:
+					print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
+					print('\t[ERROR] value of key "'+str(key)+'" should be one of',ModbusHelper.CONFIG_STRING_CHOICES[key])
+					print('\t[ERROR] current value is config["'+str(key)+'"] =',str(key_value))
+					return
+
 			# for keys/values that should be entered as integer
-			elif key in ['modbus_server_port','modbus_server_id','mqtt_broker_port','mqtt_max_inflight_messages_set']:
+			elif key in ['modbus_server_port','modbus_server_id','mqtt_broker_port','mqtt_max_inflight_messages_set','modbus_max_gap_registers','modbus_max_gap_bits','modbus_max_registers_per_call','modbus_max_bits_per_call','modbus_max_outstanding_requests','modbus_connections_per_server','modbus_shard_processes','mqtt_publish_queue_size','mqtt_store_max_messages','mqtt_store_replay_batch_size','mqtt_batch_max_bytes','metrics_prometheus_port']:
 				if not isinstance(key_value,int):
 					print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
 					print('\t[ERROR] value of key "'+str(key)+'" should be of type "integer" (int)')
@@ -414,27 +818,113 @@ class ModbusHelper(object):
 					if not (key_value in range(0,256)):
 						print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
 						print('\t[ERROR] invalid server ID "'+str(key_value)+'" out of valid range [0,255]')
-						return				
+						return
+				# check for a valid maximum number of outstanding (pipelined) requests
+				elif key == 'modbus_max_outstanding_requests':
+					if key_value < 1:
+						print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
+						print('\t[ERROR] invalid maximum number of outstanding requests "'+str(key_value)+'", should be at least 1 (1 for sequential requests)')
+						return
+				# check for a valid number of connections per Modbus TCP Server
+				elif key == 'modbus_connections_per_server':
+					if key_value < 1:
+						print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
+						print('\t[ERROR] invalid number of connections per Modbus TCP Server "'+str(key_value)+'", should be at least 1')
+						return
+				# check for a valid number of worker processes
+				elif key == 'modbus_shard_processes':
+					if key_value < 1:
+						print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
+						print('\t[ERROR] invalid number of worker processes "'+str(key_value)+'", should be at least 1 (1 to poll from the gateway process itself)')
+						return
+				# check for valid queue, buffer and batch sizes
+				elif key in ['mqtt_publish_queue_size','mqtt_store_max_messages','mqtt_store_replay_batch_size','mqtt_batch_max_bytes']:
+					if key_value < 1:
+						print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
+						print('\t[ERROR] invalid value "'+str(key_value)+'" for key "'+str(key)+'", should be at least 1')
+						return
+				# check for a valid TCP port to serve the Prometheus metrics on
+				elif key == 'metrics_prometheus_port':
+					if not (key_value in range(1,65536)):
+						print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
+						print('\t[ERROR] invalid TCP port "'+str(key_value)+'" out of valid range [1,65535] for TCP ports')
+						return
 			
 			# for keys/values that should be entered as either integer or float
-			elif key in ['modbus_poll_interval_seconds','modbus_server_timeout_seconds']:
+			elif key in ['modbus_poll_interval_seconds','modbus_server_timeout_seconds','modbus_round_trip_seconds','modbus_link_bytes_per_second','mqtt_publish_ack_timeout_seconds','mqtt_store_max_age_seconds','mqtt_store_replay_messages_per_second','metrics_interval_seconds','hot_reload_interval_seconds','mqtt_state_checkpoint_seconds','mqtt_initial_publish_messages_per_second']:
 				if not (isinstance(key_value,int) or isinstance(config[key],float)):
 					print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
 					print('\t[ERROR] value of key "'+str(key)+'" should be of type "integer" (int) or "float" (float)')
 					print('\t[ERROR] current type of value for key "'+str(key)+'" is',type(key_value),'and current value is config["'+str(key)+'"] =',str(key_value))
 					return
 			# for keys/values that should be entered as boolean, either true or false		
-			elif key in ['mqtt_connection_monitoring','mqtt_broker_tls','mqtt_v5','mqtt_v311','mqtt_v31','mqtt_tls_insecure_set']:
+			elif key in ['mqtt_connection_monitoring','mqtt_broker_tls','mqtt_v5','mqtt_v311','mqtt_v31','mqtt_tls_insecure_set','modbus_poll_align_to_wall_clock','modbus_change_detection','mqtt_metrics']:
 				if not isinstance(key_value,bool):
 					print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
 					print('\t[ERROR] value of key "'+str(key)+'" should be of type boolean, either true or false in the .json config')
 					print('\t[ERROR] current type of value for key "'+str(key)+'" is',type(key_value),'and current value is config["'+str(key)+'"] =',str(key_value))
 					return
+			# for the list of Modbus TCP Servers polled concurrently, each entry being an object with at least a unique "name"
+			elif key == 'modbus_servers':
+				if (not isinstance(key_value,list)) or (len(key_value) == 0) or (not all(isinstance(modbus_server,dict) for modbus_server in key_value)):
+					print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
+					print('\t[ERROR] value of key "'+str(key)+'" should be a non-empty list of objects, one per Modbus TCP Server')
+					print('\t[ERROR] current value is config["'+str(key)+'"] =',str(key_value))
+					return
+				server_names = [modbus_server.get('name') for modbus_server in key_value]
+				if (not all(isinstance(server_name,str) and server_name != '' for server_name in server_names)) or (len(set(server_names)) != len(server_names)):
+					print('\t[ERROR] Error parsing config file:',str(full_path_to_modqtt_config_json))
+					print('\t[ERROR] each entry of "'+str(key)+'" should have a unique, non-empty "name" string')
+					print('\t[ERROR] current names are:',server_names)
+					return
 
 		return config
 
+	# Method to merge the changes of a config (ex: the config file edited while the gateway runs) into the running config, for the keys of RELOADABLE_CONFIG_KEYS only
+	# the entries of modbus_servers are merged the same way, as long as they list the same server names in the same order
+	# returns the merged config and the sorted list of the changed keys that are ignored, i.e. that require a restart
+	@classmethod
+	def merge_reloadable_config(cls, running_config, new_config):
+		config = dict(running_config)
+		ignored_keys = []
+		for key in list(running_config) + [key for key in new_config if key not in running_config]:
+			if running_config.get(key) == new_config.get(key):
+				continue
+			if key in ModbusHelper.RELOADABLE_CONFIG_KEYS:
+				if key in new_config:
+					config[key] = new_config[key]
+				else:
+					del config[key]
+			elif (key == 'modbus_servers') and (key in running_config) and (key in new_config) and ([modbus_server['name'] for modbus_server in running_config[key]] == [modbus_server['name'] for modbus_server in new_config[key]]):
+				config[key] = []
+				for running_server, new_server in zip(running_config[key], new_config[key]):
+					modbus_server, ignored_server_keys = ModbusHelper.merge_reloadable_config(running_server, new_server)
+					config[key].append(modbus_server)
+					ignored_keys.extend([key+'/'+str(modbus_server['name'])+'/'+ignored_key for ignored_key in ignored_server_keys])
+			else:
+				ignored_keys.append(key)
+		return config, sorted(ignored_keys)
+
+	# Method to derive the config of the worker process of shard shard_index out of shard_count of a sharded gateway (see modbus_shard_processes) from the config of the gateway
+	# in multi-server mode, the worker polls every shard_count-th entry of modbus_servers; otherwise, it polls its share of the call groups of the template (see shard_call_groups)
+	# the MQTT connection, its monitoring and the store-and-forward buffer belong to the MQTT publisher process; the last published state and the Prometheus metrics of each worker are kept apart
+	@classmethod
+	def shard_config(cls, config, shard_index, shard_count):
+		config = dict(config)
+		for key in ['modbus_shard_processes','mqtt_store_path']:
+			config.pop(key, None)
+		config['mqtt_connection_monitoring'] = False
+		if 'modbus_servers' in config:
+			config['modbus_servers'] = config['modbus_servers'][shard_index::shard_count]
+		for key in ['mqtt_state_path','metrics_prometheus_path']:
+			if key in config:
+				config[key] = shard_path(config[key], shard_index)
+		if 'metrics_prometheus_port' in config:
+			config['metrics_prometheus_port'] += 1 + shard_index
+		return config
+
 class ModbusTCPClient:
-	def __init__(self, server_ip=None, server_port=None, server_id=None, poll_interval_seconds=None):
+	def __init__(self, server_ip=None, server_port=None, server_id=None, poll_interval_seconds=None, decode_engine=None, max_outstanding_requests=None, connections=None, change_detection=False, shard=None):
 		if server_ip is None:
 			print('\t[ERROR] no server_ip argument provided to ModbusTCPClient instance')
 			print('\t[ERROR] server_port, server_id and poll_interval_seconds arguments will default to 502, 1, and 1 second respectively if not specified')
@@ -460,15 +950,58 @@ class ModbusTCPClient:
 			default_poll_interval = '(default)'
 			poll_interval_seconds = 1
 		self.poll_interval_seconds = poll_interval_seconds
+		default_decode_engine = ''
+		if decode_engine is None:
+			default_decode_engine = '(default)'
+			decode_engine = 'struct'
+		elif (decode_engine == 'numpy') and (not NumpyBulkDecoder.is_available()):
+			print('\t[WARNING] decode_engine "numpy" requested but numpy is not installed, using the default "struct" decode engine')
+			decode_engine = 'struct'
+		self.decode_engine = decode_engine
+		default_max_outstanding_requests = ''
+		if max_outstanding_requests is None:
+			default_max_outstanding_requests = '(default)'
+			max_outstanding_requests = 1
+		self.pipeline = ModbusTCPPipeline(max_outstanding_requests)
+		default_connections = ''
+		if connections is None:
+			default_connections = '(default)'
+			connections = 1
+		self.connections = connections
+		# with several connections, the requests of a poll cycle are spread over a pool of connections and sent in parallel
+		self.connection_pool = None
+		if connections > 1:
+			self.connection_pool = self.build_connection_pool(connections, max_outstanding_requests)
+		# with change detection, the call groups whose raw response did not change since their last poll are not decoded again, see CallGroupChangeDetector
+		self.change_detector = CallGroupChangeDetector() if change_detection else None
+		self.cycle_changes = None		# changes of the last poll cycle, with change detection
+		self.shard = shard				# (shard index, shard count) of a worker process of a sharded gateway, to only poll the call groups of its shard, see shard_call_groups
+		self.tick_interval_seconds = poll_interval_seconds
+		self.scan_buckets = []
 		self.call_groups = None
 		self.interpreter_helper = None
+		self.template_cache_key = None	# key of the compiled template in the template cache (modbus_template_cache_dir), if any
+		self.full_path_to_modbus_template_csv = None
+		self.tag_namespace = None
+		self.pending_plan = None		# plan compiled from a changed template, put in place between two poll cycles (see compile_plan)
 		self.sock = None
+		self.metrics = None				# optional ModbusClientMetrics, set by the gateway
+		self.round_trip_seconds = []	# round trip time of each request of the last poll cycle
 		print('\t[INFO] Client will attempt to connect to Modbus TCP Server at:\t\t\t',str(self.modbus_tcp_server_ip_address))
 		print('\t[INFO] Client will attempt to connect to Modbus TCP Server on port:\t\t',str(self.modbus_tcp_server_port),default_server_port)
 		print('\t[INFO] Client will attempt to connect to Modbus TCP Server with Modbus ID:\t',str(self.modbus_tcp_server_id),default_server_id)
 		print('\t[INFO] Client will attempt to poll the Modbus TCP Server every:\t\t\t',str(self.poll_interval_seconds)+' seconds',default_poll_interval)
+		print('\t[INFO] Client will decode the Modbus TCP responses with decode engine:\t',str(self.decode_engine),default_decode_engine)
+		print('\t[INFO] Client will send at most this many outstanding (pipelined) requests:\t',str(self.pipeline.max_outstanding_requests),default_max_outstanding_requests)
+		print('\t[INFO] Client will open this many connections to the Modbus TCP Server:\t',str(self.connections),default_connections)
+		print('\t[INFO] Client will only decode the call groups whose response changed:\t',str(self.change_detector is not None))
+		if self.shard is not None:
+			print('\t[INFO] Client will only poll the call groups of shard:\t\t\t',str(self.shard[0])+' of '+str(self.shard[1]))
+
+	def build_connection_pool(self, connections, max_outstanding_requests):
+		return ModbusTCPConnectionPool(self.modbus_tcp_server_ip_address, self.modbus_tcp_server_port, connections, max_outstanding_requests)
 
-	def load_template(self, full_path_to_modbus_template_csv=None):
+	def load_template(self, full_path_to_modbus_template_csv=None, call_plan_config=None, tag_namespace=None):
 		if full_path_to_modbus_template_csv is None:
 			print('\t[ERROR] in ModbusTCPClient.load_template(): please make sure to provide a valid path to a modbus_template.csv file')
 			return
@@ -476,145 +1009,274 @@ class ModbusTCPClient:
 			print('\t[ERROR] in ModbusTCPClient.load_template(): unable to find "'+str(full_path_to_modbus_template_csv)+'"')
 			return
 		else:
-			self.call_groups, self.interpreter_helper, self.mqtt_helper = ModbusHelper.parse_template_build_calls(full_path_to_modbus_template_csv)
+			self.call_groups, self.interpreter_helper, self.mqtt_helper, self.template_cache_key = ModbusHelper.load_template_build_calls(full_path_to_modbus_template_csv, call_plan_config, tag_namespace)
+			if self.shard is not None:
+				self.call_groups = shard_call_groups(self.call_groups, *self.shard)
+			self.full_path_to_modbus_template_csv = full_path_to_modbus_template_csv
+			self.tag_namespace = tag_namespace
+			self.build_scan_buckets()
+
+	# Method to compile the plan of a changed template (ex: on a hot reload) while the current plan keeps being polled, returns the plan to set as pending_plan
+	# the decode plans of the call groups reading the same tags as before are reused, and so are the scan buckets whose call groups are unchanged, see plan_scan_buckets
+	def compile_plan(self, full_path_to_modbus_template_csv, call_plan_config=None, tag_namespace=None):
+		compiled_plan = ModbusHelper.load_template_build_calls(full_path_to_modbus_template_csv, call_plan_config, tag_namespace, previous_interpreter_helper=self.interpreter_helper)
+		if self.shard is not None:
+			compiled_plan = (shard_call_groups(compiled_plan[0], *self.shard),) + tuple(compiled_plan[1:])
+		tick_interval_seconds, scan_buckets = self.plan_scan_buckets(compiled_plan[0], compiled_plan[1], self.scan_buckets, self.interpreter_helper)
+		return {
+			'full_path_to_modbus_template_csv': full_path_to_modbus_template_csv,
+			'tag_namespace': tag_namespace,
+			'compiled_plan': compiled_plan,
+			'tick_interval_seconds': tick_interval_seconds,
+			'scan_buckets': scan_buckets
+		}
+
+	# Method to put the pending plan in place, to be called between two poll cycles; returns True if there was a pending plan
+	# the unchanged scan buckets keep their schedule, the new or changed ones are polled at the next tick
+	def apply_pending_plan(self):
+		plan = self.pending_plan
+		if plan is None:
+			return False
+		for scan_bucket in plan['scan_buckets']:
+			if scan_bucket['previous'] is not None:
+				scan_bucket['last_slot_index'] = scan_bucket['previous']['last_slot_index']
+				scan_bucket['previous'] = None
+		self.call_groups, self.interpreter_helper, self.mqtt_helper, self.template_cache_key = plan['compiled_plan']
+		self.full_path_to_modbus_template_csv = plan['full_path_to_modbus_template_csv']
+		self.tag_namespace = plan['tag_namespace']
+		self.tick_interval_seconds = plan['tick_interval_seconds']
+		self.scan_buckets = plan['scan_buckets']
+		self.pending_plan = None
+		if self.change_detector is not None:
+			self.change_detector.reset()
+		return True
+
+	# Method to group the call groups into scan buckets, i.e. the call groups that are always polled together
+	# the scheduler ticks at the fastest poll interval of the template (or modbus_poll_interval_seconds if faster), and each scan class is due every round(poll_interval / tick) ticks
+	# the call groups of a scan class are spread over the ticks of its period (phase), so that slow scan classes do not all fall on the same tick
+	# all scan buckets are polled on the first tick, and the "once" scan class only on the first tick
+	def build_scan_buckets(self):
+		self.tick_interval_seconds, self.scan_buckets = self.plan_scan_buckets(self.call_groups, self.interpreter_helper)
+
+	# Method to build the scan buckets of call_groups, returns the tick interval and the scan buckets
+	# with previous_scan_buckets (the running ones, when a changed template is compiled), a scan bucket with the same period, phase, call groups and decode plans as a previous one keeps its bulk decoder,
+	# and is linked to it ('previous') so that it keeps its schedule when the plan is put in place (see apply_pending_plan); nothing is kept if the tick interval changes
+	def plan_scan_buckets(self, call_groups, interpreter_helper, previous_scan_buckets=None, previous_interpreter_helper=None):
+		poll_intervals = [query['poll_interval'] for fc in call_groups for query in call_groups[fc] if query['poll_interval'] not in [None, 'once']]
+		tick_interval_seconds = min([self.poll_interval_seconds] + poll_intervals)
+		scan_buckets = {}
+		phase_counter = 0
+		for fc in call_groups:
+			for query in call_groups[fc]:
+				if query['poll_interval'] == 'once':
+					period_ticks, phase = None, 0
+				else:
+					poll_interval = self.poll_interval_seconds if query['poll_interval'] is None else query['poll_interval']
+					period_ticks = max(1, int(round(poll_interval/tick_interval_seconds)))
+					phase = phase_counter % period_ticks
+					phase_counter += 1
+				if (period_ticks, phase) not in scan_buckets:
+					scan_buckets[(period_ticks, phase)] = {'period_ticks': period_ticks, 'phase': phase, 'last_slot_index': None, 'queries': [], 'bulk_decoder': None, 'previous': None}
+				scan_buckets[(period_ticks, phase)]['queries'].append((fc, query))
+		if previous_scan_buckets and (tick_interval_seconds == self.tick_interval_seconds):
+			for previous_scan_bucket in previous_scan_buckets:
+				scan_bucket = scan_buckets.get((previous_scan_bucket['period_ticks'], previous_scan_bucket['phase']))
+				if (scan_bucket is not None) and ModbusTCPClient.same_call_groups(scan_bucket['queries'], interpreter_helper, previous_scan_bucket['queries'], previous_interpreter_helper):
+					scan_bucket['previous'] = previous_scan_bucket
+					scan_bucket['bulk_decoder'] = previous_scan_bucket['bulk_decoder']
+		scan_buckets = list(scan_buckets.values())
+		# with the numpy decode engine, all the responses of a scan bucket are decoded at once
+		if self.decode_engine == 'numpy':
+			for scan_bucket in scan_buckets:
+				if scan_bucket['bulk_decoder'] is None:
+					scan_bucket['bulk_decoder'] = NumpyBulkDecoder(self.call_group_layouts(scan_bucket['queries'], interpreter_helper))
+		return tick_interval_seconds, scan_buckets
+
+	# Method to check if two lists of call groups [(fc, query), ...] are the same, decoded with the same decode plans (see previous_interpreter_helper in ModbusHelper.parse_template_build_calls)
+	@classmethod
+	def same_call_groups(cls, queries, interpreter_helper, previous_queries, previous_interpreter_helper):
+		if len(queries) != len(previous_queries):
+			return False
+		for (fc, query), (previous_fc, previous_query) in zip(queries, previous_queries):
+			decode_plan_key = (query['start_address'], query['register_count'])
+			if (fc != previous_fc) or (decode_plan_key != (previous_query['start_address'], previous_query['register_count'])) or (query['poll_interval'] != previous_query['poll_interval']):
+				return False
+			if interpreter_helper[fc]['decode_plans'].get(decode_plan_key) is not previous_interpreter_helper[fc]['decode_plans'].get(decode_plan_key):
+				return False
+		return True
+
+	# Method to check if a scan bucket is due at a given scheduler slot index, including if the slot where it was due has been skipped
+	def scan_bucket_due(self, scan_bucket, slot_index):
+		if scan_bucket['last_slot_index'] is None:
+			return True
+		if scan_bucket['period_ticks'] is None:
+			return False
+		period_ticks = scan_bucket['period_ticks']
+		phase = scan_bucket['phase']
+		return ((slot_index - phase)//period_ticks) > ((scan_bucket['last_slot_index'] - phase)//period_ticks)
+
+	# Method to list the (fc, register_count, [(register offset within the group, address map), ...]) of each call group of queries [(fc, query), ...], or of all call groups in poll order
+	# interpreter_helper defaults to the one of the loaded template
+	def call_group_layouts(self, queries=None, interpreter_helper=None):
+		if queries is None:
+			queries = [(fc, query) for fc in self.call_groups for query in self.call_groups[fc]]
+		if interpreter_helper is None:
+			interpreter_helper = self.interpreter_helper
+		layouts = []
+		for fc, query in queries:
+			tags = ModbusHelper.call_group_tags(fc, interpreter_helper[fc]['address_maps'], query['start_address'], query['register_count'])
+			layouts.append((fc, query['register_count'], tags))
+		return layouts
 
 	def connect(self, timeout=5):
+		self.timeout_seconds = timeout
 		socket.setdefaulttimeout(timeout)
+		if self.connection_pool is not None:
+			self.connection_pool.connect(timeout)
+			return
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)		
 		self.sock.connect((self.modbus_tcp_server_ip_address, self.modbus_tcp_server_port))
 
 	def disconnect(self):
+		if self.connection_pool is not None:
+			self.connection_pool.close()
+			return
 		self.sock.close()
 
 	def interpret_response(self, response, fc, start_address):
-		interpreted_response = {}
-		skip_next = False
-		skip_count = 0
-		for i in range(len(response)):
-			address_index = i + start_address
-			if fc in ['01', '02']:
-				#interpreted_response[self.interpreter_helper[fc]['address_tag_name_map'][address_index]] = response[i]
-				interpreted_response[self.interpreter_helper[fc]['address_maps'][address_index]['tag_name']] = response[i]
-			else:
-				if skip_next:
-					if skip_count == 0:
-						skip_next = False
-					elif skip_count == 1:
-						skip_count -= 1
-						skip_next = False
-					else:
-						skip_count -= 1
-					continue								
-
-				#given_data_type = self.interpreter_helper[fc]['address_data_type_map'][address_index]
-				given_data_type = self.interpreter_helper[fc]['address_maps'][address_index]['data_type']
-				if given_data_type == 'float32':
-					float_32_items = response[i:i+2]
-					float_32_binaries = [DataHelper.int_16_unsigned_to_binary(reg) for reg in float_32_items]
-					rv = DataHelper.binary_32_to_ieee_754_single_precision_float(''.join(float_32_binaries))
-					skip_next = True
-				elif given_data_type == 'sint16':
-					rv = DataHelper.int_16_unsigned_to_signed(response[i])
-					skip_next = False
-				elif given_data_type == 'uint16':
-					rv = response[i]
-					skip_next = False
-				elif given_data_type == 'float64':
-					float_64_items = response[i:i+4]
-					float_64_binaries = [DataHelper.int_16_unsigned_to_binary(reg) for reg in float_64_items]
-					rv = DataHelper.binary_64_to_ieee_754_single_precision_float(''.join(float_64_binaries))
-					skip_next = True
-					skip_count = 3
-				elif given_data_type == 'rsint16':
-					swapped_rv = DataHelper.binary_string_16_bits_to_int_16_unsigned(DataHelper.int_16_swap_bytes(DataHelper.int_16_unsigned_to_binary(response[i])))
-					rv = DataHelper.int_16_unsigned_to_signed(swapped_rv)
-					skip_next = False
-				elif given_data_type == 'ruint16':
-					rv = DataHelper.binary_string_16_bits_to_int_16_unsigned(DataHelper.int_16_swap_bytes(DataHelper.int_16_unsigned_to_binary(response[i])))					
-					skip_next = False
-				elif given_data_type == 'packedbool':
-					binary_string_register = DataHelper.int_16_unsigned_to_binary(response[i])
-					binary_string_register_list = []
-					binary_string_register_list[:0]= binary_string_register 
-					skip_next = False
-				elif given_data_type == 'rfloat32_byte_swap':
-					float_32_items = response[i:i+2]
-					float_32_binary_string = ''.join([DataHelper.int_16_unsigned_to_binary(reg) for reg in float_32_items])
-					swapped_rv = DataHelper.float32_swap_bytes(float_32_binary_string)
-					rv = DataHelper.binary_32_to_ieee_754_single_precision_float(swapped_rv)
-					skip_next = True
-				elif given_data_type == 'rfloat32_word_swap':
-					float_32_items = response[i:i+2]
-					float_32_binary_string = ''.join([DataHelper.int_16_unsigned_to_binary(reg) for reg in float_32_items])
-					swapped_rv = DataHelper.float32_swap_words(float_32_binary_string)
-					rv = DataHelper.binary_32_to_ieee_754_single_precision_float(swapped_rv)
-					skip_next = True
-				elif given_data_type == 'rfloat32_byte_word_swap':
-					float_32_items = response[i:i+2]
-					float_32_binary_string = ''.join([DataHelper.int_16_unsigned_to_binary(reg) for reg in float_32_items])
-					swapped_rv = DataHelper.float32_swap_bytes_words(float_32_binary_string)
-					rv = DataHelper.binary_32_to_ieee_754_single_precision_float(swapped_rv)
-					skip_next = True
-				else:
-					print('\t[ERROR] unsupported data_type of "'+str(given_data_type)+'" on tag_name = "'+self.interpreter_helper[fc]['address_maps'][address_index]['tag_name']+'"')
-					skip_next = False
-					continue
-
-				# evaluate scaling to apply
-				applied_coeff = self.interpreter_helper[fc]['address_maps'][address_index]['scaling_coeff']
-				applied_offset = self.interpreter_helper[fc]['address_maps'][address_index]['scaling_offset']
-				if (not applied_coeff) ^ (not applied_offset):
-					one_scaling_null = True
-					applied_coeff_null = not applied_coeff
-					both_null_case = False
-				elif (not applied_coeff) & (not applied_offset):
-					both_null_case = True
-				else:
-					applied_coeff_null = (math.isnan(float(applied_coeff)) or (applied_coeff is None))
-					one_scaling_null =  applied_coeff_null ^ (math.isnan(float(applied_offset)) or (applied_offset is None))
-					both_null_case = (math.isnan(float(applied_coeff)) or (applied_coeff is None)) & (math.isnan(float(applied_offset)) or (applied_offset is None))
-				if not both_null_case:
-					if not (given_data_type == 'packedbool'):
-						if one_scaling_null:
-							if applied_coeff_null:
-								applied_coeff = 1
-							else:
-								applied_offset = 0
-						rv = rv*float(applied_coeff) + float(applied_offset)
-
-				if given_data_type == 'packedbool':					
-					interpreted_response[self.interpreter_helper[fc]['address_maps'][address_index]['tag_name']+'_uint16_value'] = response[i]
-					for string_char_pos, string_char in enumerate(binary_string_register_list):
-						suffix = str(15 - string_char_pos)
-						interpreted_response[self.interpreter_helper[fc]['address_maps'][address_index]['tag_name']+'_bit'+suffix] = int(string_char)
-				else:
-					interpreted_response[self.interpreter_helper[fc]['address_maps'][address_index]['tag_name']] = rv
-
-		return interpreted_response
+		return ModbusHelper.decode_response(self.decode_plan(fc, start_address, len(response)), response)
+
+	# Method to get the decode plan of a call group, compiled on first use if the template did not compile it
+	def decode_plan(self, fc, start_address, register_count):
+		decode_plan = self.interpreter_helper[fc]['decode_plans'].get((start_address, register_count))
+		if decode_plan is None:
+			decode_plan = ModbusHelper.compile_decode_plan(fc, self.interpreter_helper[fc]['address_maps'], start_address, register_count)
+			self.interpreter_helper[fc]['decode_plans'][(start_address, register_count)] = decode_plan
+		return decode_plan
 	
 	def combine_tag_responses(self, lod):
 		combined_responses = {}
 		for resp in lod:
-			for tag in resp:
-				combined_responses[tag] = resp[tag]
+			combined_responses.update(resp)
 		return combined_responses
 
-	def cycle_poll(self, time_format = '%Y-%m-%d %H:%M:%S%z'):
-		ts_local = datetime.datetime.now().astimezone()
-		ts_utc = ts_local.astimezone(datetime.timezone.utc)
-		all_interpreted_responses = [{'timestamp_utc': ts_utc.strftime(time_format), 'timestamp_local': ts_local.strftime(time_format)}]
-		for modbus_call in self.call_groups:
-			modbus_request = ModbusHelper.UMODBUS_TCP_CALL[modbus_call]
-			for query in self.call_groups[modbus_call]:
-				message = modbus_request(slave_id=self.modbus_tcp_server_id, starting_address=query['start_address'], quantity=query['register_count'])
-
-				# Response depends on Modbus function code.
-				response = tcp.send_message(message, self.sock)
-				interpreted_response = self.interpret_response(response, modbus_call, query['start_address'])
-				all_interpreted_responses.append(interpreted_response)
+	# Method to poll the scan buckets due at the scheduler slot_index (all of them if slot_index is None), and return the tags refreshed by this poll cycle
+	def cycle_poll(self, slot_index=None):
+		poll_start = time.perf_counter()
+		all_interpreted_responses = [self.cycle_timestamp()]
+		scan_buckets = self.due_scan_buckets(slot_index)
+		queries = [query for scan_bucket in scan_buckets for query in scan_bucket['queries']]
+		messages = [self.build_request(modbus_call, query) for modbus_call, query in queries]
+		responses = self.send_messages(messages)
+		decode_start = time.perf_counter()
+		self.interpret_scan_buckets(scan_buckets, responses, all_interpreted_responses)
 		combined_responses = self.combine_tag_responses(all_interpreted_responses)
+		if self.metrics is not None:
+			poll_end = time.perf_counter()
+			self.metrics.record_poll(queries, self.round_trip_seconds, poll_end - decode_start, poll_end - poll_start)
 		return combined_responses
 
+	# Method to send the request ADUs of a poll cycle and return their responses, pipelined if max_outstanding_requests > 1
+	# if the server does not answer the pipelined requests properly (timeout, closed connection, unexpected transaction ID), the client reconnects and sends the poll cycle sequentially;
+	# it falls back to sequential requests for good on an unexpected transaction ID, or after several pipelined poll cycles failed in a row (see ModbusTCPPipeline.record_failure)
+	# with a connection pool, the requests are spread over its connections instead, see ModbusTCPConnectionPool
+	def send_messages(self, messages):
+		if self.connection_pool is not None:
+			responses = self.connection_pool.send_messages(messages)
+			self.round_trip_seconds = self.connection_pool.round_trip_seconds
+			return responses
+		if (self.pipeline.max_outstanding_requests > 1) and (len(messages) > 1):
+			try:
+				responses = self.pipeline.send_messages(messages, self.sock)
+				self.round_trip_seconds = self.pipeline.round_trip_seconds
+				return responses
+			except (socket.timeout, ConnectionError, ValueError, PipelineError) as error:
+				if self.pipeline.record_failure(error):
+					print('\t[WARNING] Modbus TCP Server does not support pipelined requests ('+repr(error)+'), falling back to sequential requests')
+				else:
+					print('\t[WARNING] Pipelined requests to the Modbus TCP Server failed ('+repr(error)+'), reconnecting and sending this poll cycle sequentially')
+				self.disconnect()
+				self.connect(self.timeout_seconds)
+		# Response depends on Modbus function code.
+		responses = []
+		self.round_trip_seconds = []
+		for message in messages:
+			sent_at = time.perf_counter()
+			responses.append(self.pipeline.send_message(message, self.sock))
+			self.round_trip_seconds.append(time.perf_counter() - sent_at)
+		return responses
+
+	# name of the Modbus TCP Server in the metrics
+	def metrics_name(self):
+		return str(self.modbus_tcp_server_ip_address)+':'+str(self.modbus_tcp_server_port)
+
+	# Method to timestamp a poll cycle: nanoseconds since the Unix epoch (to be formatted when published), and on the monotonic clock (to measure the time elapsed between publishes)
+	def cycle_timestamp(self):
+		return {'timestamp_ns': time.time_ns(), 'timestamp_monotonic_ns': time.monotonic_ns()}
+
+	# Method to list the scan buckets due at the scheduler slot_index (all of them if slot_index is None), marking them as polled
+	def due_scan_buckets(self, slot_index=None):
+		due_scan_buckets = []
+		for scan_bucket in self.scan_buckets:
+			if (slot_index is not None) and (not self.scan_bucket_due(scan_bucket, slot_index)):
+				continue
+			scan_bucket['last_slot_index'] = slot_index if slot_index is not None else scan_bucket['last_slot_index']
+			due_scan_buckets.append(scan_bucket)
+		return due_scan_buckets
+
+	# Method to build the request ADU of a call group
+	def build_request(self, fc, query):
+		modbus_request = ModbusHelper.UMODBUS_TCP_CALL[fc]
+		return modbus_request(slave_id=self.modbus_tcp_server_id, starting_address=query['start_address'], quantity=query['register_count'])
+
+	# Method to decode the responses of the call groups of several scan buckets, given in the same order as their queries
+	# with change detection, the changes of the poll cycle are kept in cycle_changes, to be queued along with it
+	def interpret_scan_buckets(self, scan_buckets, responses, all_interpreted_responses):
+		if self.change_detector is not None:
+			self.change_detector.start_cycle()
+		position = 0
+		for scan_bucket in scan_buckets:
+			self.interpret_scan_bucket(scan_bucket, responses[position:position+len(scan_bucket['queries'])], all_interpreted_responses)
+			position += len(scan_bucket['queries'])
+		if self.change_detector is not None:
+			self.cycle_changes = self.change_detector.end_cycle()
+
+	# Method to decode the responses of the call groups of a scan bucket, appending the interpreted responses to all_interpreted_responses
+	# with the numpy decode engine, all the responses of a scan bucket are decoded at once
+	def interpret_scan_bucket(self, scan_bucket, responses, all_interpreted_responses):
+		if self.change_detector is not None:
+			self.interpret_changed_scan_bucket(scan_bucket, responses, all_interpreted_responses)
+			return
+		if scan_bucket['bulk_decoder'] is not None:
+			all_interpreted_responses.append(scan_bucket['bulk_decoder'].decode_cycle(responses))
+			return
+		for (modbus_call, query), response in zip(scan_bucket['queries'], responses):
+			all_interpreted_responses.append(self.interpret_response(response, modbus_call, query['start_address']))
+
+	# Method to decode the responses of the call groups of a scan bucket that changed since their last poll, reusing the last interpreted response of the others
+	# the call groups that changed are decoded from their last interpreted response, only updating the tags that changed, see ModbusHelper.decode_changed_response
+	# with the numpy decode engine, the responses of a scan bucket are decoded at once, so the whole scan bucket is decoded if any of them changed
+	def interpret_changed_scan_bucket(self, scan_bucket, responses, all_interpreted_responses):
+		change_detector = self.change_detector
+		if scan_bucket['bulk_decoder'] is not None:
+			group_key = tuple((modbus_call, query['start_address'], query['register_count']) for modbus_call, query in scan_bucket['queries'])
+			interpreted_response = change_detector.unchanged_response(group_key, responses)
+			if interpreted_response is None:
+				interpreted_response = change_detector.record(group_key, responses, scan_bucket['bulk_decoder'].decode_cycle(responses))
+			all_interpreted_responses.append(interpreted_response)
+			return
+		for (modbus_call, query), response in zip(scan_bucket['queries'], responses):
+			group_key = (modbus_call, query['start_address'], query['register_count'])
+			interpreted_response = change_detector.unchanged_response(group_key, response)
+			if interpreted_response is None:
+				last_response = change_detector.last_response(group_key)
+				if last_response is None:
+					interpreted_response = change_detector.record(group_key, response, self.interpret_response(response, modbus_call, query['start_address']))
+				else:
+					interpreted_response, changed_tag_keys = ModbusHelper.decode_changed_response(self.decode_plan(modbus_call, query['start_address'], len(response)), response, last_response[0], last_response[1])
+					change_detector.record_changes(group_key, response, interpreted_response, changed_tag_keys)
+			all_interpreted_responses.append(interpreted_response)
+
 	def pretty_print_interpreted_response(self, to_print, max_items_per_line=5):
 		headers = list(to_print.keys())		
 		header_max_length = max([len(str(h)) for h in headers])
@@ -636,10 +1298,98 @@ class ModbusTCPClient:
 		print('\t',sep_line)
 		print('')
 
+# asyncio counterpart of the ModbusTCPClient, to poll many Modbus TCP Servers concurrently from a single event loop
+# it shares the template parsing, scan buckets and decoding of the ModbusTCPClient, only the network I/O is non-blocking
+class AsyncModbusTCPClient(ModbusTCPClient):
+	def __init__(self, server_name=None, server_ip=None, server_port=None, server_id=None, poll_interval_seconds=None, decode_engine=None, timeout_seconds=5, max_outstanding_requests=None, connections=None, change_detection=False):
+		print('\t[INFO] Client will poll the Modbus TCP Server named:\t\t\t',str(server_name))
+		self.timeout_seconds = timeout_seconds
+		super().__init__(server_ip=server_ip, server_port=server_port, server_id=server_id, poll_interval_seconds=poll_interval_seconds, decode_engine=decode_engine, max_outstanding_requests=max_outstanding_requests, connections=connections, change_detection=change_detection)
+		self.server_name = server_name
+		self.connection = AsyncModbusTCPConnection(self.modbus_tcp_server_ip_address, self.modbus_tcp_server_port, timeout_seconds)
+
+	def build_connection_pool(self, connections, max_outstanding_requests):
+		return AsyncModbusTCPConnectionPool(self.modbus_tcp_server_ip_address, self.modbus_tcp_server_port, self.timeout_seconds, connections, max_outstanding_requests)
+
+	def metrics_name(self):
+		return str(self.server_name)
+
+	def connected(self):
+		if self.connection_pool is not None:
+			return self.connection_pool.connected()
+		return self.connection.writer is not None
+
+	async def connect(self):
+		if self.connection_pool is not None:
+			await self.connection_pool.connect()
+			return
+		await self.connection.connect()
+
+	def disconnect(self):
+		if self.connection_pool is not None:
+			self.connection_pool.close()
+			return
+		self.connection.close()
+
+	# Method to poll the scan buckets due at the scheduler slot_index (all of them if slot_index is None), and return the tags refreshed by this poll cycle
+	async def cycle_poll(self, slot_index=None):
+		poll_start = time.perf_counter()
+		all_interpreted_responses = [self.cycle_timestamp()]
+		scan_buckets = self.due_scan_buckets(slot_index)
+		queries = [query for scan_bucket in scan_buckets for query in scan_bucket['queries']]
+		messages = [self.build_request(modbus_call, query) for modbus_call, query in queries]
+		responses = await self.send_messages(messages)
+		decode_start = time.perf_counter()
+		self.interpret_scan_buckets(scan_buckets, responses, all_interpreted_responses)
+		combined_responses = self.combine_tag_responses(all_interpreted_responses)
+		if self.metrics is not None:
+			poll_end = time.perf_counter()
+			self.metrics.record_poll(queries, self.round_trip_seconds, poll_end - decode_start, poll_end - poll_start)
+		return combined_responses
+
+	# Method to send the request ADUs of a poll cycle and return their responses, pipelined if max_outstanding_requests > 1, with the same fallback to sequential requests as the ModbusTCPClient
+	# with a connection pool, the requests are spread over its connections instead, see AsyncModbusTCPConnectionPool
+	async def send_messages(self, messages):
+		if self.connection_pool is not None:
+			responses = await self.connection_pool.send_messages(messages)
+			self.round_trip_seconds = self.connection_pool.round_trip_seconds
+			return responses
+		if (self.pipeline.max_outstanding_requests > 1) and (len(messages) > 1):
+			try:
+				responses = await self.connection.send_messages(messages, self.pipeline)
+				self.round_trip_seconds = self.pipeline.round_trip_seconds
+				return responses
+			except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, PipelineError) as error:
+				if self.pipeline.record_failure(error):
+					print('\t[WARNING] Modbus TCP Server "'+str(self.server_name)+'" does not support pipelined requests ('+repr(error)+'), falling back to sequential requests')
+				else:
+					print('\t[WARNING] Pipelined requests to Modbus TCP Server "'+str(self.server_name)+'" failed ('+repr(error)+'), reconnecting and sending this poll cycle sequentially')
+				self.disconnect()
+				await self.connect()
+		responses = []
+		self.round_trip_seconds = []
+		for message in messages:
+			sent_at = time.perf_counter()
+			responses.append(await self.connection.send_message(message))
+			self.round_trip_seconds.append(time.perf_counter() - sent_at)
+		return responses
+
 class ModbusTCPMqttDataGateway:
 	def termination_signal_handler(self, signal, frame):
 		print('\nYou pressed Ctrl+C!')
-		self.modbus_tcp_client.disconnect()				
+		self.poll_scheduler.stop()
+		self.shutdown()
+		sys.exit(0)	
+
+	# Method to disconnect from the Modbus TCP Server(s), let the publisher stage publish the poll cycles already queued, and disconnect from the MQTT Broker
+	def shutdown(self):
+		self.stop_hot_reload()
+		for modbus_tcp_client in self.modbus_tcp_clients:
+			modbus_tcp_client.disconnect()
+		self.stop_publisher()
+		self.stop_mqtt_state()
+		self.stop_replay()
+		self.stop_metrics()
 		if self.modqtt_config['mqtt_connection_monitoring']:
 			self.mqtt_publish(
 						'/'.join([str(self.modqtt_config['mqtt_client_id']),'_connection_monitoring','last_disconnection']),
@@ -647,16 +1397,30 @@ class ModbusTCPMqttDataGateway:
 						0, 
 						True
 					)
-		self.mqttc.loop_stop()
-		self.mqttc.disconnect()
+		if self.shard_publisher is not None:
+			self.shard_publisher.close()
+		else:
+			self.mqttc.loop_stop()
+			self.mqttc.disconnect()
 		print('Bye!')
 		time.sleep(2)
-		sys.exit(0)	
 	
-	def generate_timestamp(self, time_format = '%Y-%m-%d %H:%M:%S%z'):
-		ts_local = datetime.datetime.now().astimezone()
-		ts_utc = ts_local.astimezone(datetime.timezone.utc)
-		return {'timestamp_utc': ts_utc.strftime(time_format), 'timestamp_local': ts_local.strftime(time_format)}
+	def generate_timestamp(self):
+		ts_utc, ts_local = self.timestamp_formatter.format(time.time_ns())
+		return {'timestamp_utc': ts_utc, 'timestamp_local': ts_local}
+
+	# Method to publish (retained) the layout of the "binary" mqtt_payload under <mqtt_client_id>/_payload_schema/binary, if any tag uses it
+	def mqtt_publish_payload_schema(self):
+		mqtt_helper = getattr(self, 'mqtt_helper', None)
+		if not mqtt_helper:
+			return
+		if any(mqtt_helper[tag_key].get('mqtt_payload') == 'binary' for tag_key in mqtt_helper):
+			self.mqtt_publish(
+					'/'.join([str(self.modqtt_config['mqtt_client_id']),'_payload_schema','binary']),
+					json.dumps(BinaryPayload.schema()),
+					1,
+					True
+				)
 	
 	# setting callbacks for on_connect events, print some debug feedback
 	def on_connect(self, client, userdata, flags, rc, properties=None):
@@ -690,6 +1454,10 @@ class ModbusTCPMqttDataGateway:
 			print('\t[INFO] **MQTT** Connected to MQTT Broker!')
 			self.mqtt_connected = True
 			self.mqtt_disconnected=False
+			self.mqtt_publish_payload_schema()
+			# replay the messages stored while disconnected (or before a restart)
+			if self.mqtt_store is not None:
+				self.mqtt_replay_event.set()
 		else:
 			print('\t[INFO] **MQTT** Failed to connect, return code', rc)
 			#if str(rc) in self.mqtt_on_connect_return_codes:
@@ -711,6 +1479,9 @@ class ModbusTCPMqttDataGateway:
 				)		
 			)
 		self.mqtt_last_successful_mid_count += 1
+		self.mqtt_inflight.acknowledge(mid)
+		if self.mqtt_store is not None:
+			self.mqtt_replay_acknowledge(mid)
 
 	# handle disconnects
 	def on_disconnect(self, client, userdata, rc, *args, **kwargs):				
@@ -739,8 +1510,16 @@ class ModbusTCPMqttDataGateway:
 			)
 	
 	def mqtt_publish(self, topic, payload, qos, retain):
+		# in a worker process of a sharded gateway, the message is handed over to the MQTT publisher process
+		if self.shard_publisher is not None:
+			publish_status = paho.MQTT_ERR_SUCCESS if self.shard_publisher.publish(topic, payload, qos, retain) else paho.MQTT_ERR_NO_CONN
+			if not self.quiet:
+				print('\t[INFO] **MQTT** Sent: '+str(payload)+' to topic "'+str(topic)+'" with qos='+str(qos)+' and retain='+str(retain)+' through the MQTT publisher process')
+			return publish_status
 		publish_result = self.mqttc.publish(topic, payload=payload, qos=qos, retain=retain)											
 		publish_status = publish_result[0]
+		if publish_status == 0:
+			self.mqtt_inflight.register(publish_result.mid, len(payload) if payload is not None else 0)
 		if not self.quiet:
 			print('\t[INFO] **MQTT**',publish_result)
 
@@ -748,161 +1527,291 @@ class ModbusTCPMqttDataGateway:
 				print('\t[INFO] **MQTT** Sent: '+str(payload)+' to topic "'+str(topic)+'" with qos='+str(qos)+' and retain='+str(retain))
 			else:
 				print('\t[INFO] **MQTT** Failed to send message to topic "'+str(topic)+'"')
+		return publish_status
+
+	# Method to publish a message of the live data, or to store it in the store-and-forward buffer (if mqtt_store_path is set) when the MQTT Broker is unreachable
+	def mqtt_publish_or_store(self, topic, payload, qos, retain):
+		if self.mqtt_store is None:
+			self.mqtt_flow_control()
+			self.mqtt_publish(topic, payload, qos, retain)
+			return
+		if self.mqtt_connected:
+			self.mqtt_flow_control()
+			if self.mqtt_publish(topic, payload, qos, retain) == 0:
+				return
+		self.mqtt_store.append(topic, payload, qos, retain)
+
+	# Method run by the replay thread: once connected, publish the stored messages oldest first, in batches and rate-limited to mqtt_store_replay_messages_per_second
+	# the replay only uses half of the in-flight window (mqtt_max_inflight_messages_set), the other half is left to the live data so that the replay does not starve it
+	# replayed messages are published without the retain flag, so that they never overwrite the retained value of the live data with an older one
+	# a replayed message is only removed from the store once acknowledged (see on_publish); the messages of a batch not acknowledged within mqtt_publish_ack_timeout_seconds stay stored and are replayed again
+	def mqtt_replay_worker(self):
+		batch_size = self.modqtt_config.get('mqtt_store_replay_batch_size', 100)
+		seconds_per_message = 1.0/self.modqtt_config.get('mqtt_store_replay_messages_per_second', 1000)
+		replay_max_inflight = max(1, self.modqtt_config['mqtt_max_inflight_messages_set']//2)
+		while True:
+			self.mqtt_replay_event.wait()
+			if self.mqtt_replay_stop.is_set():
+				return
+			self.mqtt_store.expire()
+			batch = self.mqtt_store.peek_batch(batch_size) if self.mqtt_connected else []
+			if not batch:
+				self.mqtt_replay_event.clear()
+				# on_connect may have set the event in the meantime
+				if self.mqtt_connected and (not self.mqtt_store.is_empty()):
+					self.mqtt_replay_event.set()
+				continue
+			batch_start = time.monotonic()
+			replayed_count = 0
+			for message_id, topic, payload, qos, retain in batch:
+				if (not self.mqtt_connected) or self.mqtt_replay_stop.is_set():
+					break
+				# as in mqtt_flow_control, the messages in flight for longer than mqtt_publish_ack_timeout_seconds (ex: replayed messages never acknowledged) are considered lost, so that they do not hold the replay window
+				if not self.mqtt_inflight.wait_for_capacity(replay_max_inflight, self.mqtt_publish_ack_timeout_seconds):
+					self.mqtt_inflight.expire(self.mqtt_publish_ack_timeout_seconds)
+				if not self.mqtt_replay_publish(message_id, topic, payload, qos):
+					break
+				replayed_count += 1
+			acknowledged_ids = self.mqtt_replay_wait_for_acknowledgements(self.mqtt_publish_ack_timeout_seconds)
+			self.mqtt_store.remove(acknowledged_ids)
+			if not self.quiet:
+				print('\t[INFO] **MQTT** Replayed '+str(replayed_count)+' stored message(s), '+str(len(acknowledged_ids))+' acknowledged:',json.dumps(self.mqtt_store.statistics()))
+			if len(acknowledged_ids) < replayed_count:
+				print('\t[WARNING] **MQTT** No acknowledgement received within '+str(self.mqtt_publish_ack_timeout_seconds)+' seconds for '+str(replayed_count - len(acknowledged_ids))+' replayed message(s), they stay stored')
+			self.mqtt_replay_stop.wait(replayed_count*seconds_per_message - (time.monotonic() - batch_start))
+
+	# Method to publish a stored message, and remember its mid until acknowledged; returns False if it could not be published
+	def mqtt_replay_publish(self, message_id, topic, payload, qos):
+		publish_result = self.mqttc.publish(topic, payload=payload, qos=qos, retain=False)
+		if publish_result.rc != 0:
+			return False
+		self.mqtt_inflight.register(publish_result.mid, len(payload) if payload is not None else 0)
+		with self.mqtt_replay_condition:
+			# on_publish may already have run, ex: QoS 0 messages are acknowledged once sent
+			if publish_result.is_published():
+				self.mqtt_replay_acknowledged_ids.append(message_id)
+			else:
+				self.mqtt_replay_pending[publish_result.mid] = (message_id, publish_result)
+		return True
+
+	# Method to record the acknowledgement of a replayed message, to be called from on_publish; the mids of the live data are ignored
+	def mqtt_replay_acknowledge(self, mid):
+		with self.mqtt_replay_condition:
+			pending = self.mqtt_replay_pending.pop(mid, None)
+			if pending is None:
+				return
+			self.mqtt_replay_acknowledged_ids.append(pending[0])
+			self.mqtt_replay_condition.notify_all()
+
+	# Method to wait, at most timeout_seconds, until the replayed messages are acknowledged (or the replay is stopped), returns the ids of the stored messages acknowledged
+	# on_publish may run just before the mid of a message is remembered by mqtt_replay_publish, such a message is found acknowledged through its MQTTMessageInfo instead; the messages not acknowledged are forgotten
+	def mqtt_replay_wait_for_acknowledgements(self, timeout_seconds):
+		deadline = time.monotonic() + timeout_seconds
+		with self.mqtt_replay_condition:
+			while True:
+				for mid in [mid for mid in self.mqtt_replay_pending if self.mqtt_replay_pending[mid][1].is_published()]:
+					self.mqtt_replay_acknowledged_ids.append(self.mqtt_replay_pending.pop(mid)[0])
+				remaining_seconds = deadline - time.monotonic()
+				if (not self.mqtt_replay_pending) or (remaining_seconds <= 0) or self.mqtt_replay_stop.is_set():
+					break
+				self.mqtt_replay_condition.wait(min(remaining_seconds, 0.1))
+			acknowledged_ids = self.mqtt_replay_acknowledged_ids
+			self.mqtt_replay_acknowledged_ids = []
+			self.mqtt_replay_pending.clear()
+		return acknowledged_ids
+
+	# Method to stop the replay thread and close the store-and-forward buffer, the messages not replayed yet stay stored for the next start
+	def stop_replay(self):
+		if self.mqtt_store is None:
+			return
+		self.mqtt_replay_stop.set()
+		self.mqtt_replay_event.set()
+		self.mqtt_replay_thread.join(self.mqtt_publish_ack_timeout_seconds)
+		print('\t[INFO] **MQTT** Store-and-forward buffer:',json.dumps(self.mqtt_store.statistics()))
+		self.mqtt_store.close()
 	
-	def mqtt_parse_publish_tag(self, tag_key, tag_current_value, ts_utc, ts_local,limit_flag=False):
-		tag_topic = '/'.join([str(self.modqtt_config['mqtt_client_id']),self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_topic']])
-		tag_qos = self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_qos']
-		tag_retain = self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_retain']
-		tag_payload = self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_payload']
+	# tag_rule is the compiled publish rule of the tag, see compile_tag_rules
+	# timestamp_ns and monotonic_ns are the timestamps of the poll cycle, see ModbusTCPClient.cycle_timestamp; they are only formatted for the "json" mqtt_payload
+	def mqtt_parse_publish_tag(self, tag_rule, tag_current_value, timestamp_ns, monotonic_ns, limit_flag=False):
+		tag_payload = tag_rule.payload
 		if tag_payload == 'json':
-			tag_value = {
-				'timestamp_utc': ts_utc,
-				'timestamp_local': ts_local,
-				'value': tag_current_value
-			}
-			tag_value = json.dumps(tag_value)
+			tag_value = self.json_payload.render(timestamp_ns, tag_current_value)
 		elif tag_payload == 'text':
 			tag_value = str(tag_current_value)										
+		elif tag_payload == 'binary':
+			tag_value = BinaryPayload.encode(tag_rule.binary_type, timestamp_ns // 1000000, tag_current_value)
 		
-		self.mqqt_last_published_values[tag_key]={
-			'timestamp_utc':ts_utc,
-			'timestamp_local':ts_local,
+		self.mqqt_last_published_values[tag_rule.tag_key]={
+			'timestamp_ns':timestamp_ns,
+			'monotonic_ns':monotonic_ns,
 			'last_published_value': tag_current_value,
 			'limit_flag': limit_flag
 		}		
 		self.mqtt_client_publish_count += 1
-		self.mqtt_publish(tag_topic, tag_value, tag_qos, tag_retain)
+		if tag_payload == 'batch':
+			self.mqtt_batch_tag(tag_rule.topic, tag_current_value, tag_rule.qos, tag_rule.retain)
+			return
+		self.mqtt_publish_or_store(tag_rule.topic, tag_value, tag_rule.qos, tag_rule.retain)
+
+	# Method to add a tag to the batch of its topic, the tag name (last level of its topic) being the key in the batch
+	# the batches are published at the end of the publish cycle by mqtt_publish_batches, with the highest QoS and the retain flag of their tags
+	def mqtt_batch_tag(self, tag_topic, tag_current_value, tag_qos, tag_retain):
+		batch_topic, batch_key = tag_topic.rsplit('/', 1)
+		if batch_topic not in self.mqtt_batches:
+			self.mqtt_batches[batch_topic] = {'values': {}, 'qos': tag_qos, 'retain': tag_retain}
+		batch = self.mqtt_batches[batch_topic]
+		batch['values'][batch_key] = tag_current_value
+		batch['qos'] = max(batch['qos'], tag_qos)
+		batch['retain'] = batch['retain'] or tag_retain
+
+	# Method to publish one JSON document per batch topic, with the tags whose rules fired during the publish cycle and a single timestamp
+	# documents larger than mqtt_batch_max_bytes are split into chunks, numbered with "chunk" (from 0) and "chunks" (their number)
+	def mqtt_publish_batches(self, timestamp_ns):
+		max_bytes = self.modqtt_config.get('mqtt_batch_max_bytes', 65536)
+		ts_utc, ts_local = self.timestamp_formatter.format(timestamp_ns)
+		for batch_topic in self.mqtt_batches:
+			batch = self.mqtt_batches[batch_topic]
+			header = {'timestamp_utc': ts_utc, 'timestamp_local': ts_local}
+			# the number of values bounds the chunk numbers, so that the header is not underestimated once they take several digits
+			header_bytes = len(self.json_payload.dumps(dict(header, values={}, chunk=len(batch['values']), chunks=len(batch['values']))))
+			chunks = [{}]
+			chunk_bytes = header_bytes
+			for batch_key in batch['values']:
+				entry_bytes = len(self.json_payload.dumps({batch_key: batch['values'][batch_key]})) + 1
+				if chunks[-1] and (chunk_bytes + entry_bytes > max_bytes):
+					chunks.append({})
+					chunk_bytes = header_bytes
+				chunks[-1][batch_key] = batch['values'][batch_key]
+				chunk_bytes += entry_bytes
+			for chunk_index, chunk in enumerate(chunks):
+				document = dict(header, values=chunk)
+				if len(chunks) > 1:
+					document['chunk'] = chunk_index
+					document['chunks'] = len(chunks)
+				self.mqtt_publish_or_store(batch_topic, self.json_payload.dumps(document), batch['qos'], batch['retain'])
+		self.mqtt_batches = {}
+
+	# flow control: while connected, wait for the number of messages in flight to get below mqtt_max_inflight_messages_set before publishing
+	# if the acknowledgements do not come within mqtt_publish_ack_timeout_seconds, the messages in flight for longer than that are considered lost
+	# while disconnected, messages are left to the paho client queue, or stored in the store-and-forward buffer if mqtt_store_path is set
+	def mqtt_flow_control(self):
+		if not self.mqtt_connected:
+			return
+		if not self.mqtt_inflight.wait_for_capacity(self.modqtt_config['mqtt_max_inflight_messages_set'], self.mqtt_publish_ack_timeout_seconds):
+			expired_count = self.mqtt_inflight.expire(self.mqtt_publish_ack_timeout_seconds)
+			print('\t[WARNING] **MQTT** No acknowledgement received within '+str(self.mqtt_publish_ack_timeout_seconds)+' seconds for '+str(expired_count)+' message(s) in flight, considering them lost')
 	
-	def mqtt_publish_data(self, previous_values, current_values, mqtt_client=None,time_format = '%Y-%m-%d %H:%M:%S%z'):
+	# evaluated_tag_keys: the keys of the tags whose publish rules are evaluated, in poll order (see PublishChangeFilter), all the tags of current_values if None
+	def mqtt_publish_data(self, previous_values, current_values, mqtt_client=None, evaluated_tag_keys=None):
 		if mqtt_client is None:
 			mqtt_client = self.mqttc			 	
-		
-		# every time the modqtt gateway instance is freshly started, it will connect and publish all the data tags
-		if previous_values is None:
-			for tag_key in current_values:
-				if tag_key == 'timestamp_utc':
-					ts_utc = current_values[tag_key]
-					continue
-				elif tag_key == 'timestamp_local':
-					ts_local = current_values[tag_key]
-					continue
-				else:
-					tag_current_value = current_values[tag_key]
-					self.mqtt_parse_publish_tag(
-							tag_key = tag_key,
-							tag_current_value = tag_current_value,
-							ts_utc = ts_utc,
-							ts_local = ts_local
-						)					
-
-			while (self.mqtt_client_publish_count > self.mqtt_last_successful_mid_count):
-				waiting = 1
-
-		# logic to only publish what is relevant (i.e. deadband changes, high/low limits reached/recovered, etc.)
+		timestamp_ns = current_values['timestamp_ns']
+		monotonic_ns = current_values['timestamp_monotonic_ns']
+		tag_rules = self.tag_rules
+
+		# the rules of all the tags are evaluated first, then the tags whose rules fired are serialized and published, so that both phases are timed separately
+		# every time the modqtt gateway instance is freshly started, it will connect and publish all the data tags, unless their last published state was restored from mqtt_state_path (see restore_mqtt_state)
+		publish_all = (previous_values is None) and self.mqtt_publish_all_on_start
+		evaluate_start = time.perf_counter()
+		tag_keys, limit_flags = self.mqtt_evaluate_rules(current_values, monotonic_ns, publish_all=publish_all, evaluated_tag_keys=evaluated_tag_keys)
+		publish_start = time.perf_counter()
+		if publish_all and ('mqtt_initial_publish_messages_per_second' in self.modqtt_config):
+			self.mqtt_publish_paced(tag_rules, tag_keys, limit_flags, current_values, timestamp_ns, monotonic_ns)
 		else:
-			for tag_key in current_values:
-				if tag_key == 'timestamp_utc':
-					ts_utc = current_values[tag_key]
-					# previous_ts_utc = previous_values[tag_key]					
-					continue
-				elif tag_key == 'timestamp_local':
-					ts_local = current_values[tag_key]
-					# previous_ts_local = previous_values[tag_key]
-					continue
-				else:
-					ts_utc_previously_published = self.mqqt_last_published_values[tag_key]['timestamp_utc']
-					tag_time_elapsed = datetime.datetime.strptime(ts_utc,time_format) - datetime.datetime.strptime(ts_utc_previously_published,time_format)
-					tag_current_value = current_values[tag_key]					
-					# tag_previous_value = previous_values[tag_key]
-					tag_previously_published_value = self.mqqt_last_published_values[tag_key]['last_published_value']
-					# tag_delta_value = abs((float(tag_current_value) - float(tag_previous_value)))
-					tag_delta_value_last_published = abs((float(tag_current_value) - float(tag_previously_published_value))) 
-					
-					tag_publish = self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_publish']										
-					
-					# if data_type not in ['di','coil','packedbool'] (those have mqtt_ignore_low/high set to None by default), and if value falls outside the mqqt_ignore_low/high thresholds, then ignore the current value and do not publish
-					if self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_ignore_low'] is not None and (float(tag_current_value) < float(self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_ignore_low'])):
-						continue
-					elif self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_ignore_high'] is not None and (float(tag_current_value) > float(self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_ignore_high'])):
-						continue
-
-					# regardless of reporting/upload method, if the value falls outside of high/low limits (assuming they are not None), it is reported. MQTT high/low thresholds are ignored for di, coil and packedbool data_type
-					if (self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_alarm_low'] is not None) and (self.modbus_tcp_client.mqtt_helper[tag_key]['data_type'] not in ['di','coil','packedbool']):
-						if float(tag_current_value) <= self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_alarm_low']:
-							self.mqtt_parse_publish_tag(
-									tag_key = tag_key,
-									tag_current_value = tag_current_value,
-									ts_utc = ts_utc,
-									ts_local = ts_local,
-									limit_flag=True
-								)
-							continue
-						# handle alarm recovery, force publish on recovery
-						elif self.mqqt_last_published_values[tag_key]['limit_flag']:
-							self.mqtt_parse_publish_tag(
-									tag_key = tag_key,
-									tag_current_value = tag_current_value,
-									ts_utc = ts_utc,
-									ts_local = ts_local,
-									limit_flag=False
-								)
-							continue
-					if (self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_alarm_high'] is not None) and (self.modbus_tcp_client.mqtt_helper[tag_key]['data_type'] not in ['di','coil','packedbool']):
-						if float(tag_current_value) >= self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_alarm_high']:
-							self.mqtt_parse_publish_tag(
-								tag_key = tag_key,
-								tag_current_value = tag_current_value,
-								ts_utc = ts_utc,
-								ts_local = ts_local,
-								limit_flag=True
-							)
-							continue
-						# handle alarm recovery, force publish on recovery
-						elif self.mqqt_last_published_values[tag_key]['limit_flag']:
-							self.mqtt_parse_publish_tag(
-									tag_key = tag_key,
-									tag_current_value = tag_current_value,
-									ts_utc = ts_utc,
-									ts_local = ts_local,
-									limit_flag=False
-								)
-							continue
-
-					# if the tag is configured to be uploaded via 'rbe', withih high/low limits, then the deadband is considered, i.e. the current value is compared against the last reported/published value
-					if tag_publish == 'rbe':
-						if tag_delta_value_last_published > self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_deadband']:	#tag_delta_value > self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_deadband']:							
-							self.mqtt_parse_publish_tag(
-									tag_key = tag_key,
-									tag_current_value = tag_current_value,
-									ts_utc = ts_utc,
-									ts_local = ts_local
-								)
-						else:
-							continue
-					# if the tag is configured to be uploaded at a regular interval, then the deadband is ignored, unless the -f "force deadband" switch is activated
-					elif float(tag_time_elapsed.seconds) >= float(tag_publish):
-						tag_current_value = current_values[tag_key]
-						
-						if not self.mqtt_force_deadband:
-							self.mqtt_parse_publish_tag(
-								tag_key = tag_key,
-								tag_current_value = tag_current_value,
-								ts_utc = ts_utc,
-								ts_local = ts_local
-							)
-						elif tag_delta_value_last_published > self.modbus_tcp_client.mqtt_helper[tag_key]['mqtt_deadband']:				
-							self.mqtt_parse_publish_tag(
-								tag_key = tag_key,
-								tag_current_value = tag_current_value,
-								ts_utc = ts_utc,
-								ts_local = ts_local
-							)
+			for tag_key, limit_flag in zip(tag_keys, limit_flags):
+				self.mqtt_parse_publish_tag(tag_rules[tag_key], current_values[tag_key], timestamp_ns, monotonic_ns, limit_flag)
+		if self.mqtt_batches:
+			self.mqtt_publish_batches(timestamp_ns)
+		publish_end = time.perf_counter()
+		self.rule_evaluation_seconds.observe(publish_start - evaluate_start)
+		self.publish_seconds.observe(publish_end - publish_start)
+
+		# wait (bounded) for the acknowledgement of the initial publish of all tags
+		if publish_all and self.mqtt_connected and (not self.mqtt_inflight.wait_for_all(self.mqtt_publish_ack_timeout_seconds)):
+			expired_count = self.mqtt_inflight.expire(self.mqtt_publish_ack_timeout_seconds)
+			print('\t[WARNING] **MQTT** No acknowledgement received within '+str(self.mqtt_publish_ack_timeout_seconds)+' seconds for '+str(expired_count)+' message(s) of the initial publish, considering them lost')
 
 		if not self.quiet:
-			print('\t[INFO] **MQTT** MQTT publish cycle complete!')
+			print('\t[INFO] **MQTT** MQTT publish cycle complete!',json.dumps(self.mqtt_inflight.statistics()))
 		return
+
+	# Method to publish the tags of an initial publish of all the tags at most mqtt_initial_publish_messages_per_second, spread over time so that a fleet of gateways restarting together does not flood the MQTT Broker
+	# it sleeps on the MQTT publisher thread: the poll cycles wait in the publish queue meanwhile
+	def mqtt_publish_paced(self, tag_rules, tag_keys, limit_flags, current_values, timestamp_ns, monotonic_ns):
+		seconds_per_message = 1.0/self.modqtt_config['mqtt_initial_publish_messages_per_second']
+		pace_start = time.monotonic()
+		for message_count, (tag_key, limit_flag) in enumerate(zip(tag_keys, limit_flags), 1):
+			self.mqtt_parse_publish_tag(tag_rules[tag_key], current_values[tag_key], timestamp_ns, monotonic_ns, limit_flag)
+			# sleep by slices of at least 10 ms rather than after every message
+			delay = message_count*seconds_per_message - (time.monotonic() - pace_start)
+			if delay >= 0.01:
+				time.sleep(delay)
+
+	# Method to evaluate the publish rules of the tags of a poll cycle, returns the tag keys whose rules fire (in poll order) and their limit flags
+	# with the "numpy" mqtt_rule_engine, the publish rules of all the tags are evaluated at once by the NumpyRuleEvaluator
+	# only the rules of the tags of evaluated_tag_keys are evaluated if set, unless publish_all
+	def mqtt_evaluate_rules(self, current_values, monotonic_ns, publish_all=False, evaluated_tag_keys=None):
+		if publish_all:
+			evaluated_tag_keys = None
+		if self.rule_evaluator is not None:
+			if evaluated_tag_keys is not None:
+				return self.rule_evaluator.evaluate_tags(evaluated_tag_keys, current_values, monotonic_ns, self.mqtt_force_deadband)
+			return self.rule_evaluator.evaluate_cycle(current_values, monotonic_ns, self.mqtt_force_deadband, publish_all)
+		tag_keys = []
+		limit_flags = []
+		# the tags without a tag rule (the timestamps of the poll cycle, and the tags removed by a hot reload still in the poll cycles queued before it) are never published
+		tag_rules = self.tag_rules
+		if publish_all:
+			for tag_key in current_values:
+				if tag_key not in tag_rules:
+					continue
+				tag_keys.append(tag_key)
+				limit_flags.append(False)
+			return tag_keys, limit_flags
+
+		# logic to only publish what is relevant (i.e. deadband changes, high/low limits reached/recovered, etc.), see the evaluation functions of the compiled tag rules in rule_helper
+		last_published_values = self.mqqt_last_published_values
+		force_deadband = self.mqtt_force_deadband
+		for tag_key in (current_values if evaluated_tag_keys is None else evaluated_tag_keys):
+			tag_rule = tag_rules.get(tag_key)
+			if tag_rule is None:
+				continue
+			last_published = last_published_values.get(tag_key)
+			# tags of scan classes polled for the first time (ex: spread over the ticks of their poll_interval) are published unconditionally
+			if last_published is None:
+				tag_keys.append(tag_key)
+				limit_flags.append(False)
+				continue
+			limit_flag = tag_rule.evaluate(tag_rule, current_values[tag_key], last_published, (monotonic_ns - last_published['monotonic_ns'])/1e9, force_deadband)
+			if limit_flag is not None:
+				tag_keys.append(tag_key)
+				limit_flags.append(limit_flag)
+		return tag_keys, limit_flags
+
+	# Method to compile the publish rules of the tags of the template(s), and their columnar evaluator with the "numpy" mqtt_rule_engine
+	# with modbus_template_cache_dir, the compiled rules are cached along with the call plans of the templates
+	def compile_publish_rules(self):
+		self.tag_rules = None
+		template_cache = ModbusHelper.template_cache(self.modqtt_config)
+		if template_cache is not None:
+			cache_key = template_cache.key('tag_rules', [modbus_tcp_client.template_cache_key for modbus_tcp_client in self.modbus_tcp_clients], self.modqtt_config['mqtt_client_id'])
+			self.tag_rules = template_cache.load(cache_key)
+		if self.tag_rules is None:
+			self.tag_rules = compile_tag_rules(self.mqtt_helper, self.modqtt_config['mqtt_client_id'])
+			if template_cache is not None:
+				template_cache.store(cache_key, self.tag_rules)
+		self.rule_evaluator = self.build_rule_evaluator(self.tag_rules, self.modqtt_config)
+
+	# Method to build the columnar evaluator of tag_rules with the "numpy" mqtt_rule_engine of config, returns None with the "python" one
+	def build_rule_evaluator(self, tag_rules, config):
+		rule_engine = config.get('mqtt_rule_engine', 'python')
+		if (rule_engine == 'numpy') and (not NumpyRuleEvaluator.is_available()):
+			print('\t[WARNING] mqtt_rule_engine "numpy" requested but numpy is not installed, using the default "python" rule engine')
+		elif rule_engine == 'numpy':
+			return NumpyRuleEvaluator(tag_rules)
+		return None
 	
-	def __init__(self, full_path_to_modqtt_config_json=None, full_path_to_modqtt_template_csv=None, full_path_to_modqtt_env=None, full_path_to_modqtt_ca_certs=None, full_path_to_modqtt_certfile=None, full_path_to_modqtt_keyfile=None, force_deadband=False, quiet=False):
+	def __init__(self, full_path_to_modqtt_config_json=None, full_path_to_modqtt_template_csv=None, full_path_to_modqtt_env=None, full_path_to_modqtt_ca_certs=None, full_path_to_modqtt_certfile=None, full_path_to_modqtt_keyfile=None, force_deadband=False, quiet=False, republish=False, shard=None, shard_fd=None):
 						
 		if full_path_to_modqtt_config_json is None:
 			print('\t[ERROR] a modqtt config.json file is required for a ModbusTCPDataLogger instance')
@@ -927,11 +1836,18 @@ class ModbusTCPMqttDataGateway:
 		else:
 			self.mqtt_broker_creds = False
 		
+		self.full_path_to_modqtt_config_json = full_path_to_modqtt_config_json
+		self.full_path_to_modqtt_template_csv = full_path_to_modqtt_template_csv
 		self.full_path_to_modqtt_ca_certs = full_path_to_modqtt_ca_certs
 		self.full_path_to_modqtt_certfile = full_path_to_modqtt_certfile
 		self.full_path_to_modqtt_keyfile = full_path_to_modqtt_keyfile
+		# sharded gateway (modbus_shard_processes > 1): this process is either the MQTT publisher, supervising the worker processes (shard_supervisor),
+		# or one of the worker processes, polling its shard (shard index, shard count) of the Modbus TCP Server(s) and handing over its messages to the MQTT publisher process (shard_publisher)
+		self.shard = shard
+		self.shard_publisher = None
+		self.shard_supervisor = None
 				
-		self.modqtt_config = ModbusHelper.parse_json_config(full_path_to_modqtt_config_json)
+		self.modqtt_config = self.parse_config()
 		if self.modqtt_config is None:
 			print('\t[ERROR] An error occured while parsing the modqtt json configuration file!')
 			print('\t[ERROR] Please review the error messages, correct the modqtt json configuration file and try again.')
@@ -959,7 +1875,37 @@ class ModbusTCPMqttDataGateway:
 		self.mqtt_disconnected=True
 		self.mqtt_last_successful_mid_count = 0
 		self.mqtt_client_publish_count = 0
+		self.mqtt_inflight = PublishTracker()
+		self.mqtt_publish_ack_timeout_seconds = self.modqtt_config.get('mqtt_publish_ack_timeout_seconds', 10.0)
 		self.mqqt_last_published_values = {}
+		# optional snapshot of mqqt_last_published_values, saved every mqtt_state_checkpoint_seconds and restored on startup unless republish (-r) is set
+		self.mqtt_republish = republish
+		self.mqtt_publish_all_on_start = True
+		self.mqtt_state = None
+		self.mqtt_state_thread = None
+		self.mqtt_state_stop = threading.Event()
+		if ('mqtt_state_path' in self.modqtt_config) and (self.modqtt_config.get('modbus_shard_processes', 1) == 1):
+			self.mqtt_state = PublishedStateSnapshot(self.modqtt_config['mqtt_state_path'])
+		# the poll cycles are timestamped in nanoseconds, formatted only when published with mqtt_timestamp_format and mqtt_timestamp_precision
+		self.timestamp_formatter = TimestampFormatter(self.modqtt_config.get('mqtt_timestamp_format', '%Y-%m-%d %H:%M:%S%z'), self.modqtt_config.get('mqtt_timestamp_precision', 'seconds'))
+		self.json_payload = JsonPayload(self.timestamp_formatter, self.modqtt_config.get('mqtt_json_serializer', 'json'))
+		self.mqtt_batches = {}		# batch topic -> tags of the "batch" mqtt_payload to publish at the end of the publish cycle
+		# optional disk-backed store-and-forward buffer of the messages that can not be published while the MQTT Broker is unreachable
+		self.mqtt_store = None
+		if 'mqtt_store_path' in self.modqtt_config:
+			self.mqtt_store = StoreAndForwardBuffer(
+					self.modqtt_config['mqtt_store_path'],
+					max_messages=self.modqtt_config.get('mqtt_store_max_messages', 1000000),
+					max_age_seconds=self.modqtt_config.get('mqtt_store_max_age_seconds', 604800)
+				)
+			print('\t[INFO] **MQTT** Store-and-forward buffer "'+str(self.modqtt_config['mqtt_store_path'])+'" opened with '+str(self.mqtt_store.count)+' stored message(s) to replay')
+			self.mqtt_replay_event = threading.Event()
+			self.mqtt_replay_stop = threading.Event()
+			self.mqtt_replay_condition = threading.Condition()
+			self.mqtt_replay_pending = {}		# mid -> (id of the stored message, MQTTMessageInfo) of the replayed messages not acknowledged yet
+			self.mqtt_replay_acknowledged_ids = []		# ids of the stored messages acknowledged, to remove from the store-and-forward buffer
+			self.mqtt_replay_thread = threading.Thread(target=self.mqtt_replay_worker, name='modqtt-replay', daemon=True)
+			self.mqtt_replay_thread.start()
 		self.mqtt_on_connect_return_codes = { # https://pypi.org/project/paho-mqtt/#on-connect
 			'0': 'Connection successful',
 			'1': 'Connection refused - incorrect protocol version (see https://pypi.org/project/paho-mqtt/#on-connect)',
@@ -974,6 +1920,58 @@ class ModbusTCPMqttDataGateway:
 		self.mqtt_last_disconnection_published = 0
 		self.mqtt_last_disconnection_receive_maximum_exceeded = None
 		self.mqtt_last_disconnection_receive_maximum_exceeded_published = None
+		if self.shard is None:
+			self.connect_mqtt()
+		else:
+			# the worker processes are "connected" as long as the pipe to the MQTT publisher process is open
+			self.mqttc = None
+			self.shard_publisher = ShardPublisher(shard_fd, on_closed=self.on_shard_publisher_closed)
+			self.mqtt_connected = True
+			self.mqtt_disconnected = False
+
+		# the Modbus acquisition (producer) and the MQTT publish (consumer) run as two stages connected by a bounded queue of poll cycles,
+		# so that a slow MQTT Broker never delays the next Modbus poll cycle
+		self.acquisition_latency = StageLatency()
+		self.publish_latency = StageLatency()
+		self.publish_queue = BoundedCycleQueue(
+				max_size=self.modqtt_config.get('mqtt_publish_queue_size', 10),
+				overflow_policy=self.modqtt_config.get('mqtt_publish_queue_overflow_policy', 'drop_oldest')
+			)
+		self.change_filters = {}		# Modbus TCP client -> PublishChangeFilter, selecting the publish rules to evaluate for the clients with change detection
+		self.setup_metrics()
+		self.pending_reload = None		# config, plans and rules of a hot reload, put in place by the publisher thread between two publish cycles (see hot_reload)
+		self.hot_reload_watcher = None
+		self.hot_reload_thread = None
+		self.hot_reload_stop = threading.Event()
+		self.publisher_thread = threading.Thread(target=self.publish_worker, name='modqtt-publisher', daemon=True)
+		self.publisher_thread.start()
+
+		# in sharded mode, the Modbus TCP Server(s) are polled by the worker processes, this process publishes their messages
+		if self.modqtt_config.get('modbus_shard_processes', 1) > 1:
+			self.run_shard_supervisor()
+		# in multi-server mode, the config lists many Modbus TCP Servers, each with its own template, all polled from a single asyncio event loop
+		elif 'modbus_servers' in self.modqtt_config:
+			self.setup_multi_server_modbus(full_path_to_modqtt_template_csv)
+			self.start_mqtt_state()
+			self.start_metrics_export()
+			self.start_hot_reload()
+			self.run_multi_server()
+		else:
+			self.setup_modbus(full_path_to_modqtt_template_csv)
+			self.start_mqtt_state()
+			self.start_metrics_export()
+			self.start_hot_reload()
+			self.run()
+
+	# Method to parse the config file, as the config of the shard of this process in a worker process of a sharded gateway (see ModbusHelper.shard_config)
+	def parse_config(self):
+		config = ModbusHelper.parse_json_config(self.full_path_to_modqtt_config_json)
+		if (config is None) or (self.shard is None):
+			return config
+		return ModbusHelper.shard_config(config, *self.shard)
+
+	# Method to create the MQTT client, connect to the MQTT Broker and wait for the connection
+	def connect_mqtt(self):
 		# using MQTT version 5 here, for 3.1.1: MQTTv311, 3.1: MQTTv31
 		# userdata is user defined data of any type, updated by user_data_set()
 		# client_id is the given name of the client
@@ -1020,36 +2018,482 @@ class ModbusTCPMqttDataGateway:
 		while self.mqtt_connected != True:
 			time.sleep(0.1)
 
+	def setup_modbus(self, full_path_to_modqtt_template_csv):
 		self.modbus_tcp_client = ModbusTCPClient(
 				server_ip=self.modqtt_config['modbus_server_ip'],
 				server_port=self.modqtt_config['modbus_server_port'],
 				server_id=self.modqtt_config['modbus_server_id'],
-				poll_interval_seconds=self.modqtt_config['modbus_poll_interval_seconds']
+				poll_interval_seconds=self.modqtt_config['modbus_poll_interval_seconds'],
+				decode_engine=self.modqtt_config.get('modbus_decode_engine'),
+				max_outstanding_requests=self.modqtt_config.get('modbus_max_outstanding_requests'),
+				connections=self.modqtt_config.get('modbus_connections_per_server'),
+				change_detection=self.modqtt_config.get('modbus_change_detection', False),
+				shard=self.shard
 			)
-		self.modbus_tcp_client.load_template(full_path_to_modqtt_template_csv)
+		self.modbus_tcp_client.load_template(full_path_to_modqtt_template_csv, self.modqtt_config)
+		self.modbus_tcp_clients = [self.modbus_tcp_client]
+		self.setup_client_metrics(self.modbus_tcp_client)
+		self.mqtt_helper = self.modbus_tcp_client.mqtt_helper
+		self.compile_publish_rules()
+		self.mqtt_publish_payload_schema()
+		if not self.quiet:
+			ModbusHelper.explain_call_groups(self.modbus_tcp_client.call_groups, self.modqtt_config)
 		self.modbus_tcp_client.connect(self.modqtt_config['modbus_server_timeout_seconds'])				
 
+	def run(self):
+		# the poll cycles are started on absolute deadlines of the monotonic clock, waiting (not spinning) in between
+		# the scheduler ticks at the fastest scan class of the template, each poll cycle only polls the scan classes due at that tick
+		self.poll_scheduler = self.build_poll_scheduler(self.modbus_tcp_client)
+
 		signal.signal(signal.SIGINT, self.termination_signal_handler)
 
 		print('Press Ctrl+C to stop and exit gracefully...')
-		previous_response = None
+		previous_overrun_count = 0
+		while self.poll_scheduler.wait_next_cycle():
+			if self.poll_scheduler.overrun_count > previous_overrun_count:
+				previous_overrun_count = self.poll_scheduler.overrun_count
+				if not self.quiet:
+					print('\t[WARNING] Modbus poll cycle overrun, the previous cycle took longer than modbus_poll_interval_seconds:',json.dumps(self.poll_scheduler.statistics()))
+			self.apply_pending_plan(self.modbus_tcp_client, self.poll_scheduler)
+			cycle_start = time.monotonic()
+			modbus_poll_response = self.modbus_tcp_client.cycle_poll(slot_index=self.poll_scheduler.slot_index)
+			self.acquisition_latency.record(time.monotonic() - cycle_start)
+			self.queue_poll_cycle(self.modbus_tcp_client, modbus_poll_response, self.modbus_tcp_client.cycle_changes)
+
+	# Method to hand over a poll cycle to the publisher stage, along with its changes if the Modbus TCP client detects them (see CallGroupChangeDetector)
+	def queue_poll_cycle(self, modbus_tcp_client, modbus_poll_response, cycle_changes=None):
+		if not self.publish_queue.put((modbus_tcp_client, modbus_poll_response, cycle_changes)):
+			if not self.quiet:
+				print('\t[WARNING] Publish queue full, a poll cycle was dropped (mqtt_publish_queue_overflow_policy "'+self.publish_queue.overflow_policy+'"):',json.dumps(self.publish_queue.statistics()))
+
+	# Method run by the publisher thread: display and publish the poll cycles of the queue, until the queue is closed and empty
+	# each Modbus TCP client is tracked separately, so that the first poll cycle of each server publishes all of its tags
+	def publish_worker(self):
+		previous_responses = {}
 		while True:
-			#wake_up_time = datetime.datetime.now() + datetime.timedelta(seconds=self.modqtt_config['modbus_poll_interval_seconds'])
-			modbus_poll_response = self.modbus_tcp_client.cycle_poll()						
-			
+			queued_cycle = self.publish_queue.get()
+			if queued_cycle is None:
+				return
+			modbus_tcp_client, modbus_poll_response, cycle_changes = queued_cycle
+			if self.pending_reload is not None:
+				self.apply_pending_reload()
+
 			if not self.quiet:
-				self.modbus_tcp_client.pretty_print_interpreted_response(modbus_poll_response)
-				print('Press Ctrl+C to stop and exit gracefully...')
-			
+				modbus_tcp_client.pretty_print_interpreted_response(modbus_poll_response)
+
+			# with change detection, only the publish rules of the tags that changed (or that depend on time) are evaluated, see PublishChangeFilter
+			evaluated_tag_keys = None
+			if cycle_changes is not None:
+				evaluated_tag_keys = self.change_filters[modbus_tcp_client].select(cycle_changes, self.tag_rules)
+
+			publish_start = time.monotonic()
 			self.mqtt_publish_data(
-					previous_values = previous_response,
+					previous_values = previous_responses.get(modbus_tcp_client),
 					current_values = modbus_poll_response,
-					mqtt_client=self.mqttc
-				)			
-			
-			#time.sleep(self.modqtt_config['poll_interval_seconds'])			
-			wake_up_time = datetime.datetime.now() + datetime.timedelta(seconds=self.modqtt_config['modbus_poll_interval_seconds'])
-			while (wake_up_time > datetime.datetime.now()):
-				kill_time = 1
+					mqtt_client=self.mqttc,
+					evaluated_tag_keys=evaluated_tag_keys
+				)
+			if self.shard_publisher is not None:
+				self.shard_publisher.flush()
+			self.publish_latency.record(time.monotonic() - publish_start)
+			previous_responses[modbus_tcp_client] = modbus_poll_response
 
-			previous_response = modbus_poll_response
\ No newline at end of file
+			if not self.quiet:
+				print('\t[INFO] Pipeline stages:',json.dumps(self.pipeline_statistics()))
+				print('Press Ctrl+C to stop and exit gracefully...')
+
+	# Method to stop the publisher stage, once the poll cycles already queued are published (bounded by mqtt_publish_ack_timeout_seconds)
+	def stop_publisher(self):
+		self.publish_queue.close()
+		if self.publisher_thread is not threading.current_thread():
+			self.publisher_thread.join(self.mqtt_publish_ack_timeout_seconds)
+		print('\t[INFO] Pipeline stages:',json.dumps(self.pipeline_statistics()))
+
+	# Method to report the latency of each stage: Modbus acquisition, wait in the publish queue, and MQTT publish
+	def pipeline_statistics(self):
+		return {
+			'acquisition': self.acquisition_latency.statistics(),
+			'publish_queue': self.publish_queue.statistics(),
+			'publish': self.publish_latency.statistics()
+		}
+
+	def build_poll_scheduler(self, modbus_tcp_client):
+		poll_scheduler = PollScheduler(
+				interval_seconds=modbus_tcp_client.tick_interval_seconds,
+				overrun_policy=self.modqtt_config.get('modbus_poll_overrun_policy', 'skip'),
+				align_to_wall_clock=self.modqtt_config.get('modbus_poll_align_to_wall_clock', False)
+			)
+		self.metrics.register('modbus_poll_overruns_total', 'Modbus poll cycles still running at the deadline of the next cycle', 'counter', lambda: poll_scheduler.overrun_count, server=modbus_tcp_client.metrics_name())
+		self.metrics.register('modbus_poll_skipped_cycles_total', 'Modbus poll cycles skipped after an overrun', 'counter', lambda: poll_scheduler.skipped_cycle_count, server=modbus_tcp_client.metrics_name())
+		return poll_scheduler
+
+	# Method to set the metrics of a Modbus TCP client, with the health of each connection of its connection pool, if any, and the call groups and publish rules skipped by its change detection, if enabled
+	def setup_client_metrics(self, modbus_tcp_client):
+		modbus_tcp_client.metrics = self.metrics.client_metrics(modbus_tcp_client.metrics_name())
+		if modbus_tcp_client.change_detector is not None:
+			change_detector = modbus_tcp_client.change_detector
+			change_filter = PublishChangeFilter()
+			self.change_filters[modbus_tcp_client] = change_filter
+			self.metrics.register('modbus_call_groups_total', 'Call groups polled', 'counter', lambda: change_detector.group_count, server=modbus_tcp_client.metrics_name())
+			self.metrics.register('modbus_call_groups_unchanged_total', 'Call groups polled whose response did not change since their last poll, not decoded again', 'counter', lambda: change_detector.unchanged_group_count, server=modbus_tcp_client.metrics_name())
+			self.metrics.register('mqtt_rule_evaluations_total', 'Publish rules of the tags evaluated', 'counter', lambda: change_filter.evaluated_count, server=modbus_tcp_client.metrics_name())
+			self.metrics.register('mqtt_rule_evaluations_skipped_total', 'Publish rules of the tags not evaluated, their value not having changed', 'counter', lambda: change_filter.skipped_count, server=modbus_tcp_client.metrics_name())
+		if modbus_tcp_client.connection_pool is None:
+			return
+		for connection_health in modbus_tcp_client.connection_pool.health:
+			self.metrics.register('modbus_connection_healthy', 'Whether the connection of the pool succeeded its last exchange (1) or not (0)', 'gauge', lambda connection_health=connection_health: int(connection_health.healthy()), server=modbus_tcp_client.metrics_name(), connection=connection_health.index)
+			self.metrics.register('modbus_connection_errors_total', 'Errors of the connection of the pool: timeouts, broken connections, failed connection attempts', 'counter', lambda connection_health=connection_health: connection_health.error_count, server=modbus_tcp_client.metrics_name(), connection=connection_health.index)
+			self.metrics.register('modbus_connection_reconnects_total', 'Reconnections of the connection of the pool after an error', 'counter', lambda connection_health=connection_health: connection_health.reconnect_count, server=modbus_tcp_client.metrics_name(), connection=connection_health.index)
+
+	# Method to create the metrics of the gateway: latency histograms of the hot path, observed on every poll cycle, and counters/gauges read from the other components when exported
+	# the Modbus TCP clients observe the round trip time of each call group, the decode time and the poll cycle time, see ModbusClientMetrics
+	def setup_metrics(self):
+		self.metrics = GatewayMetrics()
+		self.metrics_stop = threading.Event()
+		self.metrics_thread = None
+		self.metrics_server = None
+		self.rule_evaluation_seconds = self.metrics.histogram('mqtt_rule_evaluation_seconds', 'Time to evaluate the publish rules of the tags of a poll cycle')
+		self.publish_seconds = self.metrics.histogram('mqtt_publish_seconds', 'Time to serialize and publish the messages of a poll cycle')
+		# a worker process of a sharded gateway counts the messages handed over to the MQTT publisher process
+		publish_statistics = self.mqtt_inflight.statistics if self.shard_publisher is None else self.shard_publisher.statistics
+		self.metrics.register('mqtt_messages_published_total', 'MQTT messages published', 'counter', lambda: publish_statistics()['published_count'])
+		self.metrics.register('mqtt_bytes_published_total', 'Payload bytes of the MQTT messages published', 'counter', lambda: publish_statistics()['published_bytes'])
+		if self.shard_publisher is None:
+			self.metrics.register('mqtt_inflight_messages', 'MQTT messages published and not yet acknowledged', 'gauge', lambda: self.mqtt_inflight.statistics()['inflight_depth'])
+		else:
+			self.metrics.register('mqtt_shard_batches_total', 'Batches of messages sent to the MQTT publisher process', 'counter', lambda: self.shard_publisher.statistics()['batch_count'])
+		self.metrics.register('mqtt_publish_queue_depth', 'Poll cycles waiting in the publish queue', 'gauge', lambda: self.publish_queue.statistics()['depth'])
+		self.metrics.register('mqtt_publish_queue_dropped_total', 'Poll cycles dropped by the publish queue', 'counter', lambda: self.publish_queue.statistics()['dropped_count'])
+		self.metrics.register_rate('mqtt_messages_per_second', 'mqtt_messages_published_total')
+		self.metrics.register_rate('mqtt_bytes_per_second', 'mqtt_bytes_published_total')
+
+	# Method to start exporting the metrics every metrics_interval_seconds: published under <mqtt_client_id>/_metrics if mqtt_metrics is true, and written to metrics_prometheus_path if set
+	# and to serve them in the Prometheus text format on metrics_prometheus_port if set
+	def start_metrics_export(self):
+		if 'metrics_prometheus_port' in self.modqtt_config:
+			self.metrics_server = self.metrics.serve_prometheus(self.modqtt_config['metrics_prometheus_port'])
+			print('\t[INFO] Serving the Prometheus metrics on port '+str(self.modqtt_config['metrics_prometheus_port']))
+		if self.modqtt_config.get('mqtt_metrics', False) or ('metrics_prometheus_path' in self.modqtt_config):
+			self.metrics_thread = threading.Thread(target=self.metrics_worker, name='modqtt-metrics', daemon=True)
+			self.metrics_thread.start()
+
+	# Method run by the metrics thread: export the metrics every metrics_interval_seconds, until stopped
+	def metrics_worker(self):
+		while not self.metrics_stop.wait(self.modqtt_config.get('metrics_interval_seconds', 60)):
+			self.export_metrics()
+
+	# the worker processes of a sharded gateway publish their metrics under <mqtt_client_id>/_metrics/shard<shard index>
+	def export_metrics(self):
+		if self.modqtt_config.get('mqtt_metrics', False) and self.mqtt_connected:
+			self.mqtt_publish(
+						'/'.join([str(self.modqtt_config['mqtt_client_id']),'_metrics'] + (['shard'+str(self.shard[0])] if self.shard is not None else [])),
+						json.dumps(self.metrics.snapshot()),
+						0,
+						False
+					)
+			if self.shard_publisher is not None:
+				self.shard_publisher.flush()
+		if 'metrics_prometheus_path' in self.modqtt_config:
+			try:
+				self.metrics.write_prometheus_file(self.modqtt_config['metrics_prometheus_path'])
+			except OSError as error:
+				print('\t[WARNING] Unable to write the Prometheus metrics to "'+str(self.modqtt_config['metrics_prometheus_path'])+'": '+repr(error))
+
+	# Method to stop the metrics export, after a last export
+	def stop_metrics(self):
+		self.metrics_stop.set()
+		if (self.metrics_thread is not None) and (self.metrics_thread is not threading.current_thread()):
+			self.metrics_thread.join(self.mqtt_publish_ack_timeout_seconds)
+			self.export_metrics()
+		if self.metrics_server is not None:
+			self.metrics_server.shutdown()
+
+	# Method to create one AsyncModbusTCPClient per entry of modbus_servers in the config
+	# each entry may override any Modbus setting of the config (modbus_server_ip, modbus_server_port, modbus_server_id, modbus_poll_interval_seconds, modbus_max_gap_registers, etc.) and sets its own modbus_template (defaults to the -t template)
+	# tag names and MQTT topics are namespaced with the server name, i.e. published under <mqtt_client_id>/<server name>/<mqtt_topic>/<tag_name>
+	def setup_multi_server_modbus(self, full_path_to_modqtt_template_csv=None):
+		self.modbus_tcp_client = None
+		self.modbus_tcp_clients = []
+		self.mqtt_helper = {}
+		for modbus_server, (server_template, server_config, tag_namespace) in zip(self.modqtt_config['modbus_servers'], self.client_templates(self.modqtt_config, full_path_to_modqtt_template_csv)):
+			print('\t[INFO] Modbus TCP Server "'+str(modbus_server['name'])+'" with template "'+str(server_template)+'":')
+			modbus_tcp_client = AsyncModbusTCPClient(
+					server_name=modbus_server['name'],
+					server_ip=server_config.get('modbus_server_ip'),
+					server_port=server_config.get('modbus_server_port'),
+					server_id=server_config.get('modbus_server_id'),
+					poll_interval_seconds=server_config.get('modbus_poll_interval_seconds'),
+					decode_engine=server_config.get('modbus_decode_engine'),
+					max_outstanding_requests=server_config.get('modbus_max_outstanding_requests'),
+					connections=server_config.get('modbus_connections_per_server'),
+					change_detection=server_config.get('modbus_change_detection', False),
+					timeout_seconds=server_config.get('modbus_server_timeout_seconds', 5)
+				)
+			modbus_tcp_client.load_template(server_template, server_config, tag_namespace=tag_namespace)
+			if modbus_tcp_client.call_groups is None:
+				print('\t[ERROR] Unable to load the template of Modbus TCP Server "'+str(modbus_server['name'])+'", now exiting Python with sys.exit()')
+				sys.exit()
+			if not self.quiet:
+				ModbusHelper.explain_call_groups(modbus_tcp_client.call_groups, server_config)
+			self.setup_client_metrics(modbus_tcp_client)
+			self.mqtt_helper.update(modbus_tcp_client.mqtt_helper)
+			self.modbus_tcp_clients.append(modbus_tcp_client)
+		self.compile_publish_rules()
+		self.mqtt_publish_payload_schema()
+
+	# Method to restore the last published state of the tags from mqtt_state_path (unless republish is set), and to start saving it every mqtt_state_checkpoint_seconds
+	# once restored, the publish rules apply from the first poll cycle: only the tags without a restored state (ex: added to the template since) are published unconditionally
+	def start_mqtt_state(self):
+		if self.mqtt_state is None:
+			return
+		if self.mqtt_republish:
+			print('\t[INFO] **MQTT** Republish requested, the last published state is not restored, all the tags will be published')
+		else:
+			self.restore_mqtt_state()
+		self.mqtt_state_thread = threading.Thread(target=self.mqtt_state_worker, name='modqtt-state', daemon=True)
+		self.mqtt_state_thread.start()
+
+	def restore_mqtt_state(self):
+		last_published_values = self.mqtt_state.load(self.tag_rules, self.modqtt_config['mqtt_client_id'])
+		if not last_published_values:
+			return
+		self.mqqt_last_published_values.update(last_published_values)
+		if self.rule_evaluator is not None:
+			self.rule_evaluator.load_state(self.mqqt_last_published_values)
+		self.mqtt_publish_all_on_start = False
+		print('\t[INFO] **MQTT** Restored the last published state of '+str(len(last_published_values))+' of '+str(len(self.tag_rules))+' tag(s) from "'+str(self.modqtt_config['mqtt_state_path'])+'"')
+
+	# Method run by the state thread: save the last published state every mqtt_state_checkpoint_seconds, until stopped
+	def mqtt_state_worker(self):
+		while not self.mqtt_state_stop.wait(self.modqtt_config.get('mqtt_state_checkpoint_seconds', 60)):
+			self.save_mqtt_state()
+
+	# Method to save the last published state; the published values are replaced (never modified) by the publisher thread, so a shallow copy is a consistent snapshot
+	def save_mqtt_state(self):
+		try:
+			self.mqtt_state.save(dict(self.mqqt_last_published_values), self.tag_rules, self.modqtt_config['mqtt_client_id'])
+		except OSError as error:
+			print('\t[WARNING] Unable to save the last published state to "'+str(self.modqtt_config['mqtt_state_path'])+'": '+repr(error))
+
+	# Method to stop saving the last published state, after a last save (once the publisher stage is stopped)
+	def stop_mqtt_state(self):
+		if self.mqtt_state is None:
+			return
+		self.mqtt_state_stop.set()
+		if (self.mqtt_state_thread is not None) and (self.mqtt_state_thread is not threading.current_thread()):
+			self.mqtt_state_thread.join(self.mqtt_publish_ack_timeout_seconds)
+		self.save_mqtt_state()
+		print('\t[INFO] **MQTT** Saved the last published state of '+str(self.mqtt_state.saved_count)+' tag(s) to "'+str(self.modqtt_config['mqtt_state_path'])+'"')
+
+	# Method to list the (template, config, tag namespace) of each Modbus TCP client of a config, in the order of modbus_tcp_clients
+	# in multi-server mode, the config of each server is the config with the keys of its modbus_servers entry, see setup_multi_server_modbus
+	def client_templates(self, config, full_path_to_modqtt_template_csv=None):
+		if full_path_to_modqtt_template_csv is None:
+			full_path_to_modqtt_template_csv = self.full_path_to_modqtt_template_csv
+		if 'modbus_servers' not in config:
+			return [(full_path_to_modqtt_template_csv, config, None)]
+		client_templates = []
+		for modbus_server in config['modbus_servers']:
+			server_config = dict(config)
+			server_config.update(modbus_server)
+			client_templates.append((modbus_server.get('modbus_template', full_path_to_modqtt_template_csv), server_config, modbus_server['name']))
+		return client_templates
+
+	# Method to start watching the config and template file(s) every hot_reload_interval_seconds, if set
+	def start_hot_reload(self):
+		if 'hot_reload_interval_seconds' not in self.modqtt_config:
+			return
+		self.hot_reload_watcher = FileWatcher(self.hot_reload_paths(self.modqtt_config))
+		self.hot_reload_thread = threading.Thread(target=self.hot_reload_worker, name='modqtt-reload', daemon=True)
+		self.hot_reload_thread.start()
+		print('\t[INFO] Watching the config and template file(s) for changes every '+str(self.modqtt_config['hot_reload_interval_seconds'])+' seconds:',self.hot_reload_watcher.paths)
+
+	def hot_reload_paths(self, config):
+		return [self.full_path_to_modqtt_config_json] + [client_template[0] for client_template in self.client_templates(config)]
+
+	# Method run by the hot reload thread: check the watched files every hot_reload_interval_seconds and reload the changed ones, until stopped
+	# a hot reload is compiled against the running plans and rules, so the next one waits until it is put in place
+	def hot_reload_worker(self):
+		while not self.hot_reload_stop.wait(self.modqtt_config['hot_reload_interval_seconds']):
+			if (self.pending_reload is not None) or any(modbus_tcp_client.pending_plan is not None for modbus_tcp_client in self.modbus_tcp_clients):
+				continue
+			changed_paths = self.hot_reload_watcher.check()
+			if changed_paths:
+				self.hot_reload(changed_paths)
+
+	def stop_hot_reload(self):
+		self.hot_reload_stop.set()
+		if (self.hot_reload_thread is not None) and (self.hot_reload_thread is not threading.current_thread()):
+			self.hot_reload_thread.join(self.mqtt_publish_ack_timeout_seconds)
+
+	# Method to reload the changed config and template file(s), without interrupting the polling nor republishing the unchanged tags:
+	#	only the reloadable changes of the config are taken into account (see ModbusHelper.merge_reloadable_config), the others require a restart
+	#	only the templates whose file, path or call planner settings changed are compiled again, reusing the decode plans and scan buckets of their unchanged call groups (see ModbusTCPClient.compile_plan)
+	#	only the tag rules of the tags added or changed are compiled again (see recompile_tag_rules)
+	# everything is compiled here, off the hot path; the new plan of each Modbus TCP client is then put in place by its poll loop between two poll cycles, and the new config and rules by the publisher thread between two publish cycles
+	# if a file is invalid, the running config, plans and rules are kept
+	def hot_reload(self, changed_paths):
+		print('\t[INFO] Hot reload of the changed file(s):',changed_paths)
+		config = self.modqtt_config
+		if self.full_path_to_modqtt_config_json in changed_paths:
+			new_config = self.parse_config()
+			if new_config is None:
+				print('\t[WARNING] Hot reload: invalid modqtt json configuration file, keeping the running configuration')
+				return
+			config, ignored_keys = ModbusHelper.merge_reloadable_config(config, new_config)
+			if ignored_keys:
+				print('\t[WARNING] Hot reload: the changes of',ignored_keys,'require a restart of the gateway, they are ignored until then')
+
+		pending_plans = []
+		mqtt_helper = {}
+		for modbus_tcp_client, running_template, client_template in zip(self.modbus_tcp_clients, self.client_templates(self.modqtt_config), self.client_templates(config)):
+			full_path_to_modbus_template_csv, client_config, tag_namespace = client_template
+			if (full_path_to_modbus_template_csv not in changed_paths) and (full_path_to_modbus_template_csv == running_template[0]) and (ModbusHelper.call_plan_config_values(client_config) == ModbusHelper.call_plan_config_values(running_template[1])):
+				pending_plans.append(None)
+				mqtt_helper.update(modbus_tcp_client.mqtt_helper)
+				continue
+			try:
+				plan = modbus_tcp_client.compile_plan(full_path_to_modbus_template_csv, client_config, tag_namespace)
+			except (OSError, KeyError, ValueError) as error:
+				print('\t[WARNING] Hot reload: unable to load the template "'+str(full_path_to_modbus_template_csv)+'" ('+repr(error)+'), keeping the running templates')
+				return
+			pending_plans.append(plan)
+			mqtt_helper.update(plan['compiled_plan'][2])
+
+		tag_rules, reset_tag_keys = recompile_tag_rules(self.tag_rules, self.mqtt_helper, mqtt_helper, config['mqtt_client_id'])
+		self.pending_reload = {
+			'config': config,
+			'mqtt_helper': mqtt_helper,
+			'tag_rules': tag_rules,
+			'rule_evaluator': self.build_rule_evaluator(tag_rules, config),
+			'reset_tag_keys': reset_tag_keys
+		}
+		# the new rules are pending before the new plans, so that they are in place before the publisher thread gets a poll cycle of a new plan
+		for modbus_tcp_client, plan in zip(self.modbus_tcp_clients, pending_plans):
+			modbus_tcp_client.pending_plan = plan
+		self.hot_reload_watcher.watch(self.hot_reload_paths(config))
+		print('\t[INFO] Hot reload compiled: '+str(sum(plan is not None for plan in pending_plans))+' template(s), '+str(len(tag_rules))+' tag rule(s) of which '+str(sum(tag_rules[tag_key] is not self.tag_rules.get(tag_key) for tag_key in tag_rules))+' added or changed, '+str(len([tag_key for tag_key in self.tag_rules if tag_key not in tag_rules]))+' removed')
+
+	# Method to put a pending hot reload in place, called by the publisher thread between two publish cycles
+	# the last published state of the unchanged tags is kept, so that they are not published again; the tags removed, or whose topic or payload changed, are forgotten
+	# the poll cycles queued before the new plans are in place are evaluated with the new rules, their tags without a rule being skipped
+	def apply_pending_reload(self):
+		pending_reload = self.pending_reload
+		for tag_key in pending_reload['reset_tag_keys']:
+			self.mqqt_last_published_values.pop(tag_key, None)
+		if pending_reload['rule_evaluator'] is not None:
+			pending_reload['rule_evaluator'].load_state(self.mqqt_last_published_values)
+		self.modqtt_config = pending_reload['config']
+		self.mqtt_helper = pending_reload['mqtt_helper']
+		self.tag_rules = pending_reload['tag_rules']
+		self.rule_evaluator = pending_reload['rule_evaluator']
+		self.pending_reload = None
+		for change_filter in self.change_filters.values():
+			change_filter.reset()
+		self.mqtt_publish_payload_schema()
+		print('\t[INFO] Hot reload: new configuration and tag rules in place')
+
+	# Method to put the pending plan of a Modbus TCP client in place (see hot_reload), called by its poll loop between two poll cycles
+	def apply_pending_plan(self, modbus_tcp_client, poll_scheduler):
+		if (modbus_tcp_client.pending_plan is None) or (not modbus_tcp_client.apply_pending_plan()):
+			return
+		if poll_scheduler.interval_seconds != modbus_tcp_client.tick_interval_seconds:
+			poll_scheduler.set_interval(modbus_tcp_client.tick_interval_seconds)
+		print('\t[INFO] Hot reload: new call plan of Modbus TCP Server '+modbus_tcp_client.metrics_name()+' in place, '+str(sum(len(modbus_tcp_client.call_groups[fc]) for fc in modbus_tcp_client.call_groups))+' call group(s)')
+
+	def run_multi_server(self):
+		print('Press Ctrl+C to stop and exit gracefully...')
+		asyncio.run(self.poll_all_servers())
+		self.shutdown()
+		sys.exit(0)
+
+	async def poll_all_servers(self):
+		poll_tasks = [asyncio.ensure_future(self.poll_server(modbus_tcp_client)) for modbus_tcp_client in self.modbus_tcp_clients]
+		asyncio.get_running_loop().add_signal_handler(signal.SIGINT, self.cancel_poll_tasks, poll_tasks)
+		try:
+			await asyncio.gather(*poll_tasks)
+		except asyncio.CancelledError:
+			print('\nYou pressed Ctrl+C!')
+		# the connections are closed while the event loop still runs, so that shutdown finds them closed
+		for modbus_tcp_client in self.modbus_tcp_clients:
+			modbus_tcp_client.disconnect()
+
+	def cancel_poll_tasks(self, poll_tasks):
+		for poll_task in poll_tasks:
+			poll_task.cancel()
+
+	# Method to poll one Modbus TCP Server on its own schedule, forever; on a Modbus TCP connection error, the server is reconnected without affecting the other servers
+	async def poll_server(self, modbus_tcp_client):
+		loop = asyncio.get_running_loop()
+		poll_scheduler = self.build_poll_scheduler(modbus_tcp_client)
+		while True:
+			delay = poll_scheduler.next_cycle_delay()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			try:
+				if not modbus_tcp_client.connected():
+					await modbus_tcp_client.connect()
+				self.apply_pending_plan(modbus_tcp_client, poll_scheduler)
+				cycle_start = time.monotonic()
+				modbus_poll_response = await modbus_tcp_client.cycle_poll(slot_index=poll_scheduler.slot_index)
+				self.acquisition_latency.record(time.monotonic() - cycle_start)
+			except (OSError, EOFError, asyncio.TimeoutError, ModbusError) as error:
+				print('\t[WARNING] Modbus TCP Server "'+str(modbus_tcp_client.server_name)+'" error: '+repr(error)+', reconnecting at the next poll cycle')
+				modbus_tcp_client.disconnect()
+				continue
+
+			# with the "block" overflow policy, waiting for room in the queue must not block the event loop (i.e. the other servers)
+			if self.publish_queue.overflow_policy == 'block':
+				await loop.run_in_executor(None, self.queue_poll_cycle, modbus_tcp_client, modbus_poll_response, modbus_tcp_client.cycle_changes)
+			else:
+				self.queue_poll_cycle(modbus_tcp_client, modbus_poll_response, modbus_tcp_client.cycle_changes)
+
+
+	# Method to run the MQTT publisher process of a sharded gateway: start one worker process per shard (modbus_shard_processes), publish the messages they hand over and restart the ones that exit, until Ctrl+C
+	# each worker process runs modqtt-gw.py with the same config and template, and polls its shard with its own Modbus TCP connection(s), decode and publish rules (see ModbusHelper.shard_config)
+	def run_shard_supervisor(self):
+		self.modbus_tcp_client = None
+		self.modbus_tcp_clients = []
+		shard_count = self.modqtt_config['modbus_shard_processes']
+		if ('modbus_servers' in self.modqtt_config) and (len(self.modqtt_config['modbus_servers']) < shard_count):
+			shard_count = len(self.modqtt_config['modbus_servers'])
+			print('\t[WARNING] modbus_shard_processes is larger than the number of Modbus TCP Servers, starting '+str(shard_count)+' worker process(es)')
+		self.shard_supervisor = ShardSupervisor(self.shard_worker_command, shard_count, self.mqtt_publish_or_store)
+		for worker in self.shard_supervisor.workers:
+			self.metrics.register('shard_worker_running', 'Whether the worker process of the shard is running (1) or not (0)', 'gauge', lambda worker=worker: int(worker.running()), shard=worker.shard_index)
+			self.metrics.register('shard_worker_restarts_total', 'Restarts of the worker process of the shard after it exited', 'counter', lambda worker=worker: worker.restart_count, shard=worker.shard_index)
+			self.metrics.register('shard_messages_received_total', 'Messages received from the worker process of the shard', 'counter', lambda worker=worker: worker.message_count, shard=worker.shard_index)
+		self.start_metrics_export()
+		signal.signal(signal.SIGINT, self.shard_termination_signal_handler)
+		print('Press Ctrl+C to stop and exit gracefully...')
+		self.shard_supervisor.run()
+		print('\t[INFO] Worker processes:',json.dumps(self.shard_supervisor.statistics()))
+		self.shutdown()
+		sys.exit(0)
+
+	def shard_termination_signal_handler(self, signal, frame):
+		print('\nYou pressed Ctrl+C!')
+		self.shard_supervisor.stop()
+
+	# Method to build the command line of the worker process of a shard, handing over its messages through the file descriptor fd
+	def shard_worker_command(self, shard_index, shard_count, fd):
+		command = [
+				sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'modqtt-gw.py'),
+				'-c', self.full_path_to_modqtt_config_json,
+				'-t', self.full_path_to_modqtt_template_csv,
+				'--shard', str(shard_index)+'/'+str(shard_count),
+				'--shard-fd', str(fd)
+			]
+		if self.mqtt_force_deadband:
+			command.append('-f')
+		if self.quiet:
+			command.append('-q')
+		if self.mqtt_republish:
+			command.append('-r')
+		return command
+
+	# Method called in a worker process of a sharded gateway when the pipe to the MQTT publisher process is closed (i.e. it exited): stop as on Ctrl+C
+	def on_shard_publisher_closed(self):
+		print('\t[ERROR] The MQTT publisher process is gone, now stopping the worker process of shard '+str(self.shard[0]))
+		self.mqtt_connected = False
+		os.kill(os.getpid(), signal.SIGINT)
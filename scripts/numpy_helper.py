@@ -0,0 +1,255 @@
+import operator
+
+# numpy is an optional dependency, only required when the "numpy" modbus_decode_engine or mqtt_rule_engine is selected
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+class NumpyBulkDecoder(object):
+
+	# byte permutation (applied to the big-endian wire bytes of a tag) and numpy dtype used to decode each register data_type
+	DATA_TYPE_LAYOUTS = {
+		'uint16': ((0,1), '>u2'),
+		'sint16': ((0,1), '>i2'),
+		'float32': ((0,1,2,3), '>f4'),
+		'float64': ((0,1,2,3,4,5,6,7), '>f8'),
+		'packedbool': ((0,1), '>u2'),
+		'ruint16': ((1,0), '>u2'),
+		'rsint16': ((1,0), '>i2'),
+		'rfloat32_byte_swap': ((1,0,3,2), '>f4'), # [A B C D] -> [B A] [D C]
+		'rfloat32_word_swap': ((2,3,0,1), '>f4'), # [A B C D] -> [C D] [A B]
+		'rfloat32_byte_word_swap': ((3,2,1,0), '>f4') # [A B C D] -> [D C] [B A]
+	}
+
+	# Method to check whether the numpy decode engine can be used in this Python environment
+	@classmethod
+	def is_available(cls):
+		return numpy is not None
+
+	# call_group_layouts is the list, in poll order, of (fc, register_count, [(register offset within the group, address map), ...]) of each call group
+	# all the responses of a poll cycle are decoded at once: register responses are concatenated into one uint16 array, and all tags of a given data_type are decoded with a single fancy-indexing and dtype view
+	def __init__(self, call_group_layouts):
+		self.register_count = 0
+		self.bit_count = 0
+		self.register_fcs = []
+		ordered_names = []
+		ordered_sources = []	# (segment, index within segment) of each output tag, in poll order
+		unscaled = {}			# data_type -> [register offset within the cycle]
+		scaled = {}				# data_type -> [(register offset within the cycle, (coeff, offset))]
+		packedbools = []		# [register offset within the cycle]
+
+		for fc, register_count, tags in call_group_layouts:
+			self.register_fcs.append(fc not in ['01', '02'])
+			if fc in ['01', '02']:
+				for i, address_map in tags:
+					ordered_names.append(address_map['tag_name'])
+					ordered_sources.append(('bits', self.bit_count + i))
+				self.bit_count += register_count
+				continue
+			for i, address_map in tags:
+				data_type = address_map['data_type']
+				tag_name = address_map['tag_name']
+				cycle_offset = self.register_count + i
+				if data_type == 'packedbool':
+					ordered_names.append(tag_name+'_uint16_value')
+					ordered_sources.append(('packedbool', len(packedbools)))
+					for bit in range(15, -1, -1):
+						ordered_names.append(tag_name+'_bit'+str(bit))
+						ordered_sources.append(('packedbool_bits', 16*len(packedbools) + 15 - bit))
+					packedbools.append(cycle_offset)
+				elif address_map['scaling'] is None:
+					unscaled.setdefault(data_type, []).append(cycle_offset)
+					ordered_names.append(tag_name)
+					ordered_sources.append(('unscaled', (data_type, len(unscaled[data_type]) - 1)))
+				else:
+					scaled.setdefault(data_type, []).append((cycle_offset, address_map['scaling']))
+					ordered_names.append(tag_name)
+					ordered_sources.append(('scaled', (data_type, len(scaled[data_type]) - 1)))
+			self.register_count += register_count
+
+		# byte indexes into the big-endian bytes of the cycle, per data_type
+		self.unscaled_layouts = []
+		self.scaled_layouts = []
+		segment_starts = {'bits': 0}
+		value_count = self.bit_count
+		unscaled_starts = {}
+		for data_type in unscaled:
+			unscaled_starts[data_type] = value_count
+			value_count += len(unscaled[data_type])
+			self.unscaled_layouts.append(self.build_byte_indexes(data_type, unscaled[data_type]))
+		scaled_starts = {}
+		coeffs = []
+		offsets = []
+		for data_type in scaled:
+			scaled_starts[data_type] = value_count
+			value_count += len(scaled[data_type])
+			self.scaled_layouts.append(self.build_byte_indexes(data_type, [item[0] for item in scaled[data_type]]))
+			coeffs.extend([item[1][0] for item in scaled[data_type]])
+			offsets.extend([item[1][1] for item in scaled[data_type]])
+		self.scaling_coeffs = numpy.array(coeffs, dtype=numpy.float64)
+		self.scaling_offsets = numpy.array(offsets, dtype=numpy.float64)
+		segment_starts['packedbool'] = value_count
+		value_count += len(packedbools)
+		segment_starts['packedbool_bits'] = value_count
+		value_count += 16*len(packedbools)
+		self.packedbool_layout = self.build_byte_indexes('packedbool', packedbools) if packedbools else None
+		self.packedbool_shifts = numpy.arange(15, -1, -1, dtype=numpy.uint16)
+
+		value_indexes = []
+		for segment, index in ordered_sources:
+			if segment == 'unscaled':
+				value_indexes.append(unscaled_starts[index[0]] + index[1])
+			elif segment == 'scaled':
+				value_indexes.append(scaled_starts[index[0]] + index[1])
+			else:
+				value_indexes.append(segment_starts[segment] + index)
+		self.ordered_names = tuple(ordered_names)
+		self.value_count = value_count
+		if len(value_indexes) == 1:
+			single_index = value_indexes[0]
+			self.select_values = lambda values: (values[single_index],)
+		elif value_indexes:
+			self.select_values = operator.itemgetter(*value_indexes)
+		else:
+			self.select_values = lambda values: ()
+
+	# Method to build the (n, bytes per value) array of byte indexes of n values of a given data_type, from their register offsets within the cycle
+	def build_byte_indexes(self, data_type, register_offsets):
+		byte_permutation, dtype = NumpyBulkDecoder.DATA_TYPE_LAYOUTS[data_type]
+		byte_indexes = 2*numpy.array(register_offsets, dtype=numpy.intp)[:, None] + numpy.array(byte_permutation, dtype=numpy.intp)
+		return byte_indexes, numpy.dtype(dtype)
+
+	# Method to decode all the responses of a poll cycle, given in the same order as the call_group_layouts
+	# it returns the same tag dictionary as combining the ModbusTCPClient.interpret_response of each response
+	def decode_cycle(self, responses):
+		bits = []
+		registers = []
+		for is_register_fc, response in zip(self.register_fcs, responses):
+			if is_register_fc:
+				registers.extend(response)
+			else:
+				bits.extend(response)
+		wire_bytes = numpy.array(registers, dtype='>u2').view(numpy.uint8)
+
+		values = bits
+		for byte_indexes, dtype in self.unscaled_layouts:
+			values += wire_bytes[byte_indexes].view(dtype).ravel().tolist()
+		if self.scaled_layouts:
+			# NaN and overflowing values are passed through as NaN and inf, as with the struct decode engine
+			with numpy.errstate(invalid='ignore', over='ignore'):
+				scaled_values = numpy.concatenate([wire_bytes[byte_indexes].view(dtype).ravel().astype(numpy.float64) for byte_indexes, dtype in self.scaled_layouts])
+				values += (scaled_values*self.scaling_coeffs + self.scaling_offsets).tolist()
+		if self.packedbool_layout is not None:
+			byte_indexes, dtype = self.packedbool_layout
+			packedbool_values = wire_bytes[byte_indexes].view(dtype).ravel().astype(numpy.uint16)
+			values += packedbool_values.tolist()
+			values += ((packedbool_values[:, None] >> self.packedbool_shifts) & 1).ravel().tolist()
+
+		return dict(zip(self.ordered_names, self.select_values(values)))
+
+class NumpyRuleEvaluator(object):
+
+	# maximum number of cached poll cycle layouts, see cycle_layout
+	LAYOUT_CACHE_SIZE = 64
+
+	# Columnar evaluation of the publish rules of all the tags of a poll cycle at once, making exactly the same publish decisions as the evaluation functions of rule_helper
+	# the thresholds of the compiled tag rules and the state of the last publish of each tag (value, monotonic time, limit_flag) are kept in arrays indexed like tag_keys, unset limits being NaN
+	def __init__(self, tag_rules):
+		self.tag_keys = list(tag_rules)
+		self.indexes = dict((tag_key, index) for index, tag_key in enumerate(self.tag_keys))
+		rules = [tag_rules[tag_key] for tag_key in self.tag_keys]
+		self.deadbands = numpy.array([rule.deadband for rule in rules], dtype=numpy.float64)
+		self.alarm_lows = self.limit_array([rule.alarm_low for rule in rules])
+		self.alarm_highs = self.limit_array([rule.alarm_high for rule in rules])
+		self.ignore_lows = self.limit_array([rule.ignore_low for rule in rules])
+		self.ignore_highs = self.limit_array([rule.ignore_high for rule in rules])
+		self.publish_intervals = self.limit_array([rule.publish_interval for rule in rules])
+		self.rbe = numpy.array([rule.publish_interval is None for rule in rules], dtype=bool)
+		self.last_values = numpy.zeros(len(rules), dtype=numpy.float64)
+		self.last_monotonic_ns = numpy.zeros(len(rules), dtype=numpy.int64)
+		self.limit_flags = numpy.zeros(len(rules), dtype=bool)
+		self.published = numpy.zeros(len(rules), dtype=bool)
+		self.layouts = {}
+
+	# Method to check whether the numpy rule engine can be used in this Python environment
+	@classmethod
+	def is_available(cls):
+		return numpy is not None
+
+	@classmethod
+	def limit_array(cls, limits):
+		return numpy.array([numpy.nan if limit is None else limit for limit in limits], dtype=numpy.float64)
+
+	# Method to load the state of the last publish of the tags from the last published values of the gateway (tag key -> {'last_published_value', 'monotonic_ns', 'limit_flag', ...}), ex: when the evaluator is rebuilt on a hot reload
+	def load_state(self, last_published_values):
+		tag_keys = [tag_key for tag_key in last_published_values if tag_key in self.indexes]
+		if not tag_keys:
+			return
+		indexes = numpy.array([self.indexes[tag_key] for tag_key in tag_keys], dtype=numpy.intp)
+		self.last_values[indexes] = [last_published_values[tag_key]['last_published_value'] for tag_key in tag_keys]
+		self.last_monotonic_ns[indexes] = [last_published_values[tag_key]['monotonic_ns'] for tag_key in tag_keys]
+		self.limit_flags[indexes] = [last_published_values[tag_key]['limit_flag'] for tag_key in tag_keys]
+		self.published[indexes] = True
+
+	# Method to get the layout of a poll cycle: its tags (skipping the keys without a tag rule, i.e. the timestamps of the poll cycle), their positions among the values of the poll cycle, and their indexes in tag_keys
+	# the poll cycles of a given scheduler slot always have the same tags in the same order, so the layouts are cached by the keys of the poll cycle
+	def cycle_layout(self, current_values):
+		cycle_keys = tuple(current_values)
+		layout = self.layouts.get(cycle_keys)
+		if layout is None:
+			positions = [position for position, tag_key in enumerate(cycle_keys) if tag_key in self.indexes]
+			tag_keys = [cycle_keys[position] for position in positions]
+			layout = (tag_keys, numpy.array(positions, dtype=numpy.intp), numpy.array([self.indexes[tag_key] for tag_key in tag_keys], dtype=numpy.intp))
+			if len(self.layouts) >= NumpyRuleEvaluator.LAYOUT_CACHE_SIZE:
+				self.layouts.clear()
+			self.layouts[cycle_keys] = layout
+		return layout
+
+	# Method to evaluate the publish rules of a poll cycle (the tag dictionary of ModbusTCPClient.cycle_poll), returns the tags to publish, in poll order, and their limit_flag
+	def evaluate_cycle(self, current_values, monotonic_ns, force_deadband=False, publish_all=False):
+		tag_keys, positions, indexes = self.cycle_layout(current_values)
+		values = numpy.fromiter(current_values.values(), dtype=numpy.float64, count=len(current_values))[positions]
+		fired, limit_flags = self.evaluate(indexes, values, monotonic_ns, force_deadband, publish_all)
+		return [tag_keys[position] for position in fired.tolist()], limit_flags.tolist()
+
+	# Method to evaluate the publish rules of some of the tags of a poll cycle only (ex: the tags that changed, see PublishChangeFilter), given in poll order, returns the tags to publish and their limit_flag
+	def evaluate_tags(self, tag_keys, current_values, monotonic_ns, force_deadband=False):
+		tag_keys = [tag_key for tag_key in tag_keys if tag_key in self.indexes]
+		indexes = numpy.fromiter((self.indexes[tag_key] for tag_key in tag_keys), dtype=numpy.intp, count=len(tag_keys))
+		values = numpy.fromiter((current_values[tag_key] for tag_key in tag_keys), dtype=numpy.float64, count=len(tag_keys))
+		fired, limit_flags = self.evaluate(indexes, values, monotonic_ns, force_deadband)
+		return [tag_keys[position] for position in fired.tolist()], limit_flags.tolist()
+
+	# Method to evaluate the publish rules of the tags of a poll cycle, given the positions of the tags in tag_keys (indexes) and their values, in poll order
+	# it returns the positions (within the cycle, in poll order) of the tags to publish and their limit_flag, and records them as published
+	# tags never published before, or all the tags with publish_all, are published unconditionally
+	def evaluate(self, indexes, values, monotonic_ns, force_deadband=False, publish_all=False):
+		if publish_all:
+			fire = numpy.ones(len(indexes), dtype=bool)
+			flags = numpy.zeros(len(indexes), dtype=bool)
+		else:
+			last_flags = self.limit_flags[indexes]
+			elapsed_seconds = (monotonic_ns - self.last_monotonic_ns[indexes])/1e9
+			# comparisons with NaN (unset limits, or NaN values) are always False
+			with numpy.errstate(invalid='ignore'):
+				deadband_exceeded = numpy.abs(values - self.last_values[indexes]) > self.deadbands[indexes]
+				ignored = (values < self.ignore_lows[indexes]) | (values > self.ignore_highs[indexes])
+				low_alarm = values <= self.alarm_lows[indexes]
+				high_alarm = values >= self.alarm_highs[indexes]
+				interval_elapsed = elapsed_seconds >= self.publish_intervals[indexes]
+			# alarm reached, or recovery from the last limit_flag; the high alarm is only considered if the low alarm did not fire
+			low_fire = low_alarm | (last_flags & ~numpy.isnan(self.alarm_lows[indexes]))
+			high_fire = ~low_fire & (high_alarm | (last_flags & ~numpy.isnan(self.alarm_highs[indexes])))
+			rbe = self.rbe[indexes]
+			rule_fire = (rbe & deadband_exceeded) | (~rbe & interval_elapsed & (deadband_exceeded if force_deadband else True))
+			first_publish = ~self.published[indexes]
+			fire = first_publish | (~ignored & (low_fire | high_fire | rule_fire))
+			flags = ~first_publish & ~ignored & ((low_fire & low_alarm) | (high_fire & high_alarm))
+		fired = numpy.flatnonzero(fire)
+		fired_indexes = indexes[fired]
+		self.last_values[fired_indexes] = values[fired]
+		self.last_monotonic_ns[fired_indexes] = monotonic_ns
+		self.limit_flags[fired_indexes] = flags[fired]
+		self.published[fired_indexes] = True
+		return fired, flags[fired]
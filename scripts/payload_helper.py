@@ -0,0 +1,172 @@
+import struct, datetime, json
+
+# orjson is an optional dependency, only required when the "orjson" mqtt_json_serializer is selected
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+class BinaryPayload(object):
+
+	# Compact "binary" mqtt_payload: a fixed big-endian layout of 10 bytes of header followed by the value, 11 to 18 bytes per message
+	#	byte 0:		format version (1)
+	#	byte 1:		value type code, see VALUE_TYPES
+	#	bytes 2-9:	timestamp, signed 64-bit integer, milliseconds since the Unix epoch (UTC)
+	#	bytes 10-:	value, encoded as given by its value type code
+	VERSION = 1
+
+	# value type -> (type code, struct format of the value)
+	VALUE_TYPES = {
+		'bool': (0, '?'),
+		'uint16': (1, 'H'),
+		'sint16': (2, 'h'),
+		'float32': (3, 'f'),
+		'float64': (4, 'd')
+	}
+
+	# value type of each data_type, when the tag is not scaled (scaled tags are always float64)
+	DATA_TYPE_VALUE_TYPES = {
+		'di': 'bool',
+		'coil': 'bool',
+		'uint16': 'uint16',
+		'ruint16': 'uint16',
+		'sint16': 'sint16',
+		'rsint16': 'sint16',
+		'float32': 'float32',
+		'rfloat32_byte_swap': 'float32',
+		'rfloat32_word_swap': 'float32',
+		'rfloat32_byte_word_swap': 'float32',
+		'float64': 'float64'
+	}
+
+	STRUCTS = {}		# value type -> precompiled struct of the whole payload
+	TYPE_CODES = {}		# value type -> type code
+
+	# Method to get the value type of a tag from its data_type and scaling; for packedbool, the "_uint16_value" tag is uint16 and the "_bit" tags are bool
+	@classmethod
+	def value_type(cls, data_type, scaled=False):
+		if scaled:
+			return 'float64'
+		return BinaryPayload.DATA_TYPE_VALUE_TYPES.get(data_type, 'float64')
+
+	@classmethod
+	def encode(cls, value_type, epoch_ms, value):
+		return BinaryPayload.STRUCTS[value_type].pack(BinaryPayload.VERSION, BinaryPayload.TYPE_CODES[value_type], epoch_ms, value)
+
+	@classmethod
+	def decode(cls, payload):
+		version, type_code, epoch_ms = struct.unpack_from('>BBq', payload)
+		for value_type in BinaryPayload.VALUE_TYPES:
+			if BinaryPayload.TYPE_CODES[value_type] == type_code:
+				return epoch_ms, value_type, BinaryPayload.STRUCTS[value_type].unpack(payload)[3]
+		raise ValueError('unknown binary payload value type code '+str(type_code))
+
+	# Method to describe the layout, published (retained) for the consumers to decode the binary payloads
+	@classmethod
+	def schema(cls):
+		return {
+			'version': BinaryPayload.VERSION,
+			'byte_order': 'big-endian',
+			'fields': [
+				{'name': 'version', 'offset': 0, 'format': 'uint8'},
+				{'name': 'value_type', 'offset': 1, 'format': 'uint8'},
+				{'name': 'timestamp_epoch_ms', 'offset': 2, 'format': 'int64'},
+				{'name': 'value', 'offset': 10, 'format': 'value_type'}
+			],
+			'value_types': dict((str(BinaryPayload.TYPE_CODES[value_type]), {'name': value_type, 'struct_format': '>'+BinaryPayload.VALUE_TYPES[value_type][1], 'size': struct.calcsize('>'+BinaryPayload.VALUE_TYPES[value_type][1])}) for value_type in BinaryPayload.VALUE_TYPES)
+		}
+
+for value_type in BinaryPayload.VALUE_TYPES:
+	BinaryPayload.TYPE_CODES[value_type] = BinaryPayload.VALUE_TYPES[value_type][0]
+	BinaryPayload.STRUCTS[value_type] = struct.Struct('>BBq'+BinaryPayload.VALUE_TYPES[value_type][1])
+
+class TimestampFormatter(object):
+
+	# number of fractional digits of each supported timestamp precision
+	PRECISIONS = {'seconds': 0, 'milliseconds': 3, 'microseconds': 6}
+
+	# Formats the epoch nanosecond timestamps carried by the gateway into the UTC and local timestamps of the payloads, only at the serialization edge
+	# time_format: a strftime format, fractional seconds (precision) are appended to the seconds (%S); or "epoch" for an integer number of seconds/milliseconds/microseconds since the Unix epoch
+	# all the tags of a poll cycle share the same timestamp, so the last formatted timestamp is cached: each poll cycle is formatted once
+	def __init__(self, time_format='%Y-%m-%d %H:%M:%S%z', precision='seconds'):
+		if precision not in TimestampFormatter.PRECISIONS:
+			print('\t[WARNING] Unsupported timestamp precision "'+str(precision)+'", using default "seconds"; supported precisions are:',list(TimestampFormatter.PRECISIONS))
+			precision = 'seconds'
+		self.time_format = time_format
+		self.digits = TimestampFormatter.PRECISIONS[precision]
+		if (self.digits > 0) and (time_format != 'epoch'):
+			self.time_format = time_format.replace('%S', '%S.@FRACTION@')
+		self.last_formatted = (None, None)		# (timestamp_ns, (UTC timestamp, local timestamp)), replaced as a whole so that it can be shared by threads
+
+	# Method to format an epoch nanosecond timestamp, returns (UTC timestamp, local timestamp)
+	def format(self, timestamp_ns):
+		last_formatted = self.last_formatted
+		if timestamp_ns == last_formatted[0]:
+			return last_formatted[1]
+		if self.time_format == 'epoch':
+			epoch = timestamp_ns // 10**(9 - self.digits)
+			formatted = (epoch, epoch)
+		else:
+			seconds, nanoseconds = divmod(timestamp_ns, 1000000000)
+			ts_utc = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+			ts_local = ts_utc.astimezone()
+			formatted = (ts_utc.strftime(self.time_format), ts_local.strftime(self.time_format))
+			if self.digits > 0:
+				fraction = str(nanoseconds).zfill(9)[:self.digits]
+				formatted = (formatted[0].replace('@FRACTION@', fraction), formatted[1].replace('@FRACTION@', fraction))
+		self.last_formatted = (timestamp_ns, formatted)
+		return formatted
+
+class JsonPayload(object):
+
+	SERIALIZERS = ['json','orjson']
+
+	# Renders the "json" mqtt_payload {"timestamp_utc": ..., "timestamp_local": ..., "value": ...} and serializes the "batch" mqtt_payload documents
+	# only the value changes from one message to the next of a poll cycle: the document up to the value (the timestamps) is serialized once per poll cycle, and each value is formatted into place
+	# serializer: "json" renders exactly as json.dumps (str), "orjson" renders compact bytes with orjson (NaN and infinity become null)
+	def __init__(self, timestamp_formatter, serializer='json'):
+		if serializer not in JsonPayload.SERIALIZERS:
+			print('\t[WARNING] Unsupported JSON serializer "'+str(serializer)+'", using default "json"; supported serializers are:',JsonPayload.SERIALIZERS)
+			serializer = 'json'
+		elif (serializer == 'orjson') and (orjson is None):
+			print('\t[WARNING] JSON serializer "orjson" requested but orjson is not installed, using the default "json" serializer')
+			serializer = 'json'
+		self.serializer = serializer
+		self.timestamp_formatter = timestamp_formatter
+		if serializer == 'orjson':
+			self.dumps = orjson.dumps
+			self.format_value = orjson.dumps
+			self.suffix = b'}'
+		else:
+			self.dumps = json.dumps
+			self.format_value = JsonPayload.format_json_value
+			self.suffix = '}'
+		self.last_prefix = (None, None)		# (timestamp_ns, serialized document up to the value), replaced as a whole so that it can be shared by threads
+
+	# Method to format a value exactly as json.dumps, without its generic encoder for the common scalar types
+	@staticmethod
+	def format_json_value(value):
+		value_type = type(value)
+		if value_type is float:
+			if value != value:
+				return 'NaN'
+			elif value == float('inf'):
+				return 'Infinity'
+			elif value == -float('inf'):
+				return '-Infinity'
+			return float.__repr__(value)
+		elif value_type is int:
+			return int.__repr__(value)
+		elif value_type is bool:
+			return 'true' if value else 'false'
+		return json.dumps(value)
+
+	# Method to render the "json" mqtt_payload of a value at timestamp_ns (see ModbusTCPClient.cycle_timestamp)
+	def render(self, timestamp_ns, value):
+		last_prefix = self.last_prefix
+		if timestamp_ns != last_prefix[0]:
+			ts_utc, ts_local = self.timestamp_formatter.format(timestamp_ns)
+			document = self.dumps({'timestamp_utc': ts_utc, 'timestamp_local': ts_local, 'value': None})
+			last_prefix = (timestamp_ns, document[:-len(self.dumps(None))-len(self.suffix)])
+			self.last_prefix = last_prefix
+		return last_prefix[1] + self.format_value(value) + self.suffix
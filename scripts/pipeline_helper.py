@@ -0,0 +1,139 @@
+import struct, time
+from umodbus.client import tcp
+from umodbus.exceptions import ModbusError
+from umodbus.utils import recv_exactly
+
+# translation of the '0' and '1' characters of a binary string to the 0 and 1 bytes, see unpack_bits
+BIT_VALUES = bytes.maketrans(b'01', b'\x00\x01')
+
+class PackedBits(list):
+
+	# List of 0 and 1 of a FC01/FC02 response, as umodbus returns it, that keeps the packed data bytes of the response (least significant bit first in each byte, padding bits cleared)
+	# so that two responses are compared, and their flipped bits found (see ModbusHelper.decode_changed_response), with bytes and int operations on the packed bytes
+	def __init__(self, bits, packed):
+		list.__init__(self, bits)
+		self.packed = packed
+
+	def __eq__(self, other):
+		if isinstance(other, PackedBits):
+			return self.packed == other.packed
+		return list.__eq__(self, other)
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	__hash__ = None
+
+# Method to get the packed bytes of a list of 0 and 1, the ones kept by a PackedBits or packed again for a plain list
+def packed_bits(bits):
+	if isinstance(bits, PackedBits):
+		return bits.packed
+	return int(''.join('1' if bit else '0' for bit in reversed(bits)) or '0', 2).to_bytes((len(bits) + 7)//8, 'little')
+
+# Method to unpack the bits of a FC01/FC02 response (least significant bit first in each byte) into a PackedBits of 0 and 1, as umodbus does
+# the bits are unpacked with int, string and bytes operations on the whole response rather than one Python operation per bit
+def unpack_bits(data, quantity):
+	packed = int.from_bytes(data, 'little') & ((1 << quantity) - 1)
+	bits = format(packed, '0'+str(8*len(data))+'b')[::-1]
+	return PackedBits(bits[:quantity].encode('ascii').translate(BIT_VALUES), packed.to_bytes(len(data), 'little'))
+
+# Method to parse a response ADU like umodbus tcp.parse_response_adu, the bits of the FC01/FC02 responses being unpacked by unpack_bits
+def parse_response_adu(response_adu, request_adu):
+	if response_adu[7] in (1, 2):
+		quantity = struct.unpack('>H', request_adu[-2:])[0]
+		return unpack_bits(response_adu[9:9+response_adu[8]], quantity)
+	return tcp.parse_response_adu(response_adu, request_adu)
+
+# Raised when a pipelined response can not be matched to an outstanding request, i.e. the server does not support pipelining
+class PipelineError(Exception):
+	pass
+
+class ModbusTCPPipeline(object):
+
+	# Sends up to max_outstanding_requests Modbus TCP requests back-to-back, each with a distinct MBAP transaction ID, and matches the responses by transaction ID as they arrive
+	# a poll cycle then takes about one round trip per max_outstanding_requests requests, instead of one round trip per request
+	# pipelining is disabled for good once the server mismatches the responses (PipelineError), or once max_consecutive_failures pipelined exchanges failed in a row (timeout, closed connection: ValueError from recv_exactly),
+	# so that a brief network glitch does not disable pipelining on a server that supports it, see record_failure
+	def __init__(self, max_outstanding_requests=1, max_consecutive_failures=3):
+		self.max_outstanding_requests = max(1, int(max_outstanding_requests))
+		self.max_consecutive_failures = max(1, int(max_consecutive_failures))
+		self.consecutive_failure_count = 0
+		self.next_transaction_id = 0
+		self.round_trip_seconds = []	# round trip time of each request of the last send_messages, from its send to its response
+
+	# Method to record a failed pipelined exchange, returns True if pipelining is disabled by this failure, i.e. the requests are sent sequentially from now on
+	def record_failure(self, error):
+		self.consecutive_failure_count += 1
+		if isinstance(error, PipelineError) or (self.consecutive_failure_count >= self.max_consecutive_failures):
+			self.max_outstanding_requests = 1
+			return True
+		return False
+
+	# Method to record a complete pipelined exchange, Modbus exceptions included
+	def record_success(self):
+		self.consecutive_failure_count = 0
+
+	# Method to replace the (random) transaction ID of the umodbus request ADUs with distinct sequential ones, returns the list of (transaction ID, request ADU)
+	def assign_transaction_ids(self, request_adus):
+		requests = []
+		for request_adu in request_adus:
+			self.next_transaction_id = (self.next_transaction_id + 1) % 65536
+			requests.append((self.next_transaction_id, struct.pack('>H', self.next_transaction_id) + request_adu[2:]))
+		return requests
+
+	# Method to pop the outstanding request of a response ADU, returns (index of the request, request ADU)
+	def pop_outstanding(self, outstanding, response_adu):
+		transaction_id = struct.unpack('>H', response_adu[0:2])[0]
+		if transaction_id not in outstanding:
+			raise PipelineError('response with unexpected transaction ID '+str(transaction_id)+', outstanding transaction IDs are '+str(sorted(outstanding)))
+		return outstanding.pop(transaction_id)
+
+	# Method to parse a response ADU, keeping the first Modbus exception instead of raising it, so that the remaining responses are still read from the connection
+	def parse_response(self, response_adu, request_adu, errors):
+		try:
+			tcp.raise_for_exception_adu(response_adu)
+			return parse_response_adu(response_adu, request_adu)
+		except ModbusError as error:
+			errors.append(error)
+			return None
+
+	# Method to read one response ADU from a blocking socket: the 7 bytes MBAP header, then the rest of the ADU given by the MBAP length field
+	def read_adu(self, sock):
+		mbap_header = recv_exactly(sock.recv, 7)
+		length = struct.unpack('>H', mbap_header[4:6])[0]
+		return mbap_header + recv_exactly(sock.recv, length - 1)
+
+	# Method to send a single request ADU on a blocking socket and return its parsed response, like umodbus tcp.send_message
+	def send_message(self, request_adu, sock):
+		sock.sendall(request_adu)
+		response_adu = self.read_adu(sock)
+		tcp.raise_for_exception_adu(response_adu)
+		return parse_response_adu(response_adu, request_adu)
+
+	# Method to send request ADUs on a blocking socket and return their parsed responses, in the order of the requests
+	def send_messages(self, request_adus, sock):
+		requests = self.assign_transaction_ids(request_adus)
+		responses = [None]*len(requests)
+		self.round_trip_seconds = [0.0]*len(requests)
+		outstanding = {}	# transaction ID -> (index of the request, request ADU)
+		errors = []
+		next_request = 0
+		while (next_request < len(requests)) or outstanding:
+			window = []
+			sent_at = time.perf_counter()
+			while (next_request < len(requests)) and (len(outstanding) < self.max_outstanding_requests):
+				transaction_id, request_adu = requests[next_request]
+				outstanding[transaction_id] = (next_request, request_adu)
+				window.append(request_adu)
+				self.round_trip_seconds[next_request] = sent_at
+				next_request += 1
+			if window:
+				sock.sendall(b''.join(window))
+			response_adu = self.read_adu(sock)
+			index, request_adu = self.pop_outstanding(outstanding, response_adu)
+			self.round_trip_seconds[index] = time.perf_counter() - self.round_trip_seconds[index]
+			responses[index] = self.parse_response(response_adu, request_adu, errors)
+		self.record_success()
+		if errors:
+			raise errors[0]
+		return responses
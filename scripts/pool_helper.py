@@ -0,0 +1,138 @@
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from pipeline_helper import ModbusTCPPipeline, PipelineError
+
+class ConnectionHealth(object):
+
+	# Health of one connection of a pool: requests sent, errors and reconnections
+	# a connection is unhealthy from an error (or a failed connection attempt) until its next successful exchange
+	def __init__(self, index):
+		self.index = index
+		self.request_count = 0
+		self.error_count = 0
+		self.reconnect_count = 0
+		self.consecutive_error_count = 0
+		self.last_error = None
+
+	def record_success(self, request_count):
+		self.request_count += request_count
+		self.consecutive_error_count = 0
+
+	def record_error(self, error):
+		self.error_count += 1
+		self.consecutive_error_count += 1
+		self.last_error = repr(error)
+
+	def healthy(self):
+		return self.consecutive_error_count == 0
+
+	def statistics(self):
+		return {
+			'connection': self.index,
+			'healthy': self.healthy(),
+			'request_count': self.request_count,
+			'error_count': self.error_count,
+			'reconnect_count': self.reconnect_count,
+			'last_error': self.last_error
+		}
+
+# Method to spread request_count requests over the connections of connection_indexes, in turn, returns the list of (connection index, [request indexes]) of the connections with at least one request
+def spread_requests(request_count, connection_indexes):
+	shares = [(connection_index, list(range(position, request_count, len(connection_indexes)))) for position, connection_index in enumerate(connection_indexes)]
+	return [share for share in shares if share[1]]
+
+class ModbusTCPConnectionPool(object):
+
+	# Pool of size blocking Modbus TCP connections to the same server, for servers accepting several concurrent connections
+	# the requests of a poll cycle are spread over the open connections and sent in parallel, one thread per connection, each connection sending its share pipelined up to max_outstanding_requests
+	# a connection that breaks (timeout, closed connection, unexpected response) is reconnected and its share sent again once; a connection that can not be reconnected is skipped and retried on the next poll cycle
+	def __init__(self, server_ip, server_port=502, size=2, max_outstanding_requests=1):
+		self.server_ip = server_ip
+		self.server_port = server_port
+		self.size = max(1, int(size))
+		self.timeout_seconds = 5
+		self.sockets = [None]*self.size
+		self.pipelines = [ModbusTCPPipeline(max_outstanding_requests) for index in range(self.size)]
+		self.health = [ConnectionHealth(index) for index in range(self.size)]
+		self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='modqtt-modbus')
+		self.round_trip_seconds = []	# round trip time of each request of the last send_messages, in the order of the requests
+
+	# Method to open the connections of the pool, at least one of them must succeed
+	def connect(self, timeout=5):
+		self.timeout_seconds = timeout
+		self.connect_closed()
+		if not any(self.sockets):
+			raise ConnectionError('unable to open any of the '+str(self.size)+' connections to '+str(self.server_ip)+':'+str(self.server_port)+', last errors: '+str([connection_health.last_error for connection_health in self.health]))
+
+	# Method to (re)open the closed connections of the pool, recording the failures in their health
+	def connect_closed(self):
+		for index in range(self.size):
+			if self.sockets[index] is not None:
+				continue
+			try:
+				self.sockets[index] = socket.create_connection((self.server_ip, self.server_port), self.timeout_seconds)
+			except OSError as error:
+				self.health[index].record_error(error)
+
+	def close_connection(self, index):
+		if self.sockets[index] is not None:
+			self.sockets[index].close()
+			self.sockets[index] = None
+
+	def close(self):
+		for index in range(self.size):
+			self.close_connection(index)
+
+	def shutdown(self):
+		self.close()
+		self.executor.shutdown(wait=False)
+
+	# Method to send request ADUs over the open connections in parallel and return their parsed responses, in the order of the requests
+	# the first error is raised once all the connections are done, so that no connection is left in the middle of an exchange
+	def send_messages(self, request_adus):
+		self.connect_closed()
+		open_indexes = [index for index in range(self.size) if self.sockets[index] is not None]
+		if not open_indexes:
+			raise ConnectionError('no open connection to '+str(self.server_ip)+':'+str(self.server_port)+', last errors: '+str([connection_health.last_error for connection_health in self.health]))
+		shares = spread_requests(len(request_adus), open_indexes)
+		futures = [(request_indexes, self.executor.submit(self.send_share, index, [request_adus[request_index] for request_index in request_indexes])) for index, request_indexes in shares]
+		responses = [None]*len(request_adus)
+		self.round_trip_seconds = [0.0]*len(request_adus)
+		errors = []
+		for request_indexes, future in futures:
+			try:
+				share_responses, share_round_trip_seconds = future.result()
+			except Exception as error:
+				errors.append(error)
+				continue
+			for request_index, response, round_trip_seconds in zip(request_indexes, share_responses, share_round_trip_seconds):
+				responses[request_index] = response
+				self.round_trip_seconds[request_index] = round_trip_seconds
+		if errors:
+			raise errors[0]
+		return responses
+
+	# Method run by the thread of a connection: send its share of the requests, reconnecting it and sending the share again once if it breaks
+	# Modbus exceptions leave the connection usable, they are raised as is
+	def send_share(self, index, request_adus):
+		pipeline = self.pipelines[index]
+		try:
+			responses = pipeline.send_messages(request_adus, self.sockets[index])
+		except (socket.timeout, ConnectionError, ValueError, PipelineError) as error:
+			self.health[index].record_error(error)
+			if (pipeline.max_outstanding_requests > 1) and pipeline.record_failure(error):
+				print('\t[WARNING] Connection '+str(index)+' to Modbus TCP Server '+str(self.server_ip)+':'+str(self.server_port)+' broke with pipelined requests ('+repr(error)+'), falling back to sequential requests on this connection')
+			self.close_connection(index)
+			self.health[index].reconnect_count += 1
+			try:
+				self.sockets[index] = socket.create_connection((self.server_ip, self.server_port), self.timeout_seconds)
+				responses = pipeline.send_messages(request_adus, self.sockets[index])
+			except (OSError, ValueError, PipelineError) as retry_error:
+				self.health[index].record_error(retry_error)
+				self.close_connection(index)
+				raise
+		self.health[index].record_success(len(request_adus))
+		return responses, list(pipeline.round_trip_seconds)
+
+	def statistics(self):
+		return [connection_health.statistics() for connection_health in self.health]
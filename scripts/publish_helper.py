@@ -0,0 +1,99 @@
+import time, threading
+
+class PublishTracker(object):
+
+	# Tracks the MQTT messages in flight (published but not yet acknowledged through on_publish) per message id (mid)
+	# on_publish is called from the paho network thread, possibly before publish() has returned the mid to the caller, hence the early acknowledgements, only kept for early_acknowledgement_seconds
+	# paho mids are 16-bit and reused: the late acknowledgement of an expired message is discarded, so that it is not taken for the acknowledgement of the next message registered with the same mid
+	def __init__(self, clock=time.monotonic, early_acknowledgement_seconds=1.0):
+		self.clock = clock
+		self.early_acknowledgement_seconds = early_acknowledgement_seconds
+		self.condition = threading.Condition()
+		self.inflight = {}				# mid -> publish time on the monotonic clock
+		self.early_acknowledgements = {}	# mid -> acknowledgement time on the monotonic clock, of the messages acknowledged before being registered
+		self.expired_mids = set()		# mids of the messages expired while in flight, until acknowledged late or reused
+		self.published_count = 0
+		self.published_bytes = 0
+		self.acknowledged_count = 0
+		self.expired_count = 0
+		self.late_acknowledged_count = 0
+		self.max_depth = 0
+		self.ack_latency_total_seconds = 0.0
+		self.ack_latency_max_seconds = 0.0
+		self.last_ack_latency_seconds = 0.0
+
+	# Method to register a message published with a given mid, and its payload size
+	def register(self, mid, payload_bytes=0):
+		with self.condition:
+			self.published_count += 1
+			self.published_bytes += payload_bytes
+			self.expired_mids.discard(mid)
+			acknowledged_at = self.early_acknowledgements.pop(mid, None)
+			if (acknowledged_at is not None) and (self.clock() - acknowledged_at <= self.early_acknowledgement_seconds):
+				self.record_acknowledgement(0.0)
+				self.condition.notify_all()
+				return
+			self.inflight[mid] = self.clock()
+			self.max_depth = max(self.max_depth, len(self.inflight))
+
+	# Method to acknowledge a message, to be called from on_publish
+	def acknowledge(self, mid):
+		with self.condition:
+			published_at = self.inflight.pop(mid, None)
+			if published_at is None:
+				if mid in self.expired_mids:
+					self.expired_mids.discard(mid)
+					self.late_acknowledged_count += 1
+					return
+				# keyed by the 16-bit paho mids, this dict holds at most 65535 entries; a stale entry (ex: acknowledgement of a message never registered) is ignored by register after early_acknowledgement_seconds
+				self.early_acknowledgements[mid] = self.clock()
+				return
+			self.record_acknowledgement(self.clock() - published_at)
+			self.condition.notify_all()
+
+	def record_acknowledgement(self, latency_seconds):
+		self.acknowledged_count += 1
+		self.last_ack_latency_seconds = latency_seconds
+		self.ack_latency_total_seconds += latency_seconds
+		self.ack_latency_max_seconds = max(self.ack_latency_max_seconds, latency_seconds)
+
+	# Method to forget the messages in flight for longer than timeout_seconds (ex: acknowledgement lost), returns the number of messages expired
+	def expire(self, timeout_seconds):
+		with self.condition:
+			oldest_allowed = self.clock() - timeout_seconds
+			expired_mids = [mid for mid in self.inflight if self.inflight[mid] < oldest_allowed]
+			for mid in expired_mids:
+				del self.inflight[mid]
+				self.expired_mids.add(mid)
+			self.expired_count += len(expired_mids)
+			if expired_mids:
+				self.condition.notify_all()
+			return len(expired_mids)
+
+	# Method to wait, at most timeout_seconds, until all the messages in flight are acknowledged; returns True if they are, False on timeout
+	# must not be called from the paho network thread (i.e. from a paho callback), since that thread delivers the acknowledgements
+	def wait_for_all(self, timeout_seconds=None):
+		with self.condition:
+			return self.condition.wait_for(lambda: not self.inflight, timeout_seconds)
+
+	# Method to wait, at most timeout_seconds, until fewer than max_depth messages are in flight (flow control); returns True if so, False on timeout
+	# must not be called from the paho network thread (i.e. from a paho callback), since that thread delivers the acknowledgements
+	def wait_for_capacity(self, max_depth, timeout_seconds=None):
+		with self.condition:
+			return self.condition.wait_for(lambda: len(self.inflight) < max_depth, timeout_seconds)
+
+	# Method to report the in-flight depth and acknowledgement latency statistics
+	def statistics(self):
+		with self.condition:
+			return {
+				'inflight_depth': len(self.inflight),
+				'inflight_max_depth': self.max_depth,
+				'published_count': self.published_count,
+				'published_bytes': self.published_bytes,
+				'acknowledged_count': self.acknowledged_count,
+				'expired_count': self.expired_count,
+				'late_acknowledged_count': self.late_acknowledged_count,
+				'ack_latency_last_seconds': self.last_ack_latency_seconds,
+				'ack_latency_mean_seconds': (self.ack_latency_total_seconds/self.acknowledged_count) if self.acknowledged_count else 0.0,
+				'ack_latency_max_seconds': self.ack_latency_max_seconds
+			}
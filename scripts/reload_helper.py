@@ -0,0 +1,39 @@
+import os
+
+class FileWatcher(object):
+
+	# Detects the changes of a set of files (ex: the config and template(s) of the gateway) by polling their modification time and size, without any platform-specific notification API
+	# a change is only reported once the files are unchanged between two consecutive checks, so that a file still being written by an editor is not reloaded half-written
+	def __init__(self, paths):
+		self.paths = []
+		self.file_states = {}			# path -> (modification time in ns, size), or None if the file does not exist; state of the files last reported
+		self.changed_file_states = None	# state of the files at the previous check, if they differed from file_states
+		self.watch(paths)
+
+	# Method to set the files to watch; the files already watched keep their last reported state, the new ones are watched from their current state
+	def watch(self, paths):
+		self.paths = list(dict.fromkeys(paths))
+		self.file_states = dict((path, self.file_states[path] if path in self.file_states else FileWatcher.file_state(path)) for path in self.paths)
+		self.changed_file_states = None
+
+	@classmethod
+	def file_state(cls, path):
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+		return (stat.st_mtime_ns, stat.st_size)
+
+	# Method to check the files, returns the paths changed since the last reported state once they are settled, otherwise an empty list
+	def check(self):
+		file_states = dict((path, FileWatcher.file_state(path)) for path in self.paths)
+		if file_states == self.file_states:
+			self.changed_file_states = None
+			return []
+		if file_states != self.changed_file_states:
+			self.changed_file_states = file_states
+			return []
+		changed_paths = [path for path in self.paths if file_states[path] != self.file_states[path]]
+		self.file_states = file_states
+		self.changed_file_states = None
+		return changed_paths
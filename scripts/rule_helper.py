@@ -0,0 +1,117 @@
+class TagRule(object):
+
+	# Publish rule of a tag, compiled once from its mqtt_helper entry so that the publish cycle does not look up and convert the template settings of every tag on every poll cycle
+	# evaluate(rule, value, last_published, elapsed_seconds, force_deadband) is pre-selected by compile_tag_rules depending on mqtt_publish and on the limits set
+	# it returns None if the value should not be published, otherwise the limit_flag to publish it with
+	__slots__ = ('tag_key','topic','qos','retain','payload','binary_type','publish_interval','deadband','alarm_low','alarm_high','ignore_low','ignore_high','evaluate')
+
+	def __init__(self, tag_key, topic, qos, retain, payload, binary_type, publish_interval, deadband, alarm_low, alarm_high, ignore_low, ignore_high, evaluate):
+		self.tag_key = tag_key
+		self.topic = topic
+		self.qos = qos
+		self.retain = retain
+		self.payload = payload
+		self.binary_type = binary_type
+		self.publish_interval = publish_interval		# None for report by exception ("rbe"), otherwise seconds
+		self.deadband = deadband
+		self.alarm_low = alarm_low
+		self.alarm_high = alarm_high
+		self.ignore_low = ignore_low
+		self.ignore_high = ignore_high
+		self.evaluate = evaluate
+
+	# pickled as the arguments of the constructor, which unpickles about twice as fast as the default state of the slots (see TemplateCache)
+	def __reduce__(self):
+		return (TagRule, tuple(getattr(self, slot) for slot in TagRule.__slots__))
+
+# report by exception: publish if the value changed by strictly more than the deadband since it was last published
+def evaluate_rbe(rule, value, last_published, elapsed_seconds, force_deadband):
+	if abs(value - last_published['last_published_value']) > rule.deadband:
+		return False
+	return None
+
+# publish at a regular interval, the deadband being ignored unless the -f "force deadband" switch is activated
+def evaluate_interval(rule, value, last_published, elapsed_seconds, force_deadband):
+	if elapsed_seconds >= rule.publish_interval:
+		if (not force_deadband) or (abs(value - last_published['last_published_value']) > rule.deadband):
+			return False
+	return None
+
+# Method to build the evaluation function of the tags with mqtt_ignore_low/high or mqtt_alarm_low/high limits, wrapping the rbe or interval evaluation
+# values outside the ignore limits are never published; regardless of the publish method, values reaching the alarm limits are published with limit_flag, and the first value back within them (recovery) is always published
+def evaluate_with_limits(evaluate):
+	def evaluate_limits(rule, value, last_published, elapsed_seconds, force_deadband):
+		if (rule.ignore_low is not None) and (value < rule.ignore_low):
+			return None
+		elif (rule.ignore_high is not None) and (value > rule.ignore_high):
+			return None
+		if rule.alarm_low is not None:
+			if value <= rule.alarm_low:
+				return True
+			elif last_published['limit_flag']:
+				return False
+		if rule.alarm_high is not None:
+			if value >= rule.alarm_high:
+				return True
+			elif last_published['limit_flag']:
+				return False
+		return evaluate(rule, value, last_published, elapsed_seconds, force_deadband)
+	return evaluate_limits
+
+EVALUATE_RBE_WITH_LIMITS = evaluate_with_limits(evaluate_rbe)
+EVALUATE_INTERVAL_WITH_LIMITS = evaluate_with_limits(evaluate_interval)
+
+# the evaluation functions by name, so that compiled tag rules can be cached on disk (see TemplateCache)
+EVALUATION_FUNCTIONS = {
+	'evaluate_rbe': evaluate_rbe,
+	'evaluate_interval': evaluate_interval,
+	'evaluate_rbe_with_limits': EVALUATE_RBE_WITH_LIMITS,
+	'evaluate_interval_with_limits': EVALUATE_INTERVAL_WITH_LIMITS
+}
+
+# Method to compile the mqtt_helper of a template (see ModbusHelper.parse_template_build_calls) into a TagRule per tag, with the full MQTT topic under mqtt_client_id
+def compile_tag_rules(mqtt_helper, mqtt_client_id):
+	tag_rules = {}
+	for tag_key in mqtt_helper:
+		tag_helper = mqtt_helper[tag_key]
+		publish_interval = None if tag_helper['mqtt_publish'] == 'rbe' else float(tag_helper['mqtt_publish'])
+		# MQTT alarm limits are ignored for the di, coil and packedbool data_type (the bits and uint16 value of packedbool have no data_type)
+		alarm_low = tag_helper['mqtt_alarm_low']
+		alarm_high = tag_helper['mqtt_alarm_high']
+		if tag_helper.get('data_type', 'packedbool') in ['di','coil','packedbool']:
+			alarm_low = None
+			alarm_high = None
+		ignore_low = tag_helper['mqtt_ignore_low']
+		ignore_high = tag_helper['mqtt_ignore_high']
+		if (alarm_low is None) and (alarm_high is None) and (ignore_low is None) and (ignore_high is None):
+			evaluate = evaluate_rbe if publish_interval is None else evaluate_interval
+		else:
+			evaluate = EVALUATE_RBE_WITH_LIMITS if publish_interval is None else EVALUATE_INTERVAL_WITH_LIMITS
+		tag_rules[tag_key] = TagRule(
+				tag_key = tag_key,
+				topic = str(mqtt_client_id)+'/'+tag_helper['mqtt_topic'],
+				qos = tag_helper['mqtt_qos'],
+				retain = tag_helper['mqtt_retain'],
+				payload = tag_helper['mqtt_payload'],
+				binary_type = tag_helper.get('mqtt_binary_type'),
+				publish_interval = publish_interval,
+				deadband = float(tag_helper['mqtt_deadband']),
+				alarm_low = None if alarm_low is None else float(alarm_low),
+				alarm_high = None if alarm_high is None else float(alarm_high),
+				ignore_low = None if ignore_low is None else float(ignore_low),
+				ignore_high = None if ignore_high is None else float(ignore_high),
+				evaluate = evaluate
+			)
+	return tag_rules
+
+# Method to recompile the tag rules after a change of the mqtt_helper (ex: hot reload of the template), only compiling the rules of the tags added or changed
+# returns the tag rules and the keys of the tags whose last published state no longer applies: the tags removed, and the tags whose topic or payload changed, to be published again on their next poll
+def recompile_tag_rules(tag_rules, previous_mqtt_helper, mqtt_helper, mqtt_client_id):
+	changed_tag_rules = compile_tag_rules(dict((tag_key, mqtt_helper[tag_key]) for tag_key in mqtt_helper if previous_mqtt_helper.get(tag_key) != mqtt_helper[tag_key]), mqtt_client_id)
+	recompiled_tag_rules = dict((tag_key, changed_tag_rules[tag_key] if tag_key in changed_tag_rules else tag_rules[tag_key]) for tag_key in mqtt_helper)
+	reset_tag_keys = [tag_key for tag_key in tag_rules if tag_key not in mqtt_helper]
+	for tag_key in changed_tag_rules:
+		previous_rule = tag_rules.get(tag_key)
+		if (previous_rule is not None) and ((previous_rule.topic, previous_rule.payload, previous_rule.binary_type) != (changed_tag_rules[tag_key].topic, changed_tag_rules[tag_key].payload, changed_tag_rules[tag_key].binary_type)):
+			reset_tag_keys.append(tag_key)
+	return recompiled_tag_rules, reset_tag_keys
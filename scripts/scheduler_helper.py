@@ -0,0 +1,97 @@
+import time, threading
+
+class PollScheduler(object):
+
+	# what to do when a poll cycle overruns (i.e. it is still running at the deadline of the next cycle):
+	#	'skip': skip the missed cycles and resume on the next deadline of the schedule
+	#	'catch_up': run the missed cycles back-to-back (at most max_catch_up_cycles of them) until the schedule is caught up
+	#	'late': run the next cycle immediately, and shift the schedule so that the following cycles are one interval apart from it
+	OVERRUN_POLICIES = ['skip','catch_up','late']
+
+	# interval_seconds: time between the start of two consecutive poll cycles
+	# align_to_wall_clock: if True, cycles start on multiples of interval_seconds of the wall clock (ex: on second boundaries for a 1 second interval), plus phase_seconds
+	# deadlines are absolute times on the monotonic clock, so that the schedule does not drift with the duration of the cycles nor with wall clock adjustments
+	def __init__(self, interval_seconds, overrun_policy='skip', align_to_wall_clock=False, phase_seconds=0, max_catch_up_cycles=10, clock=time.monotonic, wall_clock=time.time):
+		if overrun_policy not in PollScheduler.OVERRUN_POLICIES:
+			print('\t[WARNING] Unsupported poll overrun policy "'+str(overrun_policy)+'", using default "skip"; supported policies are:',PollScheduler.OVERRUN_POLICIES)
+			overrun_policy = 'skip'
+		self.interval_seconds = float(interval_seconds)
+		self.overrun_policy = overrun_policy
+		self.align_to_wall_clock = align_to_wall_clock
+		self.phase_seconds = float(phase_seconds)
+		self.max_catch_up_cycles = max_catch_up_cycles
+		self.clock = clock
+		self.wall_clock = wall_clock
+		self.next_deadline = None
+		self.slot_index = -1	# index of the current slot of the schedule, i.e. number of intervals elapsed since the first cycle, including skipped ones
+		self.cycle_count = 0
+		self.overrun_count = 0
+		self.skipped_cycle_count = 0
+		self.last_lateness_seconds = 0.0
+		self.stop_event = threading.Event()
+
+	# Method to change the interval between two cycles (ex: when the fastest scan class changes on a hot reload), from the next deadline on
+	def set_interval(self, interval_seconds):
+		self.interval_seconds = float(interval_seconds)
+
+	# Method to compute the deadline of the first cycle, aligned on the wall clock if requested
+	def first_deadline(self):
+		now = self.clock()
+		if not self.align_to_wall_clock:
+			return now
+		return now + (self.phase_seconds - self.wall_clock()) % self.interval_seconds
+
+	# Method to compute the deadline of the next cycle, applying the overrun policy if the previous cycle ran past it
+	def advance_deadline(self):
+		self.slot_index += 1
+		if self.next_deadline is None:
+			self.next_deadline = self.first_deadline()
+			return
+		self.next_deadline += self.interval_seconds
+		now = self.clock()
+		if now <= self.next_deadline:
+			return
+		self.overrun_count += 1
+		missed_cycles = int((now - self.next_deadline) // self.interval_seconds)
+		if self.overrun_policy == 'late':
+			self.next_deadline = now
+		elif (self.overrun_policy == 'skip') or (missed_cycles > self.max_catch_up_cycles):
+			self.skipped_cycle_count += missed_cycles + 1
+			self.slot_index += missed_cycles + 1
+			self.next_deadline += (missed_cycles + 1)*self.interval_seconds
+
+	# Method to advance to the next cycle and return the delay in seconds until its deadline (0 or negative if already due), for callers doing their own waiting (ex: asyncio.sleep)
+	def next_cycle_delay(self):
+		self.advance_deadline()
+		timeout = self.next_deadline - self.clock()
+		self.last_lateness_seconds = max(-timeout, 0.0)
+		self.cycle_count += 1
+		return timeout
+
+	# Method to block until the deadline of the next cycle without spinning
+	# it returns True when the next cycle should run, False if the scheduler was stopped while waiting
+	def wait_next_cycle(self):
+		self.advance_deadline()
+		timeout = self.next_deadline - self.clock()
+		self.last_lateness_seconds = max(-timeout, 0.0)
+		if timeout > 0:
+			if self.stop_event.wait(timeout):
+				return False
+		elif self.stop_event.is_set():
+			return False
+		self.cycle_count += 1
+		return True
+
+	# Method to stop the scheduler, waking up wait_next_cycle if it is waiting
+	def stop(self):
+		self.stop_event.set()
+
+	# Method to report the scheduler counters
+	def statistics(self):
+		return {
+			'cycle_count': self.cycle_count,
+			'slot_index': self.slot_index,
+			'overrun_count': self.overrun_count,
+			'skipped_cycle_count': self.skipped_cycle_count,
+			'last_lateness_seconds': self.last_lateness_seconds
+		}
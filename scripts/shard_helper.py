@@ -0,0 +1,224 @@
+import os, time, signal, marshal, threading, subprocess
+from multiprocessing.connection import Connection, wait
+
+# Method to keep the call groups of one shard out of the call groups {fc: [query, ...]} of a template, returns them in the same format
+# the call groups of each scan class (poll_interval) are dealt to the shards in turn, in poll order, so that each shard polls a similar share of every scan class
+def shard_call_groups(call_groups, shard_index, shard_count):
+	positions = {}		# poll_interval -> position of the next call group of the scan class
+	selected_call_groups = {}
+	for fc in call_groups:
+		selected_call_groups[fc] = []
+		for query in call_groups[fc]:
+			position = positions.get(query['poll_interval'], 0)
+			positions[query['poll_interval']] = position + 1
+			if position % shard_count == shard_index:
+				selected_call_groups[fc].append(query)
+	return selected_call_groups
+
+# Method to insert the shard index in a file path, before its extension, ex: "state.gz" -> "state.shard1.gz"
+def shard_path(full_path, shard_index):
+	root, extension = os.path.splitext(full_path)
+	return root+'.shard'+str(shard_index)+extension
+
+class ShardPublisher(object):
+
+	# Publisher of a worker process of a sharded gateway: the messages are batched and sent over a pipe to the MQTT publisher process (see ShardSupervisor), which publishes them
+	# a batch is sent at the end of each publish cycle (flush), even if empty so that a worker notices when the MQTT publisher process is gone, or as soon as max_batch_messages are batched
+	# the batches are serialized with marshal: the messages are only made of str, bytes, int and bool, and both processes run the same Python interpreter
+	def __init__(self, fd, max_batch_messages=1000, on_closed=None):
+		self.connection = Connection(fd, readable=False)
+		self.max_batch_messages = max_batch_messages
+		self.on_closed = on_closed		# called once, outside of the lock, when the pipe is closed by the MQTT publisher process
+		self.lock = threading.Lock()
+		self.batch = []
+		self.closed = False
+		self.published_count = 0
+		self.published_bytes = 0
+		self.batch_count = 0
+
+	# Method to add a message to the batch, returns False if the pipe is closed
+	def publish(self, topic, payload, qos, retain):
+		with self.lock:
+			if self.closed:
+				return False
+			self.batch.append((topic, payload, qos, retain))
+			self.published_count += 1
+			self.published_bytes += len(payload) if payload is not None else 0
+			if len(self.batch) < self.max_batch_messages:
+				return True
+			sent = self.send_batch()
+		if not sent:
+			self.closed_pipe()
+		return sent
+
+	def flush(self):
+		with self.lock:
+			if self.closed:
+				return False
+			sent = self.send_batch()
+		if not sent:
+			self.closed_pipe()
+		return sent
+
+	def send_batch(self):
+		batch = self.batch
+		self.batch = []
+		try:
+			self.connection.send_bytes(marshal.dumps(batch))
+		except OSError:
+			self.closed = True
+			return False
+		self.batch_count += 1
+		return True
+
+	def closed_pipe(self):
+		if self.on_closed is not None:
+			self.on_closed()
+
+	# Method to send the last batch and close the pipe
+	def close(self):
+		self.flush()
+		with self.lock:
+			self.closed = True
+			self.connection.close()
+
+	def statistics(self):
+		with self.lock:
+			return {
+				'published_count': self.published_count,
+				'published_bytes': self.published_bytes,
+				'batch_count': self.batch_count
+			}
+
+class ShardWorker(object):
+
+	# One worker process of a sharded gateway, as seen by its supervisor
+	def __init__(self, shard_index):
+		self.shard_index = shard_index
+		self.process = None
+		self.connection = None		# reading end of the pipe of the worker, None once closed by the worker (i.e. once it exited)
+		self.started_at = None
+		self.restart_at = None		# when to restart the worker after it failed, on the monotonic clock
+		self.consecutive_failure_count = 0
+		self.restart_count = 0
+		self.message_count = 0
+		self.batch_count = 0
+
+	def running(self):
+		return (self.process is not None) and (self.process.poll() is None)
+
+	def statistics(self):
+		return {
+			'shard': self.shard_index,
+			'pid': self.process.pid if self.process is not None else None,
+			'running': self.running(),
+			'restart_count': self.restart_count,
+			'message_count': self.message_count,
+			'batch_count': self.batch_count
+		}
+
+class ShardSupervisor(object):
+
+	# Supervisor of the worker processes of a sharded gateway, run by the MQTT publisher process: each worker polls its shard of the Modbus TCP Server(s) and sends the messages to publish over a pipe (see ShardPublisher)
+	# worker_command(shard_index, shard_count, fd) returns the command line of a worker, writing its batches to the file descriptor fd; the workers are started in their own session, so that only the supervisor gets Ctrl+C and stops them
+	# a worker that exits is restarted after restart_delay_seconds, doubled after each consecutive failure up to max_restart_delay_seconds; a worker that ran for longer than max_restart_delay_seconds is restarted after restart_delay_seconds again
+	# publish(topic, payload, qos, retain) is called for each message received, from the thread running the supervisor
+	def __init__(self, worker_command, shard_count, publish, restart_delay_seconds=1.0, max_restart_delay_seconds=30.0, stop_timeout_seconds=30.0, clock=time.monotonic):
+		self.worker_command = worker_command
+		self.workers = [ShardWorker(shard_index) for shard_index in range(shard_count)]
+		self.publish = publish
+		self.restart_delay_seconds = restart_delay_seconds
+		self.max_restart_delay_seconds = max_restart_delay_seconds
+		self.stop_timeout_seconds = stop_timeout_seconds
+		self.clock = clock
+		self.stop_requested = False		# set by stop(), possibly from a signal handler, acted upon by run()
+		self.stop_deadline = None
+
+	def start_worker(self, worker):
+		read_fd, write_fd = os.pipe()
+		try:
+			worker.process = subprocess.Popen(self.worker_command(worker.shard_index, len(self.workers), write_fd), pass_fds=(write_fd,), start_new_session=True)
+		except OSError as error:
+			os.close(read_fd)
+			print('\t[WARNING] Unable to start the worker process of shard '+str(worker.shard_index)+': '+repr(error))
+			worker.process = None
+			self.schedule_restart(worker)
+			return
+		finally:
+			os.close(write_fd)
+		worker.connection = Connection(read_fd, writable=False)
+		worker.started_at = self.clock()
+		worker.restart_at = None
+		print('\t[INFO] Started the worker process of shard '+str(worker.shard_index)+' of '+str(len(self.workers))+' with pid '+str(worker.process.pid))
+
+	def schedule_restart(self, worker):
+		if (worker.started_at is not None) and (self.clock() - worker.started_at > self.max_restart_delay_seconds):
+			worker.consecutive_failure_count = 0
+		delay = min(self.max_restart_delay_seconds, self.restart_delay_seconds*(2**worker.consecutive_failure_count))
+		worker.consecutive_failure_count += 1
+		worker.restart_at = self.clock() + delay
+		return delay
+
+	# Method to request the workers to stop, safe to call from a signal handler
+	def stop(self):
+		self.stop_requested = True
+
+	# Method to start the workers and publish their messages, restarting the workers that exit, until stop() is called and all the workers exited (or are killed after stop_timeout_seconds)
+	def run(self):
+		for worker in self.workers:
+			self.start_worker(worker)
+		while True:
+			if self.stop_requested and (self.stop_deadline is None):
+				self.stop_workers()
+			connections = {worker.connection: worker for worker in self.workers if worker.connection is not None}
+			if (self.stop_deadline is not None) and (not connections):
+				break
+			for connection in wait(list(connections), 0.5):
+				self.receive(connections[connection])
+			self.check_workers()
+		for worker in self.workers:
+			if worker.process is not None:
+				try:
+					worker.process.wait(max(0.0, self.stop_deadline - self.clock()))
+				except subprocess.TimeoutExpired:
+					worker.process.kill()
+					worker.process.wait()
+
+	def stop_workers(self):
+		self.stop_deadline = self.clock() + self.stop_timeout_seconds
+		for worker in self.workers:
+			if worker.running():
+				worker.process.send_signal(signal.SIGINT)
+
+	def receive(self, worker):
+		try:
+			batch = marshal.loads(worker.connection.recv_bytes())
+		except (EOFError, OSError):
+			worker.connection.close()
+			worker.connection = None
+			return
+		worker.batch_count += 1
+		worker.message_count += len(batch)
+		publish = self.publish
+		for topic, payload, qos, retain in batch:
+			publish(topic, payload, qos, retain)
+
+	# Method to restart the workers that exited once due, a worker being considered exited once its pipe is closed and its process ended; once stopping, to kill the workers still running after stop_timeout_seconds
+	def check_workers(self):
+		for worker in self.workers:
+			if self.stop_deadline is not None:
+				if (worker.connection is not None) and (self.clock() > self.stop_deadline) and worker.running():
+					print('\t[WARNING] The worker process of shard '+str(worker.shard_index)+' did not stop within '+str(self.stop_timeout_seconds)+' seconds, killing it')
+					worker.process.kill()
+				continue
+			if (worker.connection is not None) or worker.running():
+				continue
+			if worker.restart_at is None:
+				delay = self.schedule_restart(worker)
+				print('\t[WARNING] The worker process of shard '+str(worker.shard_index)+' exited with code '+str(worker.process.returncode)+', restarting it in '+str(delay)+' seconds')
+			elif self.clock() >= worker.restart_at:
+				worker.restart_count += 1
+				self.start_worker(worker)
+
+	def statistics(self):
+		return [worker.statistics() for worker in self.workers]
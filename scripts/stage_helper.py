@@ -0,0 +1,103 @@
+import time, threading, collections
+
+class StageLatency(object):
+
+	# Latency statistics (in seconds) of one stage of the gateway pipeline, ex: Modbus acquisition, publish queue wait, MQTT publish
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.count = 0
+		self.last_seconds = 0.0
+		self.total_seconds = 0.0
+		self.max_seconds = 0.0
+
+	def record(self, seconds):
+		with self.lock:
+			self.count += 1
+			self.last_seconds = seconds
+			self.total_seconds += seconds
+			self.max_seconds = max(self.max_seconds, seconds)
+
+	def statistics(self):
+		with self.lock:
+			return {
+				'count': self.count,
+				'last_seconds': self.last_seconds,
+				'mean_seconds': (self.total_seconds/self.count) if self.count else 0.0,
+				'max_seconds': self.max_seconds
+			}
+
+class BoundedCycleQueue(object):
+
+	# what to do when a poll cycle is produced while the queue is full:
+	#	'drop_oldest': drop the oldest queued poll cycle to make room (the consumer always catches up on the most recent data)
+	#	'drop_newest': drop the new poll cycle (the consumer sees every cycle up to the overflow, then resumes)
+	#	'block': wait for the consumer to make room, i.e. a slow consumer slows down the producer
+	OVERFLOW_POLICIES = ['drop_oldest','drop_newest','block']
+
+	# Bounded queue of poll cycles between the producer stage (Modbus acquisition) and the consumer stage (rule evaluation and MQTT publish)
+	# each item is timestamped on the monotonic clock when queued, to measure how long it waited in the queue
+	def __init__(self, max_size=10, overflow_policy='drop_oldest', clock=time.monotonic):
+		if overflow_policy not in BoundedCycleQueue.OVERFLOW_POLICIES:
+			print('\t[WARNING] Unsupported queue overflow policy "'+str(overflow_policy)+'", using default "drop_oldest"; supported policies are:',BoundedCycleQueue.OVERFLOW_POLICIES)
+			overflow_policy = 'drop_oldest'
+		self.max_size = max(1, int(max_size))
+		self.overflow_policy = overflow_policy
+		self.clock = clock
+		self.items = collections.deque()
+		self.condition = threading.Condition()
+		self.closed = False
+		self.queued_count = 0
+		self.dropped_count = 0
+		self.max_depth = 0
+		self.wait_latency = StageLatency()
+
+	# Method to queue an item, returns False if an item (the new or the oldest one) was dropped because the queue was full, or the new one because the queue is closed
+	# with the 'block' policy, a put waiting for room is woken by close(), the new item being dropped then
+	def put(self, item):
+		with self.condition:
+			if self.overflow_policy == 'block':
+				self.condition.wait_for(lambda: (len(self.items) < self.max_size) or self.closed)
+			if self.closed:
+				self.dropped_count += 1
+				return False
+			dropped = False
+			if len(self.items) >= self.max_size:
+				if self.overflow_policy == 'drop_newest':
+					self.dropped_count += 1
+					return False
+				self.items.popleft()
+				self.dropped_count += 1
+				dropped = True
+			self.items.append((self.clock(), item))
+			self.queued_count += 1
+			self.max_depth = max(self.max_depth, len(self.items))
+			self.condition.notify_all()
+			return not dropped
+
+	# Method to wait for the next item, returns None once the queue is closed and empty
+	def get(self):
+		with self.condition:
+			self.condition.wait_for(lambda: self.items or self.closed)
+			if not self.items:
+				return None
+			queued_at, item = self.items.popleft()
+			self.condition.notify_all()
+		self.wait_latency.record(self.clock() - queued_at)
+		return item
+
+	# Method to close the queue: the consumer still gets the items already queued, then None; the items put from then on are dropped
+	def close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+
+	def statistics(self):
+		with self.condition:
+			statistics = {
+				'depth': len(self.items),
+				'max_depth': self.max_depth,
+				'queued_count': self.queued_count,
+				'dropped_count': self.dropped_count
+			}
+		statistics['wait'] = self.wait_latency.statistics()
+		return statistics
@@ -0,0 +1,62 @@
+import os, time, json, gzip
+
+class PublishedStateSnapshot(object):
+
+	FORMAT_VERSION = 1
+
+	# Snapshot file of the last published state of the tags (see mqqt_last_published_values of the gateway), so that after a restart the publish rules apply from the first poll cycle, instead of all the tags being published again
+	# one record per tag: [tag key, topic, mqtt_payload, last published value, wall clock time of the publish in ns, limit_flag], written atomically as gzip-compressed JSON
+	# the monotonic time of the publishes does not survive a restart, it is rebuilt from their wall clock time when the snapshot is loaded
+	def __init__(self, full_path_to_snapshot, wall_clock_ns=time.time_ns, monotonic_clock_ns=time.monotonic_ns):
+		self.full_path_to_snapshot = full_path_to_snapshot
+		self.wall_clock_ns = wall_clock_ns
+		self.monotonic_clock_ns = monotonic_clock_ns
+		self.saved_count = 0
+		self.restored_count = 0
+
+	# Method to save the last published state of the tags that have a tag rule, returns the number of tags saved
+	def save(self, last_published_values, tag_rules, mqtt_client_id):
+		records = []
+		for tag_key in last_published_values:
+			tag_rule = tag_rules.get(tag_key)
+			if tag_rule is None:
+				continue
+			last_published = last_published_values[tag_key]
+			records.append([tag_key, tag_rule.topic, tag_rule.payload, last_published['last_published_value'], last_published['timestamp_ns'], last_published['limit_flag']])
+		snapshot = {'version': PublishedStateSnapshot.FORMAT_VERSION, 'mqtt_client_id': mqtt_client_id, 'saved_at_ns': self.wall_clock_ns(), 'tags': records}
+		temporary_path = self.full_path_to_snapshot+'.'+str(os.getpid())+'.tmp'
+		with gzip.open(temporary_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+			json.dump(snapshot, f, separators=(',',':'))
+		os.replace(temporary_path, self.full_path_to_snapshot)
+		self.saved_count = len(records)
+		return self.saved_count
+
+	# Method to load the last published state of the tags, returns it in the format of mqqt_last_published_values (empty if there is no snapshot)
+	# only the tags of tag_rules still published on the same topic with the same mqtt_payload are restored, the others are published on their first poll
+	def load(self, tag_rules, mqtt_client_id):
+		try:
+			with gzip.open(self.full_path_to_snapshot, 'rt', encoding='utf-8') as f:
+				snapshot = json.load(f)
+		except FileNotFoundError:
+			return {}
+		except (OSError, EOFError, ValueError) as error:
+			print('\t[WARNING] Unable to read the last published state "'+str(self.full_path_to_snapshot)+'" ('+repr(error)+'), all the tags will be published')
+			return {}
+		if (snapshot.get('version') != PublishedStateSnapshot.FORMAT_VERSION) or (snapshot.get('mqtt_client_id') != mqtt_client_id):
+			print('\t[WARNING] The last published state "'+str(self.full_path_to_snapshot)+'" is of another version or mqtt_client_id, all the tags will be published')
+			return {}
+		wall_clock_ns = self.wall_clock_ns()
+		monotonic_ns = self.monotonic_clock_ns()
+		last_published_values = {}
+		for tag_key, topic, payload, last_published_value, timestamp_ns, limit_flag in snapshot['tags']:
+			tag_rule = tag_rules.get(tag_key)
+			if (tag_rule is None) or (tag_rule.topic != topic) or (tag_rule.payload != payload):
+				continue
+			last_published_values[tag_key] = {
+				'timestamp_ns': timestamp_ns,
+				'monotonic_ns': monotonic_ns - max(0, wall_clock_ns - timestamp_ns),
+				'last_published_value': last_published_value,
+				'limit_flag': limit_flag
+			}
+		self.restored_count = len(last_published_values)
+		return last_published_values
@@ -0,0 +1,88 @@
+import time, threading, sqlite3
+
+class StoreAndForwardBuffer(object):
+
+	# Disk-backed buffer of the MQTT messages that could not be published (ex: MQTT Broker unreachable), to be replayed once reconnected
+	# messages are stored in a SQLite database in WAL mode, so they survive a restart of the gateway
+	# max_messages: the oldest messages are dropped beyond this number of stored messages
+	# max_age_seconds: messages older than this are dropped, they are considered too old to be worth replaying
+	def __init__(self, full_path_to_db, max_messages=1000000, max_age_seconds=604800, clock=time.time):
+		self.full_path_to_db = full_path_to_db
+		self.max_messages = max(1, int(max_messages))
+		self.max_age_seconds = max_age_seconds
+		self.clock = clock
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(full_path_to_db, check_same_thread=False, isolation_level=None)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		# with WAL, NORMAL only syncs on checkpoints: a power loss may lose the last messages, but never corrupts the buffer
+		self.db.execute('PRAGMA synchronous=NORMAL')
+		self.db.execute('CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, stored_at REAL, topic TEXT, payload BLOB, qos INTEGER, retain INTEGER)')
+		self.count = self.db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+		self.stored_count = 0
+		self.replayed_count = 0
+		self.dropped_count = 0
+
+	# Method to store messages [(topic, payload, qos, retain), ...] in a single transaction, dropping the oldest ones beyond max_messages
+	def append_many(self, messages):
+		stored_at = self.clock()
+		with self.lock:
+			self.db.execute('BEGIN')
+			self.db.executemany('INSERT INTO messages (stored_at, topic, payload, qos, retain) VALUES (?, ?, ?, ?, ?)', [(stored_at, topic, payload, qos, int(bool(retain))) for topic, payload, qos, retain in messages])
+			self.count += len(messages)
+			self.stored_count += len(messages)
+			if self.count > self.max_messages:
+				self.drop_oldest(self.count - self.max_messages)
+			self.db.execute('COMMIT')
+
+	def append(self, topic, payload, qos, retain):
+		self.append_many([(topic, payload, qos, retain)])
+
+	# Method to drop the oldest count messages, the lock must be held
+	def drop_oldest(self, count):
+		deleted = self.db.execute('DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)', (count,)).rowcount
+		self.count -= deleted
+		self.dropped_count += deleted
+
+	# Method to drop the messages older than max_age_seconds, returns the number of messages dropped
+	def expire(self):
+		with self.lock:
+			deleted = self.db.execute('DELETE FROM messages WHERE stored_at < ?', (self.clock() - self.max_age_seconds,)).rowcount
+			self.count -= deleted
+			self.dropped_count += deleted
+			return deleted
+
+	# Method to read (without removing them) the batch_size oldest messages, as [(id, topic, payload, qos, retain), ...]
+	def peek_batch(self, batch_size):
+		with self.lock:
+			return [(row[0], row[1], row[2], row[3], bool(row[4])) for row in self.db.execute('SELECT id, topic, payload, qos, retain FROM messages ORDER BY id LIMIT ?', (batch_size,))]
+
+	# Method to remove the messages replayed successfully, given their ids
+	def remove(self, ids):
+		if not ids:
+			return
+		with self.lock:
+			self.db.execute('BEGIN')
+			deleted = 0
+			for i in range(0, len(ids), 500):
+				chunk = ids[i:i+500]
+				deleted += self.db.execute('DELETE FROM messages WHERE id IN ('+','.join('?'*len(chunk))+')', chunk).rowcount
+			self.db.execute('COMMIT')
+			self.count -= deleted
+			self.replayed_count += deleted
+
+	def is_empty(self):
+		with self.lock:
+			return self.count == 0
+
+	def close(self):
+		with self.lock:
+			self.db.close()
+
+	def statistics(self):
+		with self.lock:
+			return {
+				'stored_messages': self.count,
+				'stored_count': self.stored_count,
+				'replayed_count': self.replayed_count,
+				'dropped_count': self.dropped_count
+			}
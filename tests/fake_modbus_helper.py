@@ -0,0 +1,131 @@
+import random, select, socket, struct, threading, time
+
+# Deterministic register and bit values of the fake Modbus TCP Server, per function code and address
+def register_value(fc, address):
+	return (address*7919 + fc) % 65536
+
+def bit_value(fc, address):
+	return int((address*31 + fc) % 3 == 0)
+
+# Method to read the values of quantity registers or bits from start_address, as the fake Modbus TCP Server answers them
+def expected_values(fc, start_address, quantity):
+	if fc in (1, 2):
+		return [bit_value(fc, start_address + i) for i in range(quantity)]
+	return [register_value(fc, start_address + i) for i in range(quantity)]
+
+# Method to pack bits into bytes, least significant bit first, as in FC01/FC02 responses
+def pack_bits(bits):
+	packed = bytearray((len(bits) + 7)//8)
+	for i, bit in enumerate(bits):
+		packed[i//8] |= bit << (i % 8)
+	return bytes(packed)
+
+# Method to build the response ADU of a read request ADU (FC01 to FC04), or its exception response ADU if exception_code is set
+def build_response_adu(request_adu, exception_code=None, transaction_id_offset=0):
+	transaction_id, protocol_id, length, unit_id, fc, start_address, quantity = struct.unpack('>HHHBBHH', request_adu)
+	if exception_code is not None:
+		pdu = struct.pack('>BB', fc | 0x80, exception_code)
+	elif fc in (1, 2):
+		data = pack_bits(expected_values(fc, start_address, quantity))
+		pdu = struct.pack('>BB', fc, len(data)) + data
+	else:
+		pdu = struct.pack('>BB', fc, 2*quantity) + struct.pack('>'+str(quantity)+'H', *expected_values(fc, start_address, quantity))
+	return struct.pack('>HHHB', (transaction_id + transaction_id_offset) % 65536, protocol_id, len(pdu) + 1, unit_id) + pdu
+
+# Method to read one request ADU from a socket, returns None once the connection is closed
+def read_request_adu(sock):
+	data = b''
+	while len(data) < 12:
+		chunk = sock.recv(12 - len(data))
+		if not chunk:
+			return None
+		data += chunk
+	return data
+
+class FakeModbusServer(threading.Thread):
+
+	# Fake Modbus TCP Server answering the read requests received on sock (ex: one end of a socket.socketpair), from a thread
+	# the requests received back-to-back are answered in a random order (rng), once window of them are pending or no other request comes within idle_seconds
+	# exception_codes maps a start address to the exception code to answer its requests with; transaction_id_offset shifts the transaction ID of the responses; with close_after, the connection is closed after that many requests
+	def __init__(self, sock, window=1, rng=None, exception_codes=None, transaction_id_offset=0, close_after=None, idle_seconds=0.02):
+		threading.Thread.__init__(self, daemon=True)
+		self.sock = sock
+		self.window = window
+		self.rng = rng
+		self.exception_codes = exception_codes or {}
+		self.transaction_id_offset = transaction_id_offset
+		self.close_after = close_after
+		self.idle_seconds = idle_seconds
+		self.request_count = 0
+		self.max_pending = 0		# most requests received and not answered yet at once, i.e. the outstanding window used by the client
+		self.start()
+
+	def run(self):
+		pending = []
+		try:
+			while True:
+				request_adu = read_request_adu(self.sock)
+				if request_adu is None:
+					return
+				self.request_count += 1
+				if (self.close_after is not None) and (self.request_count >= self.close_after):
+					return
+				pending.append(request_adu)
+				self.max_pending = max(self.max_pending, len(pending))
+				while pending and ((len(pending) >= self.window) or (not select.select([self.sock], [], [], self.idle_seconds)[0])):
+					request_adu = pending.pop(self.rng.randrange(len(pending)) if self.rng is not None else 0)
+					start_address = struct.unpack('>H', request_adu[8:10])[0]
+					self.sock.sendall(build_response_adu(request_adu, self.exception_codes.get(start_address), self.transaction_id_offset))
+		except OSError:
+			return
+		finally:
+			self.sock.close()
+
+# Method to open a socketpair served by a FakeModbusServer, returns (client socket, server)
+def fake_connection(timeout_seconds=2, **server_options):
+	client_sock, server_sock = socket.socketpair()
+	client_sock.settimeout(timeout_seconds)
+	return client_sock, FakeModbusServer(server_sock, **server_options)
+
+class FakeModbusListener(threading.Thread):
+
+	# Fake Modbus TCP Server listening on 127.0.0.1 (on port, a free one by default), for the clients opening their own connections (ex: the connection pools)
+	# each connection accepted is served by a FakeModbusServer, built with the next of server_options_list, then with server_options once the list is exhausted
+	def __init__(self, server_options_list=None, port=0, **server_options):
+		threading.Thread.__init__(self, daemon=True)
+		self.server_options_list = list(server_options_list or [])
+		self.server_options = server_options
+		self.servers = []
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind(('127.0.0.1', port))
+		self.sock.listen(16)
+		self.port = self.sock.getsockname()[1]
+		self.start()
+
+	def run(self):
+		try:
+			while True:
+				sock, address = self.sock.accept()
+				server_options = self.server_options_list[len(self.servers)] if len(self.servers) < len(self.server_options_list) else self.server_options
+				self.servers.append(FakeModbusServer(sock, **server_options))
+		except OSError:
+			return
+
+	# Method to wait for count connections to be accepted, returns False on timeout
+	def wait_accepted(self, count, timeout_seconds=2):
+		deadline = time.monotonic() + timeout_seconds
+		while len(self.servers) < count:
+			if time.monotonic() > deadline:
+				return False
+			time.sleep(0.001)
+		return True
+
+	# Method to stop listening, the new connections are then refused; the connections accepted so far keep being served
+	def close(self):
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+		self.sock.close()
+		self.join()
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+# Tests of the "batch" mqtt_payload (ModbusTCPMqttDataGateway.mqtt_batch_tag and mqtt_publish_batches): one JSON document per batch topic per publish cycle with the tags whose rules fired, the highest QoS and the retain flag of its tags,
+# and documents larger than mqtt_batch_max_bytes split into numbered chunks, each within mqtt_batch_max_bytes, that together hold every value in poll order
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, math, json, random, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'benchmark'))
+from scripts import modqtt_helper
+from bench_payload import CountingMqttClient, build_gateway
+
+TIMESTAMP_NS = 1672531200000000000
+
+class RecordingMqttClient(CountingMqttClient):
+
+	def __init__(self):
+		CountingMqttClient.__init__(self)
+		self.messages = []
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		self.messages.append((topic, payload, qos, retain))
+		return CountingMqttClient.publish(self, topic, payload, qos, retain)
+
+def tag_helper(mqtt_topic, mqtt_qos=0, mqtt_retain=False):
+	return {'data_type': 'float32', 'mqtt_topic': mqtt_topic, 'mqtt_qos': mqtt_qos, 'mqtt_retain': mqtt_retain, 'mqtt_payload': 'batch', 'mqtt_publish': 'rbe', 'mqtt_deadband': 0.0,
+			'mqtt_alarm_low': None, 'mqtt_alarm_high': None, 'mqtt_ignore_low': None, 'mqtt_ignore_high': None}
+
+# Method to build a gateway publishing the batches of mqtt_helper to a RecordingMqttClient
+def batch_gateway(mqtt_helper, max_bytes=None):
+	with contextlib.redirect_stdout(io.StringIO()):
+		gateway = build_gateway(mqtt_helper)
+	if max_bytes is not None:
+		gateway.modqtt_config['mqtt_batch_max_bytes'] = max_bytes
+	gateway.mqttc = RecordingMqttClient()
+	return gateway
+
+# Method to publish a poll cycle, returns the messages published as [(topic, document, qos, retain), ...]
+def publish_cycle(gateway, previous_values, current_values):
+	gateway.mqttc.messages = []
+	gateway.mqtt_publish_data(previous_values, current_values)
+	return [(topic, json.loads(payload), qos, retain) for topic, payload, qos, retain in gateway.mqttc.messages]
+
+def cycle_values(values, cycle):
+	return dict(values, timestamp_ns=TIMESTAMP_NS + cycle*1000000000, timestamp_monotonic_ns=cycle*1000000000)
+
+def same_values(a, b):
+	return json.dumps(a) == json.dumps(b)
+
+class TestBatchPayload(unittest.TestCase):
+
+	def test_one_document_per_topic(self):
+		mqtt_helper = {}
+		for line in range(3):
+			for i in range(10):
+				mqtt_helper['line'+str(line)+'_tag'+str(i)] = tag_helper('line'+str(line)+'/tag'+str(i), mqtt_qos=(2 if (line, i) == (1, 4) else i % 2), mqtt_retain=((line, i) == (2, 7)))
+		gateway = batch_gateway(mqtt_helper)
+		rng = random.Random(0)
+		values = {tag_key: float(rng.randint(0, 3)) for tag_key in mqtt_helper}
+		# the first poll cycle publishes all the tags, one document per topic
+		messages = publish_cycle(gateway, None, cycle_values(values, 0))
+		self.assertEqual([topic for topic, document, qos, retain in messages], ['benchmark/line0', 'benchmark/line1', 'benchmark/line2'])
+		for line, (topic, document, qos, retain) in enumerate(messages):
+			self.assertEqual(document['values'], {'tag'+str(i): values['line'+str(line)+'_tag'+str(i)] for i in range(10)})
+			self.assertEqual(list(document['values']), ['tag'+str(i) for i in range(10)])
+			self.assertEqual(sorted(document), ['timestamp_local', 'timestamp_utc', 'values'])
+			self.assertEqual(document['timestamp_utc'], '2023-01-01 00:00:00+0000')
+			# the highest QoS and the retain flag of the tags of the document
+			self.assertEqual((qos, retain), [(1, False), (2, False), (1, True)][line])
+		self.assertEqual(gateway.mqtt_batches, {})
+		# then only the tags whose rules fired, in a single document per topic
+		previous_values = cycle_values(values, 0)
+		for cycle in range(1, 30):
+			changed_tag_keys = rng.sample(list(mqtt_helper), rng.randint(0, 12))
+			values = dict(values)
+			for tag_key in changed_tag_keys:
+				values[tag_key] = rng.choice([values[tag_key] + 1.0, math.nan, math.inf])
+			messages = publish_cycle(gateway, previous_values, cycle_values(values, cycle))
+			previous_values = cycle_values(values, cycle)
+			with self.subTest(cycle=cycle):
+				topics = [topic for topic, document, qos, retain in messages]
+				self.assertEqual(len(topics), len(set(topics)))
+				published = {}
+				for topic, document, qos, retain in messages:
+					for batch_key in document['values']:
+						published[topic.split('/')[1]+'_'+batch_key] = document['values'][batch_key]
+				fired_tag_keys = [tag_key for tag_key in mqtt_helper if tag_key in gateway.mqqt_last_published_values and gateway.mqqt_last_published_values[tag_key]['timestamp_ns'] == TIMESTAMP_NS + cycle*1000000000]
+				self.assertEqual(sorted(published), sorted(fired_tag_keys))
+				self.assertTrue(same_values(published, {tag_key: values[tag_key] for tag_key in published}))
+
+	def test_chunks(self):
+		for seed in range(50):
+			rng = random.Random(seed)
+			tag_count = rng.randint(1, 1500)
+			mqtt_helper = {'tag'+str(i): tag_helper('line/tag'+str(i)) for i in range(tag_count)}
+			max_bytes = rng.choice([100, 150, 200, 500, 1000, 65536])
+			gateway = batch_gateway(mqtt_helper, max_bytes)
+			values = {tag_key: rng.choice([0.0, math.nan, rng.uniform(-1e9, 1e9), float(rng.randint(0, 65535))]) for tag_key in mqtt_helper}
+			with self.subTest(seed=seed, tag_count=tag_count, max_bytes=max_bytes):
+				messages = publish_cycle(gateway, None, cycle_values(values, 0))
+				self.assertEqual(set(topic for topic, document, qos, retain in messages), {'benchmark/line'})
+				documents = [document for topic, document, qos, retain in messages]
+				# each chunk is within mqtt_batch_max_bytes (unless it holds a single value larger than that), and they hold every value once, in poll order
+				for (topic, payload, qos, retain), document in zip(gateway.mqttc.messages, documents):
+					if len(document['values']) > 1:
+						self.assertLessEqual(len(payload), max_bytes)
+				merged = {}
+				for document in documents:
+					merged.update(document['values'])
+				self.assertEqual(list(merged), ['tag'+str(i) for i in range(tag_count)])
+				self.assertEqual(sum(len(document['values']) for document in documents), tag_count)
+				self.assertTrue(same_values(merged, {tag_key: values[tag_key] for tag_key in merged}))
+				if len(documents) == 1:
+					self.assertNotIn('chunk', documents[0])
+				else:
+					self.assertEqual([(document['chunk'], document['chunks']) for document in documents], [(i, len(documents)) for i in range(len(documents))])
+					# a chunk is only started when the next value does not fit in the previous one, the header being counted with the number of values as its chunk numbers and each value with one byte of margin
+					header_bytes = len(json.dumps(dict(documents[0], values={}, chunk=tag_count, chunks=tag_count)))
+					for document, next_document in zip(documents, documents[1:]):
+						batch_key = list(next_document['values'])[0]
+						extended_values = dict(document['values'], **{batch_key: next_document['values'][batch_key]})
+						self.assertGreater(header_bytes + sum(len(json.dumps({key: extended_values[key]})) + 1 for key in extended_values), max_bytes)
+					self.assertEqual(len(set(document['timestamp_utc'] for document in documents)), 1)
+
+	def test_value_larger_than_max_bytes(self):
+		gateway = batch_gateway({'a_long_tag_name_'+str(i): tag_helper('line/a_long_tag_name_'+str(i)) for i in range(3)}, max_bytes=10)
+		messages = publish_cycle(gateway, None, cycle_values({'a_long_tag_name_'+str(i): float(i) for i in range(3)}, 0))
+		# each value gets its own chunk, even if it does not fit
+		self.assertEqual([list(document['values']) for topic, document, qos, retain in messages], [['a_long_tag_name_0'], ['a_long_tag_name_1'], ['a_long_tag_name_2']])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+
+# Tests of the "binary" mqtt_payload (BinaryPayload): encode/decode round trip of each value type (NaN, infinities and the integer limits included), decoding with the published schema only,
+# value types of the packedbool bits and uint16 values and of the scaled tags of a template, as published by the gateway, and unknown value type codes
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, csv, math, json, random, struct, tempfile, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'benchmark'))
+from scripts import modqtt_helper
+from payload_helper import BinaryPayload
+from bench_decode import write_synthetic_template, random_responses, load_client
+from bench_payload import CountingMqttClient, build_gateway
+
+# Method to draw a random value of a value type, often one of its limits or special values
+def random_value(value_type, rng):
+	if value_type == 'bool':
+		return rng.choice([False, True])
+	if value_type == 'uint16':
+		return rng.choice([0, 1, 32767, 32768, 65535, rng.randint(0, 65535)])
+	if value_type == 'sint16':
+		return rng.choice([-32768, -1, 0, 1, 32767, rng.randint(-32768, 32767)])
+	value = rng.choice([0.0, -0.0, math.nan, math.inf, -math.inf, 1e-310, 1.5, rng.uniform(-1e6, 1e6), rng.uniform(-1, 1)*10**rng.randint(-300, 300)])
+	if value_type == 'float32':
+		# the values decoded from float32 registers are representable as float32
+		value = struct.unpack('>f', struct.pack('>f', value if abs(value) < 3e38 or math.isinf(value) or math.isnan(value) else 1e38))[0]
+	return value
+
+def same_value(a, b):
+	if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+		return True
+	return (a == b) and (math.copysign(1, a) == math.copysign(1, b) if isinstance(a, float) and isinstance(b, float) else True)
+
+# Method to decode a payload as a consumer would, only with the published schema
+def decode_with_schema(schema, payload):
+	fields = dict((field['name'], field) for field in schema['fields'])
+	version = struct.unpack_from('>B', payload, fields['version']['offset'])[0]
+	value_type = schema['value_types'][str(struct.unpack_from('>B', payload, fields['value_type']['offset'])[0])]
+	epoch_ms = struct.unpack_from('>q', payload, fields['timestamp_epoch_ms']['offset'])[0]
+	if len(payload) != fields['value']['offset'] + value_type['size']:
+		raise ValueError('unexpected payload size')
+	return version, epoch_ms, value_type['name'], struct.unpack_from(value_type['struct_format'], payload, fields['value']['offset'])[0]
+
+class RecordingMqttClient(CountingMqttClient):
+
+	def __init__(self):
+		CountingMqttClient.__init__(self)
+		self.messages = []
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		self.messages.append((topic, payload))
+		return CountingMqttClient.publish(self, topic, payload, qos, retain)
+
+class TestBinaryPayload(unittest.TestCase):
+
+	def test_round_trip(self):
+		schema = json.loads(json.dumps(BinaryPayload.schema()))
+		rng = random.Random(0)
+		for value_type in BinaryPayload.VALUE_TYPES:
+			for i in range(200):
+				value = random_value(value_type, rng)
+				epoch_ms = rng.choice([0, -1, 1672531200123, rng.randint(-2**63, 2**63 - 1)])
+				with self.subTest(value_type=value_type, value=value, epoch_ms=epoch_ms):
+					payload = BinaryPayload.encode(value_type, epoch_ms, value)
+					self.assertEqual(payload[0], BinaryPayload.VERSION)
+					self.assertEqual(payload[1], BinaryPayload.VALUE_TYPES[value_type][0])
+					self.assertEqual(len(payload), 10 + struct.calcsize('>'+BinaryPayload.VALUE_TYPES[value_type][1]))
+					decoded_epoch_ms, decoded_value_type, decoded_value = BinaryPayload.decode(payload)
+					self.assertEqual((decoded_epoch_ms, decoded_value_type), (epoch_ms, value_type))
+					self.assertTrue(same_value(decoded_value, value))
+					self.assertEqual(type(decoded_value), type(value))
+					# the schema alone decodes the payload
+					version, schema_epoch_ms, schema_value_type, schema_value = decode_with_schema(schema, payload)
+					self.assertEqual((version, schema_epoch_ms, schema_value_type), (BinaryPayload.VERSION, epoch_ms, value_type))
+					self.assertTrue(same_value(schema_value, value))
+
+	def test_schema(self):
+		schema = BinaryPayload.schema()
+		self.assertEqual(json.loads(json.dumps(schema)), schema)
+		self.assertEqual(sorted(int(type_code) for type_code in schema['value_types']), sorted(type_code for type_code, struct_format in BinaryPayload.VALUE_TYPES.values()))
+		self.assertEqual(sorted(value_type['name'] for value_type in schema['value_types'].values()), sorted(BinaryPayload.VALUE_TYPES))
+
+	def test_unknown_type_code(self):
+		payload = bytearray(BinaryPayload.encode('uint16', 0, 1))
+		for type_code in [5, 99, 255]:
+			payload[1] = type_code
+			with self.assertRaises(ValueError):
+				BinaryPayload.decode(bytes(payload))
+		with self.assertRaises(KeyError):
+			BinaryPayload.encode('int32', 0, 1)
+
+	def test_value_types(self):
+		self.assertEqual(BinaryPayload.value_type('coil'), 'bool')
+		self.assertEqual(BinaryPayload.value_type('rsint16'), 'sint16')
+		self.assertEqual(BinaryPayload.value_type('rfloat32_byte_word_swap'), 'float32')
+		self.assertEqual(BinaryPayload.value_type('packedbool'), 'float64')
+		for data_type in ['uint16', 'sint16', 'float32', 'packedbool']:
+			self.assertEqual(BinaryPayload.value_type(data_type, scaled=True), 'float64')
+
+	# Method to get the value type expected for each tag of a synthetic template: the packedbool bits are bool, their uint16 value is uint16, the scaled tags are float64
+	def expected_value_types(self, full_path_to_csv, tag_keys):
+		with open(full_path_to_csv, newline='') as f:
+			rows = dict((row['tag_name'], row) for row in csv.DictReader(f))
+		expected = {}
+		for tag_key in tag_keys:
+			if tag_key.rsplit('_', 1)[-1].startswith('bit'):
+				expected[tag_key] = 'bool'
+			elif tag_key.endswith('_uint16_value'):
+				expected[tag_key] = 'uint16'
+			else:
+				row = rows[tag_key]
+				expected[tag_key] = BinaryPayload.value_type(row['data_type'], bool(row['scaling_coeff'] or row['scaling_offset']))
+		return expected
+
+	def test_published_tags(self):
+		for seed in range(10):
+			rng = random.Random(seed)
+			with tempfile.TemporaryDirectory() as tmp_dir:
+				full_path_to_csv = os.path.join(tmp_dir, 'synthetic.csv')
+				write_synthetic_template(full_path_to_csv, rng.randint(20, 200), seed=seed, mqtt_payload='binary')
+				with contextlib.redirect_stdout(io.StringIO()):
+					modbus_tcp_client = load_client(full_path_to_csv, 'struct')
+				expected_value_types = self.expected_value_types(full_path_to_csv, modbus_tcp_client.mqtt_helper)
+			self.assertIn('packedbool', [modbus_tcp_client.mqtt_helper[tag_key].get('data_type') for tag_key in modbus_tcp_client.mqtt_helper])
+			all_interpreted_responses = [{'timestamp_ns': 1672531200123456789, 'timestamp_monotonic_ns': 0}]
+			for fc, start_address, response in random_responses(modbus_tcp_client, rng):
+				all_interpreted_responses.append(modbus_tcp_client.interpret_response(response, fc, start_address))
+			current_values = modbus_tcp_client.combine_tag_responses(all_interpreted_responses)
+			gateway = build_gateway(modbus_tcp_client.mqtt_helper)
+			gateway.mqttc = RecordingMqttClient()
+			# each tag published is one message, some tags sharing their topic (ex: a packedbool and its uint16 value)
+			published_tag_keys = []
+			parse_publish_tag = gateway.mqtt_parse_publish_tag
+			def record_parse_publish_tag(tag_rule, tag_current_value, timestamp_ns, monotonic_ns, limit_flag=False):
+				published_tag_keys.append(tag_rule.tag_key)
+				parse_publish_tag(tag_rule, tag_current_value, timestamp_ns, monotonic_ns, limit_flag)
+			gateway.mqtt_parse_publish_tag = record_parse_publish_tag
+			gateway.mqtt_publish_data(None, current_values)
+			# the packedbool tags are published as their uint16 value and bits
+			self.assertEqual(sorted(published_tag_keys), sorted(tag_key for tag_key in expected_value_types if tag_key in current_values))
+			self.assertEqual(len(gateway.mqttc.messages), len(published_tag_keys))
+			for tag_key, (topic, payload) in zip(published_tag_keys, gateway.mqttc.messages):
+				self.assertEqual(topic, gateway.tag_rules[tag_key].topic)
+				with self.subTest(seed=seed, tag_key=tag_key):
+					epoch_ms, value_type, value = BinaryPayload.decode(payload)
+					self.assertEqual(epoch_ms, 1672531200123)
+					self.assertEqual(value_type, expected_value_types[tag_key])
+					self.assertTrue(same_value(value, current_values[tag_key] if value_type != 'bool' else bool(current_values[tag_key])))
+
+if __name__ == '__main__':
+	unittest.main()
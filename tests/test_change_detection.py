@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+
+# Property-based tests of modbus_change_detection (CallGroupChangeDetector, PublishChangeFilter, ModbusHelper.decode_changed_response): the same random poll cycles, where only some call groups change from one cycle to the next,
+# are decoded and published by a gateway with change detection and by a gateway without it, which must make exactly the same publish decisions (same tags, values and limit flags, in the same order) on every poll cycle,
+# on synthetic templates with interval tags, deadbands, alarm and ignore limits, including after poll cycles dropped by the publish queue and after a hot reload of the tag rules
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, random, tempfile, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'benchmark'))
+from scripts import modqtt_helper
+from rule_helper import recompile_tag_rules
+from change_helper import PublishChangeFilter
+from pipeline_helper import PackedBits, unpack_bits
+from fake_modbus_helper import pack_bits
+from bench_decode import write_synthetic_template
+from bench_payload import build_gateway
+
+SEEDS = range(12)
+CYCLES = 40
+
+# register values that decode to NaN, infinities or values at the alarm and ignore limits of the synthetic templates for some data_types
+SPECIAL_REGISTERS = [0, 1, 100, 1000, 1001, 60000, 65000, 65535, 0x7FC0, 0x7F80, 0x8000]
+
+def load_client(full_path_to_csv, decode_engine, change_detection):
+	with contextlib.redirect_stdout(io.StringIO()):
+		modbus_tcp_client = modqtt_helper.ModbusTCPClient(server_ip='127.0.0.1', decode_engine=decode_engine, change_detection=change_detection)
+		modbus_tcp_client.load_template(full_path_to_csv)
+	return modbus_tcp_client
+
+# Method to change some of the call groups of the raw responses {(fc, start address, register count): response}, the others being left unchanged
+def mutate_responses(responses, rng, change_probability=0.3):
+	for group_key in responses:
+		if rng.random() >= change_probability:
+			continue
+		fc, start_address, register_count = group_key
+		response = list(responses[group_key])
+		for i in rng.sample(range(register_count), min(register_count, rng.randint(1, 3))):
+			if fc in ['01', '02']:
+				response[i] = 1 - response[i]
+			else:
+				response[i] = rng.choice(SPECIAL_REGISTERS) if rng.random() < 0.5 else rng.randint(0, 65535)
+		responses[group_key] = response
+
+# Method to decode a poll cycle of all the call groups of a client, as ModbusTCPClient.cycle_poll does
+def poll_cycle(modbus_tcp_client, responses, timestamp):
+	scan_buckets = modbus_tcp_client.due_scan_buckets()
+	all_interpreted_responses = [dict(timestamp)]
+	modbus_tcp_client.interpret_scan_buckets(scan_buckets, [responses[(fc, query['start_address'], query['register_count'])] for scan_bucket in scan_buckets for fc, query in scan_bucket['queries']], all_interpreted_responses)
+	return modbus_tcp_client.combine_tag_responses(all_interpreted_responses)
+
+# Method to build a gateway recording its publish decisions: (tag key, repr of the value, limit flag) of each tag published
+def recording_gateway(mqtt_helper, rule_engine):
+	with contextlib.redirect_stdout(io.StringIO()):
+		gateway = build_gateway(mqtt_helper, rule_engine)
+	gateway.change_filters = {}
+	gateway.decisions = []
+	parse_publish_tag = gateway.mqtt_parse_publish_tag
+	def record_parse_publish_tag(tag_rule, tag_current_value, timestamp_ns, monotonic_ns, limit_flag=False):
+		gateway.decisions.append((tag_rule.tag_key, repr(tag_current_value), limit_flag))
+		parse_publish_tag(tag_rule, tag_current_value, timestamp_ns, monotonic_ns, limit_flag)
+	gateway.mqtt_parse_publish_tag = record_parse_publish_tag
+	return gateway
+
+# Method to change the publish rules of some of the tags (deadband, interval, alarm limits), as a hot reload of the template would, and put them in place as the publisher thread does
+def reload_tag_rules(gateway, mqtt_helper, rng):
+	reloaded_mqtt_helper = dict(mqtt_helper)
+	for tag_key in rng.sample(list(mqtt_helper), max(1, len(mqtt_helper)//4)):
+		tag_helper = dict(mqtt_helper[tag_key])
+		tag_helper['mqtt_deadband'] = rng.choice([0.0, 1.0, 100.0, -1.0])
+		tag_helper['mqtt_publish'] = rng.choice(['rbe', 'rbe', 2.0, 10.0])
+		if tag_helper.get('data_type') not in ['coil', 'di', 'packedbool']:
+			tag_helper['mqtt_alarm_low'] = rng.choice([None, 1000.0])
+			tag_helper['mqtt_alarm_high'] = rng.choice([None, 60000.0])
+		reloaded_mqtt_helper[tag_key] = tag_helper
+	tag_rules, reset_tag_keys = recompile_tag_rules(gateway.tag_rules, gateway.mqtt_helper, reloaded_mqtt_helper, gateway.modqtt_config['mqtt_client_id'])
+	gateway.pending_reload = {
+		'config': gateway.modqtt_config,
+		'mqtt_helper': reloaded_mqtt_helper,
+		'tag_rules': tag_rules,
+		'rule_evaluator': gateway.build_rule_evaluator(tag_rules, gateway.modqtt_config),
+		'reset_tag_keys': reset_tag_keys
+	}
+	with contextlib.redirect_stdout(io.StringIO()):
+		gateway.apply_pending_reload()
+	return reloaded_mqtt_helper
+
+class TestChangeDetection(unittest.TestCase):
+
+	def check_same_decisions(self, seed, decode_engine, rule_engine):
+		rng = random.Random(seed)
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			full_path_to_csv = os.path.join(tmp_dir, 'synthetic.csv')
+			write_synthetic_template(full_path_to_csv, rng.randint(20, 200), seed=seed, mqtt_payload='text', publish_rules=True)
+			plain_client = load_client(full_path_to_csv, decode_engine, False)
+			changes_client = load_client(full_path_to_csv, decode_engine, True)
+		plain_gateway = recording_gateway(plain_client.mqtt_helper, rule_engine)
+		changes_gateway = recording_gateway(changes_client.mqtt_helper, rule_engine)
+		change_filter = PublishChangeFilter()
+		changes_gateway.change_filters[changes_client] = change_filter
+
+		responses = {}
+		for fc in plain_client.call_groups:
+			for query in plain_client.call_groups[fc]:
+				responses[(fc, query['start_address'], query['register_count'])] = [rng.randint(0, 1) if fc in ['01', '02'] else rng.choice(SPECIAL_REGISTERS) for i in range(query['register_count'])]
+		mqtt_helper = plain_client.mqtt_helper
+		reload_at = rng.randint(5, CYCLES - 5)
+		timestamp = {'timestamp_ns': 1672531200000000000, 'timestamp_monotonic_ns': 0}
+		previous_values = {plain_gateway: None, changes_gateway: None}
+		for cycle in range(CYCLES):
+			if cycle > 0:
+				mutate_responses(responses, rng)
+				step_ns = int(1e9*rng.choice([0.5, 1.0, 2.0, 5.0, 10.0]))
+				timestamp = {'timestamp_ns': timestamp['timestamp_ns'] + step_ns, 'timestamp_monotonic_ns': timestamp['timestamp_monotonic_ns'] + step_ns}
+			plain_values = poll_cycle(plain_client, responses, timestamp)
+			changes_values = poll_cycle(changes_client, responses, timestamp)
+			# a poll cycle dropped by the publish queue is decoded but not published
+			if (cycle > 0) and (rng.random() < 0.1):
+				continue
+			if cycle == reload_at:
+				reload_rng_state = rng.getstate()
+				reload_tag_rules(plain_gateway, mqtt_helper, rng)
+				rng.setstate(reload_rng_state)
+				mqtt_helper = reload_tag_rules(changes_gateway, mqtt_helper, rng)
+			plain_gateway.decisions = []
+			plain_gateway.mqtt_publish_data(previous_values[plain_gateway], plain_values)
+			changes_gateway.decisions = []
+			evaluated_tag_keys = change_filter.select(changes_client.cycle_changes, changes_gateway.tag_rules)
+			changes_gateway.mqtt_publish_data(previous_values[changes_gateway], changes_values, evaluated_tag_keys=evaluated_tag_keys)
+			previous_values = {plain_gateway: plain_values, changes_gateway: changes_values}
+			self.assertEqual(changes_gateway.decisions, plain_gateway.decisions, 'publish decisions differ at cycle '+str(cycle))
+		# the change detection did skip call groups and publish rules
+		self.assertGreater(changes_client.change_detector.unchanged_group_count, 0)
+		self.assertGreater(change_filter.skipped_count, 0)
+
+	def test_same_decisions(self):
+		for seed in SEEDS:
+			with self.subTest(seed=seed):
+				self.check_same_decisions(seed, 'struct', 'python')
+
+	@unittest.skipUnless(modqtt_helper.NumpyBulkDecoder.is_available() and modqtt_helper.NumpyRuleEvaluator.is_available(), 'numpy is not installed (see requirements-dev.txt)')
+	def test_same_decisions_numpy(self):
+		for seed in SEEDS:
+			with self.subTest(seed=seed):
+				self.check_same_decisions(seed, 'numpy', 'numpy')
+
+class TestDecodeChangedResponse(unittest.TestCase):
+
+	# Method to build a FC01/FC02 response as parsed from a response ADU, with random padding bits in its data as some servers send them
+	def bits_response(self, bits, rng):
+		data = bytearray(pack_bits(bits))
+		if len(bits) % 8:
+			data[-1] |= rng.randint(0, 255) & ~((1 << (len(bits) % 8)) - 1) & 0xFF
+		return unpack_bits(bytes(data), len(bits))
+
+	def test_flipped_bits(self):
+		ModbusHelper = modqtt_helper.ModbusHelper
+		for seed in range(200):
+			rng = random.Random(seed)
+			fc = rng.choice(['01', '02'])
+			register_count = rng.randint(1, 2000)
+			start_address = rng.randint(0, 60000)
+			address_maps = {start_address + i: {'tag_name': 'bit_'+str(start_address + i)} for i in range(register_count) if rng.random() < 0.8}
+			decode_plan = ModbusHelper.compile_decode_plan(fc, address_maps, start_address, register_count)
+			last_bits = [rng.randint(0, 1) for i in range(register_count)]
+			flipped_positions = sorted(rng.sample(range(register_count), rng.choice([0, 1, rng.randint(0, register_count)])))
+			bits = list(last_bits)
+			for i in flipped_positions:
+				bits[i] = 1 - bits[i]
+			last_response = self.bits_response(last_bits, rng)
+			last_interpreted_response = ModbusHelper.decode_response(decode_plan, last_response)
+			expected_changed_tag_keys = [decode_plan['bit_names'][i] for i in flipped_positions if decode_plan['bit_names'][i] is not None]
+			# packed bytes of both responses, and plain lists (packed again) on either side
+			for response, previous_response in [(self.bits_response(bits, rng), last_response), (bits, last_response), (self.bits_response(bits, rng), last_bits), (bits, last_bits)]:
+				with self.subTest(seed=seed, packed=(isinstance(response, PackedBits), isinstance(previous_response, PackedBits))):
+					interpreted_response, changed_tag_keys = ModbusHelper.decode_changed_response(decode_plan, response, previous_response, last_interpreted_response)
+					self.assertEqual(interpreted_response, ModbusHelper.decode_response(decode_plan, bits))
+					self.assertEqual(changed_tag_keys, expected_changed_tag_keys)
+					# the padding bits are not part of the response
+					self.assertTrue(response == self.bits_response(bits, rng))
+					self.assertEqual(response != previous_response, bool(flipped_positions))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+# Property-based tests of the "numpy" modbus_decode_engine (NumpyBulkDecoder): on synthetic templates of every data_type (including the rfloat32 swaps, packedbool, coils, discrete inputs and scaled tags) and random responses,
+# decoding a poll cycle at once (decode_cycle) must give the same tag dictionary, with the same value types, as decoding each response with the "struct" modbus_decode_engine (ModbusHelper.decode_response), NaN being equal to NaN
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, math, random, tempfile, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'benchmark'))
+from scripts import modqtt_helper
+from bench_decode import write_synthetic_template, load_client
+
+SEEDS = range(20)
+CYCLES = 20
+
+# register values that decode to NaN, infinities, signed zeros, extreme integers or denormals for some data_types, once byte and/or word swapped
+SPECIAL_REGISTERS = [0x0000, 0xFFFF, 0x7FC0, 0xC07F, 0x7F80, 0x807F, 0xFF80, 0x80FF, 0x8000, 0x0080, 0x7FFF, 0xFF7F, 0x7FF8, 0xF87F, 0x0001, 0x0100]
+
+# Method to build random responses for every call group of a client, in poll order, the registers being often one of the SPECIAL_REGISTERS
+def random_responses(modbus_tcp_client, rng):
+	responses = []
+	for fc in modbus_tcp_client.call_groups:
+		for query in modbus_tcp_client.call_groups[fc]:
+			if fc in ['01', '02']:
+				responses.append((fc, query['start_address'], [rng.randint(0, 1) for i in range(query['register_count'])]))
+			else:
+				responses.append((fc, query['start_address'], [rng.choice(SPECIAL_REGISTERS) if rng.random() < 0.3 else rng.randint(0, 65535) for i in range(query['register_count'])]))
+	return responses
+
+def same_value(a, b):
+	if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+		return True
+	return (type(a) is type(b)) and (a == b)
+
+@unittest.skipUnless(modqtt_helper.NumpyBulkDecoder.is_available(), 'numpy is not installed')
+class TestDecodeEngines(unittest.TestCase):
+
+	def test_same_tag_values(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			for seed in SEEDS:
+				rng = random.Random(seed)
+				full_path_to_csv = os.path.join(tmp_dir, 'synthetic_'+str(seed)+'.csv')
+				write_synthetic_template(full_path_to_csv, rng.randint(1, 400), seed=seed)
+				modbus_tcp_client = load_client(full_path_to_csv, 'struct')
+				bulk_decoder = modqtt_helper.NumpyBulkDecoder(modbus_tcp_client.call_group_layouts())
+				for cycle in range(CYCLES):
+					responses = random_responses(modbus_tcp_client, rng)
+					expected = {}
+					for fc, start_address, response in responses:
+						modqtt_helper.ModbusHelper.decode_response(modbus_tcp_client.decode_plan(fc, start_address, len(response)), response, expected)
+					actual = bulk_decoder.decode_cycle([response for fc, start_address, response in responses])
+					with self.subTest(seed=seed, cycle=cycle):
+						self.assertEqual(list(actual), list(expected))
+						different_tags = [tag_name for tag_name in expected if not same_value(actual[tag_name], expected[tag_name])]
+						self.assertEqual(different_tags, [], 'first difference: '+(repr((actual[different_tags[0]], expected[different_tags[0]])) if different_tags else ''))
+
+	def test_all_data_types_covered(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			full_path_to_csv = os.path.join(tmp_dir, 'synthetic.csv')
+			write_synthetic_template(full_path_to_csv, 400, seed=0)
+			modbus_tcp_client = load_client(full_path_to_csv, 'struct')
+			layouts = modbus_tcp_client.call_group_layouts()
+			data_types = set(address_map['data_type'] for fc, register_count, tags in layouts for i, address_map in tags)
+			scaled_data_types = set(address_map['data_type'] for fc, register_count, tags in layouts for i, address_map in tags if address_map.get('scaling') is not None)
+			self.assertTrue(set(modqtt_helper.NumpyBulkDecoder.DATA_TYPE_LAYOUTS) <= data_types)
+			self.assertTrue(scaled_data_types)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+
+# Tests of the pipelined Modbus TCP requests (ModbusTCPPipeline) against a fake Modbus TCP Server over a socketpair: transaction IDs and their wraparound, responses matched out of order, outstanding window,
+# first Modbus exception kept while the pipe is drained, unknown transaction IDs, FC01/FC02 bit unpacking, and the fallback of the ModbusTCPClient to sequential requests
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, random, socket, struct, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from pipeline_helper import ModbusTCPPipeline, PipelineError, unpack_bits, parse_response_adu
+from umodbus.client import tcp
+from umodbus.exceptions import IllegalDataAddressError
+from fake_modbus_helper import fake_connection, build_response_adu, expected_values
+
+# Method to build count random read requests (FC01 to FC04) with distinct start addresses, returns [(fc, start_address, quantity, request ADU), ...]
+def random_requests(rng, count):
+	requests = []
+	for start_address in rng.sample(range(0, 60000, 100), count):
+		fc = rng.choice([1, 2, 3, 4])
+		quantity = rng.randint(1, 2000) if fc in (1, 2) else rng.randint(1, 125)
+		requests.append((fc, start_address, quantity, modqtt_helper.ModbusHelper.UMODBUS_TCP_CALL['0'+str(fc)](slave_id=1, starting_address=start_address, quantity=quantity)))
+	return requests
+
+class TestModbusTCPPipeline(unittest.TestCase):
+
+	def test_transaction_ids_wrap_around(self):
+		pipeline = ModbusTCPPipeline(4)
+		pipeline.next_transaction_id = 65533
+		request_adus = [request[3] for request in random_requests(random.Random(0), 5)]
+		requests = pipeline.assign_transaction_ids(request_adus)
+		self.assertEqual([transaction_id for transaction_id, request_adu in requests], [65534, 65535, 0, 1, 2])
+		for (transaction_id, request_adu), original_request_adu in zip(requests, request_adus):
+			self.assertEqual(struct.unpack('>H', request_adu[0:2])[0], transaction_id)
+			self.assertEqual(request_adu[2:], original_request_adu[2:])
+
+	def test_reordered_responses(self):
+		for seed in range(20):
+			rng = random.Random(seed)
+			window = rng.randint(2, 16)
+			requests = random_requests(rng, rng.randint(1, 60))
+			pipeline = ModbusTCPPipeline(window)
+			pipeline.next_transaction_id = rng.randint(0, 65535)		# wraps around during some of the exchanges
+			sock, server = fake_connection(window=window, rng=random.Random(seed))
+			with self.subTest(seed=seed):
+				responses = pipeline.send_messages([request[3] for request in requests], sock)
+				self.assertEqual(responses, [expected_values(fc, start_address, quantity) for fc, start_address, quantity, request_adu in requests])
+				self.assertLessEqual(server.max_pending, window)
+				self.assertEqual(len(pipeline.round_trip_seconds), len(requests))
+				# the connection is left clean for the next poll cycle
+				self.assertEqual(pipeline.send_messages([request[3] for request in requests], sock), responses)
+			sock.close()
+
+	def test_unknown_transaction_id_raises_pipeline_error(self):
+		requests = random_requests(random.Random(1), 8)
+		sock, server = fake_connection(window=4, transaction_id_offset=1000)
+		with self.assertRaises(PipelineError):
+			ModbusTCPPipeline(4).send_messages([request[3] for request in requests], sock)
+		sock.close()
+
+	def test_exception_in_the_middle_of_a_window(self):
+		requests = random_requests(random.Random(2), 12)
+		exception_codes = {requests[3][1]: 2, requests[7][1]: 3}
+		sock, server = fake_connection(window=6, exception_codes=exception_codes)
+		pipeline = ModbusTCPPipeline(6)
+		# the first exception is raised once all the responses are read
+		with self.assertRaises(IllegalDataAddressError):
+			pipeline.send_messages([request[3] for request in requests], sock)
+		self.assertEqual(server.request_count, len(requests))
+		# so that the next exchange on the same connection gets its own responses
+		valid_requests = [request for request in requests if request[1] not in exception_codes]
+		self.assertEqual(pipeline.send_messages([request[3] for request in valid_requests], sock), [expected_values(fc, start_address, quantity) for fc, start_address, quantity, request_adu in valid_requests])
+		sock.close()
+
+	def test_bits_unpacked_as_umodbus(self):
+		rng = random.Random(3)
+		for fc in ['01', '02']:
+			for quantity in list(range(1, 40)) + [rng.randint(1, 2000) for i in range(200)]:
+				request_adu = modqtt_helper.ModbusHelper.UMODBUS_TCP_CALL[fc](slave_id=1, starting_address=rng.randint(0, 60000), quantity=quantity)
+				# the padding bits of the last byte are zeros, as required by the Modbus specification (umodbus misreads them otherwise)
+				data = bytearray(rng.randint(0, 255) for i in range((quantity + 7)//8))
+				data[-1] &= (1 << (quantity % 8 or 8)) - 1
+				data = bytes(data)
+				response_adu = request_adu[0:4] + struct.pack('>HBBB', len(data) + 3, 1, int(fc), len(data)) + data
+				with self.subTest(fc=fc, quantity=quantity):
+					self.assertEqual(parse_response_adu(response_adu, request_adu), tcp.parse_response_adu(response_adu, request_adu))
+					self.assertEqual(unpack_bits(data, quantity), tcp.parse_response_adu(response_adu, request_adu))
+
+	def test_register_responses_parsed_as_umodbus(self):
+		for fc, start_address, quantity, request_adu in random_requests(random.Random(4), 40):
+			response_adu = build_response_adu(request_adu)
+			self.assertEqual(parse_response_adu(response_adu, request_adu), tcp.parse_response_adu(response_adu, request_adu))
+
+	def test_failures_before_falling_back(self):
+		pipeline = ModbusTCPPipeline(8, max_consecutive_failures=3)
+		self.assertFalse(pipeline.record_failure(socket.timeout()))
+		self.assertFalse(pipeline.record_failure(ValueError()))
+		pipeline.record_success()
+		self.assertFalse(pipeline.record_failure(ConnectionResetError()))
+		self.assertFalse(pipeline.record_failure(socket.timeout()))
+		self.assertEqual(pipeline.max_outstanding_requests, 8)
+		self.assertTrue(pipeline.record_failure(socket.timeout()))
+		self.assertEqual(pipeline.max_outstanding_requests, 1)
+		pipeline = ModbusTCPPipeline(8)
+		self.assertTrue(pipeline.record_failure(PipelineError('unexpected transaction ID')))
+		self.assertEqual(pipeline.max_outstanding_requests, 1)
+
+class TestModbusTCPClientFallback(unittest.TestCase):
+
+	# Method to build a ModbusTCPClient whose connections are socketpairs served by fake Modbus TCP Servers, built by the next of server_options_list on each (re)connection
+	def build_client(self, max_outstanding_requests, server_options_list):
+		with contextlib.redirect_stdout(io.StringIO()):
+			client = modqtt_helper.ModbusTCPClient(server_ip='127.0.0.1', max_outstanding_requests=max_outstanding_requests)
+		client.servers = []
+		def connect(timeout=5):
+			client.timeout_seconds = timeout
+			client.sock, server = fake_connection(**server_options_list[len(client.servers)])
+			client.servers.append(server)
+		client.connect = connect
+		client.connect(2)
+		self.addCleanup(lambda: client.sock.close())
+		return client
+
+	def send_messages(self, client, requests):
+		with contextlib.redirect_stdout(io.StringIO()):
+			responses = client.send_messages([request[3] for request in requests])
+		self.assertEqual(responses, [expected_values(fc, start_address, quantity) for fc, start_address, quantity, request_adu in requests])
+
+	def test_glitch_keeps_pipelining(self):
+		requests = random_requests(random.Random(5), 10)
+		client = self.build_client(4, [{'window': 4, 'close_after': 3}, {'window': 4, 'rng': random.Random(5)}])
+		# the poll cycle interrupted by the closed connection is sent again sequentially, after reconnecting
+		self.send_messages(client, requests)
+		self.assertEqual(len(client.servers), 2)
+		self.assertEqual(client.servers[1].max_pending, 1)
+		self.assertEqual(client.pipeline.max_outstanding_requests, 4)
+		# the next poll cycle is pipelined again
+		self.send_messages(client, requests)
+		self.assertEqual(client.servers[1].max_pending, 4)
+		self.assertEqual(client.pipeline.consecutive_failure_count, 0)
+
+	def test_repeated_failures_fall_back(self):
+		requests = random_requests(random.Random(6), 10)
+		client = self.build_client(4, [{'window': 4, 'close_after': 2}, {'window': 4, 'close_after': 12}, {'window': 4, 'close_after': 12}, {'window': 4}])
+		for cycle in range(3):
+			self.send_messages(client, requests)
+		self.assertEqual(client.pipeline.max_outstanding_requests, 1)
+		self.send_messages(client, requests)
+		self.assertEqual(client.servers[-1].max_pending, 1)
+
+	def test_unknown_transaction_id_falls_back(self):
+		requests = random_requests(random.Random(7), 10)
+		client = self.build_client(4, [{'window': 4, 'transaction_id_offset': 7}, {'window': 4}])
+		self.send_messages(client, requests)
+		self.assertEqual(client.pipeline.max_outstanding_requests, 1)
+		self.assertEqual(client.servers[1].max_pending, 1)
+
+if __name__ == '__main__':
+	unittest.main()
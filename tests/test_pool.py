@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+# Tests of the Modbus TCP connection pools (ModbusTCPConnectionPool and its asyncio counterpart AsyncModbusTCPConnectionPool) against fake Modbus TCP Servers listening on 127.0.0.1:
+# responses returned in the order of the requests whatever the connection and the order they are answered in, a connection that breaks reconnected and its share sent again,
+# a connection that can not be reconnected skipped until the next poll cycle, Modbus exceptions leaving the connections open, and empty poll cycles
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, random, asyncio, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from pool_helper import ModbusTCPConnectionPool, spread_requests
+from async_modbus_helper import AsyncModbusTCPConnectionPool
+from umodbus.exceptions import IllegalDataAddressError
+from fake_modbus_helper import FakeModbusListener, expected_values
+
+# Method to build count random read requests (FC01 to FC04) with distinct start addresses, returns [(fc, start_address, quantity, request ADU), ...]
+def random_requests(rng, count):
+	requests = []
+	for start_address in rng.sample(range(0, 60000, 100), count):
+		fc = rng.choice([1, 2, 3, 4])
+		quantity = rng.randint(1, 2000) if fc in (1, 2) else rng.randint(1, 125)
+		requests.append((fc, start_address, quantity, modqtt_helper.ModbusHelper.UMODBUS_TCP_CALL['0'+str(fc)](slave_id=1, starting_address=start_address, quantity=quantity)))
+	return requests
+
+def request_adus(requests):
+	return [request[3] for request in requests]
+
+def responses_of(requests):
+	return [expected_values(fc, start_address, quantity) for fc, start_address, quantity, request_adu in requests]
+
+class TestSpreadRequests(unittest.TestCase):
+
+	def test_spread(self):
+		self.assertEqual(spread_requests(5, [0, 2]), [(0, [0, 2, 4]), (2, [1, 3])])
+		self.assertEqual(spread_requests(1, [1, 2, 3]), [(1, [0])])
+		self.assertEqual(spread_requests(0, [0, 1]), [])
+
+class TestModbusTCPConnectionPool(unittest.TestCase):
+
+	def listen(self, server_options_list=None, port=0, **server_options):
+		listener = FakeModbusListener(server_options_list, port, **server_options)
+		self.addCleanup(listener.close)
+		return listener
+
+	def build_pool(self, listener, size, max_outstanding_requests=1):
+		pool = ModbusTCPConnectionPool('127.0.0.1', listener.port, size, max_outstanding_requests)
+		self.addCleanup(pool.shutdown)
+		pool.connect(2)
+		self.assertTrue(listener.wait_accepted(size))
+		return pool
+
+	def send_messages(self, pool, requests):
+		with contextlib.redirect_stdout(io.StringIO()):
+			return pool.send_messages(request_adus(requests))
+
+	def test_response_order(self):
+		for seed in range(20):
+			rng = random.Random(seed)
+			size = rng.randint(1, 4)
+			window = rng.randint(1, 8)
+			listener = self.listen(window=window, rng=random.Random(seed))
+			pool = self.build_pool(listener, size, window)
+			requests = random_requests(rng, rng.randint(1, 60))
+			with self.subTest(seed=seed, size=size, window=window):
+				self.assertEqual(self.send_messages(pool, requests), responses_of(requests))
+				self.assertEqual(len(pool.round_trip_seconds), len(requests))
+				# the requests are spread evenly over the connections, each one answering its share
+				request_counts = [server.request_count for server in listener.servers]
+				self.assertEqual(sum(request_counts), len(requests))
+				self.assertLessEqual(max(request_counts) - min(request_counts), 1)
+				self.assertEqual([connection_health.request_count for connection_health in pool.health], request_counts)
+				self.assertTrue(all(connection_health.healthy() for connection_health in pool.health))
+
+	def test_empty_poll_cycle(self):
+		pool = self.build_pool(self.listen(), 2)
+		self.assertEqual(self.send_messages(pool, []), [])
+
+	def test_connection_broken(self):
+		requests = random_requests(random.Random(1), 30)
+		# the second connection is closed by the server in the middle of its share
+		listener = self.listen([{}, {'close_after': 4}, {}], window=4, rng=random.Random(1))
+		pool = self.build_pool(listener, 3, 4)
+		self.assertEqual(self.send_messages(pool, requests), responses_of(requests))
+		# it is reconnected and its share sent again, on the fourth connection accepted by the server
+		self.assertEqual(len(listener.servers), 4)
+		self.assertEqual(listener.servers[3].request_count, 10)
+		self.assertEqual([(connection_health.error_count, connection_health.reconnect_count, connection_health.healthy()) for connection_health in pool.health], [(0, 0, True), (1, 1, True), (0, 0, True)])
+		self.assertEqual(self.send_messages(pool, requests), responses_of(requests))
+
+	def test_connection_not_reconnected(self):
+		requests = random_requests(random.Random(2), 20)
+		listener = self.listen([{'close_after': 1}, {}], window=4)
+		pool = self.build_pool(listener, 2, 4)
+		# the server then refuses the new connections: the first connection can not be reconnected, the error is raised once the share of the second one is done
+		listener.close()
+		with self.assertRaises(ConnectionError):
+			self.send_messages(pool, requests)
+		self.assertEqual(listener.servers[1].request_count, 10)
+		self.assertIsNone(pool.sockets[0])
+		self.assertFalse(pool.health[0].healthy())
+		# the next poll cycles are sent over the remaining connection, the closed one being retried on each
+		self.assertEqual(self.send_messages(pool, requests), responses_of(requests))
+		self.assertEqual(listener.servers[1].request_count, 30)
+		self.assertEqual(pool.health[0].error_count, 3)
+		# until the server accepts it again
+		listener = self.listen(port=listener.port, window=4)
+		self.assertEqual(self.send_messages(pool, requests), responses_of(requests))
+		self.assertEqual(listener.servers[0].request_count, 10)
+		self.assertTrue(all(connection_health.healthy() for connection_health in pool.health))
+
+	def test_modbus_exception(self):
+		requests = random_requests(random.Random(3), 12)
+		listener = self.listen(window=4, exception_codes={requests[5][1]: 2})
+		pool = self.build_pool(listener, 2, 4)
+		with self.assertRaises(IllegalDataAddressError):
+			self.send_messages(pool, requests)
+		# the connections stay open, the next poll cycle getting its own responses
+		self.assertEqual(len(listener.servers), 2)
+		valid_requests = requests[:5] + requests[6:]
+		self.assertEqual(self.send_messages(pool, valid_requests), responses_of(valid_requests))
+		self.assertEqual([connection_health.reconnect_count for connection_health in pool.health], [0, 0])
+
+	def test_no_connection(self):
+		listener = self.listen()
+		listener.close()
+		pool = ModbusTCPConnectionPool('127.0.0.1', listener.port, 2)
+		self.addCleanup(pool.shutdown)
+		with self.assertRaises(ConnectionError):
+			pool.connect(2)
+		self.assertEqual([connection_health.error_count for connection_health in pool.health], [1, 1])
+
+class TestAsyncModbusTCPConnectionPool(unittest.TestCase):
+
+	def listen(self, server_options_list=None, port=0, **server_options):
+		listener = FakeModbusListener(server_options_list, port, **server_options)
+		self.addCleanup(listener.close)
+		return listener
+
+	# Method to run a coroutine taking a connected pool of listener, on a new event loop; returns its result, or the exception it raised
+	def run_pool(self, listener, size, max_outstanding_requests, coroutine):
+		async def run():
+			pool = AsyncModbusTCPConnectionPool('127.0.0.1', listener.port, 2, size, max_outstanding_requests)
+			try:
+				await pool.connect()
+				with contextlib.redirect_stdout(io.StringIO()):
+					return await coroutine(pool)
+			except Exception as error:
+				return error
+			finally:
+				pool.close()
+		return asyncio.run(run())
+
+	def test_response_order(self):
+		for seed in range(20):
+			rng = random.Random(seed)
+			size = rng.randint(1, 4)
+			window = rng.randint(1, 8)
+			listener = self.listen(window=window, rng=random.Random(seed))
+			requests = random_requests(rng, rng.randint(1, 60))
+			async def send_twice(pool):
+				return [await pool.send_messages(request_adus(requests)), await pool.send_messages(request_adus(requests)), len(pool.round_trip_seconds), pool.statistics()]
+			with self.subTest(seed=seed, size=size, window=window):
+				first_responses, second_responses, round_trip_count, statistics = self.run_pool(listener, size, window, send_twice)
+				self.assertTrue(listener.wait_accepted(size))
+				self.assertEqual(first_responses, responses_of(requests))
+				self.assertEqual(second_responses, responses_of(requests))
+				self.assertEqual(round_trip_count, len(requests))
+				self.assertEqual(sum(server.request_count for server in listener.servers), 2*len(requests))
+				self.assertEqual(sorted(connection_statistics['request_count'] for connection_statistics in statistics), sorted(server.request_count for server in listener.servers))
+
+	def test_empty_poll_cycle(self):
+		async def send_none(pool):
+			return await pool.send_messages([])
+		self.assertEqual(self.run_pool(self.listen(), 2, 1, send_none), [])
+
+	def test_connection_broken(self):
+		requests = random_requests(random.Random(1), 30)
+		listener = self.listen([{}, {'close_after': 4}, {}], window=4, rng=random.Random(1))
+		async def send_twice(pool):
+			return [await pool.send_messages(request_adus(requests)), pool.statistics(), await pool.send_messages(request_adus(requests))]
+		first_responses, statistics, second_responses = self.run_pool(listener, 3, 4, send_twice)
+		self.assertEqual(first_responses, responses_of(requests))
+		self.assertEqual(second_responses, responses_of(requests))
+		# one connection was reconnected, and its share sent again
+		self.assertEqual(len(listener.servers), 4)
+		self.assertEqual(sorted((connection_statistics['error_count'], connection_statistics['reconnect_count'], connection_statistics['healthy']) for connection_statistics in statistics), [(0, 0, True), (0, 0, True), (1, 1, True)])
+
+	def test_connection_not_reconnected(self):
+		requests = random_requests(random.Random(2), 20)
+		listener = self.listen([{'close_after': 1}, {}], window=4)
+		async def send_cycles(pool):
+			self.assertTrue(listener.wait_accepted(2))
+			listener.close()
+			try:
+				await pool.send_messages(request_adus(requests))
+			except ConnectionError as error:
+				first_error = error
+			return [first_error, pool.connected(), await pool.send_messages(request_adus(requests)), pool.statistics()]
+		first_error, connected, responses, statistics = self.run_pool(listener, 2, 4, send_cycles)
+		self.assertIsInstance(first_error, ConnectionError)
+		self.assertTrue(connected)
+		self.assertEqual(responses, responses_of(requests))
+		self.assertEqual(sum(server.request_count for server in listener.servers), 1 + 10 + 20)
+		self.assertEqual(sorted(connection_statistics['healthy'] for connection_statistics in statistics), [False, True])
+
+	def test_modbus_exception(self):
+		requests = random_requests(random.Random(3), 12)
+		listener = self.listen(window=4, exception_codes={requests[5][1]: 2})
+		valid_requests = requests[:5] + requests[6:]
+		async def send_cycles(pool):
+			try:
+				await pool.send_messages(request_adus(requests))
+			except IllegalDataAddressError as error:
+				modbus_error = error
+			return [modbus_error, await pool.send_messages(request_adus(valid_requests)), pool.statistics()]
+		modbus_error, responses, statistics = self.run_pool(listener, 2, 4, send_cycles)
+		self.assertIsInstance(modbus_error, IllegalDataAddressError)
+		self.assertEqual(responses, responses_of(valid_requests))
+		self.assertEqual(len(listener.servers), 2)
+		self.assertEqual([connection_statistics['reconnect_count'] for connection_statistics in statistics], [0, 0])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+# Tests of the hot reload diffs: tag rules recompiled after a change of the templates (recompile_tag_rules), only for the tags added or changed, the tags removed or whose topic or payload changed being reset,
+# and the changes of a config merged into the running config (ModbusHelper.merge_reloadable_config), the changes of the keys that are not reloadable being ignored and listed, per server for modbus_servers
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, random, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from rule_helper import TagRule, compile_tag_rules, recompile_tag_rules
+
+ModbusHelper = modqtt_helper.ModbusHelper
+
+def tag_helper(mqtt_topic, mqtt_payload='json', mqtt_publish='rbe', mqtt_deadband=0.0, mqtt_alarm_high=None):
+	return {'data_type': 'float32', 'mqtt_topic': mqtt_topic, 'mqtt_qos': 0, 'mqtt_retain': False, 'mqtt_payload': mqtt_payload, 'mqtt_publish': mqtt_publish, 'mqtt_deadband': mqtt_deadband,
+			'mqtt_alarm_low': None, 'mqtt_alarm_high': mqtt_alarm_high, 'mqtt_ignore_low': None, 'mqtt_ignore_high': None}
+
+# changes of a tag of the template, and whether its last published state still applies after them
+TAG_CHANGES = {
+	'unchanged': (lambda tag: tag, False),
+	'topic': (lambda tag: dict(tag, mqtt_topic=tag['mqtt_topic']+'/moved'), True),
+	'payload': (lambda tag: dict(tag, mqtt_payload='text' if tag['mqtt_payload'] == 'json' else 'json'), True),
+	'binary_type': (lambda tag: dict(tag, mqtt_payload='binary', mqtt_binary_type='float64') if tag['mqtt_payload'] == 'binary' else dict(tag, mqtt_payload='binary', mqtt_binary_type='float32'), True),
+	'deadband': (lambda tag: dict(tag, mqtt_deadband=tag['mqtt_deadband'] + 1.0), False),
+	'publish': (lambda tag: dict(tag, mqtt_publish='5' if tag['mqtt_publish'] == 'rbe' else 'rbe'), False),
+	'alarm': (lambda tag: dict(tag, mqtt_alarm_high=100.0 if tag['mqtt_alarm_high'] is None else None), False),
+	'qos': (lambda tag: dict(tag, mqtt_qos=1 - tag['mqtt_qos']), False),
+}
+
+def rule_attributes(tag_rule):
+	return tuple(getattr(tag_rule, slot) for slot in TagRule.__slots__)
+
+class TestRecompileTagRules(unittest.TestCase):
+
+	def test_random_changes(self):
+		for seed in range(100):
+			rng = random.Random(seed)
+			mqtt_helper = {'tag_'+str(i): tag_helper('tags/'+str(i), mqtt_payload=rng.choice(['json', 'text']), mqtt_publish=rng.choice(['rbe', '10']), mqtt_deadband=rng.choice([0.0, 0.5]), mqtt_alarm_high=rng.choice([None, 50.0])) for i in range(30)}
+			tag_rules = compile_tag_rules(mqtt_helper, 'gw')
+			new_mqtt_helper = {}
+			changes = {}
+			for tag_key in mqtt_helper:
+				if rng.random() < 0.1:
+					changes[tag_key] = 'removed'
+					continue
+				changes[tag_key] = rng.choice(list(TAG_CHANGES))
+				new_mqtt_helper[tag_key] = TAG_CHANGES[changes[tag_key]][0](mqtt_helper[tag_key])
+			for i in range(rng.randint(0, 5)):
+				changes['added_'+str(i)] = 'added'
+				new_mqtt_helper['added_'+str(i)] = tag_helper('tags/added_'+str(i))
+			with self.subTest(seed=seed):
+				recompiled_tag_rules, reset_tag_keys = recompile_tag_rules(tag_rules, mqtt_helper, new_mqtt_helper, 'gw')
+				# the rules of the new template, in its order, as compiled from scratch
+				self.assertEqual(list(recompiled_tag_rules), list(new_mqtt_helper))
+				compiled_tag_rules = compile_tag_rules(new_mqtt_helper, 'gw')
+				for tag_key in new_mqtt_helper:
+					self.assertEqual(rule_attributes(recompiled_tag_rules[tag_key]), rule_attributes(compiled_tag_rules[tag_key]))
+					# the rules of the unchanged tags are kept, the others compiled again
+					if changes[tag_key] == 'unchanged':
+						self.assertIs(recompiled_tag_rules[tag_key], tag_rules[tag_key])
+					else:
+						self.assertIsNot(recompiled_tag_rules[tag_key], tag_rules.get(tag_key))
+				# only the tags removed, or whose topic, payload or binary type changed are reset; the tags added have no last published state to reset
+				self.assertEqual(sorted(reset_tag_keys), sorted(tag_key for tag_key in changes if (changes[tag_key] == 'removed') or ((changes[tag_key] in TAG_CHANGES) and TAG_CHANGES[changes[tag_key]][1])))
+
+	def test_no_change(self):
+		mqtt_helper = {'tag_'+str(i): tag_helper('tags/'+str(i)) for i in range(10)}
+		tag_rules = compile_tag_rules(mqtt_helper, 'gw')
+		recompiled_tag_rules, reset_tag_keys = recompile_tag_rules(tag_rules, mqtt_helper, {tag_key: dict(mqtt_helper[tag_key]) for tag_key in mqtt_helper}, 'gw')
+		self.assertEqual(reset_tag_keys, [])
+		self.assertTrue(all(recompiled_tag_rules[tag_key] is tag_rules[tag_key] for tag_key in tag_rules))
+
+class TestMergeReloadableConfig(unittest.TestCase):
+
+	def running_config(self):
+		return {'modbus_server_ip': '10.0.0.1', 'mqtt_client_id': 'gw', 'modbus_template': 'template.csv', 'modbus_max_gap_registers': 0, 'mqtt_rule_engine': 'python', 'mqtt_store_path': 'store'}
+
+	def test_reloadable_keys(self):
+		running_config = self.running_config()
+		new_config = dict(running_config, modbus_template='other.csv', modbus_max_gap_registers=10, mqtt_batch_max_bytes=1024)
+		del new_config['mqtt_rule_engine']
+		config, ignored_keys = ModbusHelper.merge_reloadable_config(running_config, new_config)
+		# the changed, added and removed reloadable keys are taken into account
+		self.assertEqual(config, new_config)
+		self.assertEqual(ignored_keys, [])
+		self.assertEqual(running_config, self.running_config())
+
+	def test_non_reloadable_keys(self):
+		running_config = self.running_config()
+		new_config = dict(running_config, modbus_server_ip='10.0.0.2', mqtt_client_id='other_gw', modbus_template='other.csv', modbus_shard_processes=4)
+		del new_config['mqtt_store_path']
+		config, ignored_keys = ModbusHelper.merge_reloadable_config(running_config, new_config)
+		# the changed, added and removed keys that are not reloadable keep their running value, and are listed in order
+		self.assertEqual(config, dict(running_config, modbus_template='other.csv'))
+		self.assertEqual(ignored_keys, ['modbus_server_ip', 'modbus_shard_processes', 'mqtt_client_id', 'mqtt_store_path'])
+		self.assertEqual(ModbusHelper.merge_reloadable_config(running_config, dict(running_config)), (running_config, []))
+
+	def test_random_changes(self):
+		keys = ModbusHelper.RELOADABLE_CONFIG_KEYS + ['modbus_server_ip', 'modbus_server_port', 'mqtt_client_id', 'mqtt_store_path', 'modbus_poll_interval_seconds']
+		for seed in range(200):
+			rng = random.Random(seed)
+			running_config = {key: rng.randint(0, 2) for key in keys if rng.random() < 0.7}
+			new_config = {key: rng.randint(0, 2) for key in keys if rng.random() < 0.7}
+			with self.subTest(seed=seed):
+				config, ignored_keys = ModbusHelper.merge_reloadable_config(running_config, new_config)
+				changed_keys = [key for key in keys if running_config.get(key) != new_config.get(key)]
+				self.assertEqual(ignored_keys, sorted(key for key in changed_keys if key not in ModbusHelper.RELOADABLE_CONFIG_KEYS))
+				for key in keys:
+					expected_config = new_config if key in ModbusHelper.RELOADABLE_CONFIG_KEYS else running_config
+					self.assertEqual((key in config, config.get(key)), (key in expected_config, expected_config.get(key)))
+
+	def test_modbus_servers(self):
+		running_config = dict(self.running_config(), modbus_servers=[{'name': 'a', 'modbus_server_ip': '10.0.0.1', 'modbus_template': 'a.csv'}, {'name': 'b', 'modbus_server_ip': '10.0.0.2', 'modbus_template': 'b.csv'}])
+		new_config = dict(running_config, modbus_servers=[{'name': 'a', 'modbus_server_ip': '10.0.0.1', 'modbus_template': 'a2.csv'}, {'name': 'b', 'modbus_server_ip': '10.0.0.3', 'modbus_template': 'b2.csv', 'modbus_max_gap_registers': 4}])
+		config, ignored_keys = ModbusHelper.merge_reloadable_config(running_config, new_config)
+		# the servers listed in the same order are merged one by one, their ignored keys prefixed with the server name
+		self.assertEqual(config['modbus_servers'], [{'name': 'a', 'modbus_server_ip': '10.0.0.1', 'modbus_template': 'a2.csv'}, {'name': 'b', 'modbus_server_ip': '10.0.0.2', 'modbus_template': 'b2.csv', 'modbus_max_gap_registers': 4}])
+		self.assertEqual(ignored_keys, ['modbus_servers/b/modbus_server_ip'])
+		# a server added, removed or renamed requires a restart
+		for modbus_servers in [new_config['modbus_servers'][:1], new_config['modbus_servers'] + [{'name': 'c'}], new_config['modbus_servers'][::-1], [dict(new_config['modbus_servers'][0], name='z'), new_config['modbus_servers'][1]]]:
+			with self.subTest(modbus_servers=[modbus_server['name'] for modbus_server in modbus_servers]):
+				config, ignored_keys = ModbusHelper.merge_reloadable_config(running_config, dict(running_config, modbus_servers=modbus_servers))
+				self.assertEqual(config['modbus_servers'], running_config['modbus_servers'])
+				self.assertEqual(ignored_keys, ['modbus_servers'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+# Property-based tests of the "numpy" mqtt_rule_engine (NumpyRuleEvaluator): on random tag rules (report by exception or interval, deadband, alarm and ignore limits), random values (including NaN and values at the limits) and random time steps,
+# it must make exactly the same publish decisions, with the same limit flags, as the "python" mqtt_rule_engine (ModbusTCPMqttDataGateway.mqtt_evaluate_rules), with and without force_deadband, for whole poll cycles and for some of their tags,
+# including after its state is loaded from the last published values of the "python" engine (load_state)
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, math, random, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from scripts.rule_helper import compile_tag_rules
+
+SEEDS = range(200)
+CYCLES = 40
+
+# Method to build the mqtt_helper of tag_count random tags, with limits and deadbands on a small grid of values so that the values often fall on them
+def random_mqtt_helper(rng, tag_count):
+	def limit():
+		return rng.choice([None, None, None, -2.0, -1.0, 0.0, 1.0, 2.0])
+	mqtt_helper = {}
+	for tag_index in range(tag_count):
+		mqtt_helper['tag_'+str(tag_index)] = {
+			'data_type': rng.choice(['float32','int16','uint16','coil','packedbool']),
+			'mqtt_topic': 'tags/tag_'+str(tag_index),
+			'mqtt_qos': 0,
+			'mqtt_retain': False,
+			'mqtt_payload': 'text',
+			'mqtt_publish': rng.choice(['rbe', 'rbe', '0.5', '1', '2.5']),
+			'mqtt_deadband': rng.choice([0.0, 0.0, 0.5, 1.0, 2.5]),
+			'mqtt_alarm_low': limit(),
+			'mqtt_alarm_high': limit(),
+			'mqtt_ignore_low': rng.choice([None, None, None, -3.0, -2.0]),
+			'mqtt_ignore_high': rng.choice([None, None, None, 2.0, 3.0])
+		}
+	return mqtt_helper
+
+def random_value(rng):
+	choice = rng.random()
+	if choice < 0.05:
+		return math.nan
+	elif choice < 0.6:
+		return float(rng.choice([-3, -2, -1, 0, 1, 2, 3]))
+	return rng.uniform(-4.0, 4.0)
+
+# Method to build a gateway evaluating tag_rules with the "python" mqtt_rule_engine, without connecting to any Modbus TCP Server nor MQTT Broker
+def build_python_gateway(tag_rules, force_deadband):
+	gateway = modqtt_helper.ModbusTCPMqttDataGateway.__new__(modqtt_helper.ModbusTCPMqttDataGateway)
+	gateway.tag_rules = tag_rules
+	gateway.rule_evaluator = None
+	gateway.mqqt_last_published_values = {}
+	gateway.mqtt_force_deadband = force_deadband
+	return gateway
+
+# Method to record the publish of the tags that fired, as mqtt_parse_publish_tag does
+def record_publish(gateway, current_values, tag_keys, limit_flags, monotonic_ns):
+	for tag_key, limit_flag in zip(tag_keys, limit_flags):
+		gateway.mqqt_last_published_values[tag_key] = {
+			'timestamp_ns': current_values['timestamp_ns'],
+			'monotonic_ns': monotonic_ns,
+			'last_published_value': current_values[tag_key],
+			'limit_flag': limit_flag
+		}
+
+@unittest.skipUnless(modqtt_helper.NumpyRuleEvaluator.is_available(), 'numpy is not installed (see requirements-dev.txt)')
+class TestRuleEngines(unittest.TestCase):
+
+	# Method to run CYCLES random poll cycles of the tags of tag_rules through both rule engines, asserting the same publish decisions on each cycle
+	# some poll cycles only have some of the tags (ex: slower scan classes) or only evaluate some of them (evaluated_tag_keys, as with change detection); with reload_at, the numpy evaluator is rebuilt from the state of the "python" engine at that cycle
+	def check_same_decisions(self, rng, tag_rules, force_deadband, reload_at=None):
+		gateway = build_python_gateway(tag_rules, force_deadband)
+		rule_evaluator = modqtt_helper.NumpyRuleEvaluator(tag_rules)
+		tag_keys = list(tag_rules)
+		monotonic_ns = 0
+		for cycle in range(CYCLES):
+			if cycle == reload_at:
+				rule_evaluator = modqtt_helper.NumpyRuleEvaluator(tag_rules)
+				rule_evaluator.load_state(gateway.mqqt_last_published_values)
+			monotonic_ns += rng.choice([0, 250000000, 500000000, 1000000000, 2500000000])
+			cycle_tag_keys = tag_keys if rng.random() < 0.7 else [tag_key for tag_key in tag_keys if rng.random() < 0.5]
+			current_values = {'timestamp_ns': 1672531200000000000 + monotonic_ns, 'timestamp_monotonic_ns': monotonic_ns}
+			for tag_key in cycle_tag_keys:
+				current_values[tag_key] = random_value(rng)
+			publish_all = (cycle == 0) and (rng.random() < 0.5)
+			evaluated_tag_keys = None
+			if (not publish_all) and (rng.random() < 0.3):
+				evaluated_tag_keys = [tag_key for tag_key in cycle_tag_keys if rng.random() < 0.5]
+
+			expected_tag_keys, expected_limit_flags = gateway.mqtt_evaluate_rules(current_values, monotonic_ns, publish_all=publish_all, evaluated_tag_keys=evaluated_tag_keys)
+			if evaluated_tag_keys is None:
+				actual_tag_keys, actual_limit_flags = rule_evaluator.evaluate_cycle(current_values, monotonic_ns, force_deadband, publish_all)
+			else:
+				actual_tag_keys, actual_limit_flags = rule_evaluator.evaluate_tags(evaluated_tag_keys, current_values, monotonic_ns, force_deadband)
+			self.assertEqual(actual_tag_keys, expected_tag_keys, 'publish decisions differ at cycle '+str(cycle))
+			self.assertEqual(actual_limit_flags, expected_limit_flags, 'limit flags differ at cycle '+str(cycle))
+			record_publish(gateway, current_values, expected_tag_keys, expected_limit_flags, monotonic_ns)
+
+	def test_same_decisions(self):
+		for seed in SEEDS:
+			rng = random.Random(seed)
+			tag_rules = compile_tag_rules(random_mqtt_helper(rng, rng.randint(1, 40)), 'test')
+			with self.subTest(seed=seed):
+				self.check_same_decisions(rng, tag_rules, force_deadband=False)
+
+	def test_same_decisions_force_deadband(self):
+		for seed in SEEDS:
+			rng = random.Random(seed)
+			tag_rules = compile_tag_rules(random_mqtt_helper(rng, rng.randint(1, 40)), 'test')
+			with self.subTest(seed=seed):
+				self.check_same_decisions(rng, tag_rules, force_deadband=True)
+
+	def test_same_decisions_after_load_state(self):
+		for seed in SEEDS:
+			rng = random.Random(seed)
+			tag_rules = compile_tag_rules(random_mqtt_helper(rng, rng.randint(1, 40)), 'test')
+			with self.subTest(seed=seed):
+				self.check_same_decisions(rng, tag_rules, force_deadband=rng.random() < 0.5, reload_at=rng.randint(1, CYCLES - 1))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+# Deterministic tests of the poll scheduler (PollScheduler) with fake monotonic and wall clocks: deadlines of the 'skip', 'catch_up' (with its max_catch_up_cycles cap) and 'late' overrun policies,
+# overrun and skipped cycle counters, alignment of the first deadline on the wall clock, and random cycle durations checked against the invariants of the schedule
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, random, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from scheduler_helper import PollScheduler
+
+class FakeClock(object):
+
+	def __init__(self, now):
+		self.now = now
+
+	def __call__(self):
+		return self.now
+
+class TestPollScheduler(unittest.TestCase):
+
+	def build_scheduler(self, interval_seconds=1.0, now=100.0, wall_now=1700000000.0, **options):
+		self.clock = FakeClock(now)
+		self.wall_clock = FakeClock(wall_now)
+		return PollScheduler(interval_seconds, clock=self.clock, wall_clock=self.wall_clock, **options)
+
+	# Method to run poll cycles of the given durations, waiting for each deadline on the fake clocks; returns the delay of each cycle (negative if it starts late)
+	def run_cycles(self, scheduler, durations):
+		delays = []
+		for duration in durations:
+			delay = scheduler.next_cycle_delay()
+			delays.append(delay)
+			self.clock.now += max(delay, 0.0) + duration
+			self.wall_clock.now += max(delay, 0.0) + duration
+		return delays
+
+	def test_on_time(self):
+		scheduler = self.build_scheduler()
+		self.assertEqual(self.run_cycles(scheduler, [0.25]*5), [0.0] + [0.75]*4)
+		self.assertEqual(scheduler.next_deadline, 104.0)
+		self.assertEqual(scheduler.statistics(), {'cycle_count': 5, 'slot_index': 4, 'overrun_count': 0, 'skipped_cycle_count': 0, 'last_lateness_seconds': 0.0})
+
+	def test_skip(self):
+		scheduler = self.build_scheduler(overrun_policy='skip')
+		# the first cycle runs until 102.5: the deadlines 101 and 102 are missed, the next cycle waits for 103
+		self.assertEqual(self.run_cycles(scheduler, [2.5, 0.25, 0.25]), [0.0, 0.5, 0.75])
+		self.assertEqual(scheduler.next_deadline, 104.0)
+		self.assertEqual(scheduler.statistics(), {'cycle_count': 3, 'slot_index': 4, 'overrun_count': 1, 'skipped_cycle_count': 2, 'last_lateness_seconds': 0.0})
+		# a cycle ending exactly on the next deadline is not an overrun
+		self.run_cycles(scheduler, [1.0, 0.0])
+		self.assertEqual(scheduler.overrun_count, 1)
+
+	def test_catch_up(self):
+		scheduler = self.build_scheduler(overrun_policy='catch_up')
+		# the first cycle runs until 103.5: the cycles of 101, 102 and 103 run back-to-back, then the schedule is caught up
+		self.assertEqual(self.run_cycles(scheduler, [3.5, 0.0, 0.0, 0.0, 0.0]), [0.0, -2.5, -1.5, -0.5, 0.5])
+		self.assertEqual(scheduler.next_deadline, 104.0)
+		self.assertEqual(scheduler.statistics(), {'cycle_count': 5, 'slot_index': 4, 'overrun_count': 3, 'skipped_cycle_count': 0, 'last_lateness_seconds': 0.0})
+
+	def test_catch_up_cap(self):
+		scheduler = self.build_scheduler(overrun_policy='catch_up', max_catch_up_cycles=2)
+		# the first cycle runs until 105.5: more than 2 cycles are missed, they are skipped as with the 'skip' policy
+		self.assertEqual(self.run_cycles(scheduler, [5.5, 0.0]), [0.0, 0.5])
+		self.assertEqual(scheduler.next_deadline, 106.0)
+		self.assertEqual((scheduler.slot_index, scheduler.overrun_count, scheduler.skipped_cycle_count), (6, 1, 5))
+		# at most 2 missed cycles are caught up
+		self.assertEqual(self.run_cycles(scheduler, [2.5, 0.0, 0.0, 0.0]), [1.0, -1.5, -0.5, 0.5])
+		self.assertEqual((scheduler.slot_index, scheduler.overrun_count, scheduler.skipped_cycle_count), (10, 3, 5))
+
+	def test_late(self):
+		scheduler = self.build_scheduler(overrun_policy='late')
+		# the first cycle runs until 102.5: the next cycle runs immediately, and the schedule is shifted from it
+		self.assertEqual(self.run_cycles(scheduler, [2.5, 0.25, 0.25]), [0.0, 0.0, 0.75])
+		self.assertEqual(scheduler.next_deadline, 103.5)
+		self.assertEqual(scheduler.statistics(), {'cycle_count': 3, 'slot_index': 2, 'overrun_count': 1, 'skipped_cycle_count': 0, 'last_lateness_seconds': 0.0})
+
+	def test_lateness(self):
+		scheduler = self.build_scheduler(overrun_policy='catch_up')
+		self.run_cycles(scheduler, [1.75, 0.0])
+		self.assertEqual(scheduler.last_lateness_seconds, 0.75)
+		self.run_cycles(scheduler, [0.0])
+		self.assertEqual(scheduler.last_lateness_seconds, 0.0)
+
+	def test_set_interval(self):
+		scheduler = self.build_scheduler()
+		self.run_cycles(scheduler, [0.0, 0.0])
+		scheduler.set_interval(5)
+		self.assertEqual(self.run_cycles(scheduler, [0.0, 0.0]), [5.0, 5.0])
+		self.assertEqual(scheduler.next_deadline, 111.0)
+
+	def test_wall_clock_alignment(self):
+		for seed in range(200):
+			rng = random.Random(seed)
+			interval_seconds = rng.choice([0.1, 0.5, 1.0, 2.0, 5.0, 60.0])
+			phase_seconds = rng.uniform(0, interval_seconds)
+			wall_now = 1700000000.0 + rng.uniform(0, 3600)
+			with self.subTest(seed=seed):
+				scheduler = self.build_scheduler(interval_seconds, now=rng.uniform(0, 1e6), wall_now=wall_now, align_to_wall_clock=True, phase_seconds=phase_seconds)
+				delay = scheduler.next_cycle_delay()
+				self.assertGreaterEqual(delay, 0.0)
+				self.assertLess(delay, interval_seconds)
+				# the first cycle starts on phase_seconds past a multiple of interval_seconds of the wall clock
+				phase_error = (wall_now + delay - phase_seconds) % interval_seconds
+				self.assertAlmostEqual(min(phase_error, interval_seconds - phase_error), 0.0, places=6)
+				# and the following ones on the same phase, one interval apart
+				self.assertAlmostEqual(self.run_cycles(scheduler, [0.0, 0.0])[1], interval_seconds, places=6)
+		# without alignment, the first cycle runs immediately
+		scheduler = self.build_scheduler(wall_now=1700000000.3, phase_seconds=0.5)
+		self.assertEqual(scheduler.next_cycle_delay(), 0.0)
+
+	def test_random_durations(self):
+		for seed in range(100):
+			rng = random.Random(seed)
+			overrun_policy = rng.choice(PollScheduler.OVERRUN_POLICIES)
+			interval_seconds = rng.choice([0.25, 1.0, 10.0])
+			scheduler = self.build_scheduler(interval_seconds, overrun_policy=overrun_policy, max_catch_up_cycles=rng.randint(0, 5))
+			first_deadline = self.clock.now
+			with self.subTest(seed=seed, overrun_policy=overrun_policy):
+				previous_deadline = None
+				for cycle in range(200):
+					delay = self.run_cycles(scheduler, [interval_seconds*rng.choice([0.0, 0.5, 0.9, 1.0, 1.5, 3.0, 8.0])])[0]
+					if previous_deadline is not None:
+						self.assertGreater(scheduler.next_deadline, previous_deadline)
+					previous_deadline = scheduler.next_deadline
+					if overrun_policy == 'late':
+						self.assertEqual(scheduler.slot_index, cycle)
+						self.assertGreaterEqual(delay, 0.0)
+						continue
+					# the deadlines stay on the schedule, every slot being either run or skipped
+					self.assertAlmostEqual(scheduler.next_deadline, first_deadline + scheduler.slot_index*interval_seconds, places=6)
+					self.assertEqual(scheduler.slot_index, cycle + scheduler.skipped_cycle_count)
+					if overrun_policy == 'skip':
+						self.assertGreaterEqual(delay, 0.0)
+					else:
+						self.assertGreater(delay, -(scheduler.max_catch_up_cycles + 1)*interval_seconds)
+				self.assertEqual(scheduler.cycle_count, 200)
+
+	def test_wait_next_cycle_stopped(self):
+		scheduler = self.build_scheduler(overrun_policy='late')
+		self.assertTrue(scheduler.wait_next_cycle())
+		self.clock.now += 5
+		scheduler.stop()
+		# stopped while a cycle is due (the late cycle of 105), or while waiting for one (the cycle of 106)
+		self.assertFalse(scheduler.wait_next_cycle())
+		self.assertEqual(scheduler.next_deadline, 105.0)
+		self.assertFalse(scheduler.wait_next_cycle())
+		self.assertEqual(scheduler.next_deadline, 106.0)
+		self.assertEqual(scheduler.cycle_count, 1)
+
+	def test_unsupported_policy(self):
+		with contextlib.redirect_stdout(io.StringIO()) as output:
+			scheduler = self.build_scheduler(overrun_policy='fast')
+		self.assertEqual(scheduler.overrun_policy, 'skip')
+		self.assertIn('[WARNING]', output.getvalue())
+
+if __name__ == '__main__':
+	unittest.main()
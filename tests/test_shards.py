@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+# Tests of the sharded gateway helpers: partition of the call groups of a template over the shards (shard_call_groups), batching of the messages of a worker over a pipe (ShardPublisher, on os.pipe),
+# and the restart back-off of the worker processes by the ShardSupervisor, with a fake clock and short-lived worker processes
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, random, marshal, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from shard_helper import ShardPublisher, ShardSupervisor, shard_call_groups, shard_path
+from multiprocessing.connection import Connection, wait
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'scripts')
+
+# worker process publishing one message of its shard, then exiting with code 1
+WORKER_SCRIPT = '''import sys
+sys.path.append(sys.argv[3])
+from shard_helper import ShardPublisher
+shard_publisher = ShardPublisher(int(sys.argv[1]))
+shard_publisher.publish('shard/'+sys.argv[2], b'message', 1, False)
+shard_publisher.close()
+sys.exit(1)
+'''
+
+class FakeClock(object):
+
+	def __init__(self, now=1000.0):
+		self.now = now
+
+	def __call__(self):
+		return self.now
+
+# Method to build random call groups {fc: [query, ...]} of several scan classes (poll_interval)
+def random_call_groups(rng):
+	call_groups = {}
+	start_address = 0
+	for fc in ['01', '02', '03', '04']:
+		call_groups[fc] = []
+		for i in range(rng.randint(0, 30)):
+			call_groups[fc].append({'start_address': start_address, 'register_count': rng.randint(1, 125), 'poll_interval': rng.choice([1.0, 1.0, 5.0, 60.0])})
+			start_address += 200
+	return call_groups
+
+class TestShardCallGroups(unittest.TestCase):
+
+	def test_partition(self):
+		for seed in range(100):
+			rng = random.Random(seed)
+			call_groups = random_call_groups(rng)
+			shard_count = rng.randint(1, 7)
+			with self.subTest(seed=seed, shard_count=shard_count):
+				shards = [shard_call_groups(call_groups, shard_index, shard_count) for shard_index in range(shard_count)]
+				for fc in call_groups:
+					# every call group is polled by exactly one shard, each shard keeping the poll order
+					shard_queries = [[id(query) for query in shard[fc]] for shard in shards]
+					self.assertEqual(sorted(sum(shard_queries, [])), sorted(id(query) for query in call_groups[fc]))
+					for queries in shard_queries:
+						positions = [[id(query) for query in call_groups[fc]].index(query_id) for query_id in queries]
+						self.assertEqual(positions, sorted(positions))
+				# each scan class is dealt evenly over the shards
+				for poll_interval in set(query['poll_interval'] for fc in call_groups for query in call_groups[fc]):
+					counts = [sum(1 for fc in shard for query in shard[fc] if query['poll_interval'] == poll_interval) for shard in shards]
+					self.assertLessEqual(max(counts) - min(counts), 1)
+				self.assertEqual(shard_call_groups(call_groups, 0, 1), call_groups)
+
+	def test_shard_path(self):
+		self.assertEqual(shard_path('/var/lib/modqtt/state.gz', 1), '/var/lib/modqtt/state.shard1.gz')
+		self.assertEqual(shard_path('metrics', 0), 'metrics.shard0')
+
+class TestShardPublisher(unittest.TestCase):
+
+	def setUp(self):
+		read_fd, write_fd = os.pipe()
+		self.reader = Connection(read_fd, writable=False)
+		self.end_of_file = False
+		self.closed_count = 0
+		self.shard_publisher = ShardPublisher(write_fd, max_batch_messages=100, on_closed=self.on_closed)
+		self.addCleanup(self.reader.close)
+		self.addCleanup(self.shard_publisher.close)
+
+	def on_closed(self):
+		self.closed_count += 1
+
+	# Method to read the batches sent so far on the pipe, until it is closed by the ShardPublisher (end of file)
+	def read_batches(self):
+		batches = []
+		while self.reader.poll(0):
+			try:
+				batches.append(marshal.loads(self.reader.recv_bytes()))
+			except EOFError:
+				self.end_of_file = True
+				break
+		return batches
+
+	def test_batches(self):
+		messages = [('shard/'+str(i), ('payload_'+str(i)).encode(), i % 3, bool(i % 2)) for i in range(250)]
+		for message in messages:
+			self.assertTrue(self.shard_publisher.publish(*message))
+		# a batch is sent once max_batch_messages are batched
+		self.assertEqual(self.read_batches(), [messages[0:100], messages[100:200]])
+		# the rest on flush, and an empty batch if there is nothing to publish
+		self.assertTrue(self.shard_publisher.flush())
+		self.assertTrue(self.shard_publisher.flush())
+		self.assertEqual(self.read_batches(), [messages[200:250], []])
+		self.assertTrue(self.shard_publisher.publish('shard/none', None, 0, False))
+		self.assertEqual(self.shard_publisher.statistics(), {'published_count': 251, 'published_bytes': sum(len(message[1]) for message in messages), 'batch_count': 4})
+		# close sends the last batch, then closes the pipe
+		self.assertFalse(self.end_of_file)
+		self.shard_publisher.close()
+		self.assertEqual(self.read_batches(), [[('shard/none', None, 0, False)]])
+		self.assertTrue(self.end_of_file)
+		self.assertEqual(self.closed_count, 0)
+
+	def test_closed_pipe(self):
+		self.reader.close()
+		self.assertTrue(self.shard_publisher.publish('shard/0', b'0', 0, False))
+		self.assertFalse(self.shard_publisher.flush())
+		self.assertEqual(self.closed_count, 1)
+		# on_closed is only called once
+		self.assertFalse(self.shard_publisher.publish('shard/1', b'1', 0, False))
+		self.assertFalse(self.shard_publisher.flush())
+		self.assertEqual(self.closed_count, 1)
+
+class TestShardSupervisor(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = FakeClock()
+		self.published = []
+		self.supervisor = ShardSupervisor(lambda shard_index, shard_count, fd: [sys.executable, '-c', WORKER_SCRIPT, str(fd), str(shard_index), SCRIPTS_DIR], 2, lambda topic, payload, qos, retain: self.published.append((topic, payload, qos, retain)), restart_delay_seconds=1.0, max_restart_delay_seconds=5.0, clock=self.clock)
+		self.addCleanup(self.stop_workers)
+
+	def stop_workers(self):
+		for worker in self.supervisor.workers:
+			if worker.connection is not None:
+				worker.connection.close()
+			if worker.process is not None:
+				worker.process.wait()
+
+	# Method to receive the messages of the running workers until they exited, as ShardSupervisor.run does
+	def run_workers(self):
+		connections = {worker.connection: worker for worker in self.supervisor.workers if worker.connection is not None}
+		while connections:
+			for connection in wait(list(connections), 5):
+				self.supervisor.receive(connections[connection])
+			connections = {worker.connection: worker for worker in self.supervisor.workers if worker.connection is not None}
+		for worker in self.supervisor.workers:
+			worker.process.wait()
+
+	# Method to check the workers, returns the shard indexes of the workers started (or restarted) by this check
+	def check_workers(self):
+		restart_counts = [worker.restart_count for worker in self.supervisor.workers]
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.supervisor.check_workers()
+		return [worker.shard_index for worker, restart_count in zip(self.supervisor.workers, restart_counts) if worker.restart_count > restart_count]
+
+	def test_restart_backoff(self):
+		with contextlib.redirect_stdout(io.StringIO()):
+			for worker in self.supervisor.workers:
+				self.supervisor.start_worker(worker)
+		# each consecutive failure doubles the restart delay, up to max_restart_delay_seconds
+		for delay in [1.0, 2.0, 4.0, 5.0, 5.0]:
+			self.run_workers()
+			self.assertEqual(self.check_workers(), [])
+			self.assertEqual([worker.restart_at for worker in self.supervisor.workers], [self.clock.now + delay]*2)
+			self.clock.now += delay - 0.5
+			self.assertEqual(self.check_workers(), [])
+			self.clock.now += 0.5
+			self.assertEqual(self.check_workers(), [0, 1])
+			self.assertEqual([worker.restart_at for worker in self.supervisor.workers], [None, None])
+		self.assertEqual(sorted(self.published), sorted([('shard/0', b'message', 1, False), ('shard/1', b'message', 1, False)]*5))
+		self.assertEqual([(worker.restart_count, worker.message_count, worker.batch_count) for worker in self.supervisor.workers], [(5, 5, 5)]*2)
+		# a worker that ran for longer than max_restart_delay_seconds is restarted after restart_delay_seconds again
+		self.clock.now += 5.5
+		self.run_workers()
+		self.assertEqual([(worker.restart_count, worker.message_count, worker.batch_count) for worker in self.supervisor.workers], [(5, 6, 6)]*2)
+		self.check_workers()
+		self.assertEqual([worker.restart_at for worker in self.supervisor.workers], [self.clock.now + 1.0]*2)
+
+	def test_unable_to_start(self):
+		self.supervisor.worker_command = lambda shard_index, shard_count, fd: [os.path.join(SCRIPTS_DIR, 'no_such_worker')]
+		with contextlib.redirect_stdout(io.StringIO()):
+			for worker in self.supervisor.workers:
+				self.supervisor.start_worker(worker)
+		for worker in self.supervisor.workers:
+			self.assertIsNone(worker.process)
+			self.assertIsNone(worker.connection)
+			self.assertEqual(worker.restart_at, self.clock.now + 1.0)
+		# the start is retried once due, with the back-off of a failed worker
+		self.clock.now += 1.0
+		self.assertEqual(self.check_workers(), [0, 1])
+		self.assertEqual([worker.restart_at for worker in self.supervisor.workers], [self.clock.now + 2.0]*2)
+
+if __name__ == '__main__':
+	unittest.main()
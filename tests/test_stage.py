@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+# Tests of the publish queue between the Modbus acquisition and the MQTT publish stages (BoundedCycleQueue): the 'drop_oldest', 'drop_newest' and 'block' overflow policies,
+# close waking the consumer and a producer blocked on a full queue, the items put once closed being dropped, and the time the items waited in the queue on a fake clock
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, time, random, threading, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from stage_helper import BoundedCycleQueue, StageLatency
+
+class FakeClock(object):
+
+	def __init__(self, now=100.0):
+		self.now = now
+
+	def __call__(self):
+		return self.now
+
+# Method to get the items left in a queue, without waiting
+def drain(queue):
+	items = []
+	while queue.items:
+		items.append(queue.get())
+	return items
+
+class TestBoundedCycleQueue(unittest.TestCase):
+
+	# Method to run target in a thread, returns the thread and the list its result is appended to
+	def start_thread(self, target, *args):
+		results = []
+		thread = threading.Thread(target=lambda: results.append(target(*args)), daemon=True)
+		thread.start()
+		self.addCleanup(thread.join, 5)
+		return thread, results
+
+	# Method to wait until a thread is blocked waiting on the condition of queue (or done)
+	def wait_blocked(self, queue, thread):
+		deadline = time.monotonic() + 5
+		while thread.is_alive() and (time.monotonic() < deadline):
+			with queue.condition:
+				if queue.condition._waiters:
+					return
+			time.sleep(0.001)
+
+	def test_drop_oldest(self):
+		queue = BoundedCycleQueue(3, 'drop_oldest')
+		self.assertEqual([queue.put(i) for i in range(5)], [True, True, True, False, False])
+		# the consumer catches up on the most recent cycles
+		self.assertEqual(drain(queue), [2, 3, 4])
+		self.assertEqual(queue.statistics()['dropped_count'], 2)
+		self.assertEqual((queue.queued_count, queue.max_depth), (5, 3))
+
+	def test_drop_newest(self):
+		queue = BoundedCycleQueue(3, 'drop_newest')
+		self.assertEqual([queue.put(i) for i in range(5)], [True, True, True, False, False])
+		# the consumer sees every cycle up to the overflow, then resumes
+		self.assertEqual(queue.get(), 0)
+		self.assertTrue(queue.put(5))
+		self.assertEqual(drain(queue), [1, 2, 5])
+		self.assertEqual((queue.queued_count, queue.dropped_count, queue.max_depth), (4, 2, 3))
+
+	def test_block(self):
+		queue = BoundedCycleQueue(2, 'block')
+		self.assertTrue(queue.put(0))
+		self.assertTrue(queue.put(1))
+		# a put on a full queue waits for the consumer to make room
+		thread, results = self.start_thread(queue.put, 2)
+		self.wait_blocked(queue, thread)
+		self.assertTrue(thread.is_alive())
+		self.assertEqual(list(item for queued_at, item in queue.items), [0, 1])
+		self.assertEqual(queue.get(), 0)
+		thread.join(5)
+		self.assertEqual(results, [True])
+		self.assertEqual(drain(queue), [1, 2])
+		self.assertEqual(queue.dropped_count, 0)
+
+	def test_block_random_producer(self):
+		for seed in range(20):
+			rng = random.Random(seed)
+			queue = BoundedCycleQueue(rng.randint(1, 4), 'block')
+			item_count = rng.randint(0, 200)
+			def produce():
+				results = [queue.put(i) for i in range(item_count)]
+				queue.close()
+				return results
+			thread, results = self.start_thread(produce)
+			with self.subTest(seed=seed):
+				# no cycle is dropped, and the consumer gets them all in order, then None once closed
+				items = []
+				while True:
+					item = queue.get()
+					if item is None:
+						break
+					items.append(item)
+				thread.join(5)
+				self.assertEqual(items, list(range(item_count)))
+				self.assertEqual(results, [[True]*item_count])
+				self.assertLessEqual(queue.max_depth, queue.max_size)
+				self.assertEqual(queue.dropped_count, 0)
+
+	def test_close_wakes_blocked_put(self):
+		queue = BoundedCycleQueue(1, 'block')
+		self.assertTrue(queue.put(0))
+		thread, results = self.start_thread(queue.put, 1)
+		self.wait_blocked(queue, thread)
+		queue.close()
+		thread.join(5)
+		# the put woken by close drops its item, the consumer only gets the items queued before
+		self.assertEqual(results, [False])
+		self.assertEqual(queue.statistics()['depth'], 1)
+		self.assertEqual(queue.get(), 0)
+		self.assertIsNone(queue.get())
+		self.assertEqual((queue.queued_count, queue.dropped_count), (1, 1))
+
+	def test_close(self):
+		for overflow_policy in BoundedCycleQueue.OVERFLOW_POLICIES:
+			with self.subTest(overflow_policy=overflow_policy):
+				queue = BoundedCycleQueue(3, overflow_policy)
+				# a consumer waiting on an empty queue gets None once closed
+				thread, results = self.start_thread(queue.get)
+				self.wait_blocked(queue, thread)
+				self.assertTrue(queue.put(0))
+				thread.join(5)
+				self.assertEqual(results, [0])
+				self.assertTrue(queue.put(1))
+				queue.close()
+				# the items put once closed are dropped, whatever the policy and the room left
+				self.assertFalse(queue.put(2))
+				self.assertEqual(queue.get(), 1)
+				self.assertIsNone(queue.get())
+				self.assertIsNone(queue.get())
+				self.assertEqual((queue.queued_count, queue.dropped_count), (2, 1))
+
+	def test_wait_latency(self):
+		clock = FakeClock()
+		queue = BoundedCycleQueue(10, clock=clock)
+		for i in range(3):
+			queue.put(i)
+			clock.now += 1.0
+		clock.now += 0.5
+		self.assertEqual(drain(queue), [0, 1, 2])
+		self.assertEqual(queue.statistics()['wait'], {'count': 3, 'last_seconds': 1.5, 'mean_seconds': 2.5, 'max_seconds': 3.5})
+
+	def test_unsupported_policy(self):
+		with contextlib.redirect_stdout(io.StringIO()) as output:
+			queue = BoundedCycleQueue(0, 'fifo')
+		self.assertEqual((queue.overflow_policy, queue.max_size), ('drop_oldest', 1))
+		self.assertIn('[WARNING]', output.getvalue())
+
+class TestStageLatency(unittest.TestCase):
+
+	def test_statistics(self):
+		stage_latency = StageLatency()
+		self.assertEqual(stage_latency.statistics(), {'count': 0, 'last_seconds': 0.0, 'mean_seconds': 0.0, 'max_seconds': 0.0})
+		for seconds in [0.5, 2.0, 0.5]:
+			stage_latency.record(seconds)
+		self.assertEqual(stage_latency.statistics(), {'count': 3, 'last_seconds': 0.5, 'mean_seconds': 1.0, 'max_seconds': 2.0})
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+# Tests of the snapshot of the last published state of the tags (PublishedStateSnapshot): round trip of the values (NaN and infinities included), tags dropped when their topic or mqtt_payload changed or their tag rule is gone,
+# snapshot of another mqtt_client_id or corrupt, monotonic time of the publishes rebuilt from their wall clock time, and a restarted gateway making the same publish decisions as one that kept running
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, math, random, gzip, tempfile, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from state_helper import PublishedStateSnapshot
+from rule_helper import compile_tag_rules
+
+WALL_CLOCK_OFFSET_NS = 1672531200000000000		# wall clock time of the fake clocks when their monotonic time is 0
+
+class FakeClockNs(object):
+
+	def __init__(self, now_ns=0):
+		self.now_ns = now_ns
+
+	def __call__(self):
+		return self.now_ns
+
+def tag_helper(mqtt_topic, mqtt_payload='text', mqtt_publish='rbe', mqtt_deadband=0.0, data_type='float32'):
+	return {'data_type': data_type, 'mqtt_topic': mqtt_topic, 'mqtt_qos': 0, 'mqtt_retain': False, 'mqtt_payload': mqtt_payload, 'mqtt_publish': mqtt_publish, 'mqtt_deadband': mqtt_deadband,
+			'mqtt_alarm_low': None, 'mqtt_alarm_high': None, 'mqtt_ignore_low': None, 'mqtt_ignore_high': None}
+
+def last_published(value, timestamp_ns, limit_flag=False):
+	return {'timestamp_ns': timestamp_ns, 'monotonic_ns': timestamp_ns - WALL_CLOCK_OFFSET_NS, 'last_published_value': value, 'limit_flag': limit_flag}
+
+def same_value(a, b):
+	if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+		return True
+	return (type(a) is type(b)) and (a == b)
+
+class TestPublishedStateSnapshot(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp_dir.cleanup)
+		self.full_path_to_snapshot = os.path.join(self.tmp_dir.name, 'state.gz')
+		self.monotonic_clock = FakeClockNs(3600*1000000000)
+		self.wall_clock = FakeClockNs(WALL_CLOCK_OFFSET_NS + self.monotonic_clock.now_ns)
+
+	def snapshot(self):
+		return PublishedStateSnapshot(self.full_path_to_snapshot, wall_clock_ns=self.wall_clock, monotonic_clock_ns=self.monotonic_clock)
+
+	def load(self, tag_rules, mqtt_client_id='gw'):
+		with contextlib.redirect_stdout(io.StringIO()) as output:
+			last_published_values = self.snapshot().load(tag_rules, mqtt_client_id)
+		self.output = output.getvalue()
+		return last_published_values
+
+	def test_round_trip(self):
+		mqtt_helper = {'tag_'+str(i): tag_helper('tags/'+str(i)) for i in range(8)}
+		tag_rules = compile_tag_rules(mqtt_helper, 'gw')
+		now_ns = self.wall_clock.now_ns
+		values = [1.5, -0.0, math.nan, math.inf, -math.inf, 65535, 1, 0]
+		last_published_values = {'tag_'+str(i): last_published(value, now_ns - i*1000000000, limit_flag=(i % 2 == 1)) for i, value in enumerate(values)}
+		# the tags without a tag rule are not saved
+		last_published_values['timestamp_ns'] = last_published(0, now_ns)
+		self.assertEqual(self.snapshot().save(last_published_values, tag_rules, 'gw'), 8)
+		self.assertFalse([name for name in os.listdir(self.tmp_dir.name) if name.endswith('.tmp')])
+		restored = self.load(tag_rules)
+		self.assertEqual(sorted(restored), sorted(tag_rules))
+		for tag_key in tag_rules:
+			with self.subTest(tag_key=tag_key):
+				self.assertTrue(same_value(restored[tag_key]['last_published_value'], last_published_values[tag_key]['last_published_value']))
+				self.assertEqual(restored[tag_key]['timestamp_ns'], last_published_values[tag_key]['timestamp_ns'])
+				self.assertEqual(restored[tag_key]['limit_flag'], last_published_values[tag_key]['limit_flag'])
+		# the sign of -0.0 is kept
+		self.assertEqual(math.copysign(1, restored['tag_1']['last_published_value']), -1.0)
+
+	def test_changed_tags_dropped(self):
+		mqtt_helper = {'same': tag_helper('tags/same'), 'topic': tag_helper('tags/topic'), 'payload': tag_helper('tags/payload', mqtt_payload='json'), 'removed': tag_helper('tags/removed')}
+		now_ns = self.wall_clock.now_ns
+		self.snapshot().save({tag_key: last_published(1.0, now_ns) for tag_key in mqtt_helper}, compile_tag_rules(mqtt_helper, 'gw'), 'gw')
+		mqtt_helper = dict(mqtt_helper)
+		mqtt_helper['topic'] = tag_helper('tags/new_topic')
+		mqtt_helper['payload'] = tag_helper('tags/payload', mqtt_payload='text')
+		del mqtt_helper['removed']
+		mqtt_helper['added'] = tag_helper('tags/added')
+		snapshot = self.snapshot()
+		with contextlib.redirect_stdout(io.StringIO()):
+			restored = snapshot.load(compile_tag_rules(mqtt_helper, 'gw'), 'gw')
+		self.assertEqual(sorted(restored), ['same'])
+		self.assertEqual(snapshot.restored_count, 1)
+
+	def test_other_client_id(self):
+		mqtt_helper = {'tag': tag_helper('tags/tag')}
+		self.snapshot().save({'tag': last_published(1.0, self.wall_clock.now_ns)}, compile_tag_rules(mqtt_helper, 'gw'), 'gw')
+		# the topics include the mqtt_client_id, but the snapshot is dropped as a whole
+		self.assertEqual(self.load(compile_tag_rules(mqtt_helper, 'gw'), 'other_gw'), {})
+		self.assertIn('[WARNING]', self.output)
+		self.assertEqual(sorted(self.load(compile_tag_rules(mqtt_helper, 'gw'), 'gw')), ['tag'])
+
+	def test_missing_or_corrupt_snapshot(self):
+		tag_rules = compile_tag_rules({'tag': tag_helper('tags/tag')}, 'gw')
+		self.assertEqual(self.load(tag_rules), {})
+		self.assertEqual(self.output, '')
+		self.snapshot().save({'tag': last_published(1.0, self.wall_clock.now_ns)}, tag_rules, 'gw')
+		with open(self.full_path_to_snapshot, 'rb') as f:
+			data = f.read()
+		for corrupt_data in [data[:len(data)//2], b'not gzip', b'', gzip.compress(b'{"version": 1, "tags": '), gzip.compress(b'[1, 2')]:
+			with self.subTest(corrupt_data=corrupt_data[:10]):
+				with open(self.full_path_to_snapshot, 'wb') as f:
+					f.write(corrupt_data)
+				self.assertEqual(self.load(tag_rules), {})
+				self.assertIn('[WARNING]', self.output)
+
+	def test_monotonic_rebuild(self):
+		tag_rules = compile_tag_rules({'past': tag_helper('tags/past'), 'future': tag_helper('tags/future')}, 'gw')
+		now_ns = self.wall_clock.now_ns
+		self.snapshot().save({'past': last_published(1.0, now_ns - 90*1000000000), 'future': last_published(1.0, now_ns + 5*1000000000)}, tag_rules, 'gw')
+		# after a restart, the monotonic clock starts over while the wall clock moved on by 30 seconds
+		self.monotonic_clock.now_ns = 2*1000000000
+		self.wall_clock.now_ns = now_ns + 30*1000000000
+		restored = self.load(tag_rules)
+		# the publish was 120 seconds ago, possibly before the start of the monotonic clock
+		self.assertEqual(restored['past']['monotonic_ns'], 2*1000000000 - 120*1000000000)
+		# a publish in the future of the wall clock (ex: clock set back) is considered just done
+		self.wall_clock.now_ns = now_ns
+		restored = self.load(tag_rules)
+		self.assertEqual(restored['future']['monotonic_ns'], 2*1000000000)
+
+	# Method to run poll cycles of random values through the "python" rule engine of gateway, recording the tags published; returns the tag keys published on each cycle
+	def run_cycles(self, gateway, cycles):
+		published = []
+		for monotonic_ns, current_values in cycles:
+			tag_keys, limit_flags = gateway.mqtt_evaluate_rules(current_values, monotonic_ns)
+			for tag_key, limit_flag in zip(tag_keys, limit_flags):
+				gateway.mqqt_last_published_values[tag_key] = {'timestamp_ns': current_values['timestamp_ns'], 'monotonic_ns': monotonic_ns, 'last_published_value': current_values[tag_key], 'limit_flag': limit_flag}
+			published.append(tag_keys)
+		return published
+
+	def test_restart_same_decisions(self):
+		for seed in range(30):
+			rng = random.Random(seed)
+			mqtt_helper = {'tag_'+str(i): tag_helper('tags/'+str(i), mqtt_publish=rng.choice(['rbe', '5', '30']), mqtt_deadband=rng.choice([0.0, 1.0])) for i in range(20)}
+			tag_rules = compile_tag_rules(mqtt_helper, 'gw')
+			cycles = []
+			monotonic_ns = 0
+			for cycle in range(40):
+				monotonic_ns += rng.choice([1, 2, 5])*1000000000
+				cycles.append((monotonic_ns, dict({'timestamp_ns': WALL_CLOCK_OFFSET_NS + monotonic_ns}, **{tag_key: rng.choice([0.0, 1.0, 1.5, 3.0, math.nan]) for tag_key in tag_rules})))
+			gateways = []
+			for i in range(2):
+				gateway = modqtt_helper.ModbusTCPMqttDataGateway.__new__(modqtt_helper.ModbusTCPMqttDataGateway)
+				gateway.tag_rules = tag_rules
+				gateway.rule_evaluator = None
+				gateway.mqqt_last_published_values = {}
+				gateway.mqtt_force_deadband = False
+				gateways.append(gateway)
+			with self.subTest(seed=seed):
+				running_gateway, restarted_gateway = gateways
+				self.run_cycles(running_gateway, cycles[:20])
+				self.snapshot().save(running_gateway.mqqt_last_published_values, tag_rules, 'gw')
+				# the gateway restarts half a second after the last poll cycle, on a monotonic clock restarting from 1 second
+				restart_delay_ns = 500000000
+				self.wall_clock.now_ns = cycles[19][1]['timestamp_ns'] + restart_delay_ns
+				self.monotonic_clock.now_ns = 1000000000
+				restarted_gateway.mqqt_last_published_values = self.load(tag_rules)
+				restarted_cycles = [(monotonic_ns - cycles[19][0] - restart_delay_ns + 1000000000, current_values) for monotonic_ns, current_values in cycles[20:]]
+				self.assertEqual(self.run_cycles(restarted_gateway, restarted_cycles), self.run_cycles(running_gateway, cycles[20:]))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+# Tests of the store-and-forward buffer (StoreAndForwardBuffer) on a temporary SQLite database: append, peek and remove, oldest messages dropped beyond max_messages, expiry with an injected clock, messages kept across a restart,
+# and the replay of the stored messages by ModbusTCPMqttDataGateway.mqtt_replay_worker, where the messages not acknowledged within mqtt_publish_ack_timeout_seconds stay stored and are replayed again
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, time, tempfile, threading, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from scripts import modqtt_helper
+from store_helper import StoreAndForwardBuffer
+from publish_helper import PublishTracker
+
+class FakeClock(object):
+
+	def __init__(self, now=1000.0):
+		self.now = now
+
+	def __call__(self):
+		return self.now
+
+class TestStoreAndForwardBuffer(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp_dir.cleanup)
+		self.full_path_to_db = os.path.join(self.tmp_dir.name, 'store.db')
+
+	def open_store(self, **options):
+		store = StoreAndForwardBuffer(self.full_path_to_db, **options)
+		self.addCleanup(store.close)
+		return store
+
+	def payloads(self, store):
+		return [payload for message_id, topic, payload, qos, retain in store.peek_batch(1000)]
+
+	def test_append_peek_remove(self):
+		store = self.open_store()
+		self.assertTrue(store.is_empty())
+		store.append('a/1', b'm_0', 1, True)
+		store.append_many([('a/2', b'm_'+str(i).encode(), i % 3, False) for i in range(1, 10)])
+		batch = store.peek_batch(4)
+		self.assertEqual([(topic, payload, qos, retain) for message_id, topic, payload, qos, retain in batch], [('a/1', b'm_0', 1, True), ('a/2', b'm_1', 1, False), ('a/2', b'm_2', 2, False), ('a/2', b'm_3', 0, False)])
+		# peek does not remove the messages
+		self.assertEqual(store.peek_batch(4), batch)
+		store.remove([batch[0][0], batch[2][0]])
+		store.remove([])
+		self.assertEqual(self.payloads(store), [b'm_1', b'm_3'] + [b'm_'+str(i).encode() for i in range(4, 10)])
+		self.assertEqual(store.statistics(), {'stored_messages': 8, 'stored_count': 10, 'replayed_count': 2, 'dropped_count': 0})
+		# more than one chunk of ids at once
+		store.append_many([('a/3', b'x', 0, False)]*1200)
+		store.remove([message_id for message_id, topic, payload, qos, retain in store.peek_batch(2000)])
+		self.assertTrue(store.is_empty())
+		self.assertEqual(store.statistics()['replayed_count'], 1210)
+
+	def test_messages_kept_across_restart(self):
+		store = StoreAndForwardBuffer(self.full_path_to_db)
+		store.append_many([('a', b'm_'+str(i).encode(), 1, False) for i in range(5)])
+		store.remove([store.peek_batch(1)[0][0]])
+		store.close()
+		store = self.open_store()
+		self.assertEqual(store.statistics()['stored_messages'], 4)
+		self.assertEqual(self.payloads(store), [b'm_1', b'm_2', b'm_3', b'm_4'])
+
+	def test_overflow_drops_oldest(self):
+		store = self.open_store(max_messages=10)
+		store.append_many([('a', b'm_'+str(i).encode(), 1, False) for i in range(6)])
+		store.append_many([('a', b'm_'+str(i).encode(), 1, False) for i in range(6, 14)])
+		self.assertEqual(self.payloads(store), [b'm_'+str(i).encode() for i in range(4, 14)])
+		for i in range(14, 20):
+			store.append('a', b'm_'+str(i).encode(), 1, False)
+		self.assertEqual(self.payloads(store), [b'm_'+str(i).encode() for i in range(10, 20)])
+		# a single batch larger than max_messages only keeps its newest messages
+		store.append_many([('a', b'n_'+str(i).encode(), 1, False) for i in range(25)])
+		self.assertEqual(self.payloads(store), [b'n_'+str(i).encode() for i in range(15, 25)])
+		self.assertEqual(store.statistics(), {'stored_messages': 10, 'stored_count': 45, 'replayed_count': 0, 'dropped_count': 35})
+
+	def test_expiry_with_injected_clock(self):
+		clock = FakeClock()
+		store = self.open_store(max_age_seconds=100, clock=clock)
+		store.append('a', b'm_0', 1, False)
+		clock.now += 60
+		store.append_many([('a', b'm_1', 1, False), ('a', b'm_2', 1, False)])
+		clock.now += 30
+		store.append('a', b'm_3', 1, False)
+		# exactly max_age_seconds old is not expired yet
+		clock.now += 10
+		self.assertEqual(store.expire(), 0)
+		clock.now += 0.5
+		self.assertEqual(store.expire(), 1)
+		self.assertEqual(self.payloads(store), [b'm_1', b'm_2', b'm_3'])
+		clock.now += 60
+		self.assertEqual(store.expire(), 2)
+		self.assertEqual(self.payloads(store), [b'm_3'])
+		clock.now += 1000
+		self.assertEqual(store.expire(), 1)
+		self.assertTrue(store.is_empty())
+		self.assertEqual(store.statistics()['dropped_count'], 4)
+
+class FakeMessageInfo(object):
+
+	def __init__(self, mid):
+		self.mid = mid
+		self.rc = 0
+		self.published = False
+
+	def is_published(self):
+		return self.published
+
+class FakeMqttClient(object):
+
+	# Fake paho MQTT client acknowledging the messages of its replaying gateway according to the number n of their payload b'm_<n>':
+	# n % 3 == 0 before publish returns (on_publish runs before the mid is remembered), n % 3 == 1 later from another thread, n % 3 == 2 only once acknowledge_all is set
+	def __init__(self, gateway):
+		self.gateway = gateway
+		self.mid = 0
+		self.acknowledge_all = False
+		self.published_payloads = []
+		self.lock = threading.Lock()
+
+	def publish(self, topic, payload=None, qos=0, retain=False):
+		with self.lock:
+			self.mid = self.mid % 65535 + 1
+			mid = self.mid
+			self.published_payloads.append(payload)
+		message_info = FakeMessageInfo(mid)
+		n = int(payload.split(b'_')[1])
+		if (n % 3 == 0) or ((n % 3 == 2) and self.acknowledge_all):
+			self.acknowledge(message_info)
+		elif n % 3 == 1:
+			threading.Timer(0.01, self.acknowledge, (message_info,)).start()
+		return message_info
+
+	def acknowledge(self, message_info):
+		self.gateway.on_publish(self, None, message_info.mid)
+		message_info.published = True
+
+class TestStoreReplay(unittest.TestCase):
+
+	def build_gateway(self, full_path_to_db):
+		gateway = modqtt_helper.ModbusTCPMqttDataGateway.__new__(modqtt_helper.ModbusTCPMqttDataGateway)
+		gateway.quiet = True
+		gateway.mqtt_connected = True
+		gateway.mqtt_last_successful_mid_count = 0
+		gateway.modqtt_config = {'mqtt_store_replay_batch_size': 20, 'mqtt_store_replay_messages_per_second': 100000, 'mqtt_max_inflight_messages_set': 100}
+		gateway.mqtt_inflight = PublishTracker()
+		gateway.mqtt_publish_ack_timeout_seconds = 0.2
+		gateway.mqtt_store = StoreAndForwardBuffer(full_path_to_db)
+		gateway.mqtt_replay_event = threading.Event()
+		gateway.mqtt_replay_stop = threading.Event()
+		gateway.mqtt_replay_condition = threading.Condition()
+		gateway.mqtt_replay_pending = {}
+		gateway.mqtt_replay_acknowledged_ids = []
+		gateway.mqttc = FakeMqttClient(gateway)
+		return gateway
+
+	def wait_until(self, condition, timeout_seconds=10):
+		deadline = time.monotonic() + timeout_seconds
+		while not condition():
+			self.assertLess(time.monotonic(), deadline, 'timed out')
+			time.sleep(0.01)
+
+	def test_unacknowledged_messages_replayed_again(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			gateway = self.build_gateway(os.path.join(tmp_dir, 'store.db'))
+			gateway.mqtt_store.append_many([('a', b'm_'+str(n).encode(), 1, False) for n in range(60)])
+			replay_thread = threading.Thread(target=gateway.mqtt_replay_worker, daemon=True)
+			with contextlib.redirect_stdout(io.StringIO()):
+				replay_thread.start()
+				gateway.mqtt_replay_event.set()
+				try:
+					# the messages acknowledged are removed from the store, before or after publish returned
+					unacknowledged_payloads = [b'm_'+str(n).encode() for n in range(60) if n % 3 == 2]
+					self.wait_until(lambda: [payload for message_id, topic, payload, qos, retain in gateway.mqtt_store.peek_batch(1000)] == unacknowledged_payloads)
+					# the others survive the wait for their acknowledgement and are replayed again, until acknowledged
+					self.wait_until(lambda: all(gateway.mqttc.published_payloads.count(payload) >= 2 for payload in unacknowledged_payloads))
+					self.assertEqual(gateway.mqtt_store.statistics()['stored_messages'], len(unacknowledged_payloads))
+					gateway.mqttc.acknowledge_all = True
+					self.wait_until(gateway.mqtt_store.is_empty)
+				finally:
+					gateway.mqtt_replay_stop.set()
+					gateway.mqtt_replay_event.set()
+					replay_thread.join(5)
+					gateway.mqtt_store.close()
+			self.assertFalse(replay_thread.is_alive())
+			self.assertEqual(gateway.mqtt_store.statistics(), {'stored_messages': 0, 'stored_count': 60, 'replayed_count': 60, 'dropped_count': 0})
+			self.assertEqual(gateway.mqtt_replay_pending, {})
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+# Tests of the template cache (TemplateCache, modbus_template_cache_dir): a cached template decoding the responses as the parsed one, cache entries invalidated by a change of the template content,
+# of the call planner settings or of the gateway version, corrupt entries parsed again (and replaced), compiled tag rules round trip, and least recently used entries pruned
+# Usage: $ (python3) -m unittest discover -s tests (or python3 -m pytest tests)
+
+import os, sys, io, csv, math, pickle, random, tempfile, contextlib, unittest
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'benchmark'))
+from scripts import modqtt_helper
+from cache_helper import TemplateCache
+from rule_helper import compile_tag_rules, EVALUATION_FUNCTIONS
+from bench_decode import write_synthetic_template, random_responses
+
+LOADED_FROM_CACHE = 'from the template cache'
+
+def same_values(a, b):
+	if sorted(a) != sorted(b):
+		return False
+	for key in a:
+		if isinstance(a[key], float) and isinstance(b[key], float) and math.isnan(a[key]) and math.isnan(b[key]):
+			continue
+		if a[key] != b[key]:
+			return False
+	return True
+
+class TestTemplateCache(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp_dir.cleanup)
+		self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+		self.full_path_to_csv = os.path.join(self.tmp_dir.name, 'template.csv')
+		self.addCleanup(setattr, TemplateCache, 'gateway_version', None)
+
+	# Method to load a template in a new client, with the template cache unless call_plan_config says otherwise; self.output holds what was printed
+	def load_client(self, call_plan_config=None):
+		if call_plan_config is None:
+			call_plan_config = {'modbus_template_cache_dir': self.cache_dir}
+		with contextlib.redirect_stdout(io.StringIO()) as output:
+			modbus_tcp_client = modqtt_helper.ModbusTCPClient(server_ip='127.0.0.1')
+			modbus_tcp_client.load_template(self.full_path_to_csv, call_plan_config)
+		self.output = output.getvalue()
+		return modbus_tcp_client
+
+	def entry_names(self):
+		return sorted(name for name in os.listdir(self.cache_dir) if name.endswith('.pickle'))
+
+	# Method to decode the same random responses with each client, returns the values decoded by each
+	def decode(self, modbus_tcp_clients, seed=0):
+		decoded = []
+		for modbus_tcp_client in modbus_tcp_clients:
+			all_interpreted_responses = [{'timestamp_ns': 0, 'timestamp_monotonic_ns': 0}]
+			for fc, start_address, response in random_responses(modbus_tcp_client, random.Random(seed)):
+				all_interpreted_responses.append(modbus_tcp_client.interpret_response(response, fc, start_address))
+			decoded.append(modbus_tcp_client.combine_tag_responses(all_interpreted_responses))
+		return decoded
+
+	def test_cached_template(self):
+		for seed in range(5):
+			with self.subTest(seed=seed):
+				write_synthetic_template(self.full_path_to_csv, 300, seed=seed, publish_rules=True)
+				parsed_client = self.load_client({})
+				first_client = self.load_client()
+				self.assertNotIn(LOADED_FROM_CACHE, self.output)
+				cached_client = self.load_client()
+				self.assertIn(LOADED_FROM_CACHE, self.output)
+				self.assertEqual(cached_client.template_cache_key, first_client.template_cache_key)
+				self.assertIsNone(parsed_client.template_cache_key)
+				self.assertEqual(cached_client.call_groups, parsed_client.call_groups)
+				self.assertEqual(cached_client.mqtt_helper, parsed_client.mqtt_helper)
+				parsed_values, cached_values = self.decode([parsed_client, cached_client], seed)
+				self.assertTrue(same_values(cached_values, parsed_values))
+
+	def test_content_change(self):
+		write_synthetic_template(self.full_path_to_csv, 100)
+		first_client = self.load_client()
+		# the same content written again is still cached
+		write_synthetic_template(self.full_path_to_csv, 100)
+		self.load_client()
+		self.assertIn(LOADED_FROM_CACHE, self.output)
+		# a single changed tag invalidates the entry
+		with open(self.full_path_to_csv, newline='') as f:
+			rows = list(csv.DictReader(f))
+		rows[57]['mqtt_topic'] = 'changed'
+		with open(self.full_path_to_csv, 'w', newline='') as f:
+			writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+			writer.writeheader()
+			writer.writerows(rows)
+		changed_client = self.load_client()
+		self.assertNotIn(LOADED_FROM_CACHE, self.output)
+		self.assertNotEqual(changed_client.template_cache_key, first_client.template_cache_key)
+		self.assertEqual(changed_client.mqtt_helper['tag_57']['mqtt_topic'], 'changed/tag_57')
+		self.assertEqual(len(self.entry_names()), 2)
+		# and so does a change of the call planner settings
+		changed_client = self.load_client({'modbus_template_cache_dir': self.cache_dir, 'modbus_max_gap_registers': 10})
+		self.assertNotIn(LOADED_FROM_CACHE, self.output)
+		self.assertEqual(len(self.entry_names()), 3)
+		# or of the gateway version
+		TemplateCache.gateway_version = 'other version'
+		self.load_client()
+		self.assertNotIn(LOADED_FROM_CACHE, self.output)
+		self.assertEqual(len(self.entry_names()), 4)
+
+	def test_corrupt_entry(self):
+		write_synthetic_template(self.full_path_to_csv, 100)
+		parsed_client = self.load_client()
+		entry_path = os.path.join(self.cache_dir, self.entry_names()[0])
+		with open(entry_path, 'rb') as f:
+			data = f.read()
+		unknown_reference = pickle.dumps('not a reference', protocol=0).replace(b'V', b'P', 1)
+		for corrupt_data in [data[:len(data)//2], b'', b'not a pickle', unknown_reference]:
+			with self.subTest(corrupt_data=corrupt_data[:10]):
+				with open(entry_path, 'wb') as f:
+					f.write(corrupt_data)
+				# the template is parsed again, with a warning, and the entry replaced
+				reloaded_client = self.load_client()
+				self.assertIn('[WARNING]', self.output)
+				self.assertNotIn(LOADED_FROM_CACHE, self.output)
+				self.assertEqual(reloaded_client.mqtt_helper, parsed_client.mqtt_helper)
+				cached_client = self.load_client()
+				self.assertIn(LOADED_FROM_CACHE, self.output)
+				self.assertTrue(same_values(*self.decode([cached_client, parsed_client])))
+
+	def test_tag_rules(self):
+		write_synthetic_template(self.full_path_to_csv, 200, publish_rules=True)
+		mqtt_helper = self.load_client().mqtt_helper
+		tag_rules = compile_tag_rules(mqtt_helper, 'gw')
+		template_cache = TemplateCache(self.cache_dir, references=EVALUATION_FUNCTIONS)
+		cache_key = template_cache.key('tag_rules', 'gw')
+		template_cache.store(cache_key, tag_rules)
+		cached_tag_rules = TemplateCache(self.cache_dir, references=EVALUATION_FUNCTIONS).load(cache_key)
+		self.assertEqual(list(cached_tag_rules), list(tag_rules))
+		rng = random.Random(0)
+		for tag_key in tag_rules:
+			tag_rule, cached_tag_rule = tag_rules[tag_key], cached_tag_rules[tag_key]
+			self.assertIs(cached_tag_rule.evaluate, tag_rule.evaluate)
+			self.assertEqual(cached_tag_rule.topic, tag_rule.topic)
+			last_published = {'last_published_value': rng.choice([0.0, 1.0, 500.0]), 'limit_flag': rng.choice([False, True])}
+			for value in [0.0, 1.0, 99.5, 1500.0, 70000.0, math.nan]:
+				elapsed_seconds = rng.choice([0.0, 10.0, 100.0])
+				with self.subTest(tag_key=tag_key, value=value):
+					self.assertEqual(cached_tag_rule.evaluate(cached_tag_rule, value, last_published, elapsed_seconds, False), tag_rule.evaluate(tag_rule, value, last_published, elapsed_seconds, False))
+		# the evaluation functions are unpickled by name, an unknown name is not loaded
+		with contextlib.redirect_stdout(io.StringIO()) as output:
+			self.assertIsNone(TemplateCache(self.cache_dir).load(cache_key))
+		self.assertIn('[WARNING]', output.getvalue())
+
+	def test_prune(self):
+		template_cache = TemplateCache(self.cache_dir, max_entries=3)
+		for i in range(5):
+			template_cache.store(template_cache.key(i), i)
+			os.utime(template_cache.entry_path(template_cache.key(i)), (1000 + i, 1000 + i))
+		# loading an entry makes it the most recently used
+		self.assertEqual(template_cache.load(template_cache.key(2)), 2)
+		template_cache.store(template_cache.key(5), 5)
+		self.assertEqual(self.entry_names(), sorted(os.path.basename(template_cache.entry_path(template_cache.key(i))) for i in [2, 4, 5]))
+		self.assertEqual((template_cache.hit_count, template_cache.miss_count), (1, 0))
+		self.assertIsNone(template_cache.load(template_cache.key(0)))
+		self.assertEqual(template_cache.miss_count, 1)
+
+if __name__ == '__main__':
+	unittest.main()